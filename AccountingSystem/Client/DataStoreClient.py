@@ -1,7 +1,7 @@
 # $HeadURL$
 __RCSID__ = "$Id$"
 
-import time, random, copy
+import time, random, copy, threading, atexit
 from DIRAC import S_OK, S_ERROR, gLogger, gConfig
 from DIRAC.Core.DISET.RPCClient                     import RPCClient
 from DIRAC.Core.Utilities.ThreadSafe                import Synchronizer
@@ -20,6 +20,9 @@ class DataStoreClient:
      - It allows to reduce the interactions with the server by building and list of
     pending Registers to be sent that are sent in a bundle using the commit method.
      - In case the DataStore is down Registers are sent as DISET requests.
+     - In asynchronous mode commit returns immediately and the Registers are sent by a
+    background thread when a bundle is full or when the oldest committed one is older
+    than the flush period. The remaining Registers are sent when the process exits.
   """
   def __init__( self, setup = False, retryGraceTime = 0 ):
     self.__setup = setup
@@ -28,6 +31,15 @@ class DataStoreClient:
     self.__maxTimeRetrying = retryGraceTime
     self.__lastSuccessfulCommit = time.time()
     self.__failoverEnabled = not gConfig.getValue( '/LocalSite/DisableFailover', False )
+    # None until the first commit, when it is taken from the configuration
+    self.__asynchronous = None
+    self.__flushPeriod = 60
+    # Number of registers at the head of the list that have been committed but not sent
+    self.__committedRegisters = 0
+    self.__oldestCommitTime = 0
+    self.__flushEvent = threading.Event()
+    self.__stopEvent = threading.Event()
+    self.__flushThread = None
 
   def setRetryGraceTime( self, retryGraceTime ):
     """
@@ -64,35 +76,158 @@ class DataStoreClient:
   def disableFailover( self ):
     self.__failoverEnabled = False
 
+  def setAsynchronousCommit( self, asynchronous = True, flushPeriod = 60 ):
+    """
+    Make commit return immediately and send the Registers in the background.
+    If not called /LocalSite/AsynchronousAccounting and /LocalSite/AccountingFlushPeriod are used
+    """
+    self.__asynchronous = asynchronous
+    self.__flushPeriod = flushPeriod
+
+  def __isAsynchronous( self ):
+    if self.__asynchronous is None:
+      self.__asynchronous = gConfig.getValue( '/LocalSite/AsynchronousAccounting', False )
+      self.__flushPeriod = gConfig.getValue( '/LocalSite/AccountingFlushPeriod', self.__flushPeriod )
+    return self.__asynchronous
+
   def __getRPCClient( self ):
     if self.__setup:
       return RPCClient( "Accounting/DataStore", setup = self.__setup, timeout = 3600 )
     return RPCClient( "Accounting/DataStore", timeout = 3600 )
 
-  @gAccountingSynchro
   def commit( self ):
     """
     Send the registers in a bundle mode
     """
+    if self.__isAsynchronous():
+      return self.__queueRegisters()
+    return self.__commitRegisters()
+
+  @gAccountingSynchro
+  def __commitRegisters( self ):
+    """
+    Send synchronously all the registers
+    """
     rpcClient = self.__getRPCClient()
     sent = 0
     while len( self.__registersList ) > 0:
       registersToSend = self.__registersList[ :self.__maxRecordsInABundle ]
-      retVal = rpcClient.commitRegisters( registersToSend )
-      if retVal[ 'OK' ]:
-        self.__lastSuccessfulCommit = time.time()
-      else:
-        if self.__failoverEnabled and time.time() - self.__lastSuccessfulCommit > self.__maxTimeRetrying:
-          gLogger.verbose( "Sending accounting records to failover" )
-          result = _sendToFailover( retVal[ 'rpcStub' ] )
-          if not result[ 'OK' ]:
-            return result
-        else:
-          return S_ERROR( "Cannot commit data to DataStore service" )
+      retVal = self.__sendRegisters( rpcClient, registersToSend )
+      if not retVal[ 'OK' ]:
+        return retVal
       sent += len( registersToSend )
       del( self.__registersList[ :self.__maxRecordsInABundle ] )
     return S_OK( sent )
 
+  def __sendRegisters( self, rpcClient, registersToSend ):
+    """
+    Send a bundle of registers, to the failover if the DataStore is failing for too long
+    """
+    retVal = rpcClient.commitRegisters( registersToSend )
+    if retVal[ 'OK' ]:
+      self.__lastSuccessfulCommit = time.time()
+    else:
+      if self.__failoverEnabled and time.time() - self.__lastSuccessfulCommit > self.__maxTimeRetrying:
+        gLogger.verbose( "Sending accounting records to failover" )
+        result = _sendToFailover( retVal[ 'rpcStub' ] )
+        if not result[ 'OK' ]:
+          return result
+      else:
+        return S_ERROR( "Cannot commit data to DataStore service" )
+    return S_OK()
+
+  @gAccountingSynchro
+  def __queueRegisters( self ):
+    """
+    Mark all the registers as committed and let the flushing thread send them
+    """
+    queued = len( self.__registersList ) - self.__committedRegisters
+    if not queued:
+      return S_OK( 0 )
+    if not self.__committedRegisters:
+      self.__oldestCommitTime = time.time()
+    self.__committedRegisters = len( self.__registersList )
+    if not self.__flushThread:
+      self.__flushThread = threading.Thread( target = self.__flushLoop )
+      self.__flushThread.setDaemon( True )
+      self.__flushThread.start()
+      # Daemon threads are just killed, what is left is sent at exit
+      atexit.register( self.__flushAtExit )
+    if self.__committedRegisters >= self.__maxRecordsInABundle:
+      self.__flushEvent.set()
+    return S_OK( queued )
+
+  def __flushLoop( self ):
+    """
+    Body of the flushing thread
+    """
+    while not self.__stopEvent.isSet():
+      timeout = self.__flushPeriod
+      if self.__committedRegisters:
+        timeout = max( 0.1, self.__oldestCommitTime + self.__flushPeriod - time.time() )
+      self.__flushEvent.wait( timeout )
+      self.__flushEvent.clear()
+      if self.__stopEvent.isSet():
+        break
+      try:
+        result = self.__sendCommittedRegisters( force = False )
+        if not result[ 'OK' ]:
+          gLogger.warn( "Could not send accounting records, will retry", result[ 'Message' ] )
+      except Exception, excp:
+        gLogger.exception( "Exception while sending accounting records", lException = excp )
+
+  def flush( self ):
+    """
+    Send synchronously all the registers committed in asynchronous mode
+    """
+    return self.__sendCommittedRegisters( force = True )
+
+  def __flushAtExit( self, timeout = 10 ):
+    """
+    Stop the flushing thread and send what is left
+    """
+    self.__stopEvent.set()
+    self.__flushEvent.set()
+    if self.__flushThread:
+      self.__flushThread.join( timeout )
+    return self.flush()
+
+  def __sendCommittedRegisters( self, force ):
+    """
+    Send the committed registers by bundles. Unless forced, only full bundles are sent
+    before the flush period of the oldest committed register is over
+    """
+    rpcClient = None
+    sent = 0
+    while True:
+      gAccountingSynchro.lock()
+      try:
+        numRegisters = min( self.__committedRegisters, self.__maxRecordsInABundle )
+        if not force and numRegisters < self.__maxRecordsInABundle and \
+           time.time() - self.__oldestCommitTime < self.__flushPeriod:
+          numRegisters = 0
+        registersToSend = self.__registersList[ :numRegisters ]
+        del( self.__registersList[ :numRegisters ] )
+        self.__committedRegisters -= numRegisters
+      finally:
+        gAccountingSynchro.unlock()
+      if not registersToSend:
+        return S_OK( sent )
+      if not rpcClient:
+        rpcClient = self.__getRPCClient()
+      retVal = self.__sendRegisters( rpcClient, registersToSend )
+      if not retVal[ 'OK' ]:
+        # Put them back in front, they will be retried after a flush period
+        gAccountingSynchro.lock()
+        try:
+          self.__registersList[ 0:0 ] = registersToSend
+          self.__committedRegisters += len( registersToSend )
+          self.__oldestCommitTime = time.time()
+        finally:
+          gAccountingSynchro.unlock()
+        return retVal
+      sent += len( registersToSend )
+
   def remove( self, register ):
     """
     Remove a Register from the Accounting DataStore
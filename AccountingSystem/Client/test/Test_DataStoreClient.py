@@ -0,0 +1,150 @@
+""" Unit tests of the asynchronous commits of the DataStoreClient, with the DataStore service mocked
+"""
+
+import threading
+import time
+import unittest
+
+from mock import MagicMock, patch
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.AccountingSystem.Client.DataStoreClient import DataStoreClient
+
+class FakeDataStore( object ):
+  """ DataStore service recording the bundles it gets, failing the first failures calls
+  """
+
+  def __init__( self ):
+    self.bundles = []
+    self.failures = 0
+    self.lock = threading.Lock()
+
+  def commitRegisters( self, registers ):
+    self.lock.acquire()
+    try:
+      if self.failures:
+        self.failures -= 1
+        return S_ERROR( 'DataStore is down' )
+      self.bundles.append( list( registers ) )
+      return S_OK()
+    finally:
+      self.lock.release()
+
+  def getSent( self ):
+    self.lock.acquire()
+    try:
+      return sum( self.bundles, [] )
+    finally:
+      self.lock.release()
+
+def record( i ):
+  return ( 'Test', 1400000000 + i, 1400000100 + i, [ 'Site%d' % i, i ] )
+
+class DataStoreClientTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.dataStore = FakeDataStore()
+    self.rpcPatcher = patch( 'DIRAC.AccountingSystem.Client.DataStoreClient.RPCClient',
+                             return_value = self.dataStore )
+    self.rpcPatcher.start()
+    self.atexitPatcher = patch( 'DIRAC.AccountingSystem.Client.DataStoreClient.atexit' )
+    self.atexit = self.atexitPatcher.start()
+    self.client = DataStoreClient()
+    self.client.disableFailover()
+    self.client.setAsynchronousCommit( True, flushPeriod = 3600 )
+
+  def tearDown( self ):
+    # Stop the flushing thread as at exit
+    self.client._DataStoreClient__flushAtExit()
+    self.rpcPatcher.stop()
+    self.atexitPatcher.stop()
+
+  def addRecords( self, records ):
+    # The registers as addRegister stores them
+    self.client._DataStoreClient__registersList.extend( records )
+
+  def waitForSent( self, numRecords ):
+    for _i in range( 50 ):
+      if len( self.dataStore.getSent() ) >= numRecords:
+        break
+      time.sleep( 0.1 )
+    return self.dataStore.getSent()
+
+  def test_backgroundSend( self ):
+    """ commit returns at once and the registers are sent after the flush period
+    """
+    self.client.setAsynchronousCommit( True, flushPeriod = 0.2 )
+    records = [ record( i ) for i in range( 3 ) ]
+    self.addRecords( records )
+    self.assertEqual( self.client.commit()['Value'], 3 )
+    self.assertEqual( self.waitForSent( 3 ), records )
+    self.assertEqual( len( self.dataStore.bundles ), 1 )
+
+  def test_fullBundles( self ):
+    """ Full bundles are sent at once, the rest waits for the flush period or a flush
+    """
+    self.client._DataStoreClient__maxRecordsInABundle = 2
+    records = [ record( i ) for i in range( 5 ) ]
+    self.addRecords( records )
+    self.client.commit()
+    self.assertEqual( self.waitForSent( 4 ), records[:4] )
+    time.sleep( 0.2 )
+    self.assertEqual( self.dataStore.bundles, [ records[:2], records[2:4] ] )
+    self.assertEqual( self.client.flush()['Value'], 1 )
+    self.assertEqual( self.dataStore.getSent(), records )
+
+  def test_requeue( self ):
+    """ The registers of a failed bundle are put back in front and sent by the next flush
+    """
+    self.client._DataStoreClient__maxRecordsInABundle = 2
+    records = [ record( i ) for i in range( 5 ) ]
+    self.addRecords( records[:3] )
+    self.client.commit()
+    self.waitForSent( 2 )
+    self.dataStore.failures = 1
+    self.assertFalse( self.client.flush()['OK'] )
+    # Registered but not committed yet
+    self.addRecords( records[3:] )
+    self.assertEqual( self.client._DataStoreClient__registersList, records[2:] )
+    self.assertEqual( self.client._DataStoreClient__committedRegisters, 1 )
+    self.assertEqual( self.client.flush()['Value'], 1 )
+    self.assertEqual( self.dataStore.getSent(), records[:3] )
+    self.client.commit()
+    self.client.flush()
+    self.assertEqual( self.dataStore.getSent(), records )
+
+  def test_atexit( self ):
+    """ The flushing thread is stopped at exit and what is left is sent
+    """
+    records = [ record( i ) for i in range( 3 ) ]
+    self.addRecords( records[:2] )
+    self.client.commit()
+    self.addRecords( records[2:] )
+    self.client.commit()
+    self.assertEqual( self.atexit.register.call_count, 1 )
+    self.assertEqual( self.dataStore.bundles, [] )
+    exitFunction = self.atexit.register.call_args[0][0]
+    self.assertEqual( exitFunction()['Value'], 3 )
+    self.assertEqual( self.dataStore.getSent(), records )
+    self.assertFalse( self.client._DataStoreClient__flushThread.isAlive() )
+
+  def test_synchronous( self ):
+    """ Without the asynchronous mode the registers are sent by commit
+    """
+    self.client.setAsynchronousCommit( False )
+    self.client._DataStoreClient__maxRecordsInABundle = 2
+    records = [ record( i ) for i in range( 3 ) ]
+    self.addRecords( records )
+    self.assertEqual( self.client.commit()['Value'], 3 )
+    self.assertEqual( self.dataStore.bundles, [ records[:2], records[2:] ] )
+    self.assertFalse( self.atexit.register.called )
+
+  def test_invalidRegister( self ):
+    """ Only the accounting types are accepted
+    """
+    self.assertFalse( self.client.addRegister( MagicMock() )['OK'] )
+    self.assertEqual( self.client._DataStoreClient__registersList, [] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DataStoreClientTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
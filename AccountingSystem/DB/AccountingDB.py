@@ -30,6 +30,8 @@ class AccountingDB( DB ):
     self.dbBucketsLength = {}
     self.__keysCache = {}
     maxParallelInsertions = self.getCSOption( "ParallelRecordInsertions", 10 )
+    #Lengths of the pre-aggregated bucket tables maintained for every type
+    self.__rollupLengths = sorted( [ int( rl ) for rl in self.getCSOption( "RollupBucketLengths", [ 86400, 604800 ] ) ] )
     self.__threadPool = ThreadPool( 1, maxParallelInsertions )
     self.__threadPool.daemonize()
     self.catalogTableName = _getTableName( "catalog", "Types" )
@@ -243,7 +245,8 @@ class AccountingDB( DB ):
     """
     self.log.verbose( "Adding to catalog type %s" % typeName, "with length %s" % str( bucketsLength ) )
     self.dbCatalog[ typeName ] = { 'keys' : keyFields , 'values' : valueFields,
-                                   'typeFields' : [], 'bucketFields' : [], 'dataTimespan' : 0 }
+                                   'typeFields' : [], 'bucketFields' : [], 'dataTimespan' : 0,
+                                   'rollups' : [] }
     self.dbCatalog[ typeName ][ 'typeFields' ].extend( keyFields )
     self.dbCatalog[ typeName ][ 'typeFields' ].extend( valueFields )
     self.dbCatalog[ typeName ][ 'bucketFields' ] = list( self.dbCatalog[ typeName ][ 'typeFields' ] )
@@ -266,10 +269,26 @@ class AccountingDB( DB ):
       if not retVal[ 'OK' ]:
         return retVal
       self.dbBucketsLength[ typeName ] = bucketsLength
+      validRollups = self.__getValidRollupLengths( bucketsLength )
+      self.dbCatalog[ typeName ][ 'rollups' ] = [ rollupLength for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]
+                                                  if rollupLength in validRollups ]
     finally:
       gSynchro.unlock()
     return self.regenerateBuckets( typeName )
 
+  def __getValidRollupLengths( self, bucketsLength ):
+    """
+    Get the rollup lengths that make sense for a type. All the bucket lengths shorter
+    than the rollup length have to divide it so each bucket fits in one rollup bucket
+    """
+    lengths = [ bucketDef[1] for bucketDef in bucketsLength ]
+    validLengths = []
+    for rollupLength in self.__rollupLengths:
+      shorterLengths = [ length for length in lengths if length < rollupLength ]
+      if shorterLengths and not [ length for length in shorterLengths if rollupLength % length ]:
+        validLengths.append( rollupLength )
+    return validLengths
+
   @gSynchro
   def registerType( self, name, definitionKeyFields, definitionAccountingFields, bucketsLength ):
     """
@@ -355,12 +374,30 @@ class AccountingDB( DB ):
     typeTableName = _getTableName( "type", name )
     if typeTableName not in tablesInThere:
       tables[ typeTableName ] = { 'Fields' : fieldsDict }
+    #Rollup tables have the same layout as the bucket table
+    rollupLengths = self.__getValidRollupLengths( bucketsLength )
+    rollupsToFill = []
+    for rollupLength in rollupLengths:
+      rollupTableName = _getTableName( "rollup%s" % rollupLength, name )
+      if rollupTableName not in tablesInThere:
+        tables[ rollupTableName ] = { 'Fields' : bucketFieldsDict,
+                                      'UniqueIndexes' : { 'UniqueConstraint' : uniqueIndexFields }
+                                    }
+        if bucketTableName in tablesInThere:
+          rollupsToFill.append( rollupLength )
     inTableName = _getTableName( "in", name )
     if inTableName not in tablesInThere:
       tables[ inTableName ] = { 'Fields' : inbufferDict,
                                 'PrimaryKey' : 'id'
                               }
     if self.__readOnly:
+      #Missing rollups are just not used
+      for rollupLength in list( rollupLengths ):
+        rollupTableName = _getTableName( "rollup%s" % rollupLength, name )
+        if rollupTableName in tables:
+          self.log.notice( "ReadOnly mode: %s is not available" % rollupTableName )
+          tables.pop( rollupTableName )
+          rollupLengths.remove( rollupLength )
       if tables:
         self.log.notice( "ReadOnly mode: Skipping create of tables for %s. Removing from memory catalog" % name )
         self.log.verbose( "Skipping creation of tables %s" % ", ".join( [ tn for tn in tables ] ) )
@@ -370,6 +407,8 @@ class AccountingDB( DB ):
           pass
       else:
         self.log.notice( "ReadOnly mode: %s is OK" % name )
+        if name in self.dbCatalog:
+          self.dbCatalog[ name ][ 'rollups' ] = rollupLengths
       return S_OK( not updateDBCatalog )
 
     if tables:
@@ -384,6 +423,15 @@ class AccountingDB( DB ):
                          [ 'name', 'keyFields', 'valueFields', 'bucketsLength' ],
                          [ name, ",".join( keyFieldsList ), ",".join( valueFieldsList ), bucketsEncoding ] )
       self.__addToCatalog( name, keyFieldsList, valueFieldsList, bucketsLength )
+    #Rollups created for an already existing type are filled from its buckets
+    for rollupLength in rollupsToFill:
+      retVal = self.__rebuildRollup( name, rollupLength )
+      if not retVal[ 'OK' ]:
+        self.log.error( "Can't fill rollup", "%s for %s: %s" % ( rollupLength, name, retVal[ 'Message' ] ) )
+        #Drop it so it is filled again next time instead of being used empty
+        self.__discardRollup( name, rollupLength )
+        rollupLengths.remove( rollupLength )
+    self.dbCatalog[ name ][ 'rollups' ] = rollupLengths
     self.log.info( "Registered type %s" % name )
     return S_OK( True )
 
@@ -457,6 +505,8 @@ class AccountingDB( DB ):
     tablesToDelete.insert( 0, "`%s`" % _getTableName( "type", typeName ) )
     tablesToDelete.insert( 0, "`%s`" % _getTableName( "bucket", typeName ) )
     tablesToDelete.insert( 0, "`%s`" % _getTableName( "in", typeName ) )
+    for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]:
+      tablesToDelete.append( "`%s`" % _getTableName( "rollup%s" % rollupLength, typeName ) )
     retVal = self._query( "DROP TABLE %s" % ", ".join( tablesToDelete ) )
     if not retVal[ 'OK' ]:
       return retVal
@@ -559,34 +609,50 @@ class AccountingDB( DB ):
     return buckets
 
   def __insertInQueueTable( self, typeName, startTime, endTime, valuesList ):
-    sqlFields = [ 'id', 'taken', 'takenSince' ] + self.dbCatalog[ typeName ][ 'typeFields' ]
-    sqlValues = [ '0', '0', 'UTC_TIMESTAMP()' ] + valuesList + [ startTime, endTime ]
+    sqlFields = self.dbCatalog[ typeName ][ 'typeFields' ]
+    sqlValues = list( valuesList ) + [ startTime, endTime ]
     if len( sqlFields ) != len( sqlValues ):
       numRcv = len( valuesList ) + 2
       numExp = len( self.dbCatalog[ typeName ][ 'typeFields' ] )
       return S_ERROR( "Fields mismatch for record %s. %s fields and %s expected" % ( typeName,
                                                                                      numRcv,
                                                                                      numExp ) )
-    retVal = self.insertFields( _getTableName( "in", typeName ),
-                           sqlFields,
-                           sqlValues )
+    retVal = self.insertFieldsMany( _getTableName( "in", typeName ),
+                                    sqlFields,
+                                    [ sqlValues ],
+                                    exprDict = { 'taken' : '0', 'takenSince' : 'UTC_TIMESTAMP()' } )
     if not retVal[ 'OK' ]:
       return retVal
     return S_OK( retVal[ 'lastRowId' ] )
 
   def insertRecordBundleThroughQueue( self, recordsToQueue ) :
+    """
+    Insert a bundle of records in the in tables, with one multi-row INSERT per type
+    and per chunk of records
+    """
     if self.__readOnly:
       return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
-    recordsToProcess = []
-    now = Time.toEpoch()
+    recordsByType = {}
     for record in recordsToQueue:
       typeName, startTime, endTime, valuesList = record
-      result = self.__insertInQueueTable( typeName, startTime, endTime, valuesList )
+      if not typeName in self.dbCatalog:
+        return S_ERROR( "Type %s has not been defined in the db" % typeName )
+      numExp = len( self.dbCatalog[ typeName ][ 'typeFields' ] )
+      if len( valuesList ) + 2 != numExp:
+        return S_ERROR( "Fields mismatch for record %s. %s fields and %s expected" % ( typeName,
+                                                                                       len( valuesList ) + 2,
+                                                                                       numExp ) )
+      recordsByType.setdefault( typeName, [] ).append( list( valuesList ) + [ startTime, endTime ] )
+    maxRecords = self.getCSOption( "MaxRecordsPerInsert", 1000 )
+    for typeName, recordValues in recordsByType.items():
+      result = self.insertFieldsMany( _getTableName( "in", typeName ),
+                                      self.dbCatalog[ typeName ][ 'typeFields' ],
+                                      recordValues,
+                                      exprDict = { 'taken' : '0', 'takenSince' : 'UTC_TIMESTAMP()' },
+                                      chunkSize = maxRecords )
       if not result[ 'OK' ]:
         return result
-      iD = result[ 'Value' ]
-      recordsToProcess.append( ( iD, typeName, startTime, endTime, valuesList, now ) )
-
+      self.log.verbose( "Queued records", "%s records for type %s" % ( len( recordValues ), typeName ) )
     return S_OK()
 
   def insertRecordThroughQueue( self, typeName, startTime, endTime, valuesList ):
@@ -599,7 +665,7 @@ class AccountingDB( DB ):
     if not typeName in self.dbCatalog:
       return S_ERROR( "Type %s has not been defined in the db" % typeName )
     result = self.__insertInQueueTable( typeName, startTime, endTime, valuesList )
-    if not result[ '0K' ]:
+    if not result[ 'OK' ]:
       return result
 
     return S_OK()
@@ -783,10 +849,12 @@ class AccountingDB( DB ):
   def getBucketsDef( self, typeName ):
     return self.dbBucketsLength[ typeName ]
 
-  def __generateSQLConditionForKeys( self, typeName, keyValues ):
+  def __generateSQLConditionForKeys( self, typeName, keyValues, tableName = False ):
     """
     Generate sql condition for buckets, values are indexes to real values
     """
+    if not tableName:
+      tableName = _getTableName( "bucket", typeName )
     realCondList = []
     for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
       keyField = self.dbCatalog[ typeName ][ 'keys' ][ keyPos ]
@@ -795,7 +863,7 @@ class AccountingDB( DB ):
       if not retVal[ 'OK' ]:
         return retVal
       keyValue = retVal[ 'Value' ]
-      realCondList.append( "`%s`.`%s` = %s" % ( _getTableName( "bucket", typeName ), keyField, keyValue ) )
+      realCondList.append( "`%s`.`%s` = %s" % ( tableName, keyField, keyValue ) )
     return " AND ".join( realCondList )
 
   def __getBucketFromDB( self, typeName, startTime, bucketLength, keyValues, connObj = False ):
@@ -818,9 +886,25 @@ class AccountingDB( DB ):
 
   def __extractFromBucket( self, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj = False ):
     """
-    Update a bucket when coming from the raw insert
+    Update a bucket and the rollups containing it when coming from the raw insert
+    """
+    retVal = self.__extractFromBucketInTable( _getTableName( "bucket", typeName ), typeName, startTime, bucketLength,
+                                              keyValues, bucketValues, proportion, connObj = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]:
+      rollupStartTime, rollupBucketLength = _getRollupBucket( startTime, bucketLength, rollupLength )
+      result = self.__extractFromBucketInTable( _getTableName( "rollup%s" % rollupLength, typeName ), typeName,
+                                                rollupStartTime, rollupBucketLength, keyValues, bucketValues,
+                                                proportion, connObj = connObj )
+      if not result[ 'OK' ]:
+        return result
+    return retVal
+
+  def __extractFromBucketInTable( self, tableName, typeName, startTime, bucketLength, keyValues, bucketValues, proportion, connObj = False ):
+    """
+    Subtract values from a bucket of a bucket or rollup table
     """
-    tableName = _getTableName( "bucket", typeName )
     cmd = "UPDATE `%s` SET " % tableName
     sqlValList = []
     for pos in range( len( self.dbCatalog[ typeName ][ 'values' ] ) ):
@@ -838,14 +922,31 @@ class AccountingDB( DB ):
                                                                             startTime,
                                                                             tableName,
                                                                             bucketLength )
-    cmd += self.__generateSQLConditionForKeys( typeName, keyValues )
+    cmd += self.__generateSQLConditionForKeys( typeName, keyValues, tableName )
     return self._update( cmd, conn = connObj )
 
 
   def __writeBuckets( self, typeName, buckets, keyValues, valuesList, connObj = False ):
-    """ Insert or update a bucket
+    """ Insert or update a bucket and the rollups containing it
+    """
+    result = self.__writeBucketsInTable( _getTableName( "bucket", typeName ), typeName, buckets,
+                                         keyValues, valuesList, connObj = connObj )
+    if not result[ 'OK' ]:
+      return result
+    for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]:
+      rollupBuckets = []
+      for bStartTime, bProportion, bLength in buckets:
+        rollupStartTime, rollupBucketLength = _getRollupBucket( bStartTime, bLength, rollupLength )
+        rollupBuckets.append( ( rollupStartTime, bProportion, rollupBucketLength ) )
+      retVal = self.__writeBucketsInTable( _getTableName( "rollup%s" % rollupLength, typeName ), typeName,
+                                           rollupBuckets, keyValues, valuesList, connObj = connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+    return result
+
+  def __writeBucketsInTable( self, tableName, typeName, buckets, keyValues, valuesList, connObj = False ):
+    """ Insert or update buckets of a bucket or rollup table
     """
-#     tableName = _getTableName( "bucket", typeName )
     #INSERT PART OF THE QUERY
     sqlFields = [ '`startTime`', '`bucketLength`', '`entriesInBucket`' ]
     for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
@@ -868,7 +969,7 @@ class AccountingDB( DB ):
         sqlValues.append( "(%s*%s)" % ( valuesList[ valPos ], bProportion ) )
       valuesGroups.append( "( %s )" % ",".join( str( val ) for val in sqlValues ) )
 
-    cmd = "INSERT INTO `%s` ( %s ) " % ( _getTableName( "bucket", typeName ), ", ".join( sqlFields ) )
+    cmd = "INSERT INTO `%s` ( %s ) " % ( tableName, ", ".join( sqlFields ) )
     cmd += "VALUES %s " % ", ".join( valuesGroups)
     cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( sqlUpData )
 
@@ -928,7 +1029,8 @@ class AccountingDB( DB ):
     return self.__queryType( typeName, startTime, endTime, selectFields,
                              condDict, False, orderFields, "type" )
 
-  def retrieveBucketedData( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, connObj = False ):
+  def retrieveBucketedData( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields,
+                            connObj = False, granularity = False ):
     """
     Get data from the DB
     Parameters:
@@ -943,6 +1045,8 @@ class AccountingDB( DB ):
                   ( "%s, %s, %s", ( "field1name", "field2name", "field3name" ) )
      - orderFields -> list of fields to order by
                   ( "%s, %s, %s", ( "field1name", "field2name", "field3name" ) )
+     - granularity -> bucket length the caller will sum the returned buckets into. If given
+                  the data may come from rollup tables with buckets that fit in it
     """
     if typeName not in self.dbCatalog:
       return S_ERROR( "Type %s is not defined" % typeName )
@@ -963,14 +1067,21 @@ class AccountingDB( DB ):
                              groupFields,
                              orderFields,
                              "bucket",
-                             connObj = connObj )
+                             connObj = connObj,
+                             granularity = granularity )
     gMonitor.addMark( "querytime", Time.toEpoch() - startQueryEpoch )
     return result
 
-  def __queryType( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, tableType, connObj = False ):
+  def __queryType( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, tableType,
+                   connObj = False, granularity = False, useRollups = True ):
     """
     Execute a query over a main table
     """
+    #The grouping and sorting fields are rewritten below, keep them in case the query has to be redone
+    queryArgs = ( typeName, startTime, endTime, selectFields, condDict,
+                  groupFields and ( groupFields[0], list( groupFields[1] ) ),
+                  orderFields and ( orderFields[0], list( orderFields[1] ) ),
+                  tableType, connObj, granularity )
     tableName = _getTableName( tableType, typeName )
     cmd = "SELECT"
     sqlLinkList = []
@@ -1000,14 +1111,6 @@ class AccountingDB( DB ):
       cmd += " %s" % selectFields[0] % tuple( realFieldList )
     except Exception, e:
       return S_ERROR( "Error generating select fields string: %s" % str( e ) )
-    #Calculate tables needed
-    sqlFromList = [ "`%s`" % tableName ]
-    for key in self.dbCatalog[ typeName ][ 'keys' ]:
-      if key in condDict or key in selectFields[1]  \
-          or ( groupFields and key in groupFields[1] ) \
-          or ( orderFields and key in orderFields[1] ):
-        sqlFromList.append( "`%s`" % _getTableName( "key", typeName, key ) )
-    cmd += " FROM %s" % ", ".join( sqlFromList )
     #Calculate time conditions
     sqlTimeCond = []
     if startTime:
@@ -1024,6 +1127,21 @@ class AccountingDB( DB ):
       else:
         endTimeSQLVar = "endTime"
       sqlTimeCond.append( "`%s`.`%s` <= %s" % ( tableName, endTimeSQLVar, endTime ) )
+    #Calculate tables needed
+    sqlFromList = [ "`%s`" % tableName ]
+    rollupSQL = False
+    if tableType == "bucket" and useRollups:
+      rollupSQL = self.__getRollupQueryTable( typeName, startTime, endTime, selectFields,
+                                              groupFields, orderFields, granularity )
+      if rollupSQL:
+        #Same name as the bucket table so the rest of the query is the same
+        sqlFromList = [ "%s AS `%s`" % ( rollupSQL, tableName ) ]
+    for key in self.dbCatalog[ typeName ][ 'keys' ]:
+      if key in condDict or key in selectFields[1]  \
+          or ( groupFields and key in groupFields[1] ) \
+          or ( orderFields and key in orderFields[1] ):
+        sqlFromList.append( "`%s`" % _getTableName( "key", typeName, key ) )
+    cmd += " FROM %s" % ", ".join( sqlFromList )
     cmd += " WHERE %s" % " AND ".join( sqlTimeCond )
     #Calculate conditions
     sqlCondList = []
@@ -1071,7 +1189,99 @@ class AccountingDB( DB ):
     if orderFields:
       cmd += " ORDER BY %s" % ( orderFields[0] % tuple( orderFields[1] ) )
     self.log.verbose( cmd )
-    return self._query( cmd, conn = connObj )
+    retVal = self._query( cmd, conn = connObj )
+    if not retVal[ 'OK' ] and rollupSQL:
+      #The rollup may have been discarded by another process
+      self.log.warn( "Query using rollups failed, using the bucket table", retVal[ 'Message' ] )
+      return self.__queryType( *queryArgs, useRollups = False )
+    return retVal
+
+  def __isAdditiveQuery( self, typeName, selectFields, groupFields, orderFields ):
+    """
+    Check if the query only sums values grouped by keys and time. Only then the
+    result does not change when buckets are merged in a rollup
+    """
+    keyFields = self.dbCatalog[ typeName ][ 'keys' ]
+    sumFields = self.dbCatalog[ typeName ][ 'values' ] + [ 'entriesInBucket' ]
+    plainFields = keyFields + [ 'startTime', 'bucketLength' ]
+    selectItems = selectFields[0].replace( " ", "" ).split( "," )
+    if len( selectItems ) != len( selectFields[1] ):
+      return False
+    for iPos in range( len( selectItems ) ):
+      field = selectFields[1][ iPos ]
+      if selectItems[ iPos ] == "%s":
+        if field not in plainFields:
+          return False
+      elif selectItems[ iPos ].upper() == "SUM(%S)":
+        if field not in sumFields:
+          return False
+      else:
+        return False
+    for preGenFields in ( groupFields, orderFields ):
+      if not preGenFields:
+        continue
+      if [ item for item in preGenFields[0].replace( " ", "" ).split( "," ) if item != "%s" ]:
+        return False
+      if [ groupField for groupField in preGenFields[1] if groupField not in plainFields ]:
+        return False
+    return True
+
+  def __getRollupQueryTable( self, typeName, startTime, endTime, selectFields, groupFields, orderFields, granularity ):
+    """
+    Query planner: get the SQL of a derived table that can replace the bucket table in a query,
+    taking the aligned part of the time span from the coarsest usable rollup and the edges from the
+    bucket table. Returns False if the bucket table has to be used.
+     - startTime & endTime -> bucket startTime limits of the query, both inclusive
+     - granularity -> if the query retrieves the time of the buckets, the caller has to merge them
+                      into buckets of this length. Rollups have to fit in them
+    """
+    rollupLengths = self.dbCatalog[ typeName ][ 'rollups' ]
+    if not rollupLengths:
+      return False
+    if not self.__isAdditiveQuery( typeName, selectFields, groupFields, orderFields ):
+      return False
+    timeFields = [ 'startTime', 'bucketLength' ]
+    usesTime = [ field for field in selectFields[1] if field in timeFields ]
+    for preGenFields in ( groupFields, orderFields ):
+      if preGenFields:
+        usesTime.extend( [ field for field in preGenFields[1] if field in timeFields ] )
+    if usesTime:
+      if not granularity:
+        return False
+      rollupLengths = [ rollupLength for rollupLength in rollupLengths if granularity % rollupLength == 0 ]
+    if not rollupLengths:
+      return False
+    rollupLength = max( rollupLengths )
+    #Rollup buckets completely inside the time span
+    rollupStart = 0
+    if startTime:
+      rollupStart = startTime - startTime % rollupLength
+      if rollupStart < startTime:
+        rollupStart += rollupLength
+    rollupEnd = False
+    if endTime:
+      rollupEnd = ( endTime + 1 ) - ( endTime + 1 ) % rollupLength
+      if rollupEnd <= rollupStart:
+        return False
+    self.log.verbose( "Using rollup %s for %s" % ( rollupLength, typeName ) )
+    fieldsString = ", ".join( [ "`%s`" % field for field in self.dbCatalog[ typeName ][ 'bucketFields' ] ] )
+    bucketCond = [ "`startTime` < %s" % rollupStart ]
+    rollupCond = [ "`startTime` >= %s" % rollupStart ]
+    if rollupEnd:
+      bucketCond.append( "`startTime` >= %s" % rollupEnd )
+      rollupCond.append( "`startTime` < %s" % rollupEnd )
+    bucketCond = [ "( %s )" % " OR ".join( bucketCond ) ]
+    if startTime:
+      bucketCond.append( "`startTime` >= %s" % startTime )
+    if endTime:
+      bucketCond.append( "`startTime` <= %s" % endTime )
+    return "( SELECT %s FROM `%s` WHERE %s UNION ALL SELECT %s FROM `%s` WHERE %s )" % ( fieldsString,
+                                                                                       _getTableName( "bucket", typeName ),
+                                                                                       " AND ".join( bucketCond ),
+                                                                                       fieldsString,
+                                                                                       _getTableName( "rollup%s" % rollupLength,
+                                                                                                      typeName ),
+                                                                                       " AND ".join( rollupCond ) )
 
   def compactBuckets( self, typeFilter = False ):
     """
@@ -1086,7 +1296,7 @@ class AccountingDB( DB ):
       self.__doingCompaction = True
     finally:
       gSynchro.unlock()
-    slow = True
+    slow = self.getCSOption( "SlowCompaction", True )
     for typeName in self.dbCatalog:
       if typeFilter and typeName.find( typeFilter ) == -1:
         self.log.info( "[COMPACT] Skipping %s" % typeName )
@@ -1134,6 +1344,29 @@ class AccountingDB( DB ):
     selectSQL += " GROUP BY %s" % ", ".join( sqlGroupList )
     return self._query( selectSQL, conn = connObj )
 
+  def __selectRollupForCompactBuckets( self, typeName, timeLimit, bucketLength, rollupLength, connObj = False ):
+    """
+    Get what the buckets to compact add to a rollup, grouped by rollup bucket. The records have
+    the key fields, value fields, entriesInBucket, startTime and bucketLength of the rollup bucket
+    """
+    tableName = _getTableName( "bucket", typeName )
+    keyFields = [ "`%s`.`%s`" % ( tableName, field ) for field in self.dbCatalog[ typeName ][ 'keys' ] ]
+    sumFields = [ "SUM( `%s`.`%s` )" % ( tableName, field ) for field in self.dbCatalog[ typeName ][ 'values' ] +
+                                                                          [ 'entriesInBucket' ] ]
+    #Same merging as _getRollupBucket
+    if bucketLength < rollupLength:
+      rollupStartTime = _bucketizeDataField( "`%s`.`startTime`" % tableName, rollupLength )
+      rollupBucketLength = rollupLength
+    else:
+      rollupStartTime = "`%s`.`startTime`" % tableName
+      rollupBucketLength = bucketLength
+    selectSQL = "SELECT %s" % ", ".join( keyFields + sumFields + [ rollupStartTime, str( rollupBucketLength ) ] )
+    selectSQL += " FROM `%s`" % tableName
+    selectSQL += " WHERE `%s`.`startTime` < '%s' AND" % ( tableName, timeLimit )
+    selectSQL += " `%s`.`bucketLength` = %s" % ( tableName, bucketLength )
+    selectSQL += " GROUP BY %s" % ", ".join( keyFields + [ rollupStartTime ] )
+    return self._query( selectSQL, conn = connObj )
+
   def __deleteForCompactBuckets( self, typeName, timeLimit, bucketLength, connObj = False ):
     """
     Delete compacted buckets
@@ -1149,6 +1382,7 @@ class AccountingDB( DB ):
     Compact all buckets for a given type
     """
     nowEpoch = Time.toEpoch()
+    rebuildRollups = False
     #retVal = self.__startTransaction( connObj )
     #if not retVal[ 'OK' ]:
     #  return retVal
@@ -1168,10 +1402,32 @@ class AccountingDB( DB ):
       self.log.info( "[COMPACT] Got %d records to compact" % len( bucketsData ) )
       if len( bucketsData ) == 0:
         continue
+      #Content of the rollups coming from the buckets to delete
+      rollupsData = {}
+      for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]:
+        retVal = self.__selectRollupForCompactBuckets( typeName, timeLimit, bucketLength, rollupLength )
+        if not retVal[ 'OK' ]:
+          self.log.error( "[COMPACT] Error while selecting rollup buckets", "%s: %s" % ( typeName, retVal[ 'Message' ] ) )
+          rollupsData = False
+          break
+        rollupsData[ rollupLength ] = retVal[ 'Value' ]
       retVal = self.__deleteForCompactBuckets( typeName, timeLimit, bucketLength )
       if not retVal[ 'OK' ]:
         #self.__rollbackTransaction( connObj )
         return retVal
+      #Take the deleted buckets out of the rollups, they are added back when the compacted ones are written
+      if rollupsData is False:
+        retVal = S_ERROR( "Rollup buckets to extract are unknown" )
+      else:
+        retVal = S_OK()
+        for rollupLength, rollupBuckets in rollupsData.items():
+          retVal = self.__extractBucketsFromRollups( typeName, rollupBuckets, rollupLengths = [ rollupLength ] )
+          if not retVal[ 'OK' ]:
+            break
+      if not retVal[ 'OK' ]:
+        #The rollups would count the deleted buckets twice once they are written back
+        self.log.error( "[COMPACT] Error while updating rollups", "%s: %s" % ( typeName, retVal[ 'Message' ] ) )
+        rebuildRollups = True
       self.log.info( "[COMPACT] Compacting %s records %s seconds size for %s" % ( len( bucketsData ), bucketLength, typeName ) )
       #Add data
       for record in bucketsData:
@@ -1183,6 +1439,8 @@ class AccountingDB( DB ):
           #self.__rollbackTransaction( connObj )
           self.log.error( "[COMPACT] Error while compacting data for record", "%s: %s" % ( typeName, retVal[ 'Value' ] ) )
       self.log.info( "[COMPACT] Finished compaction %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
+    if rebuildRollups:
+      self.__rebuildRollups( typeName )
     #return self.__commitTransaction( connObj )
     return S_OK()
 
@@ -1225,6 +1483,12 @@ class AccountingDB( DB ):
           #self.__rollbackTransaction( connObj )
           return result
         bucketsData = result[ 'Value' ]
+        #Take the deleted buckets out of the rollups, they are added back when the compacted ones are written
+        result = self.__extractBucketsFromRollups( typeName, bucketsData )
+        if not result[ 'OK' ]:
+          #The rollups would count the deleted buckets twice once they are written back
+          self.log.error( "[COMPACT] Error while updating rollups", "%s: %s" % ( typeName, result[ 'Message' ] ) )
+          self.__rebuildRollups( typeName )
         deleteEndTime = time.time()
         self.log.info( "[COMPACT] Deleted %s out-of-bounds buckets (took %.2f secs)" % ( len( bucketsData ),
                                                                                          deleteEndTime - selectEndTime ) )
@@ -1292,6 +1556,101 @@ class AccountingDB( DB ):
         deletedBuckets.extend( bucketsData[ bLimit : bLimit + deleteQueryLimit ] )
     return S_OK( deletedBuckets )
 
+  def __extractBucketsFromRollups( self, typeName, bucketsData, rollupLengths = None, connObj = False ):
+    """
+    Subtract buckets from the rollups, all of them if rollupLengths is not given. bucketsData contains
+    key fields, value fields, entriesInBucket, startTime and bucketLength
+    """
+    numKeys = len( self.dbCatalog[ typeName ][ 'keys' ] )
+    if rollupLengths is None:
+      rollupLengths = self.dbCatalog[ typeName ][ 'rollups' ]
+    for rollupLength in rollupLengths:
+      #Merge the buckets falling in the same rollup bucket
+      rollupData = {}
+      for record in bucketsData:
+        rollupKey = ( tuple( record[ :numKeys ] ), _getRollupBucket( record[-2], record[-1], rollupLength ) )
+        if rollupKey in rollupData:
+          rollupData[ rollupKey ] = [ v1 + v2 for v1, v2 in zip( rollupData[ rollupKey ], record[ numKeys:-2 ] ) ]
+        else:
+          rollupData[ rollupKey ] = list( record[ numKeys:-2 ] )
+      rollupTableName = _getTableName( "rollup%s" % rollupLength, typeName )
+      for rollupKey, bucketValues in rollupData.items():
+        keyValues, ( rollupStartTime, rollupBucketLength ) = rollupKey
+        result = self.__extractFromBucketInTable( rollupTableName, typeName, rollupStartTime, rollupBucketLength,
+                                                  list( keyValues ), bucketValues, 1, connObj = connObj )
+        if not result[ 'OK' ]:
+          return result
+    return S_OK()
+
+  def __rebuildRollups( self, typeName ):
+    """
+    Regenerate all the rollups of a type, the ones that can not be regenerated are discarded
+    """
+    for rollupLength in list( self.dbCatalog[ typeName ][ 'rollups' ] ):
+      retVal = self.__rebuildRollup( typeName, rollupLength )
+      if not retVal[ 'OK' ]:
+        self.log.error( "Can't rebuild rollup", "%s for %s: %s" % ( rollupLength, typeName, retVal[ 'Message' ] ) )
+        self.__discardRollup( typeName, rollupLength )
+
+  def __rebuildRollup( self, typeName, rollupLength ):
+    """
+    Regenerate the content of a rollup table from the bucket table. It is done in one transaction,
+    so the rollup is never seen empty and the concurrent bucket writes wait for it
+    """
+    bucketTableName = _getTableName( "bucket", typeName )
+    rollupTableName = _getTableName( "rollup%s" % rollupLength, typeName )
+    self.log.info( "Rebuilding %s" % rollupTableName )
+    keyFields = [ "`%s`" % field for field in self.dbCatalog[ typeName ][ 'keys' ] ]
+    sumFields = [ "`%s`" % field for field in self.dbCatalog[ typeName ][ 'values' ] + [ 'entriesInBucket' ] ]
+    isShorter = "`bucketLength` < %d" % rollupLength
+    rollupTime = [ "IF( %s, %s, `startTime` )" % ( isShorter, _bucketizeDataField( "`startTime`", rollupLength ) ),
+                   "IF( %s, %d, `bucketLength` )" % ( isShorter, rollupLength ) ]
+    sqlCmd = "INSERT INTO `%s` ( %s ) SELECT %s FROM `%s` GROUP BY %s" % ( rollupTableName,
+                                                                          ", ".join( keyFields + sumFields +
+                                                                                     [ '`startTime`', '`bucketLength`' ] ),
+                                                                          ", ".join( keyFields +
+                                                                                     [ "SUM( %s )" % f for f in sumFields ] +
+                                                                                     rollupTime ),
+                                                                          bucketTableName,
+                                                                          ", ".join( keyFields + rollupTime ) )
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return retVal
+    connObj = retVal[ 'Value' ]
+    try:
+      for _i in range( max( 1, self.__deadLockRetries ) ):
+        retVal = self.__startTransaction( connObj )
+        if not retVal[ 'OK' ]:
+          return retVal
+        retVal = self._update( "DELETE FROM `%s`" % rollupTableName, conn = connObj )
+        if retVal[ 'OK' ]:
+          retVal = self._update( sqlCmd, conn = connObj )
+        if retVal[ 'OK' ]:
+          retVal = self.__commitTransaction( connObj )
+          if retVal[ 'OK' ]:
+            return S_OK()
+        self.__rollbackTransaction( connObj )
+        #Retry only if the transaction was chosen as dead lock victim
+        if retVal[ 'Message' ].find( "try restarting transaction" ) == -1:
+          break
+      return retVal
+    finally:
+      connObj.close()
+
+  def __discardRollup( self, typeName, rollupLength ):
+    """
+    Stop using a rollup that can not be kept consistent with the buckets. The table is dropped,
+    so it is created and filled again the next time the type is registered
+    """
+    rollupTableName = _getTableName( "rollup%s" % rollupLength, typeName )
+    self.log.warn( "Discarding %s, it will be rebuilt when %s is registered again" % ( rollupTableName, typeName ) )
+    if typeName in self.dbCatalog and rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]:
+      self.dbCatalog[ typeName ][ 'rollups' ].remove( rollupLength )
+    retVal = self._update( "DROP TABLE IF EXISTS `%s`" % rollupTableName )
+    if not retVal[ 'OK' ]:
+      self.log.error( "Can't drop rollup", "%s: %s" % ( rollupTableName, retVal[ 'Message' ] ) )
+    return retVal
+
   def __deleteRecordsOlderThanDataTimespan( self, typeName ):
     """
     IF types define dataTimespan, then records older than datatimespan seconds will be deleted
@@ -1300,8 +1659,12 @@ class AccountingDB( DB ):
     dataTimespan = self.dbCatalog[ typeName ][ 'dataTimespan' ]
     if dataTimespan < 86400 * 30:
       return
-    for table, field in ( ( _getTableName( "type", typeName ), 'endTime' ),
-                          ( _getTableName( "bucket", typeName ), 'startTime + %s' % self.dbBucketsLength[ typeName ][-1][1] ) ):
+    bucketTimeField = 'startTime + %s' % self.dbBucketsLength[ typeName ][-1][1]
+    tablesToClean = [ ( _getTableName( "type", typeName ), 'endTime' ),
+                      ( _getTableName( "bucket", typeName ), bucketTimeField ) ]
+    for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]:
+      tablesToClean.append( ( _getTableName( "rollup%s" % rollupLength, typeName ), bucketTimeField ) )
+    for table, field in tablesToClean:
       self.log.info( "[COMPACT] Deleting old records for table %s" % table )
       deleteLimit = 100000
       deleted = deleteLimit
@@ -1333,6 +1696,10 @@ class AccountingDB( DB ):
     retVal = self._update( "DELETE FROM `%s`" % _getTableName( "bucket", typeName ) )
     if not retVal[ 'OK' ]:
       return retVal
+    for rollupLength in self.dbCatalog[ typeName ][ 'rollups' ]:
+      retVal = self._update( "DELETE FROM `%s`" % _getTableName( "rollup%s" % rollupLength, typeName ) )
+      if not retVal[ 'OK' ]:
+        return retVal
     #Generate the common part of the query
     #SELECT fields
     startTimeTableField = "`%s`.startTime" % rawTableName
@@ -1457,6 +1824,15 @@ class AccountingDB( DB ):
 def _bucketizeDataField( dataField, bucketLength ):
   return "%s - ( %s %% %s )" % ( dataField, dataField, bucketLength )
 
+def _getRollupBucket( startTime, bucketLength, rollupLength ):
+  """
+  Get the rollup bucket containing a bucket. Buckets shorter than the rollup are merged,
+  longer ones are kept as they are
+  """
+  if bucketLength < rollupLength:
+    return ( startTime - startTime % rollupLength, rollupLength )
+  return ( startTime, bucketLength )
+
 def _getTableName( tableType, typeName, keyName = None ):
   """
   Generate table name
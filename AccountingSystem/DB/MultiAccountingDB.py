@@ -45,13 +45,13 @@ class MultiAccountingDB( object ):
                         'deleteType', 'insertRecordThroughQueue',
                         'deleteRecord', 'getKeyValues', 'retrieveBucketedData',
                         'calculateBuckets', 'calculateBucketLengthForTime' ):
-      (lambda closure: setattr( self, closure, lambda *x: self.__mimeTypeMethod( closure, *x ) ))(methodName)
+      (lambda closure: setattr( self, closure, lambda *x, **kw: self.__mimeTypeMethod( closure, *x, **kw ) ))(methodName)
     for methodName in ( 'autoCompactDB', 'compactBuckets', 'markAllPendingRecordsAsNotTaken',
                         'loadPendingRecords', 'getRegisteredTypes' ):
       (lambda closure: setattr( self, closure, lambda *x: self.__mimeMethod( closure, *x ) ))(methodName)
 
-  def __mimeTypeMethod( self, methodName, setup, acType, *args ):
-    return getattr( self.__db( acType ), methodName )( "%s_%s" % ( setup, acType ), *args )
+  def __mimeTypeMethod( self, methodName, setup, acType, *args, **kwargs ):
+    return getattr( self.__db( acType ), methodName )( "%s_%s" % ( setup, acType ), *args, **kwargs )
 
   def __mimeMethod( self, methodName, *args ):
     end = S_OK()
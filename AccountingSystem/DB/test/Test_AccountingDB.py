@@ -0,0 +1,297 @@
+""" Unit tests of the AccountingDB rollup tables, run over an in-memory sqlite DB
+"""
+
+import random
+import sqlite3
+import unittest
+
+from mock import patch
+
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.AccountingSystem.DB.AccountingDB import AccountingDB, _getRollupBucket
+
+DAY = 86400
+HOUR = 3600
+BASE = 1400000000 - 1400000000 % DAY
+
+class FakeAccountingDB( AccountingDB ):
+  """ AccountingDB with the MySQL access replaced by a sqlite connection
+  """
+
+  def __init__( self ):
+    self.log = gLogger.getSubLogger( "FakeAccountingDB" )
+    self.maxBucketTime = 604800
+    self._AccountingDB__readOnly = False
+    self._AccountingDB__deadLockRetries = 2
+    self._AccountingDB__keysCache = {}
+    self.dbCatalog = {}
+    self.dbBucketsLength = {}
+    self.failingCmd = False
+    self.sqlite = sqlite3.connect( ":memory:", isolation_level = None )
+    self.sqlite.create_function( "IF", 3, lambda cond, yes, no: yes if cond else no )
+    self.sqlite.create_function( "GREATEST", 2, max )
+    self._AccountingDB__addToCatalog( "T", [ "Site" ], [ "CPU" ], [ ( 10 ** 10, HOUR ) ] )
+    bucketFields = "`Site` INTEGER, `CPU` INTEGER, `entriesInBucket` INTEGER, `startTime` INTEGER, `bucketLength` INTEGER"
+    for tableName in ( "ac_bucket_T", "ac_rollup86400_T" ):
+      self.sqlite.execute( "CREATE TABLE `%s` ( %s )" % ( tableName, bucketFields ) )
+    self.sqlite.execute( "CREATE TABLE `ac_key_T_Site` ( `id` INTEGER, `value` VARCHAR(64) )" )
+    for siteID in range( 1, 4 ):
+      self.sqlite.execute( "INSERT INTO `ac_key_T_Site` VALUES ( %d, 'Site%d' )" % ( siteID, siteID ) )
+
+  def _query( self, cmd, conn = None, debug = False ):
+    if cmd == "START TRANSACTION":
+      cmd = "BEGIN"
+    if self.failingCmd and cmd.startswith( self.failingCmd ):
+      return S_ERROR( "Failing %s" % self.failingCmd )
+    if cmd.startswith( "UPDATE" ):
+      #sqlite does not take the table name in the SET columns
+      tableName = cmd.split()[1]
+      cmd = cmd.replace( "%s." % tableName, "" )
+    try:
+      return S_OK( tuple( self.sqlite.execute( cmd ).fetchall() ) )
+    except sqlite3.Error, e:
+      return S_ERROR( str( e ) )
+
+  def _update( self, cmd, conn = None, debug = False, args = None ):
+    result = self._query( cmd, conn = conn )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( self.sqlite.total_changes )
+
+  def _getConnection( self ):
+    return S_OK( FakeConnection() )
+
+  def _escapeString( self, myString ):
+    return S_OK( "'%s'" % myString )
+
+class FakeConnection( object ):
+
+  def close( self ):
+    pass
+
+class AccountingDBTestCase( unittest.TestCase ):
+  """ Base class for the AccountingDB test cases
+  """
+
+  def setUp( self ):
+    self.db = FakeAccountingDB()
+    random.seed( 1 )
+    #Hourly buckets for four days and a day long bucket on the fifth one
+    for startTime in range( BASE, BASE + 4 * DAY, HOUR ):
+      for siteID in range( 1, 4 ):
+        if random.random() < 0.7:
+          self.__insertBucket( siteID, random.randint( 1, 100 ), random.randint( 1, 5 ), startTime, HOUR )
+    self.__insertBucket( 1, 1000, 10, BASE + 4 * DAY, DAY )
+
+  def __insertBucket( self, siteID, cpu, entries, startTime, bucketLength ):
+    self.db.sqlite.execute( "INSERT INTO `ac_bucket_T` VALUES ( %s, %s, %s, %s, %s )" % ( siteID, cpu, entries,
+                                                                                      startTime, bucketLength ) )
+
+  def rebuildRollup( self ):
+    result = self.db._AccountingDB__rebuildRollup( "T", DAY )
+    self.assert_( result[ 'OK' ] )
+    self.db.dbCatalog[ "T" ][ 'rollups' ] = [ DAY ]
+
+  def getRollupTable( self, startTime, endTime, selectFields, groupFields, granularity ):
+    return self.db._AccountingDB__getRollupQueryTable( "T", startTime, endTime, selectFields,
+                                                       groupFields, False, granularity )
+
+  def queryDays( self, startTime, endTime ):
+    """ CPU per site and day
+    """
+    result = self.db.retrieveBucketedData( "T", startTime, endTime,
+                                           ( "%s, %s, %s, SUM(%s), SUM(%s)",
+                                             [ "Site", "startTime", "bucketLength", "CPU", "entriesInBucket" ] ),
+                                           {}, ( "%s, %s, %s", [ "Site", "startTime", "bucketLength" ] ), False,
+                                           granularity = DAY )
+    self.assert_( result[ 'OK' ], result.get( 'Message' ) )
+    days = {}
+    for site, startTime, _bucketLength, cpu, entries in result[ 'Value' ]:
+      key = ( site, startTime - startTime % DAY )
+      oldCPU, oldEntries = days.get( key, ( 0, 0 ) )
+      days[ key ] = ( oldCPU + cpu, oldEntries + entries )
+    return days
+
+class RollupBucketTestCase( AccountingDBTestCase ):
+
+  def test_getRollupBucket( self ):
+    """ Short buckets are merged in the rollup bucket, longer ones are kept
+    """
+    self.assertEqual( _getRollupBucket( BASE + 5 * HOUR, HOUR, DAY ), ( BASE, DAY ) )
+    self.assertEqual( _getRollupBucket( BASE, HOUR, DAY ), ( BASE, DAY ) )
+    self.assertEqual( _getRollupBucket( BASE + DAY - HOUR, HOUR, DAY ), ( BASE, DAY ) )
+    self.assertEqual( _getRollupBucket( BASE, DAY, DAY ), ( BASE, DAY ) )
+    self.assertEqual( _getRollupBucket( BASE, 7 * DAY, DAY ), ( BASE, 7 * DAY ) )
+
+class PlannerTestCase( AccountingDBTestCase ):
+
+  selectFields = ( "%s, %s, SUM(%s)", [ "Site", "startTime", "CPU" ] )
+  groupFields = ( "%s, %s", [ "Site", "startTime" ] )
+
+  def test_noRollups( self ):
+    """ Without rollups the bucket table is used
+    """
+    self.assertFalse( self.getRollupTable( BASE, BASE + 3 * DAY, self.selectFields, self.groupFields, DAY ) )
+
+  def test_granularity( self ):
+    """ The rollup has to fit in the granularity when the time is retrieved
+    """
+    self.db.dbCatalog[ "T" ][ 'rollups' ] = [ DAY ]
+    self.assertFalse( self.getRollupTable( BASE, BASE + 3 * DAY, self.selectFields, self.groupFields, False ) )
+    self.assertFalse( self.getRollupTable( BASE, BASE + 3 * DAY, self.selectFields, self.groupFields, 6 * HOUR ) )
+    self.assert_( self.getRollupTable( BASE, BASE + 3 * DAY, self.selectFields, self.groupFields, 2 * DAY ) )
+    #No time retrieved, any granularity is fine
+    self.assert_( self.getRollupTable( BASE, BASE + 3 * DAY, ( "SUM(%s)", [ "CPU" ] ), False, False ) )
+
+  def test_nonAdditive( self ):
+    """ Only sums grouped by keys and time can be taken from the rollups
+    """
+    self.db.dbCatalog[ "T" ][ 'rollups' ] = [ DAY ]
+    for selectFields, groupFields in ( ( ( "MAX(%s)", [ "CPU" ] ), False ),
+                                       ( ( "%s", [ "CPU" ] ), False ),
+                                       ( ( "SUM(%s)/SUM(%s)", [ "CPU", "entriesInBucket" ] ), False ),
+                                       ( ( "SUM(%s)", [ "CPU" ] ), ( "%s", [ "CPU" ] ) ),
+                                       ( ( "SUM(%s)", [ "CPU" ] ), ( "%s + 1", [ "Site" ] ) ) ):
+      self.assertFalse( self.getRollupTable( BASE, BASE + 3 * DAY, selectFields, groupFields, DAY ) )
+
+  def test_shortSpan( self ):
+    """ A span without a full rollup bucket inside uses the bucket table
+    """
+    self.db.dbCatalog[ "T" ][ 'rollups' ] = [ DAY ]
+    self.assertFalse( self.getRollupTable( BASE + HOUR, BASE + DAY, self.selectFields, self.groupFields, DAY ) )
+    sql = self.getRollupTable( BASE + HOUR, BASE + 2 * DAY, self.selectFields, self.groupFields, DAY )
+    self.assert_( "UNION ALL" in sql )
+    self.assert_( "`ac_rollup86400_T`" in sql )
+    self.assert_( "`startTime` >= %s" % ( BASE + DAY ) in sql )
+
+class RollupQueryTestCase( AccountingDBTestCase ):
+
+  def test_rollupEqualsRaw( self ):
+    """ The same data is returned with and without rollups
+    """
+    for startTime, endTime in ( ( BASE, BASE + 5 * DAY ),
+                                ( BASE + 5 * HOUR, BASE + 3 * DAY + 7 * HOUR ),
+                                ( BASE + DAY - HOUR, BASE + 2 * DAY + HOUR ) ):
+      raw = self.queryDays( startTime, endTime )
+      self.rebuildRollup()
+      self.assertEqual( self.queryDays( startTime, endTime ), raw )
+      self.db.dbCatalog[ "T" ][ 'rollups' ] = []
+
+  def test_droppedRollup( self ):
+    """ Queries fall back to the bucket table if the rollup is gone
+    """
+    raw = self.queryDays( BASE, BASE + 5 * DAY )
+    self.rebuildRollup()
+    self.db.sqlite.execute( "DROP TABLE `ac_rollup86400_T`" )
+    self.assertEqual( self.queryDays( BASE, BASE + 5 * DAY ), raw )
+
+  def test_failedRebuild( self ):
+    """ A failed rebuild leaves the previous rollup content
+    """
+    self.rebuildRollup()
+    before = self.db.sqlite.execute( "SELECT * FROM `ac_rollup86400_T`" ).fetchall()
+    self.assert_( before )
+    self.db.failingCmd = "INSERT"
+    result = self.db._AccountingDB__rebuildRollup( "T", DAY )
+    self.assertFalse( result[ 'OK' ] )
+    self.assertEqual( self.db.sqlite.execute( "SELECT * FROM `ac_rollup86400_T`" ).fetchall(), before )
+
+  def test_discardRollup( self ):
+    """ Rollups that can not be rebuilt are dropped and not used anymore
+    """
+    self.rebuildRollup()
+    self.db.failingCmd = "INSERT"
+    self.db._AccountingDB__rebuildRollups( "T" )
+    self.assertEqual( self.db.dbCatalog[ "T" ][ 'rollups' ], [] )
+    tables = self.db.sqlite.execute( "SELECT name FROM sqlite_master WHERE type='table'" ).fetchall()
+    self.assertFalse( ( u"ac_rollup86400_T", ) in tables )
+
+class RecordBundleTestCase( unittest.TestCase ):
+  """ Queueing of the record bundles with multi-row INSERTs
+  """
+
+  def setUp( self ):
+    self.db = FakeAccountingDB()
+    self.db.getCSOption = lambda optionName, defaultValue = None: 3
+    self.updates = []
+    def update( cmd, conn = None, debug = False, args = None ):
+      self.updates.append( ( cmd, args ) )
+      return S_OK( len( args ) / 4 )
+    self.db._update = update
+
+  def test_chunks( self ):
+    """ The records are inserted with one INSERT per MaxRecordsPerInsert records
+    """
+    records = [ ( "T", BASE + i, BASE + HOUR + i, [ "Site%d" % i, i ] ) for i in range( 7 ) ]
+    result = self.db.insertRecordBundleThroughQueue( records )
+    self.assert_( result[ 'OK' ], result.get( 'Message' ) )
+    self.assertEqual( len( self.updates ), 3 )
+    for cmd, _args in self.updates:
+      self.assert_( cmd.startswith( "INSERT INTO `ac_in_T`" ), cmd )
+      self.assert_( "UTC_TIMESTAMP()" in cmd, cmd )
+    insertedValues = [ list( args ) for _cmd, args in self.updates ]
+    self.assertEqual( [ len( values ) for values in insertedValues ], [ 12, 12, 4 ] )
+    self.assertEqual( sum( insertedValues, [] ),
+                      sum( [ [ "Site%d" % i, i, BASE + i, BASE + HOUR + i ] for i in range( 7 ) ], [] ) )
+
+  def test_invalidRecords( self ):
+    """ A bundle with an unknown type or a wrong number of values is rejected as a whole
+    """
+    valid = ( "T", BASE, BASE + HOUR, [ "Site1", 1 ] )
+    self.assertFalse( self.db.insertRecordBundleThroughQueue( [ valid, ( "U", BASE, BASE + HOUR, [ "Site1", 1 ] ) ] )[ 'OK' ] )
+    self.assertFalse( self.db.insertRecordBundleThroughQueue( [ valid, ( "T", BASE, BASE + HOUR, [ "Site1" ] ) ] )[ 'OK' ] )
+    self.assertEqual( self.updates, [] )
+
+  def test_readOnly( self ):
+    self.db._AccountingDB__readOnly = True
+    self.assertFalse( self.db.insertRecordBundleThroughQueue( [ ( "T", BASE, BASE + HOUR, [ "Site1", 1 ] ) ] )[ 'OK' ] )
+    self.assertEqual( self.updates, [] )
+
+class CompactionTestCase( AccountingDBTestCase ):
+  """ The fast compaction keeps the rollups up to date without rebuilding them
+  """
+
+  def setUp( self ):
+    AccountingDBTestCase.setUp( self )
+    self.rebuildRollup()
+    #Hourly buckets older than two days are compacted in daily ones
+    self.db.dbBucketsLength[ "T" ] = [ ( 8 * DAY, HOUR ), ( 10 ** 10, DAY ) ]
+    self.compacted = []
+    self.db._AccountingDB__splitInBuckets = lambda typeName, startTime, endTime, valuesList: \
+                                                self.compacted.append( ( startTime, endTime, valuesList ) ) or S_OK()
+    self.rebuilt = []
+    self.db._AccountingDB__rebuildRollups = self.rebuilt.append
+
+  def compact( self ):
+    with patch( "DIRAC.AccountingSystem.DB.AccountingDB.Time.toEpoch", return_value = BASE + 10 * DAY ):
+      self.db._AccountingDB__compactBucketsForType( "T" )
+
+  def getRollup( self ):
+    return sorted( self.db.sqlite.execute( "SELECT * FROM `ac_rollup86400_T` WHERE `entriesInBucket` > 0" ).fetchall() )
+
+  def test_extractFromRollups( self ):
+    """ Without the compacted buckets written back, the rollup only has what is left in the buckets
+    """
+    self.compact()
+    self.assert_( self.compacted )
+    self.assertEqual( self.rebuilt, [] )
+    self.assertEqual( self.db.sqlite.execute( "SELECT COUNT(*) FROM `ac_bucket_T` WHERE `startTime` < %d" %
+                                              ( BASE + 2 * DAY ) ).fetchall(), [ ( 0, ) ] )
+    compactedRollup = self.getRollup()
+    self.rebuildRollup()
+    self.assertEqual( compactedRollup, self.getRollup() )
+
+  def test_rebuildOnError( self ):
+    """ The rollups are rebuilt when the deleted buckets can not be taken out of them
+    """
+    self.db.failingCmd = "UPDATE"
+    self.compact()
+    self.assertEqual( self.rebuilt, [ "T" ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( RollupBucketTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( PlannerTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( RollupQueryTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( RecordBundleTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( CompactionTestCase ) )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -14,7 +14,8 @@ class DBUtils:
                              selectFields,
                              condDict = None,
                              groupFields = None,
-                             orderFields = None ):
+                             orderFields = None,
+                             granularity = False ):
     """
     Get data from the DB
     Parameters:
@@ -29,13 +30,16 @@ class DBUtils:
                        ( "%s, %s", ( "field1name", "field2name", "field3name" ) )
       - orderFields -> list of fields to order by, can be in form
                        ( "%s, %s", ( "field1name", "field2name", "field3name" )
+      - granularity -> bucket length the returned buckets will be summed into, allows
+                       the DB to use its pre-aggregated buckets
     """
     validCondDict = {}
     if type( condDict ) == types.DictType:
       for key in condDict:
         if type( condDict[ key ] ) in ( types.ListType, types.TupleType ) and len( condDict[ key ] ) > 0:
           validCondDict[ key ] = condDict[ key ]
-    return self._acDB.retrieveBucketedData( self._setup, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields )
+    return self._acDB.retrieveBucketedData( self._setup, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields,
+                                            granularity = granularity )
 
   def _getUniqueValues( self, typeName, startTime, endTime, condDict, fieldList ):
     stringList = [ "%s" for field in fieldList ]
@@ -145,6 +145,11 @@ class BaseReporter( DBUtils ):
       if keyword in preCondDict:
         condDict[ keyword ] = preCondDict[ keyword ]
     #Query!
+    coarsestGranularity = self._getBucketLengthForTime( self._typeName, startTime )
+    #Summed buckets can be retrieved already merged into the granularity
+    sumGranularity = False
+    if metadataDict[ self._PARAM_CONVERT_TO_GRANULARITY ] == "sum":
+      sumGranularity = coarsestGranularity
     timeGrouping = ( "%%s, %s" % groupingFields[0], [ 'startTime' ] + groupingFields[1] )
     retVal = self._retrieveBucketedData( self._typeName,
                                           startTime,
@@ -152,12 +157,12 @@ class BaseReporter( DBUtils ):
                                           selectFields,
                                           condDict,
                                           timeGrouping,
-                                          ( '%s', [ 'startTime' ] )
+                                          ( '%s', [ 'startTime' ] ),
+                                          granularity = sumGranularity
                                           )
     if not retVal[ 'OK' ]:
       return retVal
     dataDict = self._groupByField( 0, retVal[ 'Value' ] )
-    coarsestGranularity = self._getBucketLengthForTime( self._typeName, startTime )
     #Transform!
     for keyField in dataDict:
       if metadataDict[ self._PARAM_CHECK_FOR_NONE ]:
@@ -31,6 +31,22 @@ class ConfigurationHandler( RequestHandler ):
       retDict[ 'data' ] = gServiceInterface.getCompressedConfigurationData()
     return S_OK( retDict )
 
+  types_getDeltaIfNewer = [ types.StringType ]
+  def export_getDeltaIfNewer( self, sClientVersion ):
+    """
+    Get the modifications since the client version, or the whole compressed
+    configuration if that version is no longer in the history
+    """
+    sVersion = gServiceInterface.getVersion()
+    retDict = { 'newestVersion' : sVersion }
+    if sClientVersion < sVersion:
+      retVal = gServiceInterface.getModificationsSince( sClientVersion )
+      if retVal[ 'OK' ]:
+        retDict[ 'newestVersion' ], retDict[ 'modifications' ] = retVal[ 'Value' ]
+      else:
+        retDict[ 'data' ] = gServiceInterface.getCompressedConfigurationData()
+    return S_OK( retDict )
+
   types_publishSlaveServer = [ types.StringType ]
   def export_publishSlaveServer( self, sURL ):
     gServiceInterface.publishSlaveServer( sURL )
@@ -6,6 +6,8 @@ import zlib
 import zipfile
 import threading, thread
 import time
+import marshal
+import hashlib
 import DIRAC
 from DIRAC.Core.Utilities import List, Time
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
@@ -13,6 +15,11 @@ from DIRAC.Core.Utilities.CFG import CFG
 from DIRAC.Core.Utilities.LockRing import LockRing
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 
+# Version of the format of the remote configuration snapshots
+SNAPSHOT_FORMAT_VERSION = 1
+# Max number of paths kept in each index, they are emptied when full
+MAX_INDEX_SIZE = 10000
+
 class ConfigurationData:
 
   def __init__( self, loadDefaultCFG = True ):
@@ -22,8 +29,14 @@ class ConfigurationData:
     self.threadingLock = lr.getLock()
     self.runningThreadsNumber = 0
     self.compressedConfigurationData = ""
+    self.__compressLock = threading.Lock()
     self.configurationPath = "/DIRAC/Configuration"
     self.backupsDir = os.path.join( DIRAC.rootPath, "etc", "csbackup" )
+    self.snapshotsDir = os.path.join( DIRAC.rootPath, "etc", "cssnapshot" )
+    # Flattened indexes of the merged CFG, filled on demand and reset by sync
+    # path -> option value and path -> ( options dict, ordered options, ordered sections, sections )
+    self.__optionIndex = {}
+    self.__sectionIndex = {}
     self._isService = False
     self.localCFG = CFG()
     self.remoteCFG = CFG()
@@ -55,7 +68,18 @@ class ConfigurationData:
     if remoteServers:
       self.remoteServerList.extend( List.fromChar( remoteServers, "," ) )
     self.remoteServerList = List.uniqueElements( self.remoteServerList )
-    self.compressedConfigurationData = zlib.compress( str( self.remoteCFG ), 9 )
+    # The indexes are replaced after the merged CFG, and the section index before the option one:
+    # readers take them the other way round (see extractOptionFromCFG and __getIndexedSection),
+    # so a value from an old CFG can only end up in an old index
+    self.__sectionIndex = {}
+    self.__optionIndex = {}
+    # Only needed by the servers, compressed on demand. Reset under the lock so a blob of the
+    # previous remote CFG being compressed right now is not kept
+    self.__compressLock.acquire()
+    try:
+      self.compressedConfigurationData = None
+    finally:
+      self.__compressLock.release()
 
   def loadFile( self, fileName ):
     try:
@@ -88,6 +112,102 @@ class ConfigurationData:
     self.unlock()
     self.sync()
 
+  def __getSnapshotFile( self ):
+    """
+    Snapshots are per user and per set of configuration servers in the local configuration
+    """
+    if self._isService:
+      return False
+    value = self.extractOptionFromCFG( "%s/UseSnapshot" % self.configurationPath, self.localCFG )
+    if value and value.lower() in ( "no", "false", "n" ):
+      return False
+    servers = self.extractOptionFromCFG( "%s/Servers" % self.configurationPath, self.localCFG ) or ""
+    gateway = self.extractOptionFromCFG( "/DIRAC/Gateway", self.localCFG ) or ""
+    if not servers and not gateway:
+      return False
+    sourceKey = hashlib.md5( "%s|%s" % ( servers, gateway ) ).hexdigest()[:16]
+    return os.path.join( self.snapshotsDir, "%s.%s.snapshot" % ( sourceKey, os.getuid() ) )
+
+  def applyRemoteCFGModifications( self, modificationsList, newVersion ):
+    """
+    Update the remote configuration with a list of deltas coming from CFG.getModifications,
+    the result has to be the newVersion of the configuration
+    """
+    remoteCFG = self.remoteCFG.clone()
+    try:
+      for modList in modificationsList:
+        result = remoteCFG.applyModifications( modList )
+        if not result[ 'OK' ]:
+          return result
+    except Exception, e:
+      return S_ERROR( "Cannot apply configuration modifications: %s" % str( e ) )
+    version = self.getVersion( remoteCFG )
+    if version != newVersion:
+      return S_ERROR( "Configuration modifications lead to version %s instead of %s" % ( version, newVersion ) )
+    self.lock()
+    self.remoteCFG = remoteCFG
+    self.unlock()
+    self.sync()
+    return S_OK()
+
+  def loadRemoteCFGFromSnapshot( self ):
+    """
+    Load the remote configuration from the snapshot written after the last update,
+    so that it only has to be downloaded and parsed again if there is a newer version
+    """
+    snapshotFile = self.__getSnapshotFile()
+    if not snapshotFile or not os.path.isfile( snapshotFile ):
+      return S_ERROR( "No configuration snapshot" )
+    try:
+      # The snapshot has to belong to us and not be writable by anybody else
+      fileStat = os.stat( snapshotFile )
+      if fileStat.st_uid != os.getuid() or fileStat.st_mode & 0022:
+        return S_ERROR( "Untrusted configuration snapshot %s" % snapshotFile )
+      fd = open( snapshotFile, "rb" )
+      try:
+        formatVersion, version, cfgData = marshal.loads( fd.read() )
+      finally:
+        fd.close()
+      if formatVersion != SNAPSHOT_FORMAT_VERSION:
+        return S_ERROR( "Configuration snapshot format %s not supported" % formatVersion )
+      remoteCFG = CFG().loadFromTuple( cfgData )
+    except Exception, e:
+      gLogger.verbose( "Cannot load configuration snapshot", "%s: %s" % ( snapshotFile, str( e ) ) )
+      return S_ERROR( "Cannot load configuration snapshot %s: %s" % ( snapshotFile, str( e ) ) )
+    self.lock()
+    self.remoteCFG = remoteCFG
+    self.unlock()
+    self.sync()
+    gLogger.debug( "Loaded configuration snapshot", "version %s from %s" % ( version, snapshotFile ) )
+    return S_OK( version )
+
+  def writeRemoteCFGSnapshot( self ):
+    """
+    Write a snapshot of the remote configuration to be loaded at the next start
+    """
+    snapshotFile = self.__getSnapshotFile()
+    if not snapshotFile:
+      return S_OK()
+    tmpFile = "%s.%s.tmp" % ( snapshotFile, os.getpid() )
+    try:
+      if not os.path.isdir( self.snapshotsDir ):
+        os.makedirs( self.snapshotsDir )
+      data = marshal.dumps( ( SNAPSHOT_FORMAT_VERSION, self.getVersion(), self.remoteCFG.getAsTuple() ) )
+      fd = os.fdopen( os.open( tmpFile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600 ), "wb" )
+      try:
+        fd.write( data )
+      finally:
+        fd.close()
+      os.rename( tmpFile, snapshotFile )
+    except Exception, e:
+      try:
+        os.unlink( tmpFile )
+      except OSError:
+        pass
+      gLogger.verbose( "Cannot write configuration snapshot", "%s: %s" % ( snapshotFile, str( e ) ) )
+      return S_ERROR( "Cannot write configuration snapshot %s: %s" % ( snapshotFile, str( e ) ) )
+    return S_OK()
+
   def loadConfigurationData( self, fileName = False ):
     name = self.getName()
     self.lock()
@@ -116,9 +236,62 @@ class ConfigurationData:
       pass
     return self.dangerZoneEnd( None )
 
+  def __getIndexedSection( self, path ):
+    """
+    Get the indexed contents of a section of the merged CFG, None if the section does not exist
+    """
+    # Take the index before the CFG, sync replaces them the other way round so an entry
+    # built from an old CFG can only end up in an old index
+    sectionIndex = self.__sectionIndex
+    try:
+      return sectionIndex[ path ]
+    except KeyError:
+      pass
+    cfg = self.mergedCFG
+    levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
+    normPath = "/".join( levelList )
+    if normPath in sectionIndex:
+      entry = sectionIndex[ normPath ]
+    else:
+      entry = None
+      self.dangerZoneStart()
+      try:
+        for section in levelList:
+          if not cfg.isSection( section ):
+            break
+          cfg = cfg[ section ]
+        else:
+          options = cfg.listOptions( True )
+          entry = ( dict( [ ( option, cfg[ option ] ) for option in options ] ),
+                    options,
+                    cfg.listSections( True ),
+                    cfg.listSections( False ) )
+      except Exception:
+        entry = None
+      self.dangerZoneEnd()
+      if len( sectionIndex ) >= MAX_INDEX_SIZE:
+        sectionIndex.clear()
+      sectionIndex[ normPath ] = entry
+    sectionIndex[ path ] = entry
+    return entry
+
+  def getOptionsDictFromCFG( self, path ):
+    """
+    Get the options of a section of the merged CFG as a dict, None if the section does not exist
+    """
+    entry = self.__getIndexedSection( path )
+    if entry is None:
+      return None
+    return dict( entry[0] )
+
   def getSectionsFromCFG( self, path, cfg = False, ordered = False ):
     if not cfg:
-      cfg = self.mergedCFG
+      entry = self.__getIndexedSection( path )
+      if entry is None:
+        return None
+      if ordered:
+        return list( entry[2] )
+      return list( entry[3] )
     self.dangerZoneStart()
     try:
       levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
@@ -131,7 +304,12 @@ class ConfigurationData:
 
   def getOptionsFromCFG( self, path, cfg = False, ordered = False ):
     if not cfg:
-      cfg = self.mergedCFG
+      entry = self.__getIndexedSection( path )
+      if entry is None:
+        return None
+      if ordered:
+        return list( entry[1] )
+      return entry[0].keys()
     self.dangerZoneStart()
     try:
       levelList = [ level.strip() for level in path.split( "/" ) if level.strip() != "" ]
@@ -144,7 +322,20 @@ class ConfigurationData:
 
   def extractOptionFromCFG( self, path, cfg = False, disableDangerZones = False ):
     if not cfg:
-      cfg = self.mergedCFG
+      optionIndex = self.__optionIndex
+      try:
+        return optionIndex[ path ]
+      except KeyError:
+        pass
+      sectionPath, _sep, option = path.strip().rstrip( "/" ).rpartition( "/" )
+      value = None
+      entry = self.__getIndexedSection( sectionPath )
+      if entry is not None:
+        value = entry[0].get( option.strip() )
+      if len( optionIndex ) >= MAX_INDEX_SIZE:
+        optionIndex.clear()
+      optionIndex[ path ] = value
+      return value
     if not disableDangerZones:
       self.dangerZoneStart()
     try:
@@ -234,6 +425,13 @@ class ConfigurationData:
     except:
       return 300
 
+  def getDeltaHistorySize( self ):
+    try:
+      return int( self.extractOptionFromCFG( "%s/DeltaHistorySize" % self.configurationPath,
+                                        self.mergedCFG ) )
+    except:
+      return 10
+
   def getSlavesGraceTime( self ):
     try:
       return int( self.extractOptionFromCFG( "%s/SlavesGraceTime" % self.configurationPath,
@@ -284,7 +482,17 @@ class ConfigurationData:
     self.sync()
 
   def getCompressedData( self ):
-    return self.compressedConfigurationData
+    data = self.compressedConfigurationData
+    if data is not None:
+      return data
+    # Only one thread compresses, the others wait for its result
+    self.__compressLock.acquire()
+    try:
+      if self.compressedConfigurationData is None:
+        self.compressedConfigurationData = zlib.compress( str( self.remoteCFG ), 9 )
+      return self.compressedConfigurationData
+    finally:
+      self.__compressLock.release()
 
   def isMaster( self ):
     value = self.extractOptionFromCFG( "%s/Master" % self.configurationPath,
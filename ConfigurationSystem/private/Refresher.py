@@ -15,16 +15,39 @@ from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 def _updateFromRemoteLocation( serviceClient ):
   gLogger.debug( "", "Trying to refresh from %s" % serviceClient.serviceURL )
   localVersion = gConfigurationData.getVersion()
-  retVal = serviceClient.getCompressedDataIfNewer( localVersion )
-  if retVal[ 'OK' ]:
+  dataDict = False
+  if localVersion != "0":
+    # Ask only for the modifications since our version
+    retVal = serviceClient.getDeltaIfNewer( localVersion )
+    if retVal[ 'OK' ]:
+      dataDict = retVal[ 'Value' ]
+      if 'modifications' in dataDict:
+        gLogger.debug( "New version available", "Updating to version %s with %d deltas..." % ( dataDict[ 'newestVersion' ],
+                                                                                            len( dataDict[ 'modifications' ] ) ) )
+        result = gConfigurationData.applyRemoteCFGModifications( dataDict[ 'modifications' ], dataDict[ 'newestVersion' ] )
+        if result[ 'OK' ]:
+          return _newVersionLoaded( dataDict[ 'newestVersion' ] )
+        gLogger.warn( "Cannot apply configuration deltas, getting the whole configuration", result[ 'Message' ] )
+        dataDict = False
+    elif retVal[ 'Message' ].find( "Unknown method" ) == -1:
+      return retVal
+  if not dataDict:
+    # Servers not serving deltas or version not in their history
+    retVal = serviceClient.getCompressedDataIfNewer( localVersion )
+    if not retVal[ 'OK' ]:
+      return retVal
     dataDict = retVal[ 'Value' ]
-    if localVersion < dataDict[ 'newestVersion' ] :
-      gLogger.debug( "New version available", "Updating to version %s..." % dataDict[ 'newestVersion' ] )
-      gConfigurationData.loadRemoteCFGFromCompressedMem( dataDict[ 'data' ] )
-      gLogger.debug( "Updated to version %s" % gConfigurationData.getVersion() )
-      gEventDispatcher.triggerEvent( "CSNewVersion", dataDict[ 'newestVersion' ], threaded = True )
-    return S_OK()
-  return retVal
+  if localVersion < dataDict[ 'newestVersion' ] :
+    gLogger.debug( "New version available", "Updating to version %s..." % dataDict[ 'newestVersion' ] )
+    gConfigurationData.loadRemoteCFGFromCompressedMem( dataDict[ 'data' ] )
+    return _newVersionLoaded( dataDict[ 'newestVersion' ] )
+  return S_OK()
+
+def _newVersionLoaded( newestVersion ):
+  gLogger.debug( "Updated to version %s" % gConfigurationData.getVersion() )
+  gConfigurationData.writeRemoteCFGSnapshot()
+  gEventDispatcher.triggerEvent( "CSNewVersion", newestVersion, threaded = True )
+  return S_OK()
 
 
 class Refresher( threading.Thread ):
@@ -148,6 +171,10 @@ class Refresher( threading.Thread ):
     if not initialServerList:
       return S_OK()    
 
+    # Start from the last downloaded version, the servers only send it again if there is a newer one
+    if gConfigurationData.getVersion() == "0":
+      gConfigurationData.loadRemoteCFGFromSnapshot()
+
     randomServerList = List.randomize( initialServerList )
     gLogger.debug( "Randomized server list is %s" % ", ".join( randomServerList ) )
 
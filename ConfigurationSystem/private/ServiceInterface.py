@@ -21,14 +21,22 @@ class ServiceInterface( threading.Thread ):
     self.sURL = sURL
     gLogger.info( "Initializing Configuration Service", "URL is %s" % sURL )
     self.__modificationsIgnoreMask = [ '/DIRAC/Configuration/Servers', '/DIRAC/Configuration/Version' ]
+    # ( fromVersion, toVersion, modifications ) between the last versions, sent to the clients
+    # instead of the whole configuration
+    self.__deltaLock = threading.Lock()
+    self.__deltaHistory = []
+    self.__lastVersion = False
+    self.__lastVersionCFG = False
     gConfigurationData.setAsService()
     if not gConfigurationData.isMaster():
       gLogger.info( "Starting configuration service as slave" )
+      gRefresher.addListenerToNewVersionEvent( self.__onNewVersion )
       gRefresher.autoRefreshAndPublish( self.sURL )
     else:
       gLogger.info( "Starting configuration service as master" )
       gRefresher.disable()
       self.__loadConfigurationData()
+      self.__recordVersion()
       self.dAliveSlaveServers = {}
       self.__launchCheckSlaves()
 
@@ -70,6 +78,7 @@ class ServiceInterface( threading.Thread ):
     if gConfigurationData.isMaster():
       gConfigurationData.generateNewVersion()
       gConfigurationData.writeRemoteConfigurationToDisk()
+      self.__recordVersion()
 
   def publishSlaveServer( self, sSlaveURL ):
     if not gConfigurationData.isMaster():
@@ -153,6 +162,7 @@ class ServiceInterface( threading.Thread ):
     #self.__checkSlavesStatus( forceWriteConfiguration = True )
     gLogger.info( "Writing new version to disk!" )
     retVal = gConfigurationData.writeRemoteConfigurationToDisk( "%s@%s" % ( commiter, gConfigurationData.getVersion() ) )
+    self.__recordVersion()
     gLogger.info( "New version it is!" )
     return retVal
 
@@ -162,6 +172,48 @@ class ServiceInterface( threading.Thread ):
   def getVersion( self ):
     return gConfigurationData.getVersion()
 
+  def __onNewVersion( self, eventName, version ):
+    self.__recordVersion()
+
+  def __recordVersion( self ):
+    """
+    Add the modifications since the last recorded version to the history
+    """
+    self.__deltaLock.acquire()
+    try:
+      if self.__lastVersion == gConfigurationData.getVersion():
+        return
+      currentCFG = gConfigurationData.getRemoteCFG().clone()
+      currentVersion = gConfigurationData.getVersion( currentCFG )
+      if self.__lastVersionCFG:
+        modList = self.__lastVersionCFG.getModifications( currentCFG )
+        self.__deltaHistory.append( ( self.__lastVersion, currentVersion, modList ) )
+        historySize = max( 0, gConfigurationData.getDeltaHistorySize() )
+        self.__deltaHistory = self.__deltaHistory[ len( self.__deltaHistory ) - historySize: ]
+        gLogger.verbose( "Recorded configuration delta", "%s -> %s: %d changes" % ( self.__lastVersion, currentVersion,
+                                                                                  len( modList ) ) )
+      self.__lastVersion = currentVersion
+      self.__lastVersionCFG = currentCFG
+    finally:
+      self.__deltaLock.release()
+
+  def getModificationsSince( self, version ):
+    """
+    Get the modifications to go from a version to the newest one
+
+    :return: S_OK( ( newestVersion, [ modifications of each version ] ) ), S_ERROR if the
+             version is no longer in the history
+    """
+    self.__recordVersion()
+    self.__deltaLock.acquire()
+    try:
+      for iPos in range( len( self.__deltaHistory ) ):
+        if self.__deltaHistory[ iPos ][0] == version:
+          return S_OK( ( self.__deltaHistory[-1][1], [ entry[2] for entry in self.__deltaHistory[ iPos: ] ] ) )
+    finally:
+      self.__deltaLock.release()
+    return S_ERROR( "Version %s is not in the history" % version )
+
   def getCommitHistory( self ):
     files = self.__getCfgBackups( gConfigurationData.getBackupDir() )
     backups = [ ".".join( fileName.split( "." )[1:-1] ).split( "@" ) for fileName in files ]
@@ -0,0 +1,119 @@
+""" Benchmark of the configuration start-up of a short script ( like dirac-proxy-info ) with
+    a large remote configuration:
+      - download path: decompress and parse the data sent by the CS, as done when there is no snapshot
+      - snapshot path: load the snapshot written after the previous download
+    followed by the configuration lookups such a script does.
+
+    The remote configuration is generated with the given number of sites and users.
+
+    Usage: python ConfigurationDataBenchmark.py [ numSites [ numUsers [ numLookups ] ] ]
+"""
+
+__RCSID__ = "$Id$"
+
+import sys
+import time
+import zlib
+import random
+import shutil
+import tempfile
+
+from DIRAC.Core.Utilities.CFG import CFG
+from DIRAC.ConfigurationSystem.private.ConfigurationData import ConfigurationData
+
+localCFG = """
+DIRAC
+{
+  Setup = Benchmark
+  Configuration
+  {
+    Servers = dips://cs.example.org:9135/Configuration/Server
+  }
+}
+"""
+
+def generateRemoteCFG( numSites, numUsers ):
+  """ Remote configuration with Resources and Registry sections of the given size """
+  lines = [ "DIRAC", "{", "  Configuration", "  {", "    Version = 2015-01-01 10:00:00.000000", "  }", "}",
+            "Resources", "{", "  Sites", "  {", "    LCG", "    {" ]
+  for siteNum in xrange( numSites ):
+    lines.extend( [ "      LCG.Site%d.org" % siteNum, "      {",
+                    "        Name = SITE%d" % siteNum,
+                    "        CE = ce%d.site%d.org" % ( siteNum, siteNum ),
+                    "        SE = SE%d-DISK, SE%d-TAPE" % ( siteNum, siteNum ),
+                    "        Coordinates = 1.1:2.2",
+                    "        CEs", "        {", "          ce%d.site%d.org" % ( siteNum, siteNum ), "          {",
+                    "            Queues", "            {" ] )
+    for queueNum in xrange( 5 ):
+      lines.extend( [ "              queue%d" % queueNum, "              {",
+                      "                maxCPUTime = 2880", "                SI00 = 2000", "              }" ] )
+    lines.extend( [ "            }", "          }", "        }", "      }" ] )
+  lines.extend( [ "    }", "  }", "}", "Registry", "{", "  Users", "  {" ] )
+  for userNum in xrange( numUsers ):
+    lines.extend( [ "    user%d" % userNum, "    {",
+                    "      DN = /DC=org/DC=example/OU=Users/CN=user%d" % userNum,
+                    "      Email = user%d@example.org" % userNum, "    }" ] )
+  lines.extend( [ "  }", "  Groups", "  {", "    users", "    {",
+                  "      Users = %s" % ", ".join( [ "user%d" % userNum for userNum in xrange( numUsers ) ] ),
+                  "    }", "  }", "}" ] )
+  return CFG().loadFromBuffer( "\n".join( lines ) )
+
+def newConfigurationData( snapshotsDir ):
+  confData = ConfigurationData( loadDefaultCFG = False )
+  confData.snapshotsDir = snapshotsDir
+  confData.mergeWithLocal( CFG().loadFromBuffer( localCFG ) )
+  return confData
+
+def doLookups( confData, paths ):
+  for optionPath, sectionPath in paths:
+    confData.extractOptionFromCFG( optionPath )
+    confData.getOptionsFromCFG( sectionPath )
+
+if __name__ == '__main__':
+  numSites = int( sys.argv[1] ) if len( sys.argv ) > 1 else 1000
+  numUsers = int( sys.argv[2] ) if len( sys.argv ) > 2 else 5000
+  numLookups = int( sys.argv[3] ) if len( sys.argv ) > 3 else 2000
+  random.seed( 12345 )
+  remoteCFG = generateRemoteCFG( numSites, numUsers )
+  compressedData = zlib.compress( str( remoteCFG ), 9 )
+  print "Remote configuration: %.1f MB, %.1f MB compressed" % ( len( str( remoteCFG ) ) / 1048576.,
+                                                                len( compressedData ) / 1048576. )
+  paths = []
+  for _ in xrange( numLookups ):
+    siteNum = random.randrange( numSites )
+    sitePath = "/Resources/Sites/LCG/LCG.Site%d.org" % siteNum
+    paths.append( ( "%s/CE" % sitePath, sitePath ) )
+    userPath = "/Registry/Users/user%d" % random.randrange( numUsers )
+    paths.append( ( "%s/DN" % userPath, userPath ) )
+    paths.append( ( "/DIRAC/Setup", "/DIRAC" ) )
+
+  snapshotsDir = tempfile.mkdtemp()
+  try:
+    start = time.time()
+    confData = newConfigurationData( snapshotsDir )
+    confData.loadRemoteCFGFromCompressedMem( compressedData )
+    loadTime = time.time() - start
+    start = time.time()
+    for optionPath, sectionPath in paths:
+      confData.extractOptionFromCFG( optionPath, confData.mergedCFG )
+      confData.getOptionsFromCFG( sectionPath, confData.mergedCFG )
+    walkTime = time.time() - start
+    print "Download path: load %.3f s, %d lookups walking the CFG %.3f s" % ( loadTime, len( paths ) * 2, walkTime )
+    start = time.time()
+    confData.writeRemoteCFGSnapshot()
+    print "Snapshot written in %.3f s" % ( time.time() - start )
+
+    start = time.time()
+    confData = newConfigurationData( snapshotsDir )
+    result = confData.loadRemoteCFGFromSnapshot()
+    if not result[ 'OK' ]:
+      print "ERROR: %s" % result[ 'Message' ]
+      sys.exit( 1 )
+    snapshotTime = time.time() - start
+    start = time.time()
+    doLookups( confData, paths )
+    indexTime = time.time() - start
+    print "Snapshot path: load %.3f s, %d lookups with the index %.3f s" % ( snapshotTime, len( paths ) * 2, indexTime )
+    print "Start-up speedup: %.1f" % ( ( loadTime + walkTime ) / ( snapshotTime + indexTime ) )
+  finally:
+    shutil.rmtree( snapshotsDir )
@@ -0,0 +1,185 @@
+""" Unit tests of the ConfigurationData path index, remote configuration snapshots and deltas
+"""
+
+import shutil
+import tempfile
+import unittest
+import zlib
+
+from DIRAC.Core.Utilities.CFG import CFG
+from DIRAC.ConfigurationSystem.private.ConfigurationData import ConfigurationData, MAX_INDEX_SIZE
+
+localCFG = """
+DIRAC
+{
+  Setup = Test
+  Configuration
+  {
+    Servers = dips://cs.example.org:9135/Configuration/Server
+  }
+}
+"""
+
+remoteCFG = """
+DIRAC
+{
+  Configuration
+  {
+    Version = 2015-01-01 10:00:00.000000
+  }
+}
+Systems
+{
+  # Some comment
+  WorkloadManagement
+  {
+    Test
+    {
+      Agents
+      {
+        SiteDirector
+        {
+          PollingTime = 120
+          Queues = short, long
+        }
+      }
+    }
+  }
+}
+"""
+
+class ConfigurationDataTestCase( unittest.TestCase ):
+  """ Base class for the ConfigurationData test cases
+  """
+
+  def setUp( self ):
+    self.tmpDir = tempfile.mkdtemp()
+    self.confData = self.__getConfigurationData()
+
+  def tearDown( self ):
+    shutil.rmtree( self.tmpDir )
+
+  def __getConfigurationData( self ):
+    confData = ConfigurationData( loadDefaultCFG = False )
+    confData.snapshotsDir = self.tmpDir
+    confData.mergeWithLocal( CFG().loadFromBuffer( localCFG ) )
+    return confData
+
+  def test_index( self ):
+    """ Lookups give the same results as walking the CFG
+    """
+    self.confData.loadRemoteCFGFromMem( remoteCFG )
+    agentPath = "/Systems/WorkloadManagement/Test/Agents/SiteDirector"
+    self.assertEqual( self.confData.extractOptionFromCFG( "%s/PollingTime" % agentPath ), "120" )
+    self.assertEqual( self.confData.extractOptionFromCFG( " Systems/WorkloadManagement/Test/Agents/SiteDirector/Queues/" ),
+                      "short, long" )
+    self.assertEqual( self.confData.extractOptionFromCFG( "/DIRAC/Setup" ), "Test" )
+    self.assertEqual( self.confData.extractOptionFromCFG( "%s/Missing" % agentPath ), None )
+    self.assertEqual( self.confData.extractOptionFromCFG( "/Systems/WorkloadManagement" ), None )
+    self.assertEqual( self.confData.getOptionsFromCFG( agentPath, ordered = True ), [ "PollingTime", "Queues" ] )
+    self.assertEqual( self.confData.getSectionsFromCFG( "/", ordered = True ), [ "DIRAC", "Systems" ] )
+    self.assertEqual( sorted( self.confData.getSectionsFromCFG( "/", ordered = False ) ), [ "DIRAC", "Systems" ] )
+    self.assertEqual( sorted( self.confData.getOptionsFromCFG( agentPath, ordered = False ) ), [ "PollingTime", "Queues" ] )
+    self.assertEqual( self.confData.getSectionsFromCFG( "%s/PollingTime" % agentPath ), None )
+    self.assertEqual( self.confData.getOptionsDictFromCFG( agentPath ),
+                      { "PollingTime" : "120", "Queues" : "short, long" } )
+    # Changes are seen
+    self.confData.setOptionInCFG( "%s/PollingTime" % agentPath, "60" )
+    self.assertEqual( self.confData.extractOptionFromCFG( "%s/PollingTime" % agentPath ), "60" )
+    self.assertEqual( self.confData.getOptionsDictFromCFG( agentPath )[ "PollingTime" ], "60" )
+
+  def test_indexSize( self ):
+    """ The indexes do not grow without limit
+    """
+    self.confData.loadRemoteCFGFromMem( remoteCFG )
+    for i in range( MAX_INDEX_SIZE + 10 ):
+      self.assertEqual( self.confData.extractOptionFromCFG( "/DIRAC/Missing%d" % i ), None )
+    self.assert_( len( self.confData._ConfigurationData__optionIndex ) <= MAX_INDEX_SIZE )
+    self.assert_( len( self.confData._ConfigurationData__sectionIndex ) <= MAX_INDEX_SIZE )
+    self.assertEqual( self.confData.extractOptionFromCFG( "/DIRAC/Setup" ), "Test" )
+
+  def test_indexReset( self ):
+    """ A lookup done while sync replaces the indexes does not keep a value of the previous CFG
+    """
+    test = self
+    class RacingConfigurationData( ConfigurationData ):
+      def __setattr__( self, name, value ):
+        self.__dict__[ name ] = value
+        if name.startswith( "_ConfigurationData__" ) and name.endswith( "Index" ) and self.__dict__.get( "racing" ):
+          # Concurrent reader between the index replacements
+          test.racingValues.append( self.extractOptionFromCFG( "/DIRAC/Setup" ) )
+    self.racingValues = []
+    confData = RacingConfigurationData( loadDefaultCFG = False )
+    confData.mergeWithLocal( CFG().loadFromBuffer( localCFG ) )
+    self.assertEqual( confData.extractOptionFromCFG( "/DIRAC/Setup" ), "Test" )
+    confData.racing = True
+    confData.mergeWithLocal( CFG().loadFromBuffer( "DIRAC\n{\n  Setup = Other\n}\n" ) )
+    self.assert_( self.racingValues )
+    self.assertEqual( confData.extractOptionFromCFG( "/DIRAC/Setup" ), "Other" )
+
+  def test_compressedData( self ):
+    """ The compressed remote CFG is the one of the last sync
+    """
+    self.confData.loadRemoteCFGFromMem( remoteCFG )
+    data = self.confData.getCompressedData()
+    self.assertEqual( zlib.decompress( data ), str( self.confData.getRemoteCFG() ) )
+    self.assert_( self.confData.getCompressedData() is data )
+    self.confData.setOptionInCFG( "/DIRAC/Configuration/Version", "2015-01-02 10:00:00.000000",
+                                  self.confData.getRemoteCFG() )
+    self.confData.sync()
+    self.assert_( "2015-01-02" in zlib.decompress( self.confData.getCompressedData() ) )
+
+  def test_snapshot( self ):
+    """ The remote configuration is restored from the snapshot
+    """
+    self.assertFalse( self.confData.loadRemoteCFGFromSnapshot()[ 'OK' ] )
+    self.confData.loadRemoteCFGFromMem( remoteCFG )
+    self.assertTrue( self.confData.writeRemoteCFGSnapshot()[ 'OK' ] )
+    newConfData = self.__getConfigurationData()
+    result = newConfData.loadRemoteCFGFromSnapshot()
+    self.assertTrue( result[ 'OK' ] )
+    self.assertEqual( result[ 'Value' ], "2015-01-01 10:00:00.000000" )
+    self.assertEqual( newConfData.getVersion(), "2015-01-01 10:00:00.000000" )
+    self.assertEqual( str( newConfData.getRemoteCFG() ), str( self.confData.getRemoteCFG() ) )
+    self.assertEqual( newConfData.getMergedCFGAsString(), self.confData.getMergedCFGAsString() )
+    # Snapshots of other configuration servers are not used
+    otherConfData = ConfigurationData( loadDefaultCFG = False )
+    otherConfData.snapshotsDir = self.tmpDir
+    otherConfData.setOptionInCFG( "/DIRAC/Configuration/Servers", "dips://other.example.org:9135/Configuration/Server" )
+    self.assertFalse( otherConfData.loadRemoteCFGFromSnapshot()[ 'OK' ] )
+
+  def test_modifications( self ):
+    """ The deltas between versions give the same remote configuration
+    """
+    self.confData.loadRemoteCFGFromMem( remoteCFG )
+    firstCFG = CFG().loadFromBuffer( remoteCFG )
+    secondCFG = firstCFG.clone()
+    secondCFG.setOption( "DIRAC/Configuration/Version", "2015-01-02 10:00:00.000000" )
+    secondCFG.setOption( "Systems/WorkloadManagement/Test/Agents/SiteDirector/PollingTime", "60" )
+    secondCFG.createNewSection( "Systems/WorkloadManagement/Test/Services" )
+    secondCFG.setOption( "Systems/WorkloadManagement/Test/Services/Port", "9130" )
+    thirdCFG = secondCFG.clone()
+    thirdCFG.setOption( "DIRAC/Configuration/Version", "2015-01-03 10:00:00.000000" )
+    thirdCFG.deleteKey( "Systems/WorkloadManagement/Test/Agents/SiteDirector/Queues" )
+    modifications = [ firstCFG.getModifications( secondCFG ), secondCFG.getModifications( thirdCFG ) ]
+    # The version has to match
+    self.assertFalse( self.confData.applyRemoteCFGModifications( modifications, "2015-01-02 10:00:00.000000" )[ 'OK' ] )
+    self.assertEqual( self.confData.getVersion(), "2015-01-01 10:00:00.000000" )
+    self.assertTrue( self.confData.applyRemoteCFGModifications( modifications, "2015-01-03 10:00:00.000000" )[ 'OK' ] )
+    self.assertEqual( str( self.confData.getRemoteCFG() ), str( thirdCFG ) )
+    self.assertEqual( self.confData.getOptionsDictFromCFG( "/Systems/WorkloadManagement/Test/Agents/SiteDirector" ),
+                      { "PollingTime" : "60" } )
+    # Modifications that do not apply are refused
+    self.assertFalse( self.confData.applyRemoteCFGModifications( modifications[1:], "2015-01-03 10:00:00.000000" )[ 'OK' ] )
+
+  def test_tuple( self ):
+    """ CFG.getAsTuple and CFG.loadFromTuple are symmetric
+    """
+    cfg = CFG().loadFromBuffer( remoteCFG )
+    newCFG = CFG().loadFromTuple( cfg.getAsTuple() )
+    self.assertEqual( str( newCFG ), str( cfg ) )
+    self.assertEqual( newCFG.getComment( "Systems" ), cfg.getComment( "Systems" ) )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ConfigurationDataTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
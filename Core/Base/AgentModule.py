@@ -12,6 +12,9 @@ import os
 import threading
 import types
 import time
+import cProfile
+import pstats
+import cStringIO
 import DIRAC
 from DIRAC import S_OK, S_ERROR, gConfig, gLogger, gMonitor, rootPath
 from DIRAC.ConfigurationSystem.Client import PathFinder
@@ -65,6 +68,10 @@ class AgentModule:
       The agent can be stopped either by a signal or by creating a 'stop_agent' file
       in the controlDirectory defined in the agent configuration
 
+      The execution cycles can be profiled every ProfileCycles cycles or while a
+      'profile_agent' file exists in the controlDirectory. The profile of the last
+      profiled cycle is written to the workDirectory, see am_profileCycle()
+
   """
 
   def __init__( self, agentName, loadName, baseAgentName = False, properties = {} ):
@@ -86,6 +93,8 @@ class AgentModule:
       - WorkDirectory          work/SystemName/AgentName
       - shifterProxy           ''
       - shifterProxyLocation   WorkDirectory/SystemName/AgentName/.shifterCred
+      - ProfileCycles          default = 0
+      - ProfileTopFunctions    default = 30
 
       It defines the following default Options that can be set via Configuration (above):
       - MonitoringEnabled     True
@@ -96,6 +105,8 @@ class AgentModule:
       - WorkDirectory         work/SystemName/AgentName
       - shifterProxy          False
       - shifterProxyLocation  work/SystemName/AgentName/.shifterCred
+      - ProfileCycles         0, no cycle is profiled unless the 'profile_agent' file exists
+      - ProfileTopFunctions   30
 
       different defaults can be set in the initialize() method of the Agent using am_setOption()
 
@@ -140,7 +151,8 @@ class AgentModule:
     self.__configDefaults[ 'shifterProxy' ] = ''
     self.__configDefaults[ 'shifterProxyLocation' ] = os.path.join( self.__configDefaults[ 'WorkDirectory' ],
                                                                         '.shifterCred' )
-
+    self.__configDefaults[ 'ProfileCycles' ] = 0
+    self.__configDefaults[ 'ProfileTopFunctions' ] = 30
 
     if type( properties ) == types.DictType:
       for key in properties:
@@ -238,6 +250,24 @@ class AgentModule:
     except Exception:
       pass
 
+  def am_getProfileAgentFile( self ):
+    return os.path.join( self.am_getControlDirectory(), 'profile_agent' )
+
+  def am_checkProfileAgentFile( self ):
+    return os.path.isfile( self.am_getProfileAgentFile() )
+
+  def am_profileCycle( self ):
+    """ True if the next cycle has to be run under the profiler: every ProfileCycles
+        cycles or while the 'profile_agent' file exists
+    """
+    if self.am_checkProfileAgentFile():
+      return True
+    try:
+      profileCycles = int( self.am_getOption( 'ProfileCycles' ) )
+    except ( TypeError, ValueError ):
+      return False
+    return profileCycles > 0 and ( self.__moduleProperties[ 'cyclesDone' ] + 1 ) % profileCycles == 0
+
   def am_getBasePath( self ):
     return self.__basePath
 
@@ -302,6 +332,8 @@ class AgentModule:
     self.monitor.initialize()
     self.monitor.registerActivity( 'CPU', "CPU Usage", 'Framework', "CPU,%", self.monitor.OP_MEAN, 600 )
     self.monitor.registerActivity( 'MEM', "Memory Usage", 'Framework', 'Memory,MB', self.monitor.OP_MEAN, 600 )
+    self.monitor.registerActivity( 'ProfiledCycleTime', "Profiled cycle time", 'Framework', 'seconds',
+                                   self.monitor.OP_MEAN, 600 )
     # Component monitor
     for field in ( 'version', 'DIRACVersion', 'description', 'platform' ):
       self.monitor.setComponentExtraParam( field, self.__codeProperties[ field ] )
@@ -346,7 +378,10 @@ class AgentModule:
     self.log.notice( "-"*40 )
     elapsedTime = time.time()
     cpuStats = self._startReportToMonitoring()
-    cycleResult = self.__executeModuleCycle()
+    if self.am_profileCycle():
+      cycleResult = self.__profileModuleCycle()
+    else:
+      cycleResult = self.__executeModuleCycle()
     if cpuStats:
       self._endReportToMonitoring( *cpuStats )
     # Increment counters
@@ -399,6 +434,58 @@ class AgentModule:
       gMonitor.addMark( 'CPU', percentage )
 
 
+  def __profileModuleCycle( self ):
+    """ Execute the cycle under cProfile, then write the profile dump and the top
+        functions in the work directory and send the profiled cycle time to monitoring when enabled
+
+        Only the agent thread is profiled, the time spent in the threads of the
+        additional executors is not accounted
+    """
+    profiler = cProfile.Profile()
+    startTime = time.time()
+    cycleResult = profiler.runcall( self.__executeModuleCycle )
+    cycleTime = time.time() - startTime
+    try:
+      self.__writeProfile( profiler, cycleTime )
+    except Exception, e:
+      self.log.warn( "Failed to write the cycle profile", str( e ) )
+    return cycleResult
+
+  def __writeProfile( self, profiler, cycleTime ):
+    """ Write <WorkDirectory>/cycle.prof, readable with pstats, and the top functions
+        by internal and by cumulative time in <WorkDirectory>/cycle.prof.txt
+    """
+    cycle = self.__moduleProperties[ 'cyclesDone' ] + 1
+    try:
+      topFunctions = max( 1, int( self.am_getOption( 'ProfileTopFunctions' ) ) )
+    except ( TypeError, ValueError ):
+      topFunctions = self.__configDefaults[ 'ProfileTopFunctions' ]
+    dumpFile = os.path.join( self.am_getWorkDirectory(), 'cycle.prof' )
+    profiler.dump_stats( dumpFile )
+
+    stream = cStringIO.StringIO()
+    stream.write( "Profile of cycle %s of %s at %s, %.2f seconds\n" % ( cycle,
+                                                                     self.__moduleProperties[ 'fullName' ],
+                                                                     Time.toString(), cycleTime ) )
+    stats = pstats.Stats( profiler, stream = stream )
+    stats.strip_dirs()
+    stats.sort_stats( 'time' ).print_stats( topFunctions )
+    stats.sort_stats( 'cumulative' ).print_stats( topFunctions )
+    textFile = "%s.txt" % dumpFile
+    fd = open( textFile, 'w' )
+    try:
+      fd.write( stream.getvalue() )
+    finally:
+      fd.close()
+
+    # ( file, line, function ) -> ( primitive calls, calls, internal time, cumulative time, callers )
+    hotFunctions = sorted( stats.stats.items(), key = lambda item: item[1][2], reverse = True )[:5]
+    summary = ", ".join( [ "%s:%s(%s) %.2fs" % ( key[0], key[1], key[2], value[2] )
+                           for key, value in hotFunctions ] )
+    self.log.notice( "Cycle %s profiled in %s, hot functions:" % ( cycle, textFile ), summary )
+    if self.am_monitoringEnabled():
+      self.monitor.addMark( 'ProfiledCycleTime', cycleTime )
+
   def __executeModuleCycle( self ):
     # Execute the beginExecution function
     result = self.am_secureCall( self.beginExecution, name = "beginExecution" )
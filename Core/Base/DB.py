@@ -8,6 +8,7 @@ from DIRAC                                       import gLogger, gConfig
 from DIRAC.Core.Utilities.MySQL                  import MySQL
 from DIRAC.ConfigurationSystem.Client.Utilities  import getDBParameters
 from DIRAC.ConfigurationSystem.Client.PathFinder import getDatabaseSection
+from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
 
 class DB( MySQL ):
 
@@ -27,6 +28,7 @@ class DB( MySQL ):
     self.dbUser = dbParameters[ 'User' ]
     self.dbPass = dbParameters[ 'Password' ]
     self.dbName = dbParameters[ 'DBName' ]
+    self.__monitoringRegistered = False
 
     MySQL.__init__( self, self.dbHost, self.dbUser, self.dbPass,
                    self.dbName, self.dbPort, debug = debug )
@@ -34,6 +36,9 @@ class DB( MySQL ):
     if not self._connected:
       raise RuntimeError( 'Can not connect to DB %s, exiting...' % self.dbName )
 
+    self._slowQueryThreshold = self.getCSOption( 'SlowQueryThreshold', 0. )
+    self._queryStatistics = self.getCSOption( 'QueryStatistics', False )
+
 
     self.log.info( "==================================================" )
     #self.log.info("SystemInstance: "+self.system)
@@ -44,6 +49,33 @@ class DB( MySQL ):
     self.log.info( "DBName:         " + self.dbName )
     self.log.info( "==================================================" )
 
+#############################################################################
+  def __registerMonitoring( self ):
+    """ Register the monitoring activities of the DB once gMonitor is initialized
+    """
+    for suffix, description, unit, operation in ( ( 'Queries', 'Statements executed', 'statements', gMonitor.OP_SUM ),
+                                                  ( 'SlowQueries', 'Slow statements', 'statements', gMonitor.OP_SUM ),
+                                                  ( 'QueryTime', 'Statement execution time', 'seconds', gMonitor.OP_MEAN ),
+                                                  ( 'ConnectionWait', 'Time waiting for a connection', 'seconds',
+                                                    gMonitor.OP_MEAN ) ):
+      gMonitor.registerActivity( '%s%s' % ( self.dbName, suffix ), '%s on %s' % ( description, self.dbName ),
+                                 self.fullname, unit, operation )
+    self.__monitoringRegistered = '%sQueries' % self.dbName in gMonitor.activitiesDefinitions
+
+  def _reportStatement( self, cmd, elapsed, rows, connectionWait, ok ):
+    """ Publish the statements to gMonitor as well
+    """
+    MySQL._reportStatement( self, cmd, elapsed, rows, connectionWait, ok )
+    if not self.__monitoringRegistered:
+      self.__registerMonitoring()
+      if not self.__monitoringRegistered:
+        return
+    gMonitor.addMark( '%sQueries' % self.dbName, 1 )
+    gMonitor.addMark( '%sQueryTime' % self.dbName, elapsed )
+    gMonitor.addMark( '%sConnectionWait' % self.dbName, connectionWait )
+    if self._slowQueryThreshold and elapsed >= self._slowQueryThreshold:
+      gMonitor.addMark( '%sSlowQueries' % self.dbName, 1 )
+
 #############################################################################
   def getCSOption( self, optionName, defaultValue = None ):
     cs_path = getDatabaseSection( self.fullname )
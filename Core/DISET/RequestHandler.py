@@ -10,6 +10,8 @@ from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
 from DIRAC.Core.DISET.private.MessageBroker import getGlobalMessageBroker
 from DIRAC.Core.Utilities import Time
+from DIRAC.Core.Utilities.QueryStatistics import gQueryStatistics, HISTOGRAM_LIMITS
+from DIRAC.Core.Security import Properties
 import DIRAC
 
 def getServiceOption( serviceInfo, optionName, defaultValue ):
@@ -471,6 +473,28 @@ class RequestHandler( object ):
 
     return S_OK( dInfo )
 
+####
+#
+#  Statistics of the DB statements done by the service
+#
+####
+
+  types_getDBStatistics = []
+  def export_getDBStatistics( self, dbName = None ):
+    """ Get the statistics of the SQL statements executed in this process, see QueryStatistics.
+        They are only gathered for the databases with the QueryStatistics option
+    """
+    return S_OK( { 'HistogramLimits' : list( HISTOGRAM_LIMITS ),
+                   'Statistics' : gQueryStatistics.getStatistics( dbName ) } )
+
+  types_resetDBStatistics = []
+  auth_resetDBStatistics = [ Properties.SERVICE_ADMINISTRATOR ]
+  def export_resetDBStatistics( self, dbName = None ):
+    """ Forget the statistics of the SQL statements of one or all the databases
+    """
+    gQueryStatistics.reset( dbName )
+    return S_OK()
+
 ####
 #
 #  Utilities methods
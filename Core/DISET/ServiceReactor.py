@@ -1,20 +1,19 @@
 
+import os
+import errno
 import types
 import select
 import time
 import socket
 
-try:
-  import multiprocessing
-except:
-  multiprocessing = False
-
 from DIRAC import gLogger, S_OK, S_ERROR
 from DIRAC.Core.DISET.private.Service import Service
 from DIRAC.Core.DISET.private.GatewayService import GatewayService
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
 from DIRAC.Core.Utilities import Network, Time
 from DIRAC.Core.Base.private.ModuleLoader import ModuleLoader
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
+from DIRAC.Core.Utilities.LockRing import LockRing
 from DIRAC.Core.DISET.private.Protocols import gProtocolDict
 from DIRAC.ConfigurationSystem.Client.Helpers import Registry
 from DIRAC.ConfigurationSystem.Client import PathFinder
@@ -24,6 +23,8 @@ class ServiceReactor:
   __transportExtraKeywords = { 'SSLSessionTimeout' : False, 
                                'IgnoreCRLs': False, 
                                'PacketTimeout': 'timeout' }
+  #Seconds a new connection has to complete its handshake and send its proposal
+  __maxPendingTime = 30
 
   def __init__( self ):
     self.__services = {}
@@ -35,6 +36,11 @@ class ServiceReactor:
     self.__maxFD = 0
     self.__listeningConnections = {}
     self.__stats = ReactorStats()
+    self.__cloneId = 0
+    #pid -> clone id
+    self.__clonePids = {}
+    self.__parentPid = os.getpid()
+    self.__reusePort = False
 
   def initialize( self, servicesList ):
     try:
@@ -52,6 +58,9 @@ class ServiceReactor:
     for serviceName in self.__serviceModules:
       self.__services[ serviceName ] = Service( self.__serviceModules[ serviceName ] )
 
+    #Fork before the services start their threads and open their connections
+    self.__startCloneProcesses()
+
     #Loop again to include the GW in case there is one (included in the __init__)
     for serviceName in self.__services:
       gLogger.info( "Initializing %s" % serviceName )
@@ -60,6 +69,44 @@ class ServiceReactor:
         return result
     return S_OK()
 
+  def __startCloneProcesses( self ):
+    """
+    Fork a process per extra clone of the services ( CloneProcesses option ). Every process initializes
+    its own services and listens on the same ports, the kernel spreads the connections among them.
+
+    The handler modules are already loaded, so other threads may exist ( thread scheduler, configuration
+    refresh ) and only the forking one survives in the clones. The locks of the LockRing are released in
+    the clones, as in the ProcessPool workers, in case a gone thread held them, and the thread scheduler
+    starts its executor again. The configuration refresh threads are started on demand.
+    """
+    clones = {}
+    for svcName in self.__services:
+      clones[ svcName ] = self.__services[ svcName ].getConfig().getCloneProcesses()
+    maxClones = max( clones.values() + [ 1 ] )
+    if maxClones < 2:
+      return
+    if not Network.getReusePortOption():
+      gLogger.warn( "Listening ports can't be shared in this platform. Clone processes are disabled" )
+      return
+    self.__reusePort = True
+    for cloneId in range( 1, maxClones ):
+      pid = os.fork()
+      if pid:
+        self.__clonePids[ pid ] = cloneId
+        gLogger.always( "Started clone process %s (pid %s)" % ( cloneId, pid ) )
+        continue
+      #Clone process, only for the services with enough clones
+      self.__cloneId = cloneId
+      self.__clonePids = {}
+      for svcName in clones:
+        if clones[ svcName ] <= cloneId:
+          del self.__services[ svcName ]
+        else:
+          self.__services[ svcName ].setCloneProcessId( cloneId )
+      LockRing()._openAll()
+      gThreadScheduler.restartAfterFork()
+      return
+
   def closeListeningConnections( self ):
     gLogger.info( "Closing listening connections..." )
     for svcName in self.__listeningConnections:
@@ -82,6 +129,8 @@ class ServiceReactor:
         return S_ERROR( "Protocol %s is not known for service %s" % ( protocol, serviceName ) )
       self.__listeningConnections[ serviceName ] = { 'port' : port, 'protocol' : protocol }
       transportArgs = {}
+      if self.__reusePort:
+        transportArgs[ 'reusePort' ] = True
       for kw in ServiceReactor.__transportExtraKeywords:
         value = svcCfg.getOption( kw )
         if value:
@@ -108,23 +157,40 @@ class ServiceReactor:
       return result
     for svcName in self.__listeningConnections:
       gLogger.always( "Listening at %s" % self.__services[ svcName ].getConfig().getURL() )
-    #Multiple clones not yet working. Disabled by default
-    if False and multiprocessing:
-      for svcName in self.__listeningConnections:
-        clones = self.__services[ svcName ].getConfig().getCloneProcesses()
-        for i in range( 1, clones ):
-          p = multiprocessing.Process( target = self.__startCloneProcess, args = ( svcName, i ) )
-          p.start()
-          gLogger.always( "Started clone process %s for %s" % ( i, svcName ) )
-    while self.__alive:
-      self.__acceptIncomingConnection()
+    if hasattr( select, "epoll" ):
+      while self.__alive:
+        self.__pollIncomingConnections()
+    else:
+      while self.__alive:
+        self.__acceptIncomingConnection()
+    self.__closeListeningConnections()
+    return S_OK()
 
-  #This function runs in a different process
-  def __startCloneProcess( self, svcName, i ):
-    self.__services[ svcName ].setCloneProcessId( i )
-    self.__alive = i
-    while self.__alive:
-      self.__acceptIncomingConnection( svcName )
+  def __checkParentAlive( self ):
+    #Clones stop when the main process is gone
+    if self.__cloneId and os.getppid() != self.__parentPid:
+      gLogger.always( "Main process is gone. Stopping clone %s" % self.__cloneId )
+      self.__alive = False
+    self.__reapClones()
+
+  def __reapClones( self ):
+    """
+    Collect the clones that exited. They are not started again: the main process has initialized its
+    services by then, and a fork of it would share their DB connections and lose their threads. The
+    other processes keep serving the connections on the shared ports.
+    """
+    for pid in self.__clonePids.keys():
+      try:
+        wPid, status = os.waitpid( pid, os.WNOHANG )
+      except OSError, e:
+        if e.errno != errno.ECHILD:
+          continue
+        wPid, status = pid, None
+      if not wPid:
+        continue
+      cloneId = self.__clonePids.pop( pid )
+      gLogger.error( "Clone process %s (pid %s) exited and is not restarted" % ( cloneId, pid ),
+                     "status %s" % status )
 
   def __getListeningSocketsList( self, svcName = False ):
     if svcName:
@@ -136,6 +202,7 @@ class ServiceReactor:
     return sockets
 
   def __acceptIncomingConnection( self, svcName = False ):
+    self.__checkParentAlive()
     sockets = self.__getListeningSocketsList( svcName )
     while self.__alive:
       try:
@@ -154,26 +221,129 @@ class ServiceReactor:
         return
       self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
       #Is it banned?
-      clientIP = clientTransport.getRemoteAddress()[0]
-      if clientIP in Registry.getBannedIPs():
-        gLogger.warn( "Client connected from banned ip %s" % clientIP )
-        clientTransport.close()
+      if self.__isBanned( clientTransport ):
         continue
       #Handle connection
       self.__stats.connectionStablished()
       self.__services[ svcName ].handleConnection( clientTransport )
       #Renew context?
-      now = time.time()
-      renewed = False
-      for svcName in self.__listeningConnections:
-         tr = self.__listeningConnections[ svcName ][ 'transport' ]
-         if now - tr.latestServerRenewTime() > self.__services[ svcName ].getConfig().getContextLifeTime():
-           result = tr.renewServerContext()
-           if result[ 'OK' ]:
-             renewed = True
-      if renewed:
+      if self.__renewServerContexts():
         sockets = self.__getListeningSocketsList()
 
+  def __isBanned( self, clientTransport ):
+    clientIP = clientTransport.getRemoteAddress()[0]
+    if clientIP in Registry.getBannedIPs():
+      gLogger.warn( "Client connected from banned ip %s" % clientIP )
+      clientTransport.close()
+      return True
+    return False
+
+  def __renewServerContexts( self ):
+    now = time.time()
+    renewed = False
+    for svcName in self.__listeningConnections:
+      tr = self.__listeningConnections[ svcName ][ 'transport' ]
+      if now - tr.latestServerRenewTime() > self.__services[ svcName ].getConfig().getContextLifeTime():
+        result = tr.renewServerContext()
+        if result[ 'OK' ]:
+          renewed = True
+    return renewed
+
+  def __pollIncomingConnections( self ):
+    """
+    Event driven reactor. The handshakes and the action proposals are received here without blocking,
+    only the connections with a whole proposal are given to the service threads. Slow or idle clients
+    do not hold a thread and are dropped after __maxPendingTime seconds.
+
+    This holds for new connections only. A connection kept open after a call ( keepConnection ) stays
+    in its service thread, that waits for the next proposal itself and gives the connection up after its
+    idle time or when other connections wait for a thread ( see Service.__waitForNextProposal ).
+    """
+    poller = select.epoll()
+    listeningFDs = {}
+    for svcName in self.__listeningConnections:
+      fd = self.__listeningConnections[ svcName ][ 'transport' ].getSocket().fileno()
+      listeningFDs[ fd ] = svcName
+      poller.register( fd, select.EPOLLIN )
+    #fd -> [ service name, transport, deadline ]
+    pendingConnections = {}
+    try:
+      while self.__alive:
+        try:
+          events = poller.poll( 1 )
+        except IOError, e:
+          if e.errno == errno.EINTR:
+            continue
+          raise
+        for fd, event in events:
+          if fd in listeningFDs:
+            self.__acceptPendingConnection( listeningFDs[ fd ], poller, pendingConnections )
+          elif fd in pendingConnections:
+            self.__progressPendingConnection( fd, poller, pendingConnections )
+        now = time.time()
+        for fd in [ fd for fd in pendingConnections if pendingConnections[ fd ][2] < now ]:
+          gLogger.verbose( "Dropping connection without proposal",
+                           str( pendingConnections[ fd ][1].getRemoteAddress() ) )
+          self.__dropPendingConnection( fd, poller, pendingConnections )
+        self.__renewServerContexts()
+        self.__checkParentAlive()
+    finally:
+      for fd in pendingConnections.keys():
+        self.__dropPendingConnection( fd, poller, pendingConnections )
+      poller.close()
+
+  def __acceptPendingConnection( self, svcName, poller, pendingConnections ):
+    try:
+      retVal = self.__listeningConnections[ svcName ][ 'transport' ].acceptConnection()
+    except socket.error, e:
+      gLogger.warn( "Error while accepting a connection: ", str( e ) )
+      return
+    if not retVal[ 'OK' ]:
+      gLogger.warn( "Error while accepting a connection: ", retVal[ 'Message' ] )
+      return
+    clientTransport = retVal[ 'Value' ]
+    fd = clientTransport.getSocket().fileno()
+    self.__maxFD = max( self.__maxFD, fd )
+    if self.__isBanned( clientTransport ):
+      return
+    self.__stats.connectionStablished()
+    pendingConnections[ fd ] = [ svcName, clientTransport, time.time() + self.__maxPendingTime ]
+    poller.register( fd, select.EPOLLIN )
+    #The client may have already sent its hello
+    self.__progressPendingConnection( fd, poller, pendingConnections )
+
+  def __progressPendingConnection( self, fd, poller, pendingConnections ):
+    svcName, clientTransport = pendingConnections[ fd ][:2]
+    result = clientTransport.handshakeStep()
+    if result[ 'OK' ] and not result[ 'Value' ]:
+      #Handshake waiting for the client
+      if result.get( 'wantWrite' ):
+        poller.modify( fd, select.EPOLLOUT )
+      else:
+        poller.modify( fd, select.EPOLLIN )
+      return
+    if result[ 'OK' ]:
+      result = clientTransport.readAvailable()
+    if not result[ 'OK' ]:
+      gLogger.debug( "Dropping pending connection", result[ 'Message' ] )
+      self.__dropPendingConnection( fd, poller, pendingConnections )
+      return
+    if not clientTransport.isMessageReceived():
+      poller.modify( fd, select.EPOLLIN )
+      return
+    #Proposal is here, process it in a service thread
+    poller.unregister( fd )
+    del pendingConnections[ fd ]
+    self.__services[ svcName ].handleConnection( clientTransport )
+
+  def __dropPendingConnection( self, fd, poller, pendingConnections ):
+    clientTransport = pendingConnections.pop( fd )[1]
+    try:
+      poller.unregister( fd )
+    except ( IOError, ValueError ):
+      pass
+    clientTransport.close()
+
 
   def __closeListeningConnections( self ):
     for svcName in self.__listeningConnections:
@@ -1,9 +1,14 @@
 # $HeadURL$
 __RCSID__ = "$Id$"
 
+import os
 import time
 import types
 import thread
+try:
+  from hashlib import md5
+except:
+  from md5 import md5
 import DIRAC
 from DIRAC.Core.DISET.private.Protocols import gProtocolDict
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
@@ -32,6 +37,7 @@ class BaseClient:
   KW_PROXY_CHAIN = "proxyChain"
   KW_SKIP_CA_CHECK = "skipCACheck"
   KW_KEEP_ALIVE_LAPSE = "keepAliveLapse"
+  KW_KEEP_CONNECTION = "keepConnection"
 
   __threadConfig = ThreadConfig()
 
@@ -52,7 +58,7 @@ class BaseClient:
     for initFunc in ( self.__discoverSetup, self.__discoverVO, self.__discoverTimeout,
                       self.__discoverURL, self.__discoverCredentialsToUse,
                       self.__checkTransportSanity,
-                      self.__setKeepAliveLapse ):
+                      self.__setKeepAliveLapse, self.__discoverKeepConnection ):
       result = initFunc()
       if not result[ 'OK' ] and self.__initStatus[ 'OK' ]:
         self.__initStatus = result
@@ -270,13 +276,23 @@ and this is thread %s
   def _disconnect( self, trid ):
     getGlobalTransportPool().close( trid )
 
-  def _proposeAction( self, transport, action ):
+  def _sendProposal( self, transport, action, keepConnection = False ):
+    """
+    Send the action proposal. With keepConnection the service is asked to keep the connection
+    open after the action, if it does it answers S_OK( { 'keepConnection' : <idle time> } )
+    """
     if not self.__initStatus[ 'OK' ]:
       return self.__initStatus
-    stConnectionInfo = ( ( self.__URLTuple[3], self.setup, self.vo ),
+    serviceTuple = ( self.__URLTuple[3], self.setup, self.vo )
+    if keepConnection:
+      serviceTuple += ( { 'keepConnection' : True }, )
+    stConnectionInfo = ( serviceTuple,
                          action,
                          self.__extraCredentials )
-    retVal = transport.sendData( S_OK( stConnectionInfo ) )
+    return transport.sendData( S_OK( stConnectionInfo ) )
+
+  def _proposeAction( self, transport, action, keepConnection = False ):
+    retVal = self._sendProposal( transport, action, keepConnection )
     if not retVal[ 'OK' ]:
       return retVal
     serverReturn = transport.receiveData()
@@ -321,6 +337,30 @@ and this is thread %s
     self.kwargs[ self.KW_KEEP_ALIVE_LAPSE ] = kaa
     return S_OK()
 
+  def __discoverKeepConnection( self ):
+    #Ask the service to keep the connection open for the next calls?
+    #It can also be set for a server in /DIRAC/ConnConf/<host>:<port>/keepConnection
+    keepConnection = self.kwargs.get( self.KW_KEEP_CONNECTION, False )
+    if type( keepConnection ) in types.StringTypes:
+      keepConnection = keepConnection.lower() in ( "true", "yes", "y", "1" )
+    self.__keepConnection = bool( keepConnection )
+    return S_OK()
+
+  def _keepConnection( self ):
+    return self.__keepConnection
+
+  def _getConnectionKey( self ):
+    """
+    Identify the connections that can be shared: same URL and same credentials
+    """
+    self.__discoverExtraCredentials()
+    proxyString = self.kwargs.get( self.KW_PROXY_STRING, "" )
+    if proxyString:
+      proxyString = md5( proxyString ).hexdigest()
+    return ( self.serviceURL, self.useCertificates, self.kwargs.get( self.KW_SKIP_CA_CHECK ),
+             self.kwargs.get( self.KW_PROXY_LOCATION, os.environ.get( 'X509_USER_PROXY', "" ) ),
+             proxyString, str( self.__extraCredentials ) )
+
   def _getBaseStub( self ):
     newKwargs = dict( self.kwargs )
     #Set DN
@@ -0,0 +1,108 @@
+# $HeadURL$
+""" Pool of the client connections kept open by the services to be reused by later RPCs
+
+    An RPCClient created with keepConnection = True asks the service to keep the connection
+    open after the call. If the service agrees, the transport is put here once the call is done
+    and the next client to the same URL with the same credentials in this process picks it up
+    instead of doing a new TCP and SSL handshake. A connection is given to one client at a time,
+    and it is dropped well before the service closes it on its idle timeout.
+"""
+__RCSID__ = "$Id$"
+
+import os
+import time
+import threading
+from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
+
+class ConnectionPool( object ):
+
+  def __init__( self, maxConnectionsPerKey = 10 ):
+    self.__maxConnectionsPerKey = maxConnectionsPerKey
+    self.__lock = threading.Lock()
+    # connection key -> [ ( expiration time, trid, transport, idle time ) ]
+    self.__connections = {}
+    self.__purgeTask = None
+
+  def get( self, connectionKey ):
+    """ Get an idle connection for the key
+
+    :return: ( trid, transport, idleTime ) or False
+    """
+    now = time.time()
+    expired = []
+    connection = False
+    self.__lock.acquire()
+    try:
+      connList = self.__connections.get( connectionKey, [] )
+      while connList and not connection:
+        expirationTime, trid, transport, idleTime = connList.pop()
+        if expirationTime > now:
+          connection = ( trid, transport, idleTime )
+        else:
+          expired.append( trid )
+      if not connList and connectionKey in self.__connections:
+        del self.__connections[ connectionKey ]
+    finally:
+      self.__lock.release()
+    self.__close( expired )
+    return connection
+
+  def put( self, connectionKey, trid, transport, idleTime ):
+    """ Give back a connection kept by the service for idleTime seconds
+    """
+    # Do not use it when the service may be closing it
+    expirationTime = time.time() + idleTime / 2.
+    closeList = []
+    self.__lock.acquire()
+    try:
+      connList = self.__connections.setdefault( connectionKey, [] )
+      connList.append( ( expirationTime, trid, transport, idleTime ) )
+      if len( connList ) > self.__maxConnectionsPerKey:
+        closeList.append( connList.pop( 0 )[1] )
+      if not self.__purgeTask:
+        result = gThreadScheduler.addPeriodicTask( 30, self.purgeExpired )
+        if result[ 'OK' ]:
+          self.__purgeTask = result[ 'Value' ]
+    finally:
+      self.__lock.release()
+    self.__close( closeList )
+
+  def purgeExpired( self ):
+    """ Close the connections that can not be used any more
+    """
+    now = time.time()
+    expired = []
+    self.__lock.acquire()
+    try:
+      for connectionKey in self.__connections.keys():
+        connList = self.__connections[ connectionKey ]
+        expired.extend( [ connection[1] for connection in connList if connection[0] <= now ] )
+        connList = [ connection for connection in connList if connection[0] > now ]
+        if connList:
+          self.__connections[ connectionKey ] = connList
+        else:
+          del self.__connections[ connectionKey ]
+    finally:
+      self.__lock.release()
+    self.__close( expired )
+
+  def getNumConnections( self ):
+    return sum( [ len( connList ) for connList in self.__connections.values() ] )
+
+  def __close( self, tridList ):
+    for trid in tridList:
+      getGlobalTransportPool().close( trid )
+
+
+gConnectionPool = None
+gConnectionPoolPid = None
+
+def getGlobalConnectionPool():
+  """ The pool of this process, connections opened by a parent process are never reused
+  """
+  global gConnectionPool, gConnectionPoolPid
+  if not gConnectionPool or gConnectionPoolPid != os.getpid():
+    gConnectionPool = ConnectionPool()
+    gConnectionPoolPid = os.getpid()
+  return gConnectionPool
@@ -3,14 +3,21 @@ __RCSID__ = "$Id$"
 
 import types
 from DIRAC.Core.DISET.private.BaseClient import BaseClient
+from DIRAC.Core.DISET.private.ConnectionPool import getGlobalConnectionPool
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
 
 
 class InnerRPCClient( BaseClient ):
 
   __retry = 0
-  
+  #Max number of calls sent over a kept connection before reading their answers
+  pipelineDepth = 20
+  #Errors of the transports closed by the peer
+  __closedMessages = ( "Peer closed connection", "Connection closed by peer" )
+
   def executeRPC( self, functionName, args ):
+    if self._keepConnection():
+      return self.executeRPCPipeline( [ ( functionName, args ) ] )[ 'Value' ][0]
     stub = ( self._getBaseStub(), functionName, args )
     retVal = self._connect()
     if not retVal[ 'OK' ]:
@@ -37,3 +44,111 @@ class InnerRPCClient( BaseClient ):
     finally:
       self._disconnect( trid )
 
+  def executeRPCPipeline( self, calls ):
+    """
+    Execute a list of ( functionName, args ) calls and return S_OK( list of their results )
+
+    With keepConnection the calls go over the connections kept open by the service and up to
+    pipelineDepth calls are sent before reading their answers, otherwise they are executed
+    one after the other as with executeRPC.
+    """
+    calls = list( calls )
+    if not self._keepConnection():
+      return S_OK( [ self.executeRPC( functionName, args ) for functionName, args in calls ] )
+    results = []
+    while calls:
+      callResults = self.__executeOnKeptConnection( calls[ :self.pipelineDepth ] )
+      results.extend( callResults )
+      calls = calls[ len( callResults ): ]
+    return S_OK( results )
+
+  def __executeOnKeptConnection( self, calls ):
+    """
+    Execute the calls over an idle kept connection, or only the first one over a new connection
+
+    :return: the results of the first calls, the following ones were not executed
+    """
+    connectionKey = self._getConnectionKey()
+    connection = getGlobalConnectionPool().get( connectionKey )
+    if not connection:
+      return [ self.__executeOnNewConnection( connectionKey, calls[0][0], calls[0][1] ) ]
+    trid, transport, idleTime = connection
+    results = []
+    keepConnection = True
+    try:
+      #Send the calls without waiting for the answers
+      sentCalls = []
+      for functionName, args in calls:
+        retVal = self._sendProposal( transport, ( "RPC", functionName ), keepConnection = True )
+        if retVal[ 'OK' ]:
+          retVal = transport.sendData( S_OK( args ) )
+        if not retVal[ 'OK' ]:
+          keepConnection = False
+          break
+        sentCalls.append( ( functionName, args ) )
+      #Read the answers in the same order
+      for index in range( len( sentCalls ) ):
+        functionName, args = sentCalls[ index ]
+        stub = ( self._getBaseStub(), functionName, args )
+        retVal = transport.receiveData()
+        if not retVal[ 'OK' ]:
+          keepConnection = False
+          if retVal[ 'Message' ] in self.__closedMessages and not transport.byteStream:
+            #Closed cleanly by the service instead of answering the proposal, so this call
+            #was not executed and it is sent again with the next ones
+            break
+          #Refused or lost, do not risk executing the calls twice
+          for functionName, args in sentCalls[ index: ]:
+            result = S_ERROR( retVal[ 'Message' ] )
+            result[ 'rpcStub' ] = ( self._getBaseStub(), functionName, args )
+            results.append( result )
+          break
+        if type( retVal[ 'Value' ] ) != types.DictType or not retVal[ 'Value' ].get( 'keepConnection' ):
+          #The service executes this call and then closes the connection
+          keepConnection = False
+        receivedData = transport.receiveData()
+        if type( receivedData ) == types.DictType:
+          receivedData[ 'rpcStub' ] = stub
+        results.append( receivedData )
+        if not keepConnection:
+          break
+      return results
+    finally:
+      if keepConnection:
+        getGlobalConnectionPool().put( connectionKey, trid, transport, idleTime )
+      else:
+        self._disconnect( trid )
+
+  def __executeOnNewConnection( self, connectionKey, functionName, args ):
+    """
+    Execute one call over a new connection and keep it if the service does
+    """
+    stub = ( self._getBaseStub(), functionName, args )
+    retVal = self._connect()
+    if not retVal[ 'OK' ]:
+      retVal[ 'rpcStub' ] = stub
+      return retVal
+    trid, transport = retVal[ 'Value' ]
+    idleTime = 0
+    try:
+      retVal = self._proposeAction( transport, ( "RPC", functionName ), keepConnection = True )
+      if not retVal[ 'OK' ]:
+        retVal[ 'rpcStub' ] = stub
+        return retVal
+      if type( retVal[ 'Value' ] ) == types.DictType:
+        idleTime = retVal[ 'Value' ].get( 'keepConnection', 0 )
+      retVal = transport.sendData( S_OK( args ) )
+      if not retVal[ 'OK' ]:
+        idleTime = 0
+        return retVal
+      receivedData = transport.receiveData()
+      if type( receivedData ) == types.DictType:
+        receivedData[ 'rpcStub' ] = stub
+      else:
+        idleTime = 0
+      return receivedData
+    finally:
+      if idleTime:
+        getGlobalConnectionPool().put( connectionKey, trid, transport, idleTime )
+      else:
+        self._disconnect( trid )
@@ -1,6 +1,8 @@
 
 import os
 import time
+import types
+import select
 import DIRAC
 import threading
 from DIRAC import gConfig, gLogger, S_OK, S_ERROR, gMonitor
@@ -26,6 +28,10 @@ class Service:
                         'Message' : 'msg',
                         'Connection' : 'Message' }
   SVC_SECLOG_CLIENT = SecurityLogClient()
+  #Seconds between the checks for waiting connections while a connection is kept idle
+  KEPT_CONNECTION_CHECK_PERIOD = 1
+  #Seconds to discard what a client sends on a kept connection being closed
+  KEPT_CONNECTION_LINGER_TIME = 1
 
   def __init__( self, serviceData ):
     self._svcData = serviceData
@@ -233,7 +239,10 @@ class Service:
   def _initMonitoring( self ):
     #Init extra bits of monitoring
     self._monitor.setComponentType( MonitoringClient.COMPONENT_SERVICE )
-    self._monitor.setComponentName( self._name )
+    if self.__cloneId:
+      self._monitor.setComponentName( "%s-Clone:%s" % ( self._name, self.__cloneId ) )
+    else:
+      self._monitor.setComponentName( self._name )
     self._monitor.setComponentLocation( self._cfg.getURL() )
     self._monitor.initialize()
     self._monitor.registerActivity( "Connections", "Connections received", "Framework", "connections", MonitoringClient.OP_RATE )
@@ -282,49 +291,108 @@ class Service:
   #Threaded process function
   def _processInThread( self, clientTransport ):
     self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
-    self._lockManager.lockGlobal()
-    try:
-      monReport = self.__startReportToMonitoring()
-    except Exception, e:
-      monReport = False
-    try:
-      #Handshake
+    trid = False
+    while True:
+      self._lockManager.lockGlobal()
       try:
-        result = clientTransport.handshake()
-        if not result[ 'OK' ]:
-          clientTransport.close()
-          return
-      except:
-        return
-      #Add to the transport pool
-      trid = self._transportPool.add( clientTransport )
-      if not trid:
-        return
-      #Receive and check proposal
-      result = self._receiveAndCheckProposal( trid )
-      if not result[ 'OK' ]:
-        self._transportPool.sendAndClose( trid, result )
-        return
-      proposalTuple = result[ 'Value' ]
-      #Instantiate handler
-      result = self._instantiateHandler( trid, proposalTuple )
-      if not result[ 'OK' ]:
-        self._transportPool.sendAndClose( trid, result )
-        return
-      handlerObj = result[ 'Value' ]
-      #Execute the action
-      result = self._processProposal( trid, proposalTuple, handlerObj )
-      #Close the connection if required
-      if result[ 'closeTransport' ] or not result[ 'OK' ]:
-        if not result[ 'OK' ]:
-          gLogger.error( "Error processing proposal", result[ 'Message' ] )
+        monReport = self.__startReportToMonitoring()
+      except Exception, e:
+        monReport = False
+      try:
+        if not trid:
+          #Handshake
+          try:
+            result = clientTransport.handshake()
+            if not result[ 'OK' ]:
+              clientTransport.close()
+              return
+          except:
+            return
+          #Add to the transport pool
+          trid = self._transportPool.add( clientTransport )
+          if not trid:
+            return
+          handshakeCredentials = dict( clientTransport.getConnectingCredentials() )
+        else:
+          #Next proposal on a kept connection, forget the previous extra credentials
+          credDict = clientTransport.getConnectingCredentials()
+          credDict.clear()
+          credDict.update( handshakeCredentials )
+        result = self._processProposalInTransport( trid )
+        if not result or not result.get( 'keepConnection' ):
+          return result
+      finally:
+        self._lockManager.unlockGlobal()
+        if monReport:
+          self.__endReportToMonitoring( *monReport )
+      #Wait for the next proposal of the client
+      if not self.__waitForNextProposal( clientTransport, result[ 'keepConnection' ] ):
+        clientTransport.shutdownAndDrain( self.KEPT_CONNECTION_LINGER_TIME )
         self._transportPool.close( trid )
-      return result
-    finally:
-      self._lockManager.unlockGlobal()
-      if monReport:
-        self.__endReportToMonitoring( *monReport )
+        return result
+
+  def _processProposalInTransport( self, trid ):
+    #Receive and check proposal
+    result = self._receiveAndCheckProposal( trid )
+    if not result[ 'OK' ]:
+      self._transportPool.sendAndClose( trid, result )
+      return
+    proposalTuple = result[ 'Value' ]
+    #Instantiate handler
+    result = self._instantiateHandler( trid, proposalTuple )
+    if not result[ 'OK' ]:
+      self._transportPool.sendAndClose( trid, result )
+      return
+    handlerObj = result[ 'Value' ]
+    #Execute the action
+    result = self._processProposal( trid, proposalTuple, handlerObj )
+    #Close the connection if required
+    if result[ 'closeTransport' ] or not result[ 'OK' ]:
+      if not result[ 'OK' ]:
+        gLogger.error( "Error processing proposal", result[ 'Message' ] )
+      self._transportPool.close( trid )
+    return result
+
+  def __getKeepConnectionTime( self, proposalTuple ):
+    """
+    Idle time the connection is kept open after the action if the client asked for it, 0 otherwise
+    """
+    if proposalTuple[1][0] != 'RPC' or len( proposalTuple[0] ) < 4:
+      return 0
+    connectionOptions = proposalTuple[0][3]
+    if type( connectionOptions ) != types.DictType or not connectionOptions.get( 'keepConnection' ):
+      return 0
+    return max( 0, self._cfg.getConnectionIdleTime() )
+
+  def __waitForNextProposal( self, clientTransport, idleTime ):
+    """
+    Wait up to idleTime seconds for the client to send data on a kept connection
 
+    The data already sent by the client is always served. The connection is not kept
+    idle while other connections are waiting for a thread. Unlike the new connections
+    handled by the reactor, the rest of the proposal is then read by this thread
+    """
+    #Already received by a previous read
+    if clientTransport.receivedMessages or clientTransport.byteStream:
+      return True
+    oSocket = clientTransport.getSocket()
+    endTime = time.time() + idleTime
+    try:
+      if getattr( oSocket, 'pending', False ) and oSocket.pending():
+        return True
+      while True:
+        pendingJobs = self._threadPool.pendingJobs()
+        if pendingJobs:
+          waitTime = 0
+        else:
+          waitTime = max( 0, min( self.KEPT_CONNECTION_CHECK_PERIOD, endTime - time.time() ) )
+        inList, dummy, dummy = select.select( [ oSocket ], [], [], waitTime )
+        if inList:
+          return True
+        if pendingJobs or time.time() >= endTime:
+          return False
+    except Exception:
+      return False
 
   def _createIdentityString( self, credDict, clientTransport = None ):
     if 'username' in credDict:
@@ -447,8 +515,12 @@ class Service:
     return S_OK( handlerInstance )
 
   def _processProposal( self, trid, proposalTuple, handlerObj ):
-    #Notify the client we're ready to execute the action
-    retVal = self._transportPool.send( trid, S_OK() )
+    #Notify the client we're ready to execute the action, and if the connection will be kept
+    keepConnectionTime = self.__getKeepConnectionTime( proposalTuple )
+    if keepConnectionTime:
+      retVal = self._transportPool.send( trid, S_OK( { 'keepConnection' : keepConnectionTime } ) )
+    else:
+      retVal = self._transportPool.send( trid, S_OK() )
     if not retVal[ 'OK' ]:
       return retVal
 
@@ -477,6 +549,9 @@ class Service:
         self._msgBroker.removeTransport( trid )
 
     result[ 'closeTransport' ] = not messageConnection or not result[ 'OK' ]
+    if keepConnectionTime and result[ 'OK' ]:
+      result[ 'closeTransport' ] = False
+      result[ 'keepConnection' ] = keepConnectionTime
     return result
 
   def _mbConnect( self, trid, handlerObj = None ):
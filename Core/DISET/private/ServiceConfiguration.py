@@ -80,6 +80,12 @@ class ServiceConfiguration:
     except:
       return 15
 
+  def getConnectionIdleTime( self ):
+    try:
+      return int( self.getOption( "ConnectionIdleTime" ) )
+    except:
+      return 0
+
   def getCloneProcesses( self ):
     try:
       return int( self.getOption( "CloneProcesses" ) )
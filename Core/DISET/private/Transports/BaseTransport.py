@@ -3,6 +3,7 @@ __RCSID__ = "$Id$"
 
 import time
 import select
+import socket
 import cStringIO
 try:
   from hashlib import md5
@@ -56,6 +57,12 @@ class BaseTransport:
   def handshake( self ):
     return S_OK()
 
+  def handshakeStep( self ):
+    """
+    Advance the handshake without blocking, S_OK( True ) once it is done
+    """
+    return S_OK( True )
+
   def close( self ):
     self.oSocket.close()
 
@@ -98,6 +105,14 @@ class BaseTransport:
       return True
     return False
 
+  def _hasDataToRead( self ):
+    #poll does not have the file descriptor limit of select
+    if hasattr( select, "poll" ):
+      poller = select.poll()
+      poller.register( self.oSocket.fileno(), select.POLLIN )
+      return len( poller.poll( 0 ) ) > 0
+    return len( select.select( [ self.oSocket ], [], [], 0 )[0] ) > 0
+
   def _read( self, bufSize = 4096, skipReadyCheck = False ):
     try:
       if skipReadyCheck or self._readReady():
@@ -114,6 +129,61 @@ class BaseTransport:
   def _write( self, buffer ):
     return S_OK( self.oSocket.send( buffer ) )
 
+  def _shutdownWrite( self ):
+    """
+    Send the end of the stream to the peer, the connection can still be read
+    """
+    self.oSocket.shutdown( socket.SHUT_WR )
+
+  def shutdownAndDrain( self, lingerTime ):
+    """
+    Prepare the close of a connection the peer may still be writing to. Closing it with unread
+    data would reset it and the peer could lose the data it did not read yet, so the end of the
+    stream is sent and what the peer sends is discarded until it closes or for lingerTime seconds
+    """
+    try:
+      self._shutdownWrite()
+      endTime = time.time() + lingerTime
+      while time.time() < endTime:
+        inList, dummy, dummy = select.select( [ self.oSocket ], [], [], endTime - time.time() )
+        if not inList or not self.oSocket.recv( 16384 ):
+          break
+    except Exception:
+      pass
+
+  def readAvailable( self ):
+    """
+    Buffer the data already received from the peer without blocking, to be used when the socket is
+    reported as readable. Returns the number of bytes read.
+    """
+    if not self._hasDataToRead():
+      return S_OK( 0 )
+    retVal = self._read( 16384, skipReadyCheck = True )
+    if not retVal[ 'OK' ]:
+      return retVal
+    if not retVal[ 'Value' ]:
+      return S_ERROR( "Connection closed by peer" )
+    self.byteStream += retVal[ 'Value' ]
+    return S_OK( len( retVal[ 'Value' ] ) )
+
+  def isMessageReceived( self ):
+    """
+    Is there a whole message ( or a keep alive ) in the buffer, so receiveData will not block?
+    """
+    if self.receivedMessages:
+      return True
+    if self.byteStream.find( BaseTransport.keepAliveMagic, 0, len( BaseTransport.keepAliveMagic ) ) == 0:
+      return True
+    iSeparatorPosition = self.byteStream.find( ":", 0, 10 )
+    if iSeparatorPosition == -1:
+      return False
+    try:
+      pkgSize = int( self.byteStream[ :iSeparatorPosition ] )
+    except ValueError:
+      #Let receiveData report the error
+      return True
+    return len( self.byteStream ) - iSeparatorPosition - 1 >= pkgSize
+
   def sendData( self, uData, prefix = False ):
     self.__updateLastActionTimestamp()
     sCodedData = DEncode.encode( uData )
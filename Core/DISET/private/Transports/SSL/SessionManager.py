@@ -25,4 +25,11 @@ class SessionManager:
   def set( self, sessionId, sessionObject ):
     self.sessionsDict[ sessionId ] = sessionObject
 
+  def remove( self, sessionId ):
+    """
+    Forget a session that can not be resumed
+    """
+    if sessionId in self.sessionsDict:
+      del self.sessionsDict[ sessionId ]
+
 gSessionManager = SessionManager()
\ No newline at end of file
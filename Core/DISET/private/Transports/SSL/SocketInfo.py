@@ -4,41 +4,133 @@ __RCSID__ = "$Id$"
 import time
 import copy
 import os.path
+try:
+  from hashlib import md5
+except:
+  from md5 import md5
 import GSI
 from DIRAC.Core.Utilities.ReturnValues import S_ERROR, S_OK
 from DIRAC.Core.Utilities.Network import checkHostsMatch
 from DIRAC.Core.Utilities.LockRing import LockRing
 from DIRAC.Core.Security import Locations
 from DIRAC.Core.Security.X509Chain import X509Chain
+from DIRAC.Core.Utilities.DictCache import DictCache
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 
 DEFAULT_SSL_CIPHERS = "ECDH+AESGCM:DH+AESGCM:ECDH+AES256:DH+AES256:ECDH+AES128:DH+AES:ECDH+3DES:DH+3DES:RSA+AESGCM:RSA+AES:RSA+3DES:!aNULL:!MD5:!DSS"
+#Lifetime of the server side SSL sessions, the OpenSSL default
+DEFAULT_SSL_SESSION_TIMEOUT = 300
+#Lifetime of the peer credentials kept for the client side resumed sessions
+CLIENT_CREDENTIALS_LIFETIME = 3600
 
 class SocketInfo:
 
   __cachedCAsCRLs = False
   __cachedCAsCRLsLastLoaded = 0
   __cachedCAsCRLsLoadLock = LockRing().getLock()
+  #The CAs directory is checked for changes at most every __casCheckPeriod seconds
+  __casCheckPeriod = 60
+  __cachedCAsCRLsLastChecked = 0
+  __cachedCAsCRLsSignature = False
+  #Client contexts by credentials and CAs version
+  __cachedContexts = {}
+  __cachedContextsLock = LockRing().getLock()
+  __maxCachedContexts = 50
+  #Peer credentials of the full handshakes, for the resumed sessions
+  __peerCredentialsCache = DictCache()
+  __peerCredentialsLastPurge = 0
+  #Handshakes done by this process
+  __handshakeStats = { 'Full' : 0, 'FullTime' : 0.0, 'Resumed' : 0, 'ResumedTime' : 0.0 }
+  __handshakeStatsLock = LockRing().getLock()
 
 
   def __init__( self, infoDict, sslContext = None ):
     self.__retry = 0
+    self.__handshakeStart = 0
     self.infoDict = infoDict
     if sslContext:
       self.sslContext = sslContext
     else:
       if self.infoDict[ 'clientMode' ]:
-        if 'useCertificates' in self.infoDict and self.infoDict[ 'useCertificates' ]:
-          retVal = self.__generateContextWithCerts()
-        elif 'proxyString' in self.infoDict:
-          retVal = self.__generateContextWithProxyString()
-        else:
-          retVal = self.__generateContextWithProxy()
+        retVal = self.__getCachedClientContext()
       else:
         retVal = self.__generateServerContext()
       if not retVal[ 'OK' ]:
         raise Exception( retVal[ 'Message' ] )
 
+  def __generateClientContext( self ):
+    if 'useCertificates' in self.infoDict and self.infoDict[ 'useCertificates' ]:
+      return self.__generateContextWithCerts()
+    elif 'proxyString' in self.infoDict:
+      return self.__generateContextWithProxyString()
+    return self.__generateContextWithProxy()
+
+  def __getClientContextKey( self ):
+    """
+    Key of the client contexts that can be shared: same SSL options, same credentials files
+    and same CAs. False if the credentials can not be found.
+    """
+    if 'useCertificates' in self.infoDict and self.infoDict[ 'useCertificates' ]:
+      credFiles = Locations.getHostCertificateAndKeyLocation()
+      if not credFiles:
+        return False
+    elif 'proxyString' in self.infoDict:
+      credFiles = ()
+    elif 'proxyLocation' in self.infoDict:
+      credFiles = ( self.infoDict[ 'proxyLocation' ], )
+    else:
+      credFiles = ( Locations.getProxyLocation(), )
+    credKey = []
+    for credFile in credFiles:
+      try:
+        fileStat = os.stat( credFile )
+      except Exception:
+        return False
+      credKey.append( ( credFile, fileStat.st_mtime, fileStat.st_size ) )
+    if 'proxyString' in self.infoDict:
+      credKey.append( md5( self.infoDict[ 'proxyString' ] ).hexdigest() )
+    caVersion = 0
+    if not self.__getValue( 'skipCACheck', False ):
+      result = self.__loadCAsCRLs()
+      if not result[ 'OK' ]:
+        return False
+      caVersion = SocketInfo.__cachedCAsCRLsLastLoaded
+    return ( tuple( credKey ), caVersion ) + tuple( [ str( self.__getValue( opt, "" ) ) for opt in ( 'sslMethod',
+                                                                                              'sslCiphers',
+                                                                                              'skipCACheck',
+                                                                                              'gsiEnable',
+                                                                                              'IgnoreCRLs' ) ] )
+
+  def __getCachedClientContext( self ):
+    """
+    Reuse the context of a previous connection with the same credentials, the credentials
+    files and the CA store are loaded only once
+    """
+    contextKey = self.__getClientContextKey()
+    if contextKey:
+      SocketInfo.__cachedContextsLock.acquire()
+      try:
+        if contextKey in SocketInfo.__cachedContexts:
+          self.sslContext, credLocation = SocketInfo.__cachedContexts[ contextKey ][1:]
+          self.setLocalCredentialsLocation( credLocation )
+          return S_OK()
+      finally:
+        SocketInfo.__cachedContextsLock.release()
+    retVal = self.__generateClientContext()
+    if not retVal[ 'OK' ] or not contextKey:
+      return retVal
+    SocketInfo.__cachedContextsLock.acquire()
+    try:
+      cachedContexts = SocketInfo.__cachedContexts
+      if len( cachedContexts ) >= SocketInfo.__maxCachedContexts:
+        #Forget the oldest contexts
+        for oldKey in sorted( cachedContexts, key = lambda k: cachedContexts[k][0] )[ :len( cachedContexts ) / 2 + 1 ]:
+          del cachedContexts[ oldKey ]
+      cachedContexts[ contextKey ] = ( time.time(), self.sslContext, self.getLocalCredentialsLocation() )
+    finally:
+      SocketInfo.__cachedContextsLock.release()
+    return S_OK()
+
   def __getValue( self, optName, default ):
     if optName not in self.infoDict:
       return default
@@ -50,8 +142,34 @@ class SocketInfo:
   def getLocalCredentialsLocation( self ):
     return self.infoDict[ 'localCredentialsLocation' ]
 
+  def __getPeerCertificateKey( self, peerCert ):
+    return ( peerCert.get_subject().one_line(), peerCert.get_issuer().one_line(), peerCert.get_serial_number() )
+
+  def __cachePeerCredentials( self, credDict ):
+    """
+    Keep the credentials of a full handshake as long as its session can be resumed
+    """
+    if self.infoDict[ 'clientMode' ]:
+      lifeTime = CLIENT_CREDENTIALS_LIFETIME
+    else:
+      lifeTime = int( self.infoDict.get( 'SSLSessionTimeout', DEFAULT_SSL_SESSION_TIMEOUT ) ) + 60
+    now = time.time()
+    if now - SocketInfo.__peerCredentialsLastPurge > 600:
+      SocketInfo.__peerCredentialsLastPurge = now
+      SocketInfo.__peerCredentialsCache.purgeExpired()
+    peerKey = self.__getPeerCertificateKey( self.sslSocket.get_peer_certificate() )
+    SocketInfo.__peerCredentialsCache.add( peerKey, lifeTime, dict( credDict ) )
+
   def gatherPeerCredentials( self ):
     certList = self.sslSocket.get_peer_certificate_chain()
+    #Resumed sessions may not carry the peer chain, use the credentials of the full handshake
+    if not certList and self.sslSocket.session_reused():
+      credDict = SocketInfo.__peerCredentialsCache.get( self.__getPeerCertificateKey( self.sslSocket.get_peer_certificate() ) )
+      if not credDict:
+        raise Exception( "Unknown peer credentials for the resumed session" )
+      credDict = dict( credDict )
+      self.infoDict[ 'peerCredentials' ] = credDict
+      return credDict
     #Servers don't receive the whole chain, the last cert comes alone
     if not self.infoDict[ 'clientMode' ]:
       certList.insert( 0, self.sslSocket.get_peer_certificate() )
@@ -71,6 +189,7 @@ class SocketInfo:
     if diracGroup[ 'OK' ] and diracGroup[ 'Value' ]:
       credDict[ 'group' ] = diracGroup[ 'Value' ]
     self.infoDict[ 'peerCredentials' ] = credDict
+    self.__cachePeerCredentials( credDict )
     return credDict
 
   def setSSLSocket( self, sslSocket ):
@@ -124,71 +243,101 @@ class SocketInfo:
   def _serverCallback( self, conn, cert, errnum, depth, ok ):
     return ok
 
-  def __getCAStore( self ):
+  def __getCAsSignature( self, casPath ):
+    """
+    Changes when a CA or CRL file is added, removed or modified
+    """
+    lastModified = os.stat( casPath ).st_mtime
+    fileNames = os.listdir( casPath )
+    for fileName in fileNames:
+      try:
+        lastModified = max( lastModified, os.stat( os.path.join( casPath, fileName ) ).st_mtime )
+      except OSError:
+        pass
+    return ( casPath, len( fileNames ), lastModified )
+
+  def __loadCAsCRLs( self ):
+    """
+    Load the CAs and CRLs if the CAs directory changed since they were loaded
+    """
     SocketInfo.__cachedCAsCRLsLoadLock.acquire()
     try:
-      if not SocketInfo.__cachedCAsCRLs or time.time() - SocketInfo.__cachedCAsCRLsLastLoaded > 900:
-        #Need to generate the CA Store
-        casDict = {}
-        crlsDict = {}
-        casPath = Locations.getCAsLocation()
-        if not casPath:
-          return S_ERROR( "No valid CAs location found" )
-        gLogger.debug( "CAs location is %s" % casPath )
-        casFound = 0
-        crlsFound = 0
-        SocketInfo.__caStore = GSI.crypto.X509Store()
-        for fileName in os.listdir( casPath ):
-          filePath = os.path.join( casPath, fileName )
-          if not os.path.isfile( filePath ):
+      now = time.time()
+      if SocketInfo.__cachedCAsCRLs and now - SocketInfo.__cachedCAsCRLsLastChecked < SocketInfo.__casCheckPeriod:
+        return S_OK()
+      casPath = Locations.getCAsLocation()
+      if not casPath:
+        return S_ERROR( "No valid CAs location found" )
+      signature = self.__getCAsSignature( casPath )
+      SocketInfo.__cachedCAsCRLsLastChecked = now
+      if SocketInfo.__cachedCAsCRLs and signature == SocketInfo.__cachedCAsCRLsSignature:
+        return S_OK()
+      #Need to load the CAs and CRLs
+      casDict = {}
+      crlsDict = {}
+      gLogger.debug( "CAs location is %s" % casPath )
+      casFound = 0
+      crlsFound = 0
+      for fileName in os.listdir( casPath ):
+        filePath = os.path.join( casPath, fileName )
+        if not os.path.isfile( filePath ):
+          continue
+        fObj = file( filePath, "rb" )
+        pemData = fObj.read()
+        fObj.close()
+        #Try to load CA Cert
+        try:
+          caCert = GSI.crypto.load_certificate( GSI.crypto.FILETYPE_PEM, pemData )
+          if caCert.has_expired():
             continue
-          fObj = file( filePath, "rb" )
-          pemData = fObj.read()
-          fObj.close()
-          #Try to load CA Cert
+          caID = ( caCert.get_subject().one_line(), caCert.get_issuer().one_line() )
+          caNotAfter = caCert.get_not_after()
+          if caID not in casDict:
+            casDict[ caID ] = ( caNotAfter, caCert )
+            casFound += 1
+          else:
+            if casDict[ caID ][0] < caNotAfter:
+              casDict[ caID ] = ( caNotAfter, caCert )
+          continue
+        except:
+          if fileName.find( ".0" ) == len( fileName ) - 2:
+            gLogger.exception( "LOADING %s" % filePath )
+        if 'IgnoreCRLs' not in self.infoDict or not self.infoDict[ 'IgnoreCRLs' ]:
+          #Try to load CRL
           try:
-            caCert = GSI.crypto.load_certificate( GSI.crypto.FILETYPE_PEM, pemData )
-            if caCert.has_expired():
+            crl = GSI.crypto.load_crl( GSI.crypto.FILETYPE_PEM, pemData )
+            if crl.has_expired():
               continue
-            caID = ( caCert.get_subject().one_line(), caCert.get_issuer().one_line() )
-            caNotAfter = caCert.get_not_after()
-            if caID not in casDict:
-              casDict[ caID ] = ( caNotAfter, caCert )
-              casFound += 1
+            crlID = crl.get_issuer().one_line()
+            crlNotAfter = crl.get_not_after()
+            if crlID not in crlsDict:
+              crlsDict[ crlID ] = ( crlNotAfter, crl )
+              crlsFound += 1
             else:
-              if casDict[ caID ][0] < caNotAfter:
-                casDict[ caID ] = ( caNotAfter, caCert )
+              if crlsDict[ crlID ][0] < crlNotAfter:
+                crlsDict[ crlID ] = ( crlNotAfter, crl )
             continue
           except:
-            if fileName.find( ".0" ) == len( fileName ) - 2:
+            if fileName.find( ".r0" ) == len( fileName ) - 2:
               gLogger.exception( "LOADING %s" % filePath )
-          if 'IgnoreCRLs' not in self.infoDict or not self.infoDict[ 'IgnoreCRLs' ]:
-            #Try to load CRL
-            try:
-              crl = GSI.crypto.load_crl( GSI.crypto.FILETYPE_PEM, pemData )
-              if crl.has_expired():
-                continue
-              crlID = crl.get_issuer().one_line()
-              crlNotAfter = crl.get_not_after()
-              if crlID not in crlsDict:
-                crlsDict[ crlID ] = ( crlNotAfter, crl )
-                crlsFound += 1
-              else:
-                if crlsDict[ crlID ][0] < crlNotAfter:
-                  crlsDict[ crlID ] = ( crlNotAfter, crl )
-              continue
-            except:
-              if fileName.find( ".r0" ) == len( fileName ) - 2:
-                gLogger.exception( "LOADING %s" % filePath )
-
-        gLogger.debug( "Loaded %s CAs [%s CRLs]" % ( casFound, crlsFound ) )
-        SocketInfo.__cachedCAsCRLs = ( [ casDict[k][1] for k in casDict ],
-                                       [ crlsDict[k][1] for k in crlsDict ] )
-        SocketInfo.__cachedCAsCRLsLastLoaded = time.time()
-    except:
-      gLogger.exception( "ASD" )
+
+      gLogger.debug( "Loaded %s CAs [%s CRLs]" % ( casFound, crlsFound ) )
+      SocketInfo.__cachedCAsCRLs = ( [ casDict[k][1] for k in casDict ],
+                                     [ crlsDict[k][1] for k in crlsDict ] )
+      SocketInfo.__cachedCAsCRLsLastLoaded = now
+      SocketInfo.__cachedCAsCRLsSignature = signature
+    except Exception, e:
+      gLogger.exception( "Cannot load the CAs and CRLs" )
+      if not SocketInfo.__cachedCAsCRLs:
+        return S_ERROR( "Cannot load the CAs and CRLs: %s" % str( e ) )
     finally:
       SocketInfo.__cachedCAsCRLsLoadLock.release()
+    return S_OK()
+
+  def __getCAStore( self ):
+    result = self.__loadCAsCRLs()
+    if not result[ 'OK' ]:
+      return result
     #Generate CA Store
     caStore = GSI.crypto.X509Store()
     caList = SocketInfo.__cachedCAsCRLs[0]
@@ -289,10 +438,9 @@ class SocketInfo:
       return retVal
     self.sslContext.set_session_id( "DISETConnection%s" % str( time.time() ) )
     #self.sslContext.get_cert_store().set_flags( GSI.crypto.X509_CRL_CHECK )
-    if 'SSLSessionTimeout' in self.infoDict:
-      timeout = int( self.infoDict['SSLSessionTimeout'] )
-      gLogger.debug( "Setting session timeout to %s" % timeout )
-      self.sslContext.set_session_timeout( timeout )
+    timeout = int( self.infoDict.get( 'SSLSessionTimeout', DEFAULT_SSL_SESSION_TIMEOUT ) )
+    gLogger.debug( "Setting session timeout to %s" % timeout )
+    self.sslContext.set_session_timeout( timeout )
     return S_OK()
 
   def doClientHandshake( self ):
@@ -303,6 +451,61 @@ class SocketInfo:
     self.sslSocket.set_accept_state()
     return self.__sslHandshake()
 
+  def __recordHandshake( self, elapsed ):
+    try:
+      resumed = self.sslSocket.session_reused()
+    except Exception:
+      resumed = False
+    if resumed:
+      handshakeType = 'Resumed'
+    else:
+      handshakeType = 'Full'
+    SocketInfo.__handshakeStatsLock.acquire()
+    try:
+      SocketInfo.__handshakeStats[ handshakeType ] += 1
+      SocketInfo.__handshakeStats[ '%sTime' % handshakeType ] += elapsed
+    finally:
+      SocketInfo.__handshakeStatsLock.release()
+    gLogger.debug( "%s SSL handshake in %.4f secs" % ( handshakeType, elapsed ) )
+
+  @staticmethod
+  def getHandshakeStatistics():
+    """
+    Number of full and resumed handshakes done by this process and their mean duration in seconds
+    """
+    SocketInfo.__handshakeStatsLock.acquire()
+    try:
+      stats = dict( SocketInfo.__handshakeStats )
+    finally:
+      SocketInfo.__handshakeStatsLock.release()
+    for handshakeType in ( 'Full', 'Resumed' ):
+      if stats[ handshakeType ]:
+        stats[ '%sMeanTime' % handshakeType ] = stats[ '%sTime' % handshakeType ] / stats[ handshakeType ]
+      else:
+        stats[ '%sMeanTime' % handshakeType ] = 0.0
+    return stats
+
+  def doServerHandshakeStep( self ):
+    """
+    Advance the server handshake without waiting for the client, for the event driven reactors
+
+    :return: S_OK( credentials ) once done, S_OK( False ) while it waits for the client. In that case
+             the wantWrite key tells if it waits to write instead of read.
+    """
+    if not self.__handshakeStart:
+      self.__handshakeStart = time.time()
+      self.sslSocket.set_accept_state()
+    try:
+      self.sslSocket.do_handshake()
+    except ( GSI.SSL.WantReadError, GSI.SSL.WantWriteError ), v:
+      result = S_OK( False )
+      result[ 'wantWrite' ] = isinstance( v, GSI.SSL.WantWriteError )
+      return result
+    except Exception, v:
+      gLogger.warn( "Error while handshaking", v )
+      return S_ERROR( "Error while handshaking" )
+    return self.__endHandshake( self.__handshakeStart )
+
   #@gSynchro
   def __sslHandshake( self ):
     start = time.time()
@@ -335,8 +538,15 @@ class SocketInfo:
           # gLogger.warn( "Error while handshaking", "\n".join( [ stError[2] for stError in v.args[0] ] ) )
           gLogger.warn( "Error while handshaking", v )
           return S_ERROR( "Error while handshaking" )
-        
-    credentialsDict = self.gatherPeerCredentials()
+    return self.__endHandshake( start )
+
+  def __endHandshake( self, start ):
+    self.__recordHandshake( time.time() - start )
+    try:
+      credentialsDict = self.gatherPeerCredentials()
+    except Exception, v:
+      gLogger.warn( "Cannot get the peer credentials", v )
+      return S_ERROR( "Cannot get the peer credentials: %s" % v )
     if self.infoDict[ 'clientMode' ]:
       hostnameCN = credentialsDict[ 'CN' ]
       #if hostnameCN.split("/")[-1] != self.infoDict[ 'hostname' ]:
@@ -79,15 +79,10 @@ class SocketInfoFactory:
         return S_ERROR( "Can't connect: %s" % str( ( errno, os.strerror( errno ) ) ) )
     return S_OK( osSocket )
 
-  def __connect( self, socketInfo, hostAddress ):
-    #Connect baby!
-    result = self.__socketConnect( hostAddress, socketInfo.infoDict[ 'timeout' ] )
-    if not result[ 'OK' ]:
-      return result
-    osSocket = result[ 'Value' ]
-    #SSL MAGIC
-    sslSocket = GSI.SSL.Connection( socketInfo.getSSLContext(), osSocket )
-    #Generate sessionId
+  def __getSessionId( self, socketInfo, hostAddress ):
+    """
+    Sessions are only resumed for the same server address and the same credentials
+    """
     sessionHash = md5.md5()
     sessionHash.update( str( hostAddress ) )
     sessionHash.update( "|%s" % str( socketInfo.getLocalCredentialsLocation() ) )
@@ -96,11 +91,21 @@ class SocketInfoFactory:
         sessionHash.update( "|%s" % str( socketInfo.infoDict[ key ] ) )
     if 'proxyChain' in socketInfo.infoDict:
       sessionHash.update( "|%s" % socketInfo.infoDict[ 'proxyChain' ].dumpAllToString()[ 'Value' ] )
-    sessionId = sessionHash.hexdigest()
-    socketInfo.sslContext.set_session_id( str( hash( sessionId ) ) )
+    return sessionHash.hexdigest()
+
+  def __connect( self, socketInfo, hostAddress ):
+    #Connect baby!
+    result = self.__socketConnect( hostAddress, socketInfo.infoDict[ 'timeout' ] )
+    if not result[ 'OK' ]:
+      return result
+    osSocket = result[ 'Value' ]
+    #SSL MAGIC
+    sslSocket = GSI.SSL.Connection( socketInfo.getSSLContext(), osSocket )
     socketInfo.setSSLSocket( sslSocket )
-    if gSessionManager.isValid( sessionId ):
-      sslSocket.set_session( gSessionManager.get( sessionId ) )
+    if socketInfo.infoDict.get( 'enableSessions' ):
+      sessionId = self.__getSessionId( socketInfo, hostAddress )
+      if gSessionManager.isValid( sessionId ):
+        sslSocket.set_session( gSessionManager.get( sessionId ) )
     #Set the real timeout
     if socketInfo.infoDict[ 'timeout' ]:
       sslSocket.settimeout( socketInfo.infoDict[ 'timeout' ] )
@@ -134,18 +139,30 @@ class SocketInfoFactory:
       if retVal[ 'OK' ]:
         #Everything went ok. Don't need to retry
         break
+      #Do not try to resume the same session again
+      gSessionManager.remove( self.__getSessionId( socketInfo, ipAddress ) )
     #Did the auth or the connection fail?
     if not retVal['OK']:
       return retVal
-    if 'enableSessions' in kwargs and kwargs[ 'enableSessions' ]:
-      sessionId = hash( hostAddress )
-      gSessionManager.set( sessionId, sslSocket.get_session() )
+    if socketInfo.infoDict.get( 'enableSessions' ) and not sslSocket.session_reused():
+      gSessionManager.set( self.__getSessionId( socketInfo, ipAddress ), sslSocket.get_session() )
     return S_OK( socketInfo )
 
+  def getHandshakeStatistics( self ):
+    """
+    Full and resumed SSL handshakes done by this process and their mean time
+    """
+    return SocketInfo.getHandshakeStatistics()
+
   def getListeningSocket( self, hostAddress, listeningQueueSize = 5, reuseAddress = True, **kwargs ):
     osSocket = socket.socket( socket.AF_INET6, socket.SOCK_STREAM )
     if reuseAddress:
       osSocket.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+    if kwargs.get( 'reusePort' ):
+      reusePort = Network.getReusePortOption()
+      if not reusePort:
+        return S_ERROR( "Sharing the listening port is not supported by this platform" )
+      osSocket.setsockopt( socket.SOL_SOCKET, reusePort, 1 )
     retVal = self.generateServerInfo( kwargs )
     if not retVal[ 'OK' ]:
       return retVal
@@ -4,6 +4,7 @@ __RCSID__ = "$Id$"
 import os
 import types
 import time
+import socket
 import GSI
 from DIRAC.Core.Utilities.LockRing import LockRing
 from DIRAC.Core.Utilities.ReturnValues import S_ERROR, S_OK
@@ -24,6 +25,7 @@ class SSLTransport( BaseTransport ):
   def __init__( self, *args, **kwargs ):
     self.__writesDone = 0
     self.__locked = False
+    self.__handshakeDone = False
     BaseTransport.__init__( self, *args, **kwargs )
 
   def __lock( self, timeout = 1000 ):
@@ -77,6 +79,10 @@ class SSLTransport( BaseTransport ):
     except:
       pass
 
+  def _shutdownWrite( self ):
+    #Only the TCP stream, the SSL connection is not shut down
+    self.oSocket.sock_shutdown( socket.SHUT_WR )
+
   def renewServerContext( self ):
     BaseTransport.renewServerContext( self )
     result = gSocketInfoFactory.renewServerContext( self.oSocketInfo )
@@ -87,15 +93,30 @@ class SSLTransport( BaseTransport ):
     return S_OK()
 
   def handshake( self ):
+    #Already done by the reactor
+    if self.__handshakeDone:
+      return S_OK()
     retVal = self.oSocketInfo.doServerHandshake()
     if not retVal[ 'OK' ]:
       return retVal
-    creds = retVal[ 'Value' ]
+    self.__setHandshakeCredentials( retVal[ 'Value' ] )
+    return S_OK()
+
+  def handshakeStep( self ):
+    if self.__handshakeDone:
+      return S_OK( True )
+    retVal = self.oSocketInfo.doServerHandshakeStep()
+    if not retVal[ 'OK' ] or not retVal[ 'Value' ]:
+      return retVal
+    self.__setHandshakeCredentials( retVal[ 'Value' ] )
+    return S_OK( True )
+
+  def __setHandshakeCredentials( self, creds ):
+    self.__handshakeDone = True
     if not self.oSocket.session_reused():
       gLogger.debug( "New session connecting from client at %s" % str( self.getRemoteAddress() ) )
     for key in creds.keys():
       self.peerCredentials[ key ] = creds[ key ]
-    return S_OK()
 
   def setClientSocket( self, oSocket ):
     if self.serverMode():
@@ -139,6 +160,32 @@ class SSLTransport( BaseTransport ):
     finally:
       self.__unlock()
 
+  def readAvailable( self ):
+    if not self.oSocket.pending() and not self._hasDataToRead():
+      return S_OK( 0 )
+    self.__lock()
+    try:
+      readBytes = 0
+      while True:
+        try:
+          data = self.oSocket.recv( 16384 )
+        except ( GSI.SSL.WantReadError, GSI.SSL.WantWriteError ):
+          break
+        except GSI.SSL.ZeroReturnError:
+          data = ""
+        except Exception, e:
+          return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+        if not data:
+          return S_ERROR( "Connection closed by peer" )
+        self.byteStream += data
+        readBytes += len( data )
+        #Data already decrypted by SSL does not wake up the poller
+        if not self.oSocket.pending():
+          break
+      return S_OK( readBytes )
+    finally:
+      self.__unlock()
+
   def isLocked( self ):
     return self.__locked
 
@@ -0,0 +1,63 @@
+########################################################################
+# File :    RPCCallsBenchmark
+########################################################################
+"""
+  Benchmark of small RPC calls ( ping ) to a running service:
+    - one connection per call, as by default
+    - one kept connection, with the keepConnection client option
+    - pipelined calls over the kept connection with executeRPCPipeline
+
+  The service must have ConnectionIdleTime set for the last two to reuse the connection.
+
+  Usage: RPCCallsBenchmark.py [ -n numCalls ] <service, e.g. Framework/SystemAdministrator>
+"""
+__RCSID__ = "$Id$"
+
+from DIRAC.Core.Base import Script
+from DIRAC import S_OK
+
+Script.setUsageMessage( __doc__ )
+
+numCalls = 200
+def setNumCalls( value ):
+  global numCalls
+  numCalls = int( value )
+  return S_OK()
+
+Script.registerSwitch( "n:", "numCalls=", "Number of calls per mode [%s]" % numCalls, setNumCalls )
+Script.parseCommandLine( ignoreErrors = True )
+
+import sys
+import time
+
+from DIRAC.Core.DISET.RPCClient import RPCClient
+from DIRAC.Core.DISET.private.ConnectionPool import getGlobalConnectionPool
+
+args = Script.getPositionalArgs()
+if len( args ) != 1:
+  Script.showHelp()
+  sys.exit( 1 )
+serviceName = args[0]
+
+def report( name, elapsed, results ):
+  failed = len( [ result for result in results if not result[ 'OK' ] ] )
+  print "%-12s calls: %6d  time: %7.2f s  calls/s: %8.1f  failed: %d" % \
+        ( name, len( results ), elapsed, len( results ) / elapsed, failed )
+
+# One connection per call
+rpcClient = RPCClient( serviceName )
+start = time.time()
+results = [ rpcClient.ping() for _ in xrange( numCalls ) ]
+report( "New conn", time.time() - start, results )
+
+# Sequential calls over a kept connection
+rpcClient = RPCClient( serviceName, keepConnection = True )
+start = time.time()
+results = [ rpcClient.ping() for _ in xrange( numCalls ) ]
+report( "Kept conn", time.time() - start, results )
+print "Idle kept connections: %s" % getGlobalConnectionPool().getNumConnections()
+
+# Pipelined calls over a kept connection
+start = time.time()
+results = rpcClient.executeRPCPipeline( [ ( "ping", () ) ] * numCalls )[ 'Value' ]
+report( "Pipelined", time.time() - start, results )
@@ -0,0 +1,57 @@
+########################################################################
+# File :    SSLHandshakeBenchmark
+########################################################################
+"""
+  Benchmark of the SSL connections to a running service:
+    - full handshakes, without session resumption
+    - resumed sessions, the default for the clients
+
+  Usage: SSLHandshakeBenchmark.py [ -n numConnections ] <host> <port>
+"""
+__RCSID__ = "$Id$"
+
+from DIRAC.Core.Base import Script
+from DIRAC import S_OK
+
+Script.setUsageMessage( __doc__ )
+
+numConnections = 100
+def setNumConnections( value ):
+  global numConnections
+  numConnections = int( value )
+  return S_OK()
+
+Script.registerSwitch( "n:", "numConnections=", "Number of connections per mode [%s]" % numConnections,
+                       setNumConnections )
+Script.parseCommandLine( ignoreErrors = True )
+
+import sys
+import time
+
+from DIRAC.Core.DISET.private.Transports.SSL.SocketInfoFactory import gSocketInfoFactory
+
+args = Script.getPositionalArgs()
+if len( args ) != 2:
+  Script.showHelp()
+  sys.exit( 1 )
+hostAddress = ( args[0], int( args[1] ) )
+
+for name, enableSessions in ( ( "Full", False ), ( "Resumed", True ) ):
+  before = gSocketInfoFactory.getHandshakeStatistics()
+  failed = 0
+  start = time.time()
+  for _ in xrange( numConnections ):
+    result = gSocketInfoFactory.getSocket( hostAddress, enableSessions = enableSessions )
+    if not result[ 'OK' ]:
+      failed += 1
+      continue
+    sslSocket = result[ 'Value' ].getSSLSocket()
+    sslSocket.shutdown()
+    sslSocket.close()
+  elapsed = time.time() - start
+  after = gSocketInfoFactory.getHandshakeStatistics()
+  resumed = after[ 'Resumed' ] - before[ 'Resumed' ]
+  handshakeTime = after[ 'FullTime' ] + after[ 'ResumedTime' ] - before[ 'FullTime' ] - before[ 'ResumedTime' ]
+  print "%-8s connections: %5d  conn/s: %7.1f  mean handshake: %7.2f ms  resumed: %d  failed: %d" % \
+        ( name, numConnections, numConnections / elapsed,
+          1000 * handshakeTime / max( 1, numConnections - failed ), resumed, failed )
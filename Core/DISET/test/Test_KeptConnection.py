@@ -0,0 +1,92 @@
+""" Unit tests of the connections kept open by the services between the calls of a client
+"""
+
+import socket
+import threading
+import time
+import types
+import unittest
+
+from DIRAC import S_OK
+from DIRAC.Core.DISET.private.Service import Service
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+
+class FakeThreadPool( object ):
+
+  def __init__( self ):
+    self.pending = 0
+
+  def pendingJobs( self ):
+    return self.pending
+
+class KeptConnectionTestCase( unittest.TestCase ):
+  """ Service side of a kept connection over a socket pair
+  """
+
+  def setUp( self ):
+    self.serverSocket, self.clientSocket = socket.socketpair()
+    self.server = PlainTransport( None )
+    self.server.setClientSocket( self.serverSocket )
+    self.client = PlainTransport( None )
+    self.client.setClientSocket( self.clientSocket )
+    self.service = types.InstanceType( Service )
+    self.service._threadPool = FakeThreadPool()
+
+  def tearDown( self ):
+    self.server.close()
+    self.client.close()
+
+  def waitForNextProposal( self, idleTime ):
+    return self.service._Service__waitForNextProposal( self.server, idleTime )
+
+  def test_buffered( self ):
+    """ Proposals already received are served even with connections waiting
+    """
+    self.service._threadPool.pending = 1
+    self.client.sendData( S_OK( 1 ) )
+    self.client.sendData( S_OK( 2 ) )
+    self.assert_( self.waitForNextProposal( 10 ) )
+    self.assertEqual( self.server.receiveData(), S_OK( 1 ) )
+    # The second one was read with the first one
+    self.assert_( self.server.byteStream )
+    self.assert_( self.waitForNextProposal( 10 ) )
+    self.assertEqual( self.server.receiveData(), S_OK( 2 ) )
+    self.assertFalse( self.waitForNextProposal( 10 ) )
+
+  def test_idle( self ):
+    """ The connection is given up after the idle time
+    """
+    start = time.time()
+    self.assertFalse( self.waitForNextProposal( 0.5 ) )
+    self.assert_( time.time() - start >= 0.5 )
+    timer = threading.Timer( 0.3, self.client.sendData, ( S_OK( 1 ), ) )
+    timer.start()
+    self.assert_( self.waitForNextProposal( 10 ) )
+    timer.join()
+
+  def test_pendingJobs( self ):
+    """ The connection is given up when other connections wait for a thread
+    """
+    self.service.KEPT_CONNECTION_CHECK_PERIOD = 0.1
+    timer = threading.Timer( 0.3, setattr, ( self.service._threadPool, 'pending', 1 ) )
+    timer.start()
+    start = time.time()
+    self.assertFalse( self.waitForNextProposal( 10 ) )
+    self.assert_( time.time() - start < 2 )
+    timer.join()
+
+  def test_shutdownAndDrain( self ):
+    """ The client gets the answers and the end of the stream even if it was sending a new call
+    """
+    self.server.sendData( S_OK( 'answer' ) )
+    self.client.sendData( S_OK( 'next call' ) )
+    self.server.shutdownAndDrain( 0.5 )
+    self.server.close()
+    self.assertEqual( self.client.receiveData(), S_OK( 'answer' ) )
+    result = self.client.receiveData()
+    self.assertEqual( result[ 'Message' ], "Peer closed connection" )
+    self.assertEqual( self.client.byteStream, "" )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( KeptConnectionTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,225 @@
+""" Unit tests of the event driven reactor and of the non blocking reads of the transports
+"""
+
+import os
+import select
+import socket
+import threading
+import time
+import types
+import unittest
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.DISET.ServiceReactor import ServiceReactor, ReactorStats
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+from DIRAC.Core.DISET.private.Transports.SSLTransport import SSLTransport
+from DIRAC.Core.Utilities import DEncode
+
+class TransportTestCase( unittest.TestCase ):
+  """ Non blocking reads over a socket pair
+  """
+
+  def setUp( self ):
+    self.serverSocket, self.clientSocket = socket.socketpair()
+    self.server = PlainTransport( None )
+    self.server.setClientSocket( self.serverSocket )
+    self.client = PlainTransport( None )
+    self.client.setClientSocket( self.clientSocket )
+
+  def tearDown( self ):
+    self.server.close()
+    self.client.close()
+
+  def test_readAvailable( self ):
+    """ Only what is already there is read
+    """
+    start = time.time()
+    self.assertEqual( self.server.readAvailable(), S_OK( 0 ) )
+    self.assert_( time.time() - start < 1 )
+    self.clientSocket.sendall( "12345" )
+    self.assertEqual( self.server.readAvailable(), S_OK( 5 ) )
+    self.assertEqual( self.server.byteStream, "12345" )
+    self.clientSocket.shutdown( socket.SHUT_WR )
+    self.assertFalse( self.server.readAvailable()[ 'OK' ] )
+
+  def test_isMessageReceived( self ):
+    """ Partial messages are not reported as received
+    """
+    data = DEncode.encode( S_OK( 'proposal' ) )
+    message = "%s:%s" % ( len( data ), data )
+    self.assertFalse( self.server.isMessageReceived() )
+    for cut in ( 1, len( str( len( data ) ) ) + 1, len( message ) - 1 ):
+      self.server.byteStream = message[ :cut ]
+      self.assertFalse( self.server.isMessageReceived() )
+    self.server.byteStream = ""
+    self.clientSocket.sendall( message[ :10 ] )
+    self.server.readAvailable()
+    self.assertFalse( self.server.isMessageReceived() )
+    self.clientSocket.sendall( message[ 10: ] )
+    self.server.readAvailable()
+    self.assert_( self.server.isMessageReceived() )
+    self.assertEqual( self.server.receiveData(), S_OK( 'proposal' ) )
+    #Keep alives and garbage are left to receiveData
+    self.server.byteStream = PlainTransport.keepAliveMagic
+    self.assert_( self.server.isMessageReceived() )
+    self.server.byteStream = "garbage:"
+    self.assert_( self.server.isMessageReceived() )
+
+class FakeSocketInfo( object ):
+
+  def __init__( self, steps ):
+    self.steps = steps
+
+  def doServerHandshakeStep( self ):
+    return self.steps.pop( 0 )
+
+class FakeSSLSocket( object ):
+
+  def session_reused( self ):
+    return False
+
+  def getpeername( self ):
+    return ( '127.0.0.1', 1234 )
+
+class SSLHandshakeTestCase( unittest.TestCase ):
+
+  def test_handshakeStep( self ):
+    """ The credentials are set once the handshake is over, and it is not done again
+    """
+    wantWrite = S_OK( False )
+    wantWrite[ 'wantWrite' ] = True
+    transport = SSLTransport( None )
+    transport.oSocket = FakeSSLSocket()
+    transport.oSocketInfo = FakeSocketInfo( [ S_OK( False ), wantWrite, S_OK( { 'DN' : '/DC=org/CN=user' } ) ] )
+    self.assertEqual( transport.handshakeStep(), S_OK( False ) )
+    result = transport.handshakeStep()
+    self.assert_( result[ 'OK' ] and not result[ 'Value' ] and result[ 'wantWrite' ] )
+    self.assertEqual( transport.peerCredentials, {} )
+    self.assertEqual( transport.handshakeStep(), S_OK( True ) )
+    self.assertEqual( transport.peerCredentials, { 'DN' : '/DC=org/CN=user' } )
+    #No step left, already done
+    self.assertEqual( transport.handshakeStep(), S_OK( True ) )
+    self.assertEqual( transport.handshake(), S_OK() )
+
+  def test_handshakeError( self ):
+    transport = SSLTransport( None )
+    transport.oSocket = FakeSSLSocket()
+    transport.oSocketInfo = FakeSocketInfo( [ S_ERROR( "Error while handshaking" ) ] )
+    self.assertFalse( transport.handshakeStep()[ 'OK' ] )
+    self.assertEqual( transport.peerCredentials, {} )
+
+class FakeServiceConfig( object ):
+
+  def getContextLifeTime( self ):
+    return 3600
+
+class FakeService( object ):
+  """ Service recording the connections given by the reactor
+  """
+
+  def __init__( self ):
+    self.connections = []
+
+  def getConfig( self ):
+    return FakeServiceConfig()
+
+  def handleConnection( self, clientTransport ):
+    self.connections.append( ( clientTransport, clientTransport.isMessageReceived() ) )
+
+class ReactorTestCase( unittest.TestCase ):
+  """ epoll reactor with a plain listening transport
+  """
+
+  def setUp( self ):
+    if not hasattr( select, "epoll" ):
+      self.skipTest( "No epoll in this platform" )
+    self.listener = PlainTransport( ( "", 0 ), bServerMode = True )
+    self.assert_( self.listener.initAsServer()[ 'OK' ] )
+    self.port = self.listener.getSocket().getsockname()[1]
+    self.service = FakeService()
+    self.reactor = types.InstanceType( ServiceReactor )
+    self.reactor._ServiceReactor__services = { 'Test/Svc' : self.service }
+    self.reactor._ServiceReactor__listeningConnections = { 'Test/Svc' : { 'transport' : self.listener,
+                                                                         'socket' : self.listener.getSocket() } }
+    self.reactor._ServiceReactor__alive = True
+    self.reactor._ServiceReactor__maxFD = 0
+    self.reactor._ServiceReactor__stats = ReactorStats()
+    self.reactor._ServiceReactor__cloneId = 0
+    self.reactor._ServiceReactor__clonePids = {}
+    self.reactor._ServiceReactor__parentPid = os.getpid()
+    self.reactor._ServiceReactor__maxPendingTime = 1
+    self.clients = []
+    self.thread = threading.Thread( target = self.reactor._ServiceReactor__pollIncomingConnections )
+    self.thread.setDaemon( True )
+    self.thread.start()
+
+  def tearDown( self ):
+    self.reactor._ServiceReactor__alive = False
+    self.thread.join( 10 )
+    for client in self.clients:
+      client.close()
+    for clientTransport, _received in self.service.connections:
+      clientTransport.close()
+    self.listener.close()
+
+  def connect( self ):
+    client = socket.create_connection( ( "localhost", self.port ) )
+    self.clients.append( client )
+    return client
+
+  def waitForConnections( self, num, timeout = 5 ):
+    end = time.time() + timeout
+    while len( self.service.connections ) < num and time.time() < end:
+      time.sleep( 0.05 )
+    return len( self.service.connections )
+
+  def test_wholeProposal( self ):
+    """ Connections are given to the service once their proposal is complete
+    """
+    data = DEncode.encode( S_OK( 'proposal' ) )
+    message = "%s:%s" % ( len( data ), data )
+    client = self.connect()
+    client.sendall( message[ :10 ] )
+    self.assertEqual( self.waitForConnections( 1, timeout = 0.5 ), 0 )
+    client.sendall( message[ 10: ] )
+    self.assertEqual( self.waitForConnections( 1 ), 1 )
+    clientTransport, received = self.service.connections[0]
+    self.assert_( received )
+    self.assertEqual( clientTransport.receiveData(), S_OK( 'proposal' ) )
+
+  def test_pendingDeadline( self ):
+    """ Connections without a proposal are dropped after the deadline
+    """
+    client = self.connect()
+    client.sendall( "12" )
+    client.settimeout( 10 )
+    start = time.time()
+    #The reactor closes the connection
+    self.assertEqual( client.recv( 10 ), "" )
+    self.assert_( 0.9 <= time.time() - start < 5 )
+    self.assertEqual( self.service.connections, [] )
+
+class CloneReapTestCase( unittest.TestCase ):
+
+  def test_reapClones( self ):
+    """ Clones that exited are collected
+    """
+    pid = os.fork()
+    if not pid:
+      os._exit( 0 )
+    reactor = types.InstanceType( ServiceReactor )
+    reactor._ServiceReactor__clonePids = { pid : 1 }
+    for _i in range( 50 ):
+      reactor._ServiceReactor__reapClones()
+      if not reactor._ServiceReactor__clonePids:
+        break
+      time.sleep( 0.1 )
+    self.assertEqual( reactor._ServiceReactor__clonePids, {} )
+    self.assertRaises( OSError, os.waitpid, pid, os.WNOHANG )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( TransportTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( SSLHandshakeTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( ReactorTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( CloneReapTestCase ) )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
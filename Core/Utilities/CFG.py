@@ -2,7 +2,6 @@
 __RCSID__ = "$Id$"
 
 import types
-import copy
 import os
 import re
 try:
@@ -682,12 +681,13 @@ class CFG( object ):
     @return: CFG copy
     """
     clonedCFG = CFG()
-    clonedCFG.__orderedList = copy.deepcopy( self.__orderedList )
-    clonedCFG.__commentDict = copy.deepcopy( self.__commentDict )
-    for option in self.listOptions():
-      clonedCFG.__dataDict[ option ] = self[ option ]
-    for section in self.listSections():
-      clonedCFG.__dataDict[ section ] = self[ section ].clone()
+    # Names, comments and values are strings, a shallow copy is enough
+    clonedCFG.__orderedList = list( self.__orderedList )
+    clonedCFG.__commentDict = dict( self.__commentDict )
+    for entryName, value in self.__dataDict.iteritems():
+      if isinstance( value, CFG ):
+        value = value.clone()
+      clonedCFG.__dataDict[ entryName ] = value
     return clonedCFG
 
   @gCFGSynchro
@@ -953,6 +953,43 @@ class CFG( object ):
         self.setOption( k , str( value ), "" )
     return self
 
+  @gCFGSynchro
+  def getAsTuple( self ):
+    """
+    Get the contents of the CFG as nested tuples of basic types, to be stored with marshal
+    and loaded back with loadFromTuple without parsing
+
+    @return: tuple ( ordered keys, comments dict, values dict ). Section values are tuples
+    """
+    dataDict = {}
+    for key in self.__orderedList:
+      value = self.__dataDict[ key ]
+      if type( value ) in ( types.StringType, types.UnicodeType ):
+        dataDict[ key ] = value
+      else:
+        dataDict[ key ] = value.getAsTuple()
+    return ( list( self.__orderedList ), dict( self.__commentDict ), dataDict )
+
+  @gCFGSynchro
+  def loadFromTuple( self, data ):
+    """
+    Load the contents of the CFG from the output of getAsTuple
+
+    @type data: tuple
+    @param data: Contents of the CFG
+    @return: This CFG
+    """
+    orderedList, commentDict, dataDict = data
+    self.reset()
+    for key in orderedList:
+      value = dataDict[ key ]
+      if type( value ) == types.TupleType:
+        value = CFG().loadFromTuple( value )
+      self.__dataDict[ key ] = value
+    self.__orderedList = list( orderedList )
+    self.__commentDict = dict( commentDict )
+    return self
+
   def writeToFile( self, fileName ):
     """
     Write the contents of the cfg to file
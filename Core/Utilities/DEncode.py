@@ -11,6 +11,10 @@ Encoding and decoding for dirac, Ids:
  l -> list
  t -> tuple
  d -> dictionary
+
+Containers inline the encoding and decoding of strings, ints and floats, and naive
+datetimes have a shortcut, to save function calls on big payloads. The
+output is the same as encoding every element through g_dEncodeFunctions.
 """
 __RCSID__ = "$Id$"
 
@@ -21,6 +25,9 @@ _dateTimeObject = datetime.datetime.utcnow()
 _dateTimeType = type( _dateTimeObject )
 _dateType = type( _dateTimeObject.date() )
 _timeType = type( _dateTimeObject.time() )
+_stringType = types.StringType
+_intType = types.IntType
+_floatType = types.FloatType
 
 g_dEncodeFunctions = {}
 g_dDecodeFunctions = {}
@@ -119,7 +126,12 @@ g_dDecodeFunctions[ "u" ] = decodeUnicode
 
 #Encoding and decoding datetime
 def encodeDateTime( oValue, eList ):
-  if type( oValue ) == _dateTimeType:
+  if type( oValue ) == _dateTimeType and oValue.tzinfo is None:
+    #Same as encoding the ( year, ..., microsecond, None ) tuple
+    eList.append( "zati%dei%dei%dei%dei%dei%dei%dene" % ( oValue.year, oValue.month, oValue.day,
+                                                          oValue.hour, oValue.minute, oValue.second,
+                                                          oValue.microsecond ) )
+  elif type( oValue ) == _dateTimeType:
     tDateTime = ( oValue.year, oValue.month, oValue.day, \
                       oValue.hour, oValue.minute, oValue.second, \
                       oValue.microsecond, oValue.tzinfo )
@@ -142,6 +154,16 @@ def encodeDateTime( oValue, eList ):
 def decodeDateTime( data, i ):
   i += 1
   dataType = data[i]
+  if dataType == 'a':
+    #Shortcut for naive datetimes: "zati<year>e...i<microsecond>ene"
+    end = data.find( "ene", i, i + 64 )
+    if end > -1:
+      fields = data[ i + 3 : end ].split( "ei" )
+      if len( fields ) == 7 and data[ i + 1 : i + 3 ] == "ti":
+        try:
+          return ( datetime.datetime( *[ int( field ) for field in fields ] ), end + 3 )
+        except ValueError:
+          pass
   # corrected by KGG tupleObject, i = decode( data, i + 1 )
   tupleObject, i = g_dDecodeFunctions[ data[ i + 1 ] ]( data, i + 1 )
   if dataType == 'a':
@@ -173,16 +195,47 @@ g_dDecodeFunctions[ 'n' ] = decodeNone
 def encodeList( lValue, eList ):
   eList.append( "l" )
   for uObject in lValue:
-    g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+    oType = type( uObject )
+    if oType is _stringType:
+      eList.extend( ( 's', str( len( uObject ) ), ':', uObject ) )
+    elif oType is _intType:
+      eList.extend( ( 'i', str( uObject ), 'e' ) )
+    elif oType is _floatType:
+      eList.extend( ( 'f', str( uObject ), 'e' ) )
+    else:
+      g_dEncodeFunctions[ oType ]( uObject, eList )
   eList.append( "e" )
 
 def decodeList( data, i ):
+  decodeFunctions = g_dDecodeFunctions
   oL = []
+  append = oL.append
   i += 1
-  while data[ i ] != "e":
-    ob, i = g_dDecodeFunctions[ data[ i ] ]( data, i )
-    oL.append( ob )
-  return( oL, i + 1 )
+  while True:
+    dataType = data[ i ]
+    if dataType == "s":
+      colon = data.index( ":", i )
+      end = colon + 1 + int( data[ i + 1 : colon ] )
+      append( data[ colon + 1 : end ] )
+      i = end
+    elif dataType == "i":
+      end = data.index( "e", i )
+      append( int( data[ i + 1 : end ] ) )
+      i = end + 1
+    elif dataType == "f":
+      end = data.index( "e", i )
+      if data[ end + 1 ] in "+-":
+        #Exponent
+        ob, i = decodeFloat( data, i )
+        append( ob )
+      else:
+        append( float( data[ i + 1 : end ] ) )
+        i = end + 1
+    elif dataType == "e":
+      return( oL, i + 1 )
+    else:
+      ob, i = decodeFunctions[ dataType ]( data, i )
+      append( ob )
 
 g_dEncodeFunctions[ types.ListType ] = encodeList
 g_dDecodeFunctions[ "l" ] = decodeList
@@ -191,7 +244,15 @@ g_dDecodeFunctions[ "l" ] = decodeList
 def encodeTuple( lValue, eList ):
   eList.append( "t" )
   for uObject in lValue:
-    g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+    oType = type( uObject )
+    if oType is _stringType:
+      eList.extend( ( 's', str( len( uObject ) ), ':', uObject ) )
+    elif oType is _intType:
+      eList.extend( ( 'i', str( uObject ), 'e' ) )
+    elif oType is _floatType:
+      eList.extend( ( 'f', str( uObject ), 'e' ) )
+    else:
+      g_dEncodeFunctions[ oType ]( uObject, eList )
   eList.append( "e" )
 
 def decodeTuple( data, i ):
@@ -205,16 +266,38 @@ g_dDecodeFunctions[ "t" ] = decodeTuple
 def encodeDict( dValue, eList ):
   eList.append( "d" )
   for key in sorted( dValue ):
-    g_dEncodeFunctions[ type( key ) ]( key, eList )
-    g_dEncodeFunctions[ type( dValue[key] ) ]( dValue[key], eList )
+    value = dValue[ key ]
+    if type( key ) is _stringType:
+      eList.extend( ( 's', str( len( key ) ), ':', key ) )
+    else:
+      g_dEncodeFunctions[ type( key ) ]( key, eList )
+    oType = type( value )
+    if oType is _stringType:
+      eList.extend( ( 's', str( len( value ) ), ':', value ) )
+    else:
+      g_dEncodeFunctions[ oType ]( value, eList )
   eList.append( "e" )
 
 def decodeDict( data, i ):
+  decodeFunctions = g_dDecodeFunctions
   oD = {}
   i += 1
   while data[ i ] != "e":
-    k, i = g_dDecodeFunctions[ data[ i ] ]( data, i )
-    oD[ k ], i = g_dDecodeFunctions[ data[ i ] ]( data, i )
+    if data[ i ] == "s":
+      colon = data.index( ":", i )
+      end = colon + 1 + int( data[ i + 1 : colon ] )
+      key = data[ colon + 1 : end ]
+      i = end
+    else:
+      key, i = decodeFunctions[ data[ i ] ]( data, i )
+    dataType = data[ i ]
+    if dataType == "s":
+      colon = data.index( ":", i )
+      end = colon + 1 + int( data[ i + 1 : colon ] )
+      oD[ key ] = data[ colon + 1 : end ]
+      i = end
+    else:
+      oD[ key ], i = decodeFunctions[ dataType ]( data, i )
   return ( oD, i + 1 )
 
 g_dEncodeFunctions[ types.DictType ] = encodeDict
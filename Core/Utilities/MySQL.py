@@ -37,6 +37,17 @@
     If a connection to the the DB is passed as second argument this connection
     is used and is not  in the Queue.
     Returns S_OK with fetchall() out in Value or S_ERROR upon failure.
+    Values can be passed in "args" for the %s placeholders of "cmd", they are
+    escaped and quoted by the driver.
+
+
+    _queryIter( cmd, [chunkSize] )
+
+    Executes SQL command "cmd" with an unbuffered server side cursor on a
+    dedicated connection.
+    Returns S_OK with a generator of the rows in Value or S_ERROR upon failure.
+    The rows are fetched from the server "chunkSize" at a time, so that large
+    results are never completely in memory.
 
 
     _update( cmd, [conn] )
@@ -47,6 +58,20 @@
     If a connection to the the DB is passed as second argument this connection
     is used and is not  in the Queue
     Returns S_OK with number of updated registers in Value or S_ERROR upon failure.
+    Values can be passed in "args" for the %s placeholders of "cmd" as for _query.
+
+
+    _updateMany( cmd, argsList, [conn] )
+
+    Executes SQL command "cmd" with placeholders once for each tuple of values
+    in "argsList" with the executemany call of the driver.
+    Returns S_OK with number of updated registers in Value or S_ERROR upon failure.
+
+
+    The statements executed by these methods are logged if they take longer than
+    the _slowQueryThreshold attribute ( seconds, 0 to disable ). If the
+    _queryStatistics attribute is set, they are also accounted per normalized
+    statement in DIRAC.Core.Utilities.QueryStatistics.
 
 
     _createTables( tableDict )
@@ -90,6 +115,16 @@
       String type values will be appropriately escaped.
 
 
+    insertFieldsMany( self, tableName, inFields, rowsList, conn = None, exprDict = None,
+                      replace = False, chunkSize = 1000 ):
+
+      Insert many rows in "tableName", each row of "rowsList" giving the values of
+      the fields "inFields". The fields in "exprDict" get the same SQL expression
+      in all the rows, e.g. { 'Time' : 'UTC_TIMESTAMP()' }.
+      One multi-row INSERT (or REPLACE) is done for each "chunkSize" rows, values
+      are bound by the driver.
+
+
     updateFields( self, tableName, updateFields = None, updateValues = None,
                   condDict = None,
                   limit = False, conn = None,
@@ -132,6 +167,15 @@
       for compatibility with other methods condDict keyed argument is added
 
 
+    getFieldsIter( self, tableName, outFields = None,
+                   condDict = None,
+                   limit = False,
+                   older = None, newer = None,
+                   timeStamp = None, orderAttribute = None, chunkSize = 1000 ):
+
+      Same as getFields but return S_OK( generator of the rows ) using _queryIter
+
+
     getCounters( self, table, attrList, condDict = None, older = None,
                  newer = None, timeStamp = None, connection = False ):
 
@@ -153,6 +197,7 @@ __RCSID__ = "$Id$"
 from DIRAC                      import gLogger
 from DIRAC                      import S_OK, S_ERROR
 from DIRAC.Core.Utilities.Time  import fromString
+from DIRAC.Core.Utilities.QueryStatistics import gQueryStatistics
 
 # Get rid of the annoying Deprecation warning of the current MySQLdb
 # FIXME: compile a newer MySQLdb version
@@ -160,6 +205,7 @@ import warnings
 with warnings.catch_warnings():
   warnings.simplefilter( 'ignore', DeprecationWarning )
   import MySQLdb
+  import MySQLdb.cursors
   
 # This is for proper initialization of embedded server, it should only be called once
 MySQLdb.server_init( ['--defaults-file=/opt/dirac/etc/my.cnf', '--datadir=/opt/mysql/db'], ['mysqld'] )
@@ -169,7 +215,7 @@ gDebugFile = None
 import collections
 import time
 import threading
-from types import StringTypes, DictType, ListType, TupleType, BooleanType
+from types import StringTypes, DictType, ListType, TupleType, BooleanType, UnicodeType
 
 MAXCONNECTRETRY = 10
 
@@ -251,6 +297,26 @@ class MySQL:
       cursor.close()
       return res
 
+    def newConnection( self, dbName, netWriteTimeout = 3600 ):
+      """
+      Get a connection not assigned to the thread, the caller has to close it.
+      The server waits up to netWriteTimeout seconds for the client to read the results
+      """
+      try:
+        conn = self.__newConn()
+      except MySQLdb.MySQLError, excp:
+        return S_ERROR( "Could not connect: %s" % excp )
+      try:
+        self.__execute( conn, "SET SESSION net_write_timeout = %d" % netWriteTimeout )
+        conn.select_db( dbName )
+      except MySQLdb.MySQLError, excp:
+        try:
+          conn.close()
+        except Exception:
+          pass
+        return S_ERROR( "Could not connect: %s" % excp )
+      return S_OK( conn )
+
     def get( self, dbName, retries = 10 ):
       retries = max( 0, min( MAXCONNECTRETRY, retries ) )
       self.clean()
@@ -384,6 +450,10 @@ class MySQL:
     gInstancesCount += 1
 
     self._connected = False
+    # Statements taking longer than this number of seconds are logged, 0 to disable
+    self._slowQueryThreshold = 0
+    # Account the statements in gQueryStatistics, normalizing them has a cost
+    self._queryStatistics = False
 
     if 'log' not in dir( self ):
       self.log = gLogger.getSubLogger( 'MySQL' )
@@ -589,9 +659,10 @@ class MySQL:
       return self._except( '_connect', x, 'Could not connect to DB.' )
 
 
-  def _query( self, cmd, conn = None, debug = False ):
+  def _query( self, cmd, conn = None, debug = False, args = None ):
     """
     execute MySQL query command
+    args is the sequence of values for the %s placeholders in cmd, bound by the driver
     return S_OK structure with fetchall result as tuple
     it returns an empty tuple if no matching rows are found
     return S_ERROR upon error
@@ -604,17 +675,16 @@ class MySQL:
       else:
         self.logger.verbose( '_query:', cmd[:min( len( cmd ) , 512 )] )
 
-    if gDebugFile:
-      start = time.time()
-
+    start = time.time()
     retDict = self.__getConnection()
     if not retDict['OK']:
       return retDict
     connection = retDict[ 'Value' ]
+    execStart = time.time()
 
     try:
       cursor = connection.cursor()
-      if cursor.execute( cmd ):
+      if cursor.execute( cmd, args ):
         res = cursor.fetchall()
       else:
         res = ()
@@ -643,6 +713,11 @@ class MySQL:
     except Exception:
       pass
 
+    rows = 0
+    if retDict['OK']:
+      rows = len( retDict['Value'] )
+    self._reportStatement( cmd, time.time() - execStart, rows, execStart - start, retDict['OK'] )
+
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
       gDebugFile.flush()
@@ -650,8 +725,68 @@ class MySQL:
     return retDict
 
 
-  def _update( self, cmd, conn = None, debug = False ):
+  def _queryIter( self, cmd, chunkSize = 1000, debug = False ):
+    """
+    execute MySQL query command with an unbuffered server side cursor
+    return S_OK with a generator of the result rows, read from the server chunkSize
+    rows at a time
+    The query uses its own connection, closed when the generator is exhausted or
+    deleted. Errors while reading the rows raise MySQLdb.Error
+    return S_ERROR if the query can not be executed
+    """
+    if debug:
+      self.logger.debug( '_queryIter:', cmd )
+    else:
+      self.logger.verbose( '_queryIter:', cmd[:min( len( cmd ) , 512 )] )
+
+    # The rows are read while the caller goes on using the connection of the thread
+    start = time.time()
+    retDict = self.__connectionPool.newConnection( self.__dbName )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict[ 'Value' ]
+    execStart = time.time()
+
+    try:
+      cursor = connection.cursor( MySQLdb.cursors.SSCursor )
+      cursor.execute( cmd )
+    except Exception, x:
+      self.log.warn( '_queryIter:', cmd )
+      connection.close()
+      self._reportStatement( cmd, time.time() - execStart, 0, execStart - start, False )
+      return self._except( '_queryIter', x, 'Execution failed.' )
+
+    return S_OK( self.__iterRows( cmd, connection, cursor, chunkSize, execStart, execStart - start ) )
+
+  def __iterRows( self, cmd, connection, cursor, chunkSize, execStart, connectionWait ):
+    """
+    Generator of the rows of a query executed by _queryIter, the statement is accounted
+    from its execution until the end of the reading
+    """
+    nRows = 0
+    try:
+      while True:
+        rows = cursor.fetchmany( chunkSize )
+        if not rows:
+          break
+        nRows += len( rows )
+        for row in rows:
+          yield row
+    finally:
+      # Closing the cursor would read the rows left, the connection is just dropped
+      try:
+        connection.close()
+      except Exception:
+        pass
+      self.logger.verbose( '_queryIter: Total %d records returned' % nRows )
+      self._reportStatement( cmd, time.time() - execStart, nRows, connectionWait, True )
+      if gDebugFile:
+        print >> gDebugFile, time.time() - execStart, cmd.replace( '\n', '' )
+        gDebugFile.flush()
+
+  def _update( self, cmd, conn = None, debug = False, args = None ):
     """ execute MySQL update command
+        args is the sequence of values for the %s placeholders in cmd, bound by the driver
         return S_OK with number of updated registers upon success
         return S_ERROR upon error
     """
@@ -663,17 +798,16 @@ class MySQL:
       else:
         self.logger.verbose( '_update:', cmd[:min( len( cmd ) , 512 )] )
 
-    if gDebugFile:
-      start = time.time()
-
+    start = time.time()
     retDict = self.__getConnection( conn = conn )
     if not retDict['OK']:
       return retDict
     connection = retDict['Value']
+    execStart = time.time()
 
     try:
       cursor = connection.cursor()
-      res = cursor.execute( cmd )
+      res = cursor.execute( cmd, args )
       # connection.commit()
       if debug:
         self.log.debug( '_update:', res )
@@ -691,12 +825,69 @@ class MySQL:
     except Exception:
       pass
 
+    self._reportStatement( cmd, time.time() - execStart, retDict.get( 'Value' ) or 0, execStart - start, retDict['OK'] )
+
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
       gDebugFile.flush()
 
     return retDict
 
+  def _updateMany( self, cmd, argsList, conn = None, debug = False ):
+    """ execute MySQL update command with placeholders for each sequence of values in argsList
+        The driver turns an INSERT ... VALUES ( %s, ... ) into a single multi-row INSERT,
+        without SQL functions in the VALUES part
+        return S_OK with number of updated registers upon success
+        return S_ERROR upon error
+    """
+    if debug:
+      self.logger.debug( '_updateMany: %d times' % len( argsList ), cmd )
+    else:
+      self.logger.verbose( '_updateMany: %d times' % len( argsList ), cmd[:min( len( cmd ) , 512 )] )
+
+    if not argsList:
+      return S_OK( 0 )
+
+    start = time.time()
+    retDict = self.__getConnection( conn = conn )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict['Value']
+    execStart = time.time()
+
+    try:
+      cursor = connection.cursor()
+      res = cursor.executemany( cmd, argsList )
+      self.log.verbose( '_updateMany:', res )
+      retDict = S_OK( res )
+    except Exception, x:
+      self.log.warn( '_updateMany: %s: %s' % ( cmd, str( x ) ) )
+      retDict = self._except( '_updateMany', x, 'Execution failed.' )
+
+    try:
+      cursor.close()
+    except Exception:
+      pass
+
+    self._reportStatement( cmd, time.time() - execStart, retDict.get( 'Value' ) or 0, execStart - start, retDict['OK'] )
+
+    if gDebugFile:
+      print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
+      gDebugFile.flush()
+
+    return retDict
+
+  def _reportStatement( self, cmd, elapsed, rows, connectionWait, ok ):
+    """ Account an executed statement in the statistics of the process if enabled and
+        log it if it took longer than the slow query threshold. It can be extended to
+        publish the statements elsewhere
+    """
+    if self._queryStatistics:
+      gQueryStatistics.addStatement( self.__dbName, cmd, elapsed, rows, connectionWait, ok )
+    if self._slowQueryThreshold and elapsed >= self._slowQueryThreshold:
+      self.log.warn( 'Slow query', '%.3f s ( %.3f s waiting for a connection, %s rows ): %s' %
+                     ( elapsed, connectionWait, rows, cmd[:1024] ) )
+
   def _transaction( self, cmdList, conn = None ):
     """ dummy transaction support
 
@@ -976,6 +1167,14 @@ class MySQL:
     """
     return param[0].tostring()
 
+  def _toStr( self, value ):
+    """
+      str of a value to be stored, unicode strings being encoded in UTF-8
+    """
+    if type( value ) == UnicodeType:
+      return value.encode( 'utf-8' )
+    return str( value )
+
   def _getConnection( self ):
     """
     Return a new connection to the DB
@@ -1117,7 +1316,7 @@ class MySQL:
     res = self._query( cmd, connection, debug = True )
     if not res['OK']:
       return res
-    attr_list = [ x[0] for x in res['Value'] ]
+    attr_list = [ row[0] for row in res['Value'] ]
     return S_OK( attr_list )
 
 #############################################################################
@@ -1298,10 +1497,40 @@ class MySQL:
       if limit is not False, the given limit is set
       inValues are properly escaped using the _escape_string method, they can be single values or lists of values.
     """
+    result = self.__buildSelect( 'getFields', tableName, outFields, condDict, limit,
+                                 older, newer, timeStamp, orderAttribute )
+    if not result['OK']:
+      return result
+
+    return self._query( result['Value'], conn, debug = True )
+
+#############################################################################
+  def getFieldsIter( self, tableName, outFields = None,
+                     condDict = None,
+                     limit = False,
+                     older = None, newer = None,
+                     timeStamp = None, orderAttribute = None,
+                     chunkSize = 1000 ):
+    """
+      Same as getFields, but return S_OK( generator of the rows ) reading them
+      from the server chunkSize at a time, see _queryIter
+    """
+    result = self.__buildSelect( 'getFieldsIter', tableName, outFields, condDict, limit,
+                                 older, newer, timeStamp, orderAttribute )
+    if not result['OK']:
+      return result
+
+    return self._queryIter( result['Value'], chunkSize = chunkSize, debug = True )
+
+  def __buildSelect( self, methodName, tableName, outFields, condDict, limit,
+                     older, newer, timeStamp, orderAttribute ):
+    """
+      Build the SELECT statement of getFields and getFieldsIter
+    """
     table = _quotedList( [tableName] )
     if not table:
       error = 'Invalid tableName argument'
-      self.log.warn( 'getFields:', error )
+      self.log.warn( '%s:' % methodName, error )
       return S_ERROR( error )
 
     quotedOutFields = '*'
@@ -1309,10 +1538,10 @@ class MySQL:
       quotedOutFields = _quotedList( outFields )
       if quotedOutFields == None:
         error = 'Invalid outFields arguments'
-        self.log.warn( 'getFields:', error )
+        self.log.warn( '%s:' % methodName, error )
         return S_ERROR( error )
 
-    self.log.verbose( 'getFields:', 'selecting fields %s from table %s.' %
+    self.log.verbose( '%s:' % methodName, 'selecting fields %s from table %s.' %
                           ( quotedOutFields, table ) )
 
     if condDict == None:
@@ -1331,8 +1560,7 @@ class MySQL:
     except Exception, x:
       return S_ERROR( x )
 
-    return self._query( 'SELECT %s FROM %s %s' %
-                        ( quotedOutFields, table, condition ), conn, debug = True )
+    return S_OK( 'SELECT %s FROM %s %s' % ( quotedOutFields, table, condition ) )
 
 #############################################################################
   def deleteEntries( self, tableName,
@@ -1493,6 +1721,63 @@ class MySQL:
                          ( table, inFieldString, inValueString ), conn, debug = True )
 
 
+  def insertFieldsMany( self, tableName, inFields, rowsList, conn = None, exprDict = None,
+                        replace = False, chunkSize = 1000 ):
+    """
+      Insert many rows in "tableName", each row of "rowsList" giving the values of the
+      fields "inFields". The fields in "exprDict" take the same SQL expression in all the
+      rows, e.g. { 'Time' : 'UTC_TIMESTAMP()' }.
+      One INSERT ( or REPLACE ) statement is executed for each chunkSize rows, the values
+      are bound by the driver instead of being escaped one by one.
+      return S_OK( number of inserted rows ), with the 'lastRowId' of the first row of the
+      last statement
+    """
+    table = _quotedList( [tableName] )
+    if not table:
+      error = 'Invalid tableName argument'
+      self.log.warn( 'insertFieldsMany:', error )
+      return S_ERROR( error )
+
+    if exprDict is None:
+      exprDict = {}
+    inFieldString = _quotedList( list( inFields ) + exprDict.keys() )
+    if inFieldString == None:
+      error = 'Invalid inFields arguments'
+      self.log.warn( 'insertFieldsMany:', error )
+      return S_ERROR( error )
+
+    numFields = len( inFields )
+    for row in rowsList:
+      if len( row ) != numFields:
+        error = 'Mismatch between inFields and a row of values'
+        self.log.warn( 'insertFieldsMany:', '%s: %s' % ( error, str( row ) ) )
+        return S_ERROR( error )
+
+    rowTemplate = '( %s )' % ', '.join( [ '%s' ] * numFields + exprDict.values() )
+    command = 'INSERT'
+    if replace:
+      command = 'REPLACE'
+
+    self.log.verbose( 'insertFieldsMany:', 'inserting %d rows of ( %s ) into table %s'
+                          % ( len( rowsList ), inFieldString, table ) )
+
+    result = S_OK( 0 )
+    inserted = 0
+    for start in xrange( 0, len( rowsList ), chunkSize ):
+      rowsChunk = rowsList[ start:start + chunkSize ]
+      args = []
+      for row in rowsChunk:
+        args.extend( row )
+      result = self._update( '%s INTO %s ( %s ) VALUES %s' % ( command, table, inFieldString,
+                                                               ', '.join( [ rowTemplate ] * len( rowsChunk ) ) ),
+                             conn, args = args )
+      if not result['OK']:
+        return result
+      inserted += result['Value']
+    result['Value'] = inserted
+    return result
+
+
   def executeStoredProcedure( self, packageName, parameters, outputIds, output = True, array = None, conn = False ):
     conDict = self._getConnection()
     if not conDict['OK']:
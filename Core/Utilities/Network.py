@@ -118,3 +118,18 @@ def checkHostsMatch( host1, host2 ):
 
 
 
+
+def getReusePortOption():
+  """ Socket option letting several processes listen on the same port, False if not supported
+  """
+  if hasattr( socket, 'SO_REUSEPORT' ):
+    return socket.SO_REUSEPORT
+  #Not exported by python 2 but available since Linux 3.9
+  if platform.system() == "Linux":
+    try:
+      kernelVersion = tuple( [ int( v ) for v in platform.release().split( "." )[:2] ] )
+    except ValueError:
+      return False
+    if kernelVersion >= ( 3, 9 ):
+      return 15
+  return False
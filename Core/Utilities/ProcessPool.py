@@ -95,6 +95,19 @@ The first types of callbacks could be used in case various callable objects are
 so you probably want to handle them differently depending on their results, while the second types are for
 executing same type of callables in subprocesses and  hence you are expecting the same type of results
 everywhere.
+
+Large results
+
+Results are sent back to the ProcessPool pickled through the results queue, so through a pipe, which
+is costly for big results like Request objects or replica dicts. With::
+
+  pool = ProcessPool( minSize, maxSize, maxQueuedRequests, sharedResultsThreshold = 65536 )
+
+the results of at least 65536 bytes once pickled are written by the worker in a file of a memory
+backed directory (/dev/shm if available) and only the file name goes through the results queue. The
+ProcessPool maps the file, unpickles the result before calling the callbacks and removes the file.
+The files left by killed workers are removed by :ProcessPool.finalize:. The default of 0 sends all
+the results through the queue.
 """
 
 __RCSID__ = "$Id$"
@@ -106,6 +119,11 @@ import threading
 import os
 import signal
 import Queue
+import cPickle
+import mmap
+import glob
+import tempfile
+import uuid
 from types import FunctionType, TypeType, ClassType
 
 try:
@@ -128,6 +146,19 @@ except ImportError:
     """ dummy S_ERROR """
     return { 'OK' : False, 'Message' : mess }
 
+## prefix of the files holding the large task results
+SHARED_RESULT_PREFIX = "ProcessPoolResult_"
+
+def getSharedResultsDirectory():
+  """ Directory for the large task results: /dev/shm if usable, the temporary directory otherwise """
+  if os.path.isdir( "/dev/shm" ) and os.access( "/dev/shm", os.W_OK | os.X_OK ):
+    return "/dev/shm"
+  return tempfile.gettempdir()
+
+def getSharedResultsPrefix():
+  """ Prefix of the result files of a new ProcessPool, unique to the pool and not only to the process """
+  return "%s%s_%s_" % ( SHARED_RESULT_PREFIX, os.getpid(), uuid.uuid4().hex[:12] )
+
 class WorkingProcess( multiprocessing.Process ):
   """
   .. class:: WorkingProcess
@@ -148,7 +179,8 @@ class WorkingProcess( multiprocessing.Process ):
   
   """
 
-  def __init__( self, pendingQueue, resultsQueue, stopEvent, keepRunning ):
+  def __init__( self, pendingQueue, resultsQueue, stopEvent, keepRunning,
+                resultsThreshold = 0, resultsDirectory = None, resultsPrefix = SHARED_RESULT_PREFIX ):
     """ c'tor
 
     :param self: self reference
@@ -158,6 +190,9 @@ class WorkingProcess( multiprocessing.Process ):
     :type multiprocessing.Queue 
     :param  stopEvent: event to stop processing
     :type multiprocessing.Event
+    :param int resultsThreshold: minimal size of the pickled results passed in files, 0 to use the queue
+    :param str resultsDirectory: directory of the result files
+    :param str resultsPrefix: prefix of the result files
     """
     multiprocessing.Process.__init__( self )
     ## daemonize
@@ -174,6 +209,10 @@ class WorkingProcess( multiprocessing.Process ):
     self.__stopEvent = stopEvent
     ## keep process running until stop event
     self.__keepRunning = keepRunning
+    ## large results in files
+    self.__resultsThreshold = resultsThreshold
+    self.__resultsDirectory = resultsDirectory
+    self.__resultsPrefix = resultsPrefix
     ## placeholder for watchdog thread
     self.__watchdogThread = None
     ## placeholder for process thread
@@ -306,6 +345,8 @@ class WorkingProcess( multiprocessing.Process ):
       
       ## check results and callbacks presence, put task to results queue
       if self.task.hasCallback() or self.task.hasPoolCallback():
+        if self.__resultsThreshold and not timeout:
+          self.task.storeResult( self.__resultsDirectory, self.__resultsThreshold, self.__resultsPrefix )
         self.__resultsQueue.put( task )
       if timeout or noResults:  
         # The task execution timed out, stop the process to prevent it from running 
@@ -382,6 +423,8 @@ class ProcessTask( object ):
     self.__taskException = None
     self.__taskResult = None
     self.__usePoolCallbacks = usePoolCallbacks
+    ## pickled result set by storeResult: ( None, pickled result ) or ( file path, size )
+    self.__storedResult = None
 
   def taskResults( self ):
     """ 
@@ -505,6 +548,78 @@ class ProcessTask( object ):
     """
     self.__taskResult = result
 
+  def storeResult( self, directory, threshold, prefix = SHARED_RESULT_PREFIX ):
+    """
+    Replace the task result by its pickled form before the task is put to the results queue
+
+    If the pickled result is at least :threshold: bytes long it is written in a file in :directory:
+    and only the file path is kept, so the result does not go through the results queue.
+
+    :param self: self reference
+    :param str directory: directory of the result files
+    :param int threshold: minimal size in bytes of the pickled results written in files
+    :param str prefix: prefix of the result file name
+    """
+    if self.__taskResult is None:
+      return S_OK()
+    try:
+      data = cPickle.dumps( self.__taskResult, cPickle.HIGHEST_PROTOCOL )
+    except Exception, error:
+      return S_ERROR( "Cannot pickle task result: %s" % str( error ) )
+    self.__storedResult = ( None, data )
+    self.__taskResult = None
+    if len( data ) < threshold:
+      return S_OK()
+    path = None
+    try:
+      fd, path = tempfile.mkstemp( prefix = prefix, dir = directory )
+      try:
+        written = 0
+        while written < len( data ):
+          written += os.write( fd, buffer( data, written ) )
+      finally:
+        os.close( fd )
+    except ( IOError, OSError ), error:
+      ## no space left? the result goes through the queue
+      if path:
+        try:
+          os.unlink( path )
+        except OSError:
+          pass
+      return S_ERROR( "Cannot write task result: %s" % str( error ) )
+    self.__storedResult = ( path, len( data ) )
+    return S_OK()
+
+  def loadResult( self ):
+    """
+    Get back the task result replaced by storeResult, removing its file
+
+    :param self: self reference
+    """
+    if not self.__storedResult:
+      return S_OK()
+    path, data = self.__storedResult
+    self.__storedResult = None
+    try:
+      if path:
+        try:
+          fd = os.open( path, os.O_RDONLY )
+          try:
+            resultMap = mmap.mmap( fd, data, access = mmap.ACCESS_READ )
+            try:
+              data = resultMap[:]
+            finally:
+              resultMap.close()
+          finally:
+            os.close( fd )
+        finally:
+          os.unlink( path )
+      self.__taskResult = cPickle.loads( data )
+    except Exception, error:
+      self.__taskResult = S_ERROR( "Cannot load task result: %s" % str( error ) )
+      return self.__taskResult
+    return S_OK()
+
   def process( self ):
     """ 
     Execute task
@@ -586,7 +701,7 @@ class ProcessPool( object ):
   """
   def __init__( self, minSize = 2, maxSize = 0, maxQueuedRequests = 10,
                 strictLimits = True, poolCallback=None, poolExceptionCallback=None,
-                keepProcessesRunning=True ):
+                keepProcessesRunning=True, sharedResultsThreshold=0 ):
     """ c'tor
 
     :param self: self reference
@@ -596,6 +711,8 @@ class ProcessPool( object ):
     :param bool strictLimits: flag to workers overcommitment
     :param callable poolCallbak: results callback
     :param callable poolExceptionCallback: exception callback
+    :param int sharedResultsThreshold: minimal size in bytes of the pickled results passed
+                                       in memory backed files, 0 to pass all of them in the results queue
     """
     ## min workers
     self.__minSize = max( 1, minSize )
@@ -619,6 +736,10 @@ class ProcessPool( object ):
     self.__stopEvent = multiprocessing.Event()
     ## keep processes running flag
     self.__keepRunning = keepProcessesRunning
+    ## large results passed in files
+    self.__sharedResultsThreshold = max( 0, sharedResultsThreshold )
+    self.__sharedResultsDirectory = getSharedResultsDirectory()
+    self.__sharedResultsPrefix = getSharedResultsPrefix()
     ## lock 
     self.__prListLock = threading.Lock()
     
@@ -730,7 +851,9 @@ class ProcessPool( object ):
     """
     self.__prListLock.acquire()
     try:
-      worker = WorkingProcess( self.__pendingQueue, self.__resultsQueue, self.__stopEvent, self.__keepRunning )
+      worker = WorkingProcess( self.__pendingQueue, self.__resultsQueue, self.__stopEvent, self.__keepRunning,
+                               self.__sharedResultsThreshold, self.__sharedResultsDirectory,
+                               self.__sharedResultsPrefix )
       while worker.pid == None:
         time.sleep(0.1)
       self.__workersDict[ worker.pid ] = worker
@@ -878,6 +1001,7 @@ class ProcessPool( object ):
       task = self.__resultsQueue.get()
       ## execute callbacks
       try:
+        task.loadResult()
         task.doExceptionCallback()
         task.doCallback()
         if task.usePoolCallbacks():
@@ -935,6 +1059,23 @@ class ProcessPool( object ):
     self.__cleanDeadProcesses()
     ## third clean up - kill'em all!!!
     self.__filicide()
+    ## remove results files of the tasks lost with their workers
+    self.__removeSharedResults()
+
+  def __removeSharedResults( self ):
+    """
+    Remove the result files written by the workers of this pool
+
+    :param self: self reference
+    """
+    if not self.__sharedResultsThreshold:
+      return
+    pattern = os.path.join( self.__sharedResultsDirectory, "%s*" % self.__sharedResultsPrefix )
+    for path in glob.glob( pattern ):
+      try:
+        os.unlink( path )
+      except OSError:
+        pass
 
   def __filicide( self ):
     """ 
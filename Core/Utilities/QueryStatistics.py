@@ -0,0 +1,110 @@
+""" Statistics of the SQL statements executed by the MySQL class of the process
+
+    Statements are grouped per database and per normalized statement, with the
+    literals replaced by '?', so that all the executions of the same query with
+    different values are counted together. For each of them it keeps the number of
+    calls and errors, the time spent executing and waiting for a connection, the
+    number of rows returned or changed and a latency histogram.
+
+    This module does not depend on MySQLdb, so that any component can publish the
+    statistics gathered in its process.
+"""
+
+__RCSID__ = "$Id$"
+
+import re
+import threading
+
+# Upper limits in seconds of the latency histogram bins, the last bin has no limit
+HISTOGRAM_LIMITS = ( 0.001, 0.01, 0.1, 1., 10. )
+# Only the beginning of the statements is normalized and kept
+MAX_STATEMENT_LENGTH = 512
+
+_literals = re.compile( r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|%s|\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b" )
+_valueLists = re.compile( r"\(\s*\?(?:\s*,\s*\?)*\s*\)" )
+_rowLists = re.compile( r"\bVALUES\b.*", re.IGNORECASE | re.DOTALL )
+_spaces = re.compile( r"\s+" )
+
+def normalizeStatement( cmd ):
+  """ Get the statement with the literals replaced by '?', the lists of values
+      replaced by '(?+)' and the rows of an INSERT by '...'
+  """
+  statement = _literals.sub( "?", cmd[:MAX_STATEMENT_LENGTH * 8] )
+  statement = _valueLists.sub( "(?+)", statement )
+  statement = _rowLists.sub( "VALUES ...", statement )
+  return _spaces.sub( " ", statement ).strip()[:MAX_STATEMENT_LENGTH]
+
+class QueryStatistics( object ):
+  """ Thread safe accumulator of the statements statistics
+  """
+
+  def __init__( self ):
+    self.__lock = threading.Lock()
+    # dbName -> { statement -> [ calls, errors, time, maxTime, connectionWait, rows, histogram ] }
+    self.__stats = {}
+
+  def addStatement( self, dbName, cmd, elapsed, rows = 0, connectionWait = 0., ok = True ):
+    """ Account an executed statement
+    """
+    statement = normalizeStatement( cmd )
+    histogramBin = len( HISTOGRAM_LIMITS )
+    for iBin in range( len( HISTOGRAM_LIMITS ) ):
+      if elapsed < HISTOGRAM_LIMITS[ iBin ]:
+        histogramBin = iBin
+        break
+    self.__lock.acquire()
+    try:
+      dbStats = self.__stats.setdefault( dbName, {} )
+      if statement not in dbStats:
+        dbStats[ statement ] = [ 0, 0, 0., 0., 0., 0, [ 0 ] * ( len( HISTOGRAM_LIMITS ) + 1 ) ]
+      stats = dbStats[ statement ]
+      stats[0] += 1
+      if not ok:
+        stats[1] += 1
+      stats[2] += elapsed
+      stats[3] = max( stats[3], elapsed )
+      stats[4] += connectionWait
+      stats[5] += rows
+      stats[6][ histogramBin ] += 1
+    finally:
+      self.__lock.release()
+
+  def getStatistics( self, dbName = None ):
+    """ Get the statistics of one or all the databases
+
+    :return: { dbName : { statement : { 'Calls', 'Errors', 'Time', 'MaxTime', 'ConnectionWait',
+                                        'Rows', 'Histogram' } } }, the histogram being the list
+             of the number of calls in each bin of HISTOGRAM_LIMITS
+    """
+    result = {}
+    self.__lock.acquire()
+    try:
+      for name, dbStats in self.__stats.items():
+        if dbName and name != dbName:
+          continue
+        result[ name ] = {}
+        for statement, stats in dbStats.items():
+          result[ name ][ statement ] = { 'Calls' : stats[0],
+                                          'Errors' : stats[1],
+                                          'Time' : stats[2],
+                                          'MaxTime' : stats[3],
+                                          'ConnectionWait' : stats[4],
+                                          'Rows' : stats[5],
+                                          'Histogram' : list( stats[6] ) }
+    finally:
+      self.__lock.release()
+    return result
+
+  def reset( self, dbName = None ):
+    """ Forget the statistics of one or all the databases
+    """
+    self.__lock.acquire()
+    try:
+      if dbName:
+        self.__stats.pop( dbName, None )
+      else:
+        self.__stats = {}
+    finally:
+      self.__lock.release()
+
+gQueryStatistics = QueryStatistics()
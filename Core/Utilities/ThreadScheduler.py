@@ -145,6 +145,14 @@ class ThreadScheduler:
     self.__thId.setDaemon( True )
     self.__thId.start()
 
+  def restartAfterFork( self ):
+    """
+    The executor thread does not survive a fork, start a new one in the child process
+    """
+    self.__thId = False
+    if self.__hood:
+      self.__createExecutorIfNeeded()
+
   @gSchedulerLock
   def __destroyExecutor( self ):
     self.__thId = False
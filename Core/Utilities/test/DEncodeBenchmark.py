@@ -0,0 +1,68 @@
+""" Benchmark of the DEncode codecs on payloads representative of the DISET traffic:
+      - getReplicas like answers
+      - getJobPageSummaryWeb like answers
+      - accounting buckets
+
+    It times encode and decode, taking the best of several runs.
+
+    Usage: python DEncodeBenchmark.py [ numLFNs ]
+"""
+
+__RCSID__ = "$Id$"
+
+import sys
+import time
+import datetime
+
+from DIRAC.Core.Utilities import DEncode
+
+NUM_RUNS = 7
+
+def replicasPayload( numLFNs ):
+  """ Like the answer of a getReplicas call """
+  successful = {}
+  for i in xrange( numLFNs ):
+    lfn = "/lhcb/MC/2012/ALLSTREAMS.DST/00012345/0000/00012345_%08d_1.allstreams.dst" % i
+    successful[ lfn ] = { 'CERN-DST' : 'srm://srm-lhcb.cern.ch/castor/cern.ch/grid%s' % lfn,
+                          'GRIDKA-DST' : 'srm://gridka-dCache.fzk.de/pnfs/gridka.de/lhcb%s' % lfn }
+  return { 'OK' : True, 'Value' : { 'Successful' : successful, 'Failed' : {} } }
+
+def jobPagePayload( numJobs ):
+  """ Like the answer of a getJobPageSummaryWeb call """
+  now = datetime.datetime.utcnow()
+  records = [ [ str( 10000000 + i ), 'Done', 'Execution Complete', 'Job Finished Successfully', 'LCG.CERN.ch',
+                'MCSimulation', 'lhcb_mc', '/DC=ch/CN=someone', now, now, 12345 + i, 1.5 * i ]
+              for i in xrange( numJobs ) ]
+  return { 'OK' : True, 'Value' : { 'ParameterNames' : [ 'JobID', 'Status', 'MinorStatus', 'ApplicationStatus', 'Site',
+                                                         'JobType', 'OwnerGroup', 'OwnerDN', 'LastUpdateTime',
+                                                         'SubmissionTime', 'RescheduleCounter', 'CPUTime' ],
+                                    'Records' : records, 'TotalRecords' : numJobs } }
+
+def bucketsPayload( numBuckets ):
+  """ Like the accounting bucket dumps """
+  return { 'OK' : True, 'Value' : [ ( 'LCG.Site%s.ch' % ( i % 100 ), 1400000000 + i * 900, 900, 1.0 * i, 3 * i, 0.5 )
+                                    for i in xrange( numBuckets ) ] }
+
+def timeIt( func, *args ):
+  """ Best time of NUM_RUNS calls """
+  best = None
+  for _i in xrange( NUM_RUNS ):
+    start = time.time()
+    result = func( *args )
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return result, best
+
+def benchmark( name, payload ):
+  data, encTime = timeIt( DEncode.encode, payload )
+  _, decTime = timeIt( DEncode.decode, data )
+  print "%-10s %8.2f MB | encode %7.3fs | decode %7.3fs" % ( name, len( data ) / 1048576.0, encTime, decTime )
+
+if __name__ == "__main__":
+  numItems = 100000
+  if len( sys.argv ) > 1:
+    numItems = int( sys.argv[1] )
+  benchmark( "Replicas", replicasPayload( numItems ) )
+  benchmark( "JobPage", jobPagePayload( numItems ) )
+  benchmark( "Buckets", bucketsPayload( numItems ) )
@@ -0,0 +1,68 @@
+""" Unit tests for DEncode: encode and decode have to be byte for byte
+    compatible with the plain encoding format
+"""
+
+__RCSID__ = "$Id$"
+
+import types
+import datetime
+import unittest
+
+from DIRAC.Core.Utilities import DEncode
+
+def referenceEncode( uObject ):
+  """ Plain recursive implementation of the encoding format """
+  oType = type( uObject )
+  if oType in ( types.IntType, types.LongType, types.FloatType ):
+    return "%s%se" % ( { types.IntType : 'i', types.LongType : 'I', types.FloatType : 'f' }[ oType ], uObject )
+  if oType == types.BooleanType:
+    return "b%d" % uObject
+  if oType == types.StringType:
+    return "s%d:%s" % ( len( uObject ), uObject )
+  if oType == types.UnicodeType:
+    return "u%d:%s" % ( len( uObject.encode( 'utf-8' ) ), uObject.encode( 'utf-8' ) )
+  if uObject is None:
+    return "n"
+  if oType == datetime.datetime:
+    return "za" + referenceEncode( ( uObject.year, uObject.month, uObject.day, uObject.hour, uObject.minute,
+                                     uObject.second, uObject.microsecond, uObject.tzinfo ) )
+  if oType == datetime.date:
+    return "zd" + referenceEncode( ( uObject.year, uObject.month, uObject.day ) )
+  if oType == datetime.time:
+    return "zt" + referenceEncode( ( uObject.hour, uObject.minute, uObject.second, uObject.microsecond, uObject.tzinfo ) )
+  if oType == types.ListType:
+    return "l%se" % "".join( [ referenceEncode( v ) for v in uObject ] )
+  if oType == types.TupleType:
+    return "t%se" % "".join( [ referenceEncode( v ) for v in uObject ] )
+  if oType == types.DictType:
+    return "d%se" % "".join( [ referenceEncode( k ) + referenceEncode( uObject[k] ) for k in sorted( uObject ) ] )
+  raise TypeError( "Cannot encode %s" % oType )
+
+class DEncodeTestCase( unittest.TestCase ):
+  """ Test the DEncode codecs
+  """
+
+  def setUp( self ):
+    now = datetime.datetime( 2015, 3, 4, 12, 30, 15, 1234 )
+    self.objects = [ 1, -12, 2 ** 70, 1.5, 2.0 * 10 ** 20, 2.0 * 10 ** -10, True, False, None, "", "a:b:e",
+                     u"\u00e9t\u00e9", now, now.date(), now.time(), [], (), {},
+                     { 'OK' : True, 'Value' : { 'Successful' : dict( [ ( '/lfn/%s' % i, dict( [ ( 'SE-%s' % j, 'srm://host/%s' % i )
+                                                                                              for j in range( 3 ) ] ) )
+                                                                    for i in range( 100 ) ] ),
+                                                'Failed' : {} } },
+                     { 2 : "3", True : ( 3, None ), 2.0 * 10 ** 20 : 2.0 * 10 ** -10 },
+                     [ [ i, "job%s" % i, i + 0.25, now, None, ( i, ) ] for i in range( 50 ) ],
+                     [ 2.0 * 10 ** 20, ( 2.0 * 10 ** -10, -2.0 * 10 ** 20, True, 0 ), 3 ] ]
+
+  def test_encode( self ):
+    for obj in self.objects:
+      self.assertEqual( DEncode.encode( obj ), referenceEncode( obj ) )
+
+  def test_decode( self ):
+    for obj in self.objects:
+      data = referenceEncode( obj )
+      self.assertEqual( DEncode.decode( data ), ( obj, len( data ) ) )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DEncodeTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
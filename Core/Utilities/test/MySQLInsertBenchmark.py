@@ -0,0 +1,83 @@
+""" Benchmark of the insertion of rows like the heart beat records through the MySQL class:
+      - one insertFields per row, each value escaped with a round trip to the pooled connection
+      - one multi-row INSERT per heart beat, values escaped one by one as JobDB did
+      - insertFieldsMany with the values bound by the driver, in chunks of rows
+
+    A scratch table is created in the given database and dropped at the end.
+
+    Usage: python MySQLInsertBenchmark.py host user password database [ numRows ]
+"""
+
+__RCSID__ = "$Id$"
+
+import sys
+import time
+
+from DIRAC.Core.Utilities.MySQL import MySQL
+
+TABLE = 'InsertBenchmark'
+ROWS_PER_HEARTBEAT = 10
+
+def getRows( numRows ):
+  """ Rows like the HeartBeatLoggingInfo ones """
+  names = [ 'LoadAverage', 'MemoryUsed', 'Vsize', 'AvailableDiskSpace', 'CPUConsumed', 'WallClockTime',
+            'RSS', 'StandardOutput', 'Timestamp', 'Status' ]
+  return [ ( 1000000 + i / ROWS_PER_HEARTBEAT, names[ i % len( names ) ], "%f's" % ( i * 1.5 ) ) for i in xrange( numRows ) ]
+
+def insertRowByRow( db, rows ):
+  for row in rows:
+    result = db.insertFields( TABLE, [ 'JobID', 'Name', 'Value' ], list( row ) )
+    if not result[ 'OK' ]:
+      return result
+
+def insertEscapedBlocks( db, rows ):
+  for start in xrange( 0, len( rows ), ROWS_PER_HEARTBEAT ):
+    valueList = []
+    for jobID, name, value in rows[ start:start + ROWS_PER_HEARTBEAT ]:
+      e_name = db._escapeString( name )[ 'Value' ]
+      e_value = db._escapeString( value )[ 'Value' ]
+      valueList.append( "( %s, %s, %s, UTC_TIMESTAMP() )" % ( jobID, e_name, e_value ) )
+    result = db._update( "INSERT INTO %s ( JobID, Name, Value, Time ) VALUES %s" % ( TABLE, ','.join( valueList ) ) )
+    if not result[ 'OK' ]:
+      return result
+
+def insertBoundBlocks( db, rows ):
+  for start in xrange( 0, len( rows ), ROWS_PER_HEARTBEAT ):
+    result = db.insertFieldsMany( TABLE, [ 'JobID', 'Name', 'Value' ], rows[ start:start + ROWS_PER_HEARTBEAT ],
+                                  exprDict = { 'Time' : 'UTC_TIMESTAMP()' } )
+    if not result[ 'OK' ]:
+      return result
+
+def insertBoundBulk( db, rows ):
+  return db.insertFieldsMany( TABLE, [ 'JobID', 'Name', 'Value' ], rows,
+                              exprDict = { 'Time' : 'UTC_TIMESTAMP()' } )
+
+if __name__ == '__main__':
+  if len( sys.argv ) < 5:
+    print __doc__
+    sys.exit( 1 )
+  host, user, password, dbName = sys.argv[1:5]
+  numRows = int( sys.argv[5] ) if len( sys.argv ) > 5 else 20000
+  db = MySQL( host, user, password, dbName )
+  result = db._update( "CREATE TABLE %s ( ID INTEGER NOT NULL AUTO_INCREMENT, JobID INTEGER NOT NULL, "
+                       "Name VARCHAR(100) NOT NULL, Value TEXT NOT NULL, Time DATETIME, PRIMARY KEY( ID ) )" % TABLE )
+  if not result[ 'OK' ]:
+    print "Cannot create table %s: %s" % ( TABLE, result[ 'Message' ] )
+    sys.exit( 1 )
+  rows = getRows( numRows )
+  try:
+    for title, function in ( ( "insertFields row by row", insertRowByRow ),
+                             ( "escaped multi-row INSERT per heart beat", insertEscapedBlocks ),
+                             ( "insertFieldsMany per heart beat", insertBoundBlocks ),
+                             ( "insertFieldsMany in chunks of 1000", insertBoundBulk ) ):
+      db._update( "TRUNCATE TABLE %s" % TABLE )
+      start = time.time()
+      result = function( db, rows )
+      elapsed = time.time() - start
+      if result and not result[ 'OK' ]:
+        print "%s failed: %s" % ( title, result[ 'Message' ] )
+        continue
+      count = db._query( "SELECT COUNT(*) FROM %s" % TABLE )[ 'Value' ][0][0]
+      print "%-40s %8d rows %8.2f s %10.0f rows/s" % ( title, count, elapsed, numRows / elapsed )
+  finally:
+    db._update( "DROP TABLE %s" % TABLE )
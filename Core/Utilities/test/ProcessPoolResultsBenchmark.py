@@ -0,0 +1,59 @@
+""" Benchmark of the ProcessPool results transport versus the result size:
+      - results queue only ( sharedResultsThreshold = 0 )
+      - large results in memory backed files ( sharedResultsThreshold = 64 kB )
+
+    The tasks return replica dict like results. For each size it prints the wall time to get all
+    the results back through the pool callback and the CPU used by the parent process.
+
+    Usage: python ProcessPoolResultsBenchmark.py [ numTasks ]
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import sys
+import time
+
+from DIRAC.Core.Utilities.ProcessPool import ProcessPool
+
+def replicasResult( numLFNs ):
+  """ Like the answer of a getReplicas call """
+  successful = {}
+  for i in xrange( numLFNs ):
+    lfn = "/lhcb/MC/2012/ALLSTREAMS.DST/00012345/0000/00012345_%08d_1.allstreams.dst" % i
+    successful[ lfn ] = { 'CERN-DST' : 'srm://srm-lhcb.cern.ch/castor/cern.ch/grid%s' % lfn,
+                          'GRIDKA-DST' : 'srm://gridka-dCache.fzk.de/pnfs/gridka.de/lhcb%s' % lfn }
+  return { 'OK' : True, 'Value' : { 'Successful' : successful, 'Failed' : {} } }
+
+class Counter( object ):
+  """ Pool callback counting the results """
+  def __init__( self ):
+    self.results = 0
+  def __call__( self, taskID, taskResult ):
+    self.results += 1
+
+def benchmark( numTasks, numLFNs, threshold ):
+  """ Run numTasks tasks, return the wall time and the parent CPU time """
+  counter = Counter()
+  pool = ProcessPool( 4, 4, 2 * numTasks, poolCallback = counter, sharedResultsThreshold = threshold )
+  start = time.time()
+  cpuStart = sum( os.times()[:2] )
+  for taskID in xrange( numTasks ):
+    pool.createAndQueueTask( replicasResult, taskID = taskID, args = ( numLFNs, ), usePoolCallbacks = True )
+  while counter.results < numTasks and time.time() - start < 600:
+    pool.processResults()
+  wallTime = time.time() - start
+  cpuTime = sum( os.times()[:2] ) - cpuStart
+  pool.finalize( 10 )
+  if counter.results != numTasks:
+    print "WARNING: got %s results out of %s" % ( counter.results, numTasks )
+  return wallTime, cpuTime
+
+if __name__ == "__main__":
+  numTasks = int( sys.argv[1] ) if len( sys.argv ) > 1 else 20
+  for numLFNs in ( 10, 1000, 10000, 100000 ):
+    size = len( str( replicasResult( numLFNs ) ) ) / 1048576.0
+    for name, threshold in ( ( "queue", 0 ), ( "shared", 65536 ) ):
+      wallTime, cpuTime = benchmark( numTasks, numLFNs, threshold )
+      print "%7d LFNs %8.2f MB %-6s | %3d tasks in %7.2fs | %7.1f MB/s | parent CPU %6.2fs" % \
+            ( numLFNs, size, name, numTasks, wallTime, numTasks * size / wallTime, cpuTime )
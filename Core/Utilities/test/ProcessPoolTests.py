@@ -25,6 +25,9 @@ __RCSID__ = "$Id $"
 
 ## imports 
 import os
+import glob
+import shutil
+import tempfile
 import unittest
 import random
 import time
@@ -35,7 +38,8 @@ import threading
 # Script.parseCommandLine()
 from DIRAC import gLogger
 ## SUT
-from DIRAC.Core.Utilities.ProcessPool import ProcessPool
+from DIRAC.Core.Utilities.ProcessPool import ProcessPool, ProcessTask, SHARED_RESULT_PREFIX, \
+                                            getSharedResultsDirectory
 
 def ResultCallback( task, taskResult ):
   """ dummy result callback """
@@ -69,6 +73,10 @@ class CallableClass( object ):
       raise Exception("testException")
     return self.timeWait
 
+def BigResultFunc( taskID, size ):
+  """ global function returning a result of about :size: bytes """
+  return { "OK" : True, "Value" : { "TaskID" : taskID, "Data" : "x" * size } }
+
 ## global locked lock 
 gLock = threading.Lock()
 # make sure it is locked
@@ -344,6 +352,65 @@ class TaskTimeOutTests( unittest.TestCase ):
     gLock.release()
 
 
+########################################################################
+class SharedResultsTests( unittest.TestCase ):
+  """
+  .. class:: SharedResultsTests
+  test case for the large results passed in files
+  """
+
+  def setUp( self ):
+    gLogger.showHeaders( True )
+    self.log = gLogger.getSubLogger( self.__class__.__name__ )
+    self.directory = tempfile.mkdtemp()
+    self.results = {}
+
+  def tearDown( self ):
+    shutil.rmtree( self.directory, ignore_errors = True )
+
+  def poolCallback( self, taskID, taskResult ):
+    self.results[taskID] = taskResult
+
+  def testStoreResult( self ):
+    """ small results stay in the task, large ones go to a file removed once loaded """
+    for size, inFile in ( ( 10, False ), ( 10000, True ) ):
+      task = ProcessTask( BigResultFunc, args = ( 1, size ) )
+      task.process()
+      result = task.taskResults()
+      self.assertEqual( task.storeResult( self.directory, 1000 )["OK"], True )
+      self.assertEqual( task.taskResults(), None )
+      resultFiles = glob.glob( os.path.join( self.directory, SHARED_RESULT_PREFIX + "*" ) )
+      self.assertEqual( len( resultFiles ), int( inFile ) )
+      self.assertEqual( task.loadResult()["OK"], True )
+      self.assertEqual( task.taskResults(), result )
+      self.assertEqual( glob.glob( os.path.join( self.directory, SHARED_RESULT_PREFIX + "*" ) ), [] )
+
+  def testPool( self ):
+    """ results of all sizes get to the pool callback """
+    processPool = ProcessPool( 2, 4, 8, poolCallback = self.poolCallback, sharedResultsThreshold = 1000 )
+    sizes = { 0 : 10, 1 : 100000, 2 : 1000000 }
+    for taskID, size in sizes.items():
+      result = processPool.createAndQueueTask( BigResultFunc, taskID = taskID, args = ( taskID, size ),
+                                               usePoolCallbacks = True, blocking = True )
+      self.assertEqual( result["OK"], True )
+    processPool.processAllResults( 30 )
+    processPool.finalize( 2 )
+    self.assertEqual( sorted( self.results ), sorted( sizes ) )
+    for taskID, size in sizes.items():
+      self.assertEqual( len( self.results[taskID]["Value"]["Data"] ), size )
+
+  def testFinalize( self ):
+    """ finalize only removes the result files of its own pool """
+    fd, otherFile = tempfile.mkstemp( prefix = "%s%s_" % ( SHARED_RESULT_PREFIX, os.getpid() ),
+                                      dir = getSharedResultsDirectory() )
+    os.close( fd )
+    try:
+      processPool = ProcessPool( 1, 1, 1, sharedResultsThreshold = 1000 )
+      processPool.finalize( 2 )
+      self.assertEqual( os.path.exists( otherFile ), True )
+    finally:
+      os.unlink( otherFile )
+
 ## SUT suite execution
 if __name__ == "__main__":
 
@@ -351,6 +418,7 @@ if __name__ == "__main__":
   suitePPCT = testLoader.loadTestsFromTestCase( ProcessPoolCallbacksTests )  
   suiteTCT = testLoader.loadTestsFromTestCase( TaskCallbacksTests )
   suiteTTOT = testLoader.loadTestsFromTestCase( TaskTimeOutTests )
-  suite = unittest.TestSuite( [ suitePPCT, suiteTCT, suiteTTOT ] )
+  suiteSRT = testLoader.loadTestsFromTestCase( SharedResultsTests )
+  suite = unittest.TestSuite( [ suitePPCT, suiteTCT, suiteTTOT, suiteSRT ] )
   unittest.TextTestRunner(verbosity=3).run(suite)
 
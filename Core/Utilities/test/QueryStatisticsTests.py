@@ -0,0 +1,47 @@
+""" Test cases for DIRAC.Core.Utilities.QueryStatistics
+"""
+
+__RCSID__ = "$Id$"
+
+import unittest
+
+from DIRAC.Core.Utilities.QueryStatistics import QueryStatistics, normalizeStatement
+
+class QueryStatisticsTestCase( unittest.TestCase ):
+  """ Statement normalization and accounting
+  """
+
+  def test_normalize( self ):
+    """ Literals and lists of values are replaced """
+    self.assertEqual( normalizeStatement( "SELECT JobID FROM Jobs\n  WHERE Status='Done' AND Site = \"LCG.CERN.ch\" LIMIT 100" ),
+                      "SELECT JobID FROM Jobs WHERE Status=? AND Site = ? LIMIT ?" )
+    self.assertEqual( normalizeStatement( "DELETE FROM Table1 WHERE JobID IN ( 1, 2, 3 ) AND Name='it''s'" ),
+                      normalizeStatement( "DELETE FROM Table1 WHERE JobID IN (4) AND Name='x'" ) )
+    self.assertEqual( normalizeStatement( "SELECT * FROM T WHERE A = 'a\\'b' AND B = 1.5e3" ),
+                      "SELECT * FROM T WHERE A = ? AND B = ?" )
+    self.assertEqual( normalizeStatement( "INSERT INTO `T` ( `a`, `b` ) VALUES ( %s, %s, UTC_TIMESTAMP() ), ( %s, %s, UTC_TIMESTAMP() )" ),
+                      "INSERT INTO `T` ( `a`, `b` ) VALUES ..." )
+
+  def test_accounting( self ):
+    """ Executions of the same statement are accumulated """
+    stats = QueryStatistics()
+    stats.addStatement( 'JobDB', "SELECT Status FROM Jobs WHERE JobID=1", 0.0005, rows = 1, connectionWait = 0.1 )
+    stats.addStatement( 'JobDB', "SELECT Status FROM Jobs WHERE JobID=2", 0.5, rows = 1 )
+    stats.addStatement( 'JobDB', "SELECT Status FROM Jobs WHERE JobID=3", 20., ok = False )
+    stats.addStatement( 'TaskQueueDB', "SELECT 1", 0.002 )
+    result = stats.getStatistics()
+    self.assertEqual( sorted( result ), [ 'JobDB', 'TaskQueueDB' ] )
+    jobStats = result[ 'JobDB' ][ "SELECT Status FROM Jobs WHERE JobID=?" ]
+    self.assertEqual( jobStats[ 'Calls' ], 3 )
+    self.assertEqual( jobStats[ 'Errors' ], 1 )
+    self.assertEqual( jobStats[ 'Rows' ], 2 )
+    self.assertEqual( jobStats[ 'MaxTime' ], 20. )
+    self.assertAlmostEqual( jobStats[ 'ConnectionWait' ], 0.1 )
+    self.assertEqual( jobStats[ 'Histogram' ], [ 1, 0, 0, 1, 0, 1 ] )
+    self.assertEqual( stats.getStatistics( 'TaskQueueDB' ).keys(), [ 'TaskQueueDB' ] )
+    stats.reset( 'JobDB' )
+    self.assertEqual( stats.getStatistics().keys(), [ 'TaskQueueDB' ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( QueryStatisticsTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
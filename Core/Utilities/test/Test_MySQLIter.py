@@ -0,0 +1,145 @@
+""" Unit tests of the queries streamed from the server by the MySQL class
+"""
+
+import types
+import unittest
+
+import MySQLdb
+from mock import MagicMock, patch
+
+from DIRAC import gLogger, S_OK
+from DIRAC.Core.Utilities.MySQL import MySQL
+from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
+
+class FakeCursor( object ):
+  """ Server side cursor returning the rows by chunks
+  """
+
+  def __init__( self, rows, error = None ):
+    self.rows = list( rows )
+    self.error = error
+    self.cmd = None
+    self.fetches = []
+
+  def execute( self, cmd ):
+    if self.error:
+      raise self.error
+    self.cmd = cmd
+
+  def fetchmany( self, size ):
+    self.fetches.append( size )
+    chunk = tuple( self.rows[:size] )
+    del self.rows[:size]
+    return chunk
+
+class FakeConnection( object ):
+
+  def __init__( self, cursor ):
+    self.fakeCursor = cursor
+    self.cursorClass = None
+    self.closed = False
+
+  def cursor( self, cursorClass = None ):
+    self.cursorClass = cursorClass
+    return self.fakeCursor
+
+  def close( self ):
+    self.closed = True
+
+class FakeConnectionPool( object ):
+
+  def __init__( self, cursor ):
+    self.connections = []
+    self.cursor = cursor
+
+  def newConnection( self, dbName ):
+    self.connections.append( FakeConnection( self.cursor ) )
+    return S_OK( self.connections[-1] )
+
+class QueryIterTestCase( unittest.TestCase ):
+
+  def getDB( self, rows, error = None, dbClass = MySQL ):
+    db = types.InstanceType( dbClass )
+    db.log = gLogger.getSubLogger( 'MySQL' )
+    db.logger = db.log
+    db._slowQueryThreshold = 0
+    db._queryStatistics = False
+    db._MySQL__dbName = 'TestDB'
+    self.pool = FakeConnectionPool( FakeCursor( rows, error ) )
+    db._MySQL__connectionPool = self.pool
+    return db
+
+  def test_queryIter( self ):
+    """ The rows are read by chunks on a connection of their own, closed at the end
+    """
+    rows = [ ( i, 'name%d' % i ) for i in range( 10 ) ]
+    db = self.getDB( rows )
+    result = db._queryIter( 'SELECT * FROM T', chunkSize = 4 )
+    self.assert_( result['OK'] )
+    connection = self.pool.connections[0]
+    self.assertEqual( connection.cursorClass, MySQLdb.cursors.SSCursor )
+    self.assertFalse( connection.closed )
+    self.assertEqual( list( result['Value'] ), rows )
+    self.assertEqual( connection.fakeCursor.fetches, [ 4, 4, 4, 4 ] )
+    self.assert_( connection.closed )
+
+  def test_stopped( self ):
+    """ The connection is closed if the rows are not all read
+    """
+    db = self.getDB( [ ( i, ) for i in range( 10 ) ] )
+    rowIter = db._queryIter( 'SELECT * FROM T', chunkSize = 4 )['Value']
+    self.assertEqual( rowIter.next(), ( 0, ) )
+    rowIter.close()
+    self.assert_( self.pool.connections[0].closed )
+
+  def test_executeError( self ):
+    db = self.getDB( [], error = MySQLdb.OperationalError( 1146, "Table 'TestDB.T' doesn't exist" ) )
+    result = db._queryIter( 'SELECT * FROM T' )
+    self.assertFalse( result['OK'] )
+    self.assert_( self.pool.connections[0].closed )
+
+  def test_queryStatistics( self ):
+    """ The statements are accounted only with the QueryStatistics option
+    """
+    db = self.getDB( [ ( 1, ), ( 2, ) ] )
+    with patch( 'DIRAC.Core.Utilities.MySQL.gQueryStatistics' ) as queryStatistics:
+      list( db._queryIter( 'SELECT * FROM T' )['Value'] )
+      self.assertFalse( queryStatistics.addStatement.called )
+      db._queryStatistics = True
+      list( db._queryIter( 'SELECT * FROM T' )['Value'] )
+      self.assertEqual( queryStatistics.addStatement.call_args[0][:2], ( 'TestDB', 'SELECT * FROM T' ) )
+
+  def test_getFieldsIter( self ):
+    db = self.getDB( [ ( 1, ), ( 2, ) ] )
+    result = db.getFieldsIter( 'Jobs', [ 'JobID' ], limit = 10, chunkSize = 1 )
+    self.assertEqual( list( result['Value'] ), [ ( 1, ), ( 2, ) ] )
+    self.assertEqual( self.pool.cursor.cmd.split()[:4], [ 'SELECT', '`JobID`', 'FROM', '`Jobs`' ] )
+    self.assert_( 'LIMIT 10' in self.pool.cursor.cmd )
+
+  def test_selectJobsIter( self ):
+    """ The JobIDs are given as selectJobs does
+    """
+    db = self.getDB( [ ( 3L, ), ( 5L, ) ], dbClass = JobDB )
+    # No statements published to gMonitor
+    db._reportStatement = lambda *args: None
+    result = db.selectJobsIter( {}, chunkSize = 1 )
+    self.assert_( result['OK'] )
+    self.assertEqual( list( result['Value'] ), [ '3', '5' ] )
+
+class NewConnectionTestCase( unittest.TestCase ):
+
+  def test_selectDBError( self ):
+    """ The connection is closed if the DB can not be selected
+    """
+    connection = MagicMock()
+    connection.select_db.side_effect = MySQLdb.OperationalError( 1049, "Unknown database 'TestDB'" )
+    pool = MySQL.ConnectionPool( 'localhost', 'user', 'passwd' )
+    with patch( 'DIRAC.Core.Utilities.MySQL.MySQLdb.connect', return_value = connection ):
+      result = pool.newConnection( 'TestDB' )
+    self.assertFalse( result['OK'] )
+    self.assert_( connection.close.called )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( QueryIterTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( NewConnectionTestCase ) )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
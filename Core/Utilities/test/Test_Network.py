@@ -0,0 +1,56 @@
+""" Unit tests of the socket options of the Network utilities
+"""
+
+import socket
+import unittest
+
+from mock import patch
+
+from DIRAC.Core.Utilities import Network
+
+class ReusePortTestCase( unittest.TestCase ):
+
+  @patch( 'DIRAC.Core.Utilities.Network.socket' )
+  @patch( 'DIRAC.Core.Utilities.Network.platform' )
+  def test_fromKernel( self, platformMock, socketMock ):
+    """ Without the python constant the option depends on the Linux version
+    """
+    del socketMock.SO_REUSEPORT
+    platformMock.system.return_value = "Linux"
+    for release, option in ( ( "3.10.0-327.el7.x86_64", 15 ), ( "3.9.1", 15 ), ( "4.1", 15 ),
+                             ( "3.8.13-generic", False ), ( "2.6.32-573.el6.x86_64", False ),
+                             ( "weird", False ) ):
+      platformMock.release.return_value = release
+      self.assertEqual( Network.getReusePortOption(), option )
+    platformMock.system.return_value = "Darwin"
+    platformMock.release.return_value = "14.5.0"
+    self.assertEqual( Network.getReusePortOption(), False )
+
+  @patch( 'DIRAC.Core.Utilities.Network.socket' )
+  def test_fromSocket( self, socketMock ):
+    socketMock.SO_REUSEPORT = 1234
+    self.assertEqual( Network.getReusePortOption(), 1234 )
+
+  def test_shareListeningPort( self ):
+    """ Two sockets can listen on the same port with the option
+    """
+    option = Network.getReusePortOption()
+    if not option:
+      self.skipTest( "Port sharing is not supported by this platform" )
+    sockets = []
+    try:
+      port = 0
+      for _i in range( 2 ):
+        sock = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        sockets.append( sock )
+        sock.setsockopt( socket.SOL_SOCKET, option, 1 )
+        sock.bind( ( "127.0.0.1", port ) )
+        sock.listen( 1 )
+        port = sock.getsockname()[1]
+    finally:
+      for sock in sockets:
+        sock.close()
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ReusePortTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -89,12 +89,17 @@ class DirectoryFlatTree(DirectoryTreeBase):
     return S_OK({'Successful':successful,'Failed':res['Value']['Failed']})
 
   def findDir(self,path):
+    cached = self.dirCache.getDirID( path )
+    if cached:
+      return S_OK( cached[0] )
     res = self.__findDirs([path])
     if not res['OK']:
       return res
     if not res['Value']:
       return S_OK(0)
-    return S_OK(res['Value'].keys()[0])
+    dirID = res['Value'].keys()[0]
+    self.dirCache.add( path, dirID )
+    return S_OK(dirID)
   
   def removeDir(self,path):
     """ Remove directory """
@@ -105,7 +110,9 @@ class DirectoryFlatTree(DirectoryTreeBase):
       return S_OK()
     dirID = res['Value']
     req = "DELETE FROM DirectoryInfo WHERE DirID=%d" % dirID
-    return self.db._update(req)
+    result = self.db._update(req)
+    self.dirCache.removeDirID( dirID )
+    return result
 
 
  
@@ -184,6 +191,9 @@ class DirectoryFlatTree(DirectoryTreeBase):
 
   def getDirectoryPath(self,dirID):
     """ Get directory name by directory ID """
+    dirPath = self.dirCache.getPath( int(dirID) )
+    if dirPath:
+      return S_OK( dirPath )
     req = "SELECT DirName FROM DirectoryInfo WHERE DirID=%d" % int(dirID)
     result = self.db._query(req)
     if not result['OK']:
@@ -34,6 +34,12 @@ class DirectoryLevelTree(DirectoryTreeBase):
     """
     
     dpath = os.path.normpath( path )    
+    cached = self.dirCache.getDirID( dpath )
+    if cached:
+      res = S_OK( cached[0] )
+      res['Level'] = cached[1]
+      return res
+
     req = "SELECT DirID,Level from FC_DirectoryLevelTree WHERE DirName='%s'" % dpath
     result = self.db._query(req,connection)
     if not result['OK']:
@@ -42,6 +48,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
     if not result['Value']:
       return S_OK('')
     
+    self.dirCache.add( dpath, result['Value'][0][0], result['Value'][0][1] )
     res = S_OK(result['Value'][0][0])  
     res['Level'] = result['Value'][0][1]
     return res
@@ -49,14 +56,26 @@ class DirectoryLevelTree(DirectoryTreeBase):
   def findDirs( self, paths, connection=False ):
     """ Find DirIDs for the given path list
     """
-    dpaths = ','.join( [ "'"+os.path.normpath( path )+"'" for path in paths ] )
-    req = "SELECT DirName,DirID from FC_DirectoryLevelTree WHERE DirName in (%s)" % dpaths
+    dirDict = {}
+    toQuery = []
+    for path in paths:
+      dpath = os.path.normpath( path )
+      cached = self.dirCache.getDirID( dpath )
+      if cached:
+        dirDict[dpath] = cached[0]
+      else:
+        toQuery.append( dpath )
+    if not toQuery:
+      return S_OK( dirDict )
+
+    dpaths = ','.join( [ "'"+queryPath+"'" for queryPath in toQuery ] )
+    req = "SELECT DirName,DirID,Level from FC_DirectoryLevelTree WHERE DirName in (%s)" % dpaths
     result = self.db._query(req,connection)
     if not result['OK']:
       return result
-    dirDict = {}
-    for dirName, dirID in result['Value']:
+    for dirName, dirID, level in result['Value']:
       dirDict[dirName] = dirID
+      self.dirCache.add( dirName, dirID, level )
 
     return S_OK( dirDict )
   
@@ -75,6 +94,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
     dirID = result['Value']
     req = "DELETE FROM FC_DirectoryLevelTree WHERE DirID=%d" % dirID
     result = self.db._update(req)
+    self.dirCache.removeDirID( dirID )
     result['DirID'] = dirID
     return result
 
@@ -160,6 +180,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
       else:
         return result 
     dirID = result['lastRowId']
+    self.dirCache.add( os.path.normpath( path ), dirID, level )
     
     # Update the path number
     if parentDirID:
@@ -231,6 +252,9 @@ class DirectoryLevelTree(DirectoryTreeBase):
   def getDirectoryPath(self,dirID):
     """ Get directory name by directory ID
     """
+    dirPath = self.dirCache.getPath( int(dirID) )
+    if dirPath:
+      return S_OK( dirPath )
     req = "SELECT DirName FROM FC_DirectoryLevelTree WHERE DirID=%d" % int(dirID)
     result = self.db._query(req)
     if not result['OK']:
@@ -249,19 +273,30 @@ class DirectoryLevelTree(DirectoryTreeBase):
 
     if not dirs:
       return S_OK( {} )
+
+    resultDict = {}
+    toQuery = []
+    for dirID in dirs:
+      dirPath = self.dirCache.getPath( int( dirID ) )
+      if dirPath:
+        resultDict[int( dirID )] = dirPath
+      else:
+        toQuery.append( dirID )
+    if not toQuery:
+      return S_OK( resultDict )
       
-    dirListString = ','.join( [ str( d ) for d in dirs ] )
+    dirListString = ','.join( [ str( d ) for d in toQuery ] )
 
-    req = "SELECT DirID,DirName FROM FC_DirectoryLevelTree WHERE DirID in ( %s )" % dirListString
+    req = "SELECT DirID,DirName,Level FROM FC_DirectoryLevelTree WHERE DirID in ( %s )" % dirListString
     result = self.db._query(req)
     if not result['OK']:
       return result
-    if not result['Value']:
+    if not result['Value'] and not resultDict:
       return S_ERROR('Directories not found: %s' % dirListString )
 
-    resultDict = {}
-    for row in result['Value']:
-      resultDict[int(row[0])] = row[1]
+    for dirID, dirName, level in result['Value']:
+      resultDict[int(dirID)] = dirName
+      self.dirCache.add( os.path.normpath( dirName ), int( dirID ), level )
 
     return S_OK(resultDict) 
  
@@ -500,6 +535,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
         # We have created a new directory but let's keep the old ID
         req = "UPDATE FC_DirectoryLevelTree SET DirID=%s WHERE DirID=%s" % ( oldParentID, parentID )
         result = self.db._update( req )
+        self.dirCache.removeDirID( parentID )
         if not result['OK']:
           continue
         req = "UPDATE FC_DirectoryInfo SET DirID=%s WHERE DirID=%s" % ( oldParentID, parentID )
@@ -544,6 +580,7 @@ class DirectoryLevelTree(DirectoryTreeBase):
   def __rebuildLevelIndexes( self, parentID, connection=False ):
     """ Rebuild level indexes for all the subdirectories
     """        
+    self.dirCache.clear()
     result = self.__getNumericPath( parentID, connection )
     if not result['OK']:
       return result  
@@ -23,6 +23,9 @@ class DirectoryNodeTree( DirectoryTreeBase ):
   def findDir( self, path ):
     """ Find the identifier of a directory specified by its path
     """
+    cached = self.dirCache.getDirID( path )
+    if cached:
+      return S_OK( cached[0] )
     dpath = path
     if path[0] == "/":
       dpath = path[1:]
@@ -43,6 +46,7 @@ class DirectoryNodeTree( DirectoryTreeBase ):
     if not result['Value']:
       return S_OK( 0 )
 
+    self.dirCache.add( path, result['Value'][0][0] )
     return S_OK( result['Value'][0][0] )
 
   def makeDir( self, path ):
@@ -0,0 +1,223 @@
+########################################################################
+# $HeadURL $
+########################################################################
+""" DIRAC FileCatalog component caching the directory path <-> DirID mapping
+
+    The cache is bounded: when it grows over its maximum size the least
+    recently used entries are evicted. Entries also expire after a lifetime
+    so that changes done by other FileCatalog service instances sharing the
+    same database are eventually seen.
+
+    Only existing directories are cached, a lookup of a non existing path is
+    always done in the database.
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import threading
+
+from DIRAC import gMonitor
+
+# Default maximum number of cached directories
+DIRECTORY_CACHE_SIZE = 200000
+# Default lifetime of the cached entries in seconds
+DIRECTORY_CACHE_LIFETIME = 600
+# Fraction of the cache evicted when it is full
+EVICTION_FRACTION = 0.1
+# Period of the reporting of the hit/miss counters to the monitoring
+MONITORING_PERIOD = 60
+
+class DirectoryPathCache( object ):
+  """ Thread safe LRU cache of directory paths and their IDs, shared by all the
+      handler threads using the same directory tree object
+  """
+
+  def __init__( self, maxSize = DIRECTORY_CACHE_SIZE, lifeTime = DIRECTORY_CACHE_LIFETIME ):
+    """ c'tor
+
+    :param int maxSize: max number of cached directories, 0 disables the cache
+    :param int lifeTime: max age of the cached entries in seconds
+    """
+    self.__lock = threading.Lock()
+    self.maxSize = max( int( maxSize ), 0 )
+    self.lifeTime = lifeTime
+    # path -> [ dirID, level, expiration time, last access tick ]
+    self.__paths = {}
+    # dirID -> path
+    self.__dirIDs = {}
+    self.__tick = 0
+    self.__hits = 0
+    self.__misses = 0
+    self.__reportedHits = 0
+    self.__reportedMisses = 0
+    self.__lastReport = time.time()
+
+    gMonitor.registerActivity( "DirectoryCacheHits", "Directory path cache hits",
+                               "FileCatalogHandler", "lookups/min", gMonitor.OP_SUM )
+    gMonitor.registerActivity( "DirectoryCacheMisses", "Directory path cache misses",
+                               "FileCatalogHandler", "lookups/min", gMonitor.OP_SUM )
+    gMonitor.registerActivity( "DirectoryCacheSize", "Directories in the path cache",
+                               "FileCatalogHandler", "directories", gMonitor.OP_MEAN )
+
+  def __len__( self ):
+    return len( self.__paths )
+
+  def isEnabled( self ):
+    """ Check if the cache is in use
+    """
+    return self.maxSize > 0
+
+  def getDirID( self, path ):
+    """ Get the cached ID and level of a directory
+
+    :param str path: normalized directory path
+    :return: tuple ( dirID, level ) or None if the path is not cached
+    """
+    if not self.maxSize:
+      return None
+    self.__lock.acquire()
+    try:
+      entry = self.__paths.get( path )
+      if entry and entry[2] < time.time():
+        self.__remove( path )
+        entry = None
+      if entry:
+        self.__tick += 1
+        entry[3] = self.__tick
+        self.__hits += 1
+        result = ( entry[0], entry[1] )
+      else:
+        self.__misses += 1
+        result = None
+    finally:
+      self.__lock.release()
+    self.__report()
+    return result
+
+  def getPath( self, dirID ):
+    """ Get the cached path of a directory
+
+    :param int dirID: directory ID
+    :return: path or None if the directory is not cached
+    """
+    if not self.maxSize:
+      return None
+    self.__lock.acquire()
+    try:
+      path = self.__dirIDs.get( dirID )
+      entry = self.__paths.get( path )
+      if entry and entry[2] < time.time():
+        self.__remove( path )
+        entry = None
+      if entry:
+        self.__tick += 1
+        entry[3] = self.__tick
+        self.__hits += 1
+      else:
+        self.__misses += 1
+        path = None
+    finally:
+      self.__lock.release()
+    self.__report()
+    return path
+
+  def add( self, path, dirID, level = None ):
+    """ Add a directory to the cache
+
+    :param str path: normalized directory path
+    :param int dirID: directory ID
+    :param level: directory level if known by the directory tree
+    """
+    if not self.maxSize or not dirID:
+      return
+    self.__lock.acquire()
+    try:
+      if path in self.__paths:
+        self.__remove( path )
+      oldPath = self.__dirIDs.get( dirID )
+      if oldPath is not None:
+        self.__remove( oldPath )
+      self.__tick += 1
+      self.__paths[ path ] = [ dirID, level, time.time() + self.lifeTime, self.__tick ]
+      self.__dirIDs[ dirID ] = path
+      if len( self.__paths ) > self.maxSize:
+        self.__evict()
+    finally:
+      self.__lock.release()
+
+  def removePath( self, path ):
+    """ Invalidate the cache entry of a directory given its path
+    """
+    self.__lock.acquire()
+    try:
+      self.__remove( path )
+    finally:
+      self.__lock.release()
+
+  def removeDirID( self, dirID ):
+    """ Invalidate the cache entry of a directory given its ID
+    """
+    self.__lock.acquire()
+    try:
+      path = self.__dirIDs.get( dirID )
+      if path is not None:
+        self.__remove( path )
+    finally:
+      self.__lock.release()
+
+  def clear( self ):
+    """ Invalidate all the cache entries
+    """
+    self.__lock.acquire()
+    try:
+      self.__paths = {}
+      self.__dirIDs = {}
+    finally:
+      self.__lock.release()
+
+  def getStats( self ):
+    """ Get the cache counters since the creation of the cache
+    """
+    return { 'Size' : len( self.__paths ),
+             'MaxSize' : self.maxSize,
+             'Hits' : self.__hits,
+             'Misses' : self.__misses }
+
+  def __remove( self, path ):
+    """ Remove an entry, the lock has to be held
+    """
+    entry = self.__paths.pop( path, None )
+    if entry and self.__dirIDs.get( entry[0] ) == path:
+      del self.__dirIDs[ entry[0] ]
+
+  def __evict( self ):
+    """ Remove the least recently used entries, the lock has to be held
+    """
+    numToEvict = len( self.__paths ) - self.maxSize + int( self.maxSize * EVICTION_FRACTION )
+    lruPaths = sorted( self.__paths.items(), key = lambda item: item[1][3] )[ :numToEvict ]
+    for path, _entry in lruPaths:
+      self.__remove( path )
+
+  def __report( self ):
+    """ Send the hit/miss counters accumulated since the last report to the monitoring.
+        Marks are aggregated to avoid one mark per lookup
+    """
+    now = time.time()
+    if now - self.__lastReport < MONITORING_PERIOD:
+      return
+    self.__lock.acquire()
+    try:
+      if now - self.__lastReport < MONITORING_PERIOD:
+        return
+      self.__lastReport = now
+      hits = self.__hits - self.__reportedHits
+      misses = self.__misses - self.__reportedMisses
+      self.__reportedHits = self.__hits
+      self.__reportedMisses = self.__misses
+      size = len( self.__paths )
+    finally:
+      self.__lock.release()
+    gMonitor.addMark( "DirectoryCacheHits", hits )
+    gMonitor.addMark( "DirectoryCacheMisses", misses )
+    gMonitor.addMark( "DirectoryCacheSize", size )
@@ -20,6 +20,9 @@ class DirectorySimpleTree( DirectoryTreeBase ):
 
   def findDir( self, path ):
     
+    cached = self.dirCache.getDirID( path )
+    if cached:
+      return S_OK( cached[0] )
     req = "SELECT DirID from FC_DirectoryTree WHERE DirName='%s'" % path
     result = self.db._query(req)
     if not result['OK']:
@@ -28,6 +31,7 @@ class DirectorySimpleTree( DirectoryTreeBase ):
     if not result['Value']:
       return S_OK('')
     
+    self.dirCache.add( path, result['Value'][0][0] )
     return S_OK( result['Value'][0][0] )
   
   def removeDir( self, path ):
@@ -43,6 +47,7 @@ class DirectorySimpleTree( DirectoryTreeBase ):
     dirID = result['Value']
     req = "DELETE FROM FC_DirectoryTree WHERE DirID=%d" % dirID
     result = self.db._update(req)
+    self.dirCache.removeDirID( dirID )
     return result
 
   def makeDir( self, path ):
@@ -97,6 +102,9 @@ class DirectorySimpleTree( DirectoryTreeBase ):
   def getDirectoryPath( self, dirID ):
     """ Get directory name by directory ID
     """
+    dirPath = self.dirCache.getPath( int(dirID) )
+    if dirPath:
+      return S_OK( dirPath )
     req = "SELECT DirName FROM FC_DirectoryTree WHERE DirID=%d" % int(dirID)
     result = self.db._query(req)
     if not result['OK']:
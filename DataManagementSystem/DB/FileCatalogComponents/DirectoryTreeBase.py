@@ -6,6 +6,8 @@
 __RCSID__ = "$Id$"
 
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities  import checkArgumentFormat
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryPathCache import DirectoryPathCache, \
+                                                                       DIRECTORY_CACHE_SIZE, DIRECTORY_CACHE_LIFETIME
 from DIRAC                                                          import S_OK, S_ERROR, gLogger
 import time, threading, os
 from types import StringTypes, ListType
@@ -20,6 +22,9 @@ class DirectoryTreeBase:
     self.db = database
     self.lock = threading.Lock()
     self.treeTable = ''
+    # Path <-> DirID cache shared by all the threads using this directory tree
+    self.dirCache = DirectoryPathCache( getattr( database, 'directoryCacheSize', DIRECTORY_CACHE_SIZE ),
+                                        getattr( database, 'directoryCacheLifeTime', DIRECTORY_CACHE_LIFETIME ) )
 
 ############################################################################
 #
@@ -81,6 +86,11 @@ class DirectoryTreeBase:
   def setDatabase(self,database):
     self.db = database  
 
+  def getDirectoryCacheStats( self ):
+    """ Get the counters of the directory path cache
+    """
+    return S_OK( self.dirCache.getStats() )
+
   def makeDirectory(self,path,credDict,status=0):
     """Create a new directory. The return value is the dictionary
        containing all the parameters of the newly created directory
@@ -38,6 +38,13 @@ class DirectoryClosure( DirectoryTreeBase ):
     """
 
     dpath = os.path.normpath( path )
+    cached = self.dirCache.getDirID( dpath )
+    # Entries cached by findDirs do not know the level
+    if cached and cached[1] is not None:
+      res = S_OK( cached[0] )
+      res['Level'] = cached[1]
+      return res
+
     result = self.db.executeStoredProcedure( 'ps_find_dir', ( dpath, 'ret1', 'ret2' ), outputIds = [1, 2] )
     if not result['OK']:
       return result
@@ -45,6 +52,7 @@ class DirectoryClosure( DirectoryTreeBase ):
     if not result['Value']:
       return S_OK( 0 )
 
+    self.dirCache.add( dpath, result['Value'][0], result['Value'][1] )
     res = S_OK( result['Value'][0] )
     res['Level'] = result['Value'][1]
     return res
@@ -58,14 +66,23 @@ class DirectoryClosure( DirectoryTreeBase ):
     """
 
     dirDict = {}
-    if not paths:
+    toQuery = []
+    for path in paths:
+      dpath = os.path.normpath( path )
+      cached = self.dirCache.getDirID( dpath )
+      if cached:
+        dirDict[dpath] = cached[0]
+      else:
+        toQuery.append( dpath )
+    if not toQuery:
       return S_OK( dirDict )
-    dpaths = stringListToString( [os.path.normpath( path ) for path in paths ] )
+    dpaths = stringListToString( toQuery )
     result = self.db.executeStoredProcedureWithCursor( 'ps_find_dirs', ( dpaths, ) )
     if not result['OK']:
       return result
     for dirName, dirID in result['Value']:
       dirDict[dirName] = dirID
+      self.dirCache.add( dirName, dirID )
 
     return S_OK( dirDict )
 
@@ -92,6 +109,7 @@ class DirectoryClosure( DirectoryTreeBase ):
 
     dirId = result['Value']
     result = self.db.executeStoredProcedure( 'ps_remove_dir', ( dirId, ), outputIds = [] )
+    self.dirCache.removeDirID( dirId )
     if not result['OK']:
       return result
 
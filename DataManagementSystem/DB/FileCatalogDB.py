@@ -10,6 +10,7 @@ from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectorySimpleTree   i
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryNodeTree     import DirectoryNodeTree
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryLevelTree    import DirectoryLevelTree
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryFlatTree     import DirectoryFlatTree
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryPathCache    import DIRECTORY_CACHE_SIZE, DIRECTORY_CACHE_LIFETIME
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.WithFkAndPs.DirectoryClosure      import DirectoryClosure
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.FileManagerFlat       import FileManagerFlat
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.FileManager           import FileManager
@@ -59,6 +60,8 @@ class FileCatalogDB( DB ):
     self.validReplicaStatus = databaseConfig['ValidReplicaStatus']
     self.visibleFileStatus = databaseConfig['VisibleFileStatus']
     self.visibleReplicaStatus = databaseConfig['VisibleReplicaStatus']
+    self.directoryCacheSize = databaseConfig.get( 'DirectoryCacheSize', DIRECTORY_CACHE_SIZE )
+    self.directoryCacheLifeTime = databaseConfig.get( 'DirectoryCacheLifeTime', DIRECTORY_CACHE_LIFETIME )
 
     try:
       # Obtain the plugins to be used for DB interaction
@@ -0,0 +1,80 @@
+""" Unit tests of the FileCatalog directory path cache
+"""
+
+import time
+import unittest
+
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryPathCache import DirectoryPathCache
+
+class DirectoryPathCacheTestCase( unittest.TestCase ):
+  """ Base class for the DirectoryPathCache test cases
+  """
+
+  def setUp( self ):
+    self.cache = DirectoryPathCache( maxSize = 10, lifeTime = 600 )
+
+  def test_lookup( self ):
+    """ path -> DirID and DirID -> path lookups
+    """
+    self.assertEqual( self.cache.getDirID( '/vo/user' ), None )
+    self.cache.add( '/vo/user', 12, 2 )
+    self.assertEqual( self.cache.getDirID( '/vo/user' ), ( 12, 2 ) )
+    self.assertEqual( self.cache.getPath( 12 ), '/vo/user' )
+    self.assertEqual( self.cache.getPath( 13 ), None )
+    stats = self.cache.getStats()
+    self.assertEqual( stats['Hits'], 2 )
+    self.assertEqual( stats['Misses'], 2 )
+    self.assertEqual( stats['Size'], 1 )
+
+  def test_invalidation( self ):
+    """ Entries removed by path, by ID or all at once
+    """
+    self.cache.add( '/vo/a', 1, 2 )
+    self.cache.add( '/vo/b', 2, 2 )
+    self.cache.add( '/vo/c', 3, 2 )
+    self.cache.removePath( '/vo/a' )
+    self.assertEqual( self.cache.getDirID( '/vo/a' ), None )
+    self.assertEqual( self.cache.getPath( 1 ), None )
+    self.cache.removeDirID( 2 )
+    self.assertEqual( self.cache.getDirID( '/vo/b' ), None )
+    self.cache.clear()
+    self.assertEqual( len( self.cache ), 0 )
+    # A path pointing to a new ID replaces the old mapping
+    self.cache.add( '/vo/d', 4 )
+    self.cache.add( '/vo/d', 5 )
+    self.assertEqual( self.cache.getPath( 4 ), None )
+    self.assertEqual( self.cache.getDirID( '/vo/d' ), ( 5, None ) )
+
+  def test_eviction( self ):
+    """ The least recently used entries are evicted first
+    """
+    for dirID in range( 1, 11 ):
+      self.cache.add( '/vo/dir%d' % dirID, dirID )
+    # Use the first entry so it becomes the most recently used
+    self.assertTrue( self.cache.getDirID( '/vo/dir1' ) )
+    self.cache.add( '/vo/dir11', 11 )
+    self.assertTrue( len( self.cache ) <= 10 )
+    self.assertTrue( self.cache.getDirID( '/vo/dir1' ) )
+    self.assertTrue( self.cache.getDirID( '/vo/dir11' ) )
+    self.assertEqual( self.cache.getDirID( '/vo/dir2' ), None )
+
+  def test_expiration( self ):
+    """ Expired entries are not returned
+    """
+    cache = DirectoryPathCache( maxSize = 10, lifeTime = 0.1 )
+    cache.add( '/vo/user', 12, 2 )
+    time.sleep( 0.2 )
+    self.assertEqual( cache.getDirID( '/vo/user' ), None )
+    self.assertEqual( len( cache ), 0 )
+
+  def test_disabled( self ):
+    """ A cache with size 0 never stores anything
+    """
+    cache = DirectoryPathCache( maxSize = 0 )
+    cache.add( '/vo/user', 12, 2 )
+    self.assertEqual( cache.getDirID( '/vo/user' ), None )
+    self.assertFalse( cache.isEnabled() )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DirectoryPathCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -59,7 +59,9 @@ def initializeFileCatalogHandler( serviceInfo ):
                     'ValidFileStatus'     : ['AprioriGood','Trash','Removing','Probing'],
                     'ValidReplicaStatus'  : ['AprioriGood','Trash','Removing','Probing'],
                     'VisibleFileStatus'   : ['AprioriGood'],
-                    'VisibleReplicaStatus': ['AprioriGood']}
+                    'VisibleReplicaStatus': ['AprioriGood'],
+                    'DirectoryCacheSize'  : 200000,
+                    'DirectoryCacheLifeTime': 600 }
   for configKey in sortList( defaultConfig.keys() ):
     defaultValue = defaultConfig[configKey]
     configValue = getServiceOption( serviceInfo, configKey, defaultValue )
@@ -2,11 +2,12 @@
     It ensures that all operations are performed on the desired catalogs.
 """
 
-import types, re
+import types, re, time, threading
 
 from DIRAC  import gLogger, gConfig, S_OK, S_ERROR
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations    import Operations
 from DIRAC.Core.Security.ProxyInfo                          import getVOfromProxyGroup
+from DIRAC.Core.DISET.ThreadConfig                          import ThreadConfig
 from DIRAC.Resources.Utilities                              import checkArgumentFormat
 from DIRAC.Resources.Catalog.FileCatalogFactory             import FileCatalogFactory
 
@@ -46,6 +47,11 @@ class FileCatalog( object ):
     self.vo = vo if vo else getVOfromProxyGroup().get( 'Value', None )
 
     self.opHelper = Operations( vo = self.vo )
+    # In concurrent mode the catalogs are called in parallel, each one with its Timeout
+    self.concurrent = self.opHelper.getValue( '/Services/Catalogs/ConcurrentExecution', False )
+    self.catalogTimeouts = {}
+    self.__timings = {}
+    self.__timingsLock = threading.Lock()
 
     if catalogs is None:
       catalogList = []
@@ -80,16 +86,97 @@ class FileCatalog( object ):
 
 
   def __getattr__( self, name ):
-    self.call = name
+    # The method name goes with the executor, the same object can be used by several threads
     if name in FileCatalog.write_methods:
-      return self.w_execute
+      return lambda *parms, **kws: self.w_execute( name, *parms, **kws )
     elif name in FileCatalog.ro_methods:
-      return self.r_execute
+      return lambda *parms, **kws: self.r_execute( name, *parms, **kws )
     else:
       raise AttributeError
 
-  def w_execute( self, *parms, **kws ):
+  def getCatalogTimings( self ):
+    """ Get the time spent in the calls to each catalog:
+        { catalogName : { method : { 'Calls', 'Time', 'MaxTime', 'Timeouts' } } }
+    """
+    self.__timingsLock.acquire()
+    try:
+      timings = {}
+      for catalogName, methodDict in self.__timings.items():
+        timings[catalogName] = {}
+        for method, ( calls, totalTime, maxTime, timeouts ) in methodDict.items():
+          timings[catalogName][method] = { 'Calls' : calls, 'Time' : totalTime,
+                                           'MaxTime' : maxTime, 'Timeouts' : timeouts }
+    finally:
+      self.__timingsLock.release()
+    return S_OK( timings )
+
+  def __addTiming( self, catalogName, call, elapsed, timeout = False ):
+    """ Account the time of a call to a catalog
+    """
+    gLogger.debug( "FileCatalog: %s on %s took %.3f s" % ( call, catalogName, elapsed ) )
+    self.__timingsLock.acquire()
+    try:
+      stats = self.__timings.setdefault( catalogName, {} ).setdefault( call, [ 0, 0., 0., 0 ] )
+      stats[0] += 1
+      stats[1] += elapsed
+      stats[2] = max( stats[2], elapsed )
+      if timeout:
+        stats[3] += 1
+    finally:
+      self.__timingsLock.release()
+
+  def __callCatalog( self, catalogName, call, method, parms, kws ):
+    """ Call a catalog method and account its time
+    """
+    start = time.time()
+    try:
+      res = method( *parms, **kws )
+    except Exception, x:
+      gLogger.exception( "FileCatalog: exception in %s on %s" % ( call, catalogName ), lException = x )
+      res = S_ERROR( "Exception in %s on %s: %s" % ( call, catalogName, str( x ) ) )
+    self.__addTiming( catalogName, call, time.time() - start )
+    return res
+
+  def __callCatalogs( self, call, catalogCalls, timeout = True ):
+    """ Execute the ( catalogName, method, parms, kws ) calls in parallel, each one
+        with the timeout of its catalog unless timeout is False. Return the results
+        in the same order
+    """
+    results = [ None ] * len( catalogCalls )
+    # The credentials delegated to this thread are used by the workers too
+    threadID = ThreadConfig().dump()
+    def execute( index, catalogName, method, parms, kws ):
+      ThreadConfig().load( threadID )
+      results[index] = self.__callCatalog( catalogName, call, method, parms, kws )
+
+    start = time.time()
+    threads = []
+    for index, ( catalogName, method, parms, kws ) in enumerate( catalogCalls ):
+      thread = threading.Thread( target = execute, args = ( index, catalogName, method, parms, kws ) )
+      thread.setDaemon( True )
+      thread.start()
+      threads.append( thread )
+    for index, thread in enumerate( threads ):
+      catalogName = catalogCalls[index][0]
+      if not timeout:
+        thread.join()
+        continue
+      thread.join( max( 0, start + self.catalogTimeouts.get( catalogName, self.timeout ) - time.time() ) )
+      if results[index] is None:
+        # The thread is left to finish on its own
+        gLogger.error( "FileCatalog: timeout in %s on %s" % ( call, catalogName ) )
+        self.__addTiming( catalogName, call, time.time() - start, timeout = True )
+        results[index] = S_ERROR( "Timeout in %s on %s" % ( call, catalogName ) )
+    return results
+
+  def w_execute( self, call, *parms, **kws ):
     """ Write method executor.
+
+        In concurrent mode the master catalogs are called first, then all the other
+        catalogs are called in parallel with what succeeded in the master catalogs.
+        The results are merged in the order of the catalogs as in sequential mode.
+        The write calls are not given up after a timeout, as they would still be done
+        while reported as failed
     """
     successful = {}
     failed = {}
@@ -102,23 +189,52 @@ class FileCatalog( object ):
     allLfns = fileInfo.keys()
     parms1 = parms[1:]
     lfnsFlag = False
-    for catalogName, oCatalog, master in self.writeCatalogs:
 
+    catalogs = []
+    for catalogName, oCatalog, master in self.writeCatalogs:
       # Skip if metadata related method on pure File Catalog
-      if self.call in FileCatalog.write_meta_methods and not catalogName in self.metaCatalogs:
+      if call in FileCatalog.write_meta_methods and not catalogName in self.metaCatalogs:
         continue
-
-      method = getattr( oCatalog, self.call )
-      if self.call in FileCatalog.write_meta_methods:
-        res = method( *parms, **kws )
+      catalogs.append( ( catalogName, getattr( oCatalog, call ), master ) )
+
+    def getCallArguments( fileInfo ):
+      if call in FileCatalog.write_meta_methods:
+        return parms
+      return ( fileInfo, ) + parms1
+
+    results = {}
+    if self.concurrent:
+      # The master catalogs first, then all the others in parallel with the files that did
+      # not fail in the masters
+      masters = [ index for index in range( len( catalogs ) ) if catalogs[index][2] ]
+      for index in masters:
+        catalogName, method, _master = catalogs[index]
+        res = self.__callCatalog( catalogName, call, method, getCallArguments( fileInfo ), kws )
+        if not res['OK']:
+          gLogger.error( "FileCatalog.w_execute: Failed to execute call on master catalog",
+                         "%s on %s: %s" % ( call, catalogName, res['Message'] ) )
+          return res
+        if 'Failed' in res['Value']:
+          for lfn in res['Value']['Failed']:
+            fileInfo.pop( lfn, None )
+        results[index] = res
+      others = [ index for index in range( len( catalogs ) ) if not catalogs[index][2] ]
+      results.update( zip( others, self.__callCatalogs( call, [ ( catalogs[i][0], catalogs[i][1],
+                                                                  getCallArguments( dict( fileInfo ) ), kws )
+                                                                for i in others ], timeout = False ) ) )
+
+    for index in range( len( catalogs ) ):
+      catalogName, method, master = catalogs[index]
+      if index in results:
+        res = results[index]
       else:
-        res = method( fileInfo, *parms1, **kws )
+        res = self.__callCatalog( catalogName, call, method, getCallArguments( fileInfo ), kws )
 
       if not res['OK']:
         if master:
           # If this is the master catalog and it fails we dont want to continue with the other catalogs
           gLogger.error( "FileCatalog.w_execute: Failed to execute call on master catalog",
-                         "%s on %s: %s" % ( self.call, catalogName, res['Message'] ) )
+                         "%s on %s: %s" % ( call, catalogName, res['Message'] ) )
           return res
         else:
           # Otherwise we keep the failed catalogs so we can update their state later
@@ -145,19 +261,32 @@ class FileCatalog( object ):
     else:
       return res
 
-  def r_execute( self, *parms, **kws ):
+  def r_execute( self, call, *parms, **kws ):
     """ Read method executor.
+
+        In concurrent mode all the catalogs are called in parallel, the results
+        are merged in the order of the catalogs as in sequential mode
     """
     successful = {}
     failed = {}
-    for catalogName, oCatalog, _master in self.readCatalogs:
 
+    catalogs = []
+    for catalogName, oCatalog, _master in self.readCatalogs:
       # Skip if metadata related method on pure File Catalog
-      if self.call in FileCatalog.ro_meta_methods and not catalogName in self.metaCatalogs:
+      if call in FileCatalog.ro_meta_methods and not catalogName in self.metaCatalogs:
         continue
+      catalogs.append( ( catalogName, getattr( oCatalog, call ) ) )
 
-      method = getattr( oCatalog, self.call )
-      res = method( *parms, **kws )
+    results = None
+    if self.concurrent and len( catalogs ) > 1:
+      results = self.__callCatalogs( call, [ ( catalogName, method, parms, kws ) for catalogName, method in catalogs ] )
+
+    for index in range( len( catalogs ) ):
+      if results is None:
+        catalogName, method = catalogs[index]
+        res = self.__callCatalog( catalogName, call, method, parms, kws )
+      else:
+        res = results[index]
       if res['OK']:
         if 'Successful' in res['Value']:
           for key, item in res['Value']['Successful'].items():
@@ -169,7 +298,7 @@ class FileCatalog( object ):
         else:
           return res
     if not successful and not failed:
-      return S_ERROR( "Failed to perform %s from any catalog" % self.call )
+      return S_ERROR( "Failed to perform %s from any catalog" % call )
     return S_OK( {'Failed':failed, 'Successful':successful} )
 
   ###########################################################################################
@@ -230,6 +359,7 @@ class FileCatalog( object ):
       oCatalog = res['Value']
       self.readCatalogs.append( ( catalogName, oCatalog, True ) )
       self.writeCatalogs.append( ( catalogName, oCatalog, True ) )
+      self.__setCatalogTimeout( catalogName, catalogConfig )
       if catalogConfig.get( 'MetaCatalog' ) == 'True':
         self.metaCatalogs.append( catalogName )
     return S_OK()
@@ -275,6 +405,7 @@ class FileCatalog( object ):
           return res
         oCatalog = res['Value']
         master = catalogConfig['Master']
+        self.__setCatalogTimeout( catalogName, catalogConfig )
         # If the catalog is read type
         if re.search( 'Read', catalogConfig['AccessType'] ):
           if master:
@@ -291,6 +422,15 @@ class FileCatalog( object ):
         self.metaCatalogs.append( catalogName )
     return S_OK()
 
+  def __setCatalogTimeout( self, catalogName, catalogConfig ):
+    """ Timeout of the calls to the catalog in concurrent mode
+    """
+    try:
+      self.catalogTimeouts[catalogName] = float( catalogConfig.get( 'Timeout', self.timeout ) )
+    except ValueError:
+      gLogger.warn( "FileCatalog: invalid Timeout option", catalogName )
+      self.catalogTimeouts[catalogName] = self.timeout
+
   def _getCatalogConfigDetails( self, catalogName ):
     # First obtain the options that are available
     catalogConfigPath = '%s/%s' % ( self.rootConfigPath, catalogName )
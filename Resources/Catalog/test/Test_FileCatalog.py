@@ -0,0 +1,149 @@
+""" Unit tests of the FileCatalog dispatching in sequential and concurrent modes
+"""
+
+import threading
+import time
+import unittest
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.DISET.ThreadConfig import ThreadConfig
+from DIRAC.Resources.Catalog.FileCatalog import FileCatalog
+
+class FakeCatalog( object ):
+  """ Catalog answering after a delay, failing for the LFNs in failedLFNs
+  """
+
+  def __init__( self, delay = 0., failedLFNs = None, error = None, value = None ):
+    self.delay = delay
+    self.failedLFNs = failedLFNs or []
+    self.error = error
+    # Answer without the Successful and Failed dictionaries
+    self.value = value
+    self.calls = []
+    self.ids = []
+
+  def __answer( self, lfns ):
+    self.calls.append( sorted( lfns ) )
+    self.ids.append( ThreadConfig().getID() )
+    time.sleep( self.delay )
+    if self.error:
+      return S_ERROR( self.error )
+    if self.value is not None:
+      return S_OK( self.value )
+    successful = dict( [ ( lfn, True ) for lfn in lfns if lfn not in self.failedLFNs ] )
+    failed = dict( [ ( lfn, 'Failed' ) for lfn in lfns if lfn in self.failedLFNs ] )
+    return S_OK( { 'Successful' : successful, 'Failed' : failed } )
+
+  def addFile( self, lfns ):
+    return self.__answer( lfns )
+
+  def exists( self, lfns ):
+    return self.__answer( lfns )
+
+  def removeFile( self, lfns ):
+    return self.__answer( [ 'removed:%s' % lfn for lfn in lfns ] )
+
+class FileCatalogTestCase( unittest.TestCase ):
+  """ The concurrent mode gives the same results as the sequential one
+  """
+
+  def getFileCatalog( self, catalogs, concurrent ):
+    fileCatalog = FileCatalog( catalogs = [], vo = 'test' )
+    fileCatalog.concurrent = concurrent
+    for catalogName, oCatalog, master in catalogs:
+      fileCatalog.readCatalogs.append( ( catalogName, oCatalog, master ) )
+      fileCatalog.writeCatalogs.append( ( catalogName, oCatalog, master ) )
+    return fileCatalog
+
+  def test_write( self ):
+    """ The files failing in the master are not sent to the other catalogs
+    """
+    lfns = { '/a' : {}, '/b' : {}, '/c' : {} }
+    for concurrent in ( False, True ):
+      master = FakeCatalog( failedLFNs = [ '/a' ] )
+      second = FakeCatalog( delay = 0.2, failedLFNs = [ '/b' ] )
+      third = FakeCatalog( delay = 0.2, error = 'Down' )
+      fileCatalog = self.getFileCatalog( [ ( 'Master', master, True ), ( 'Second', second, False ),
+                                           ( 'Third', third, False ) ], concurrent )
+      start = time.time()
+      result = fileCatalog.addFile( dict( lfns ) )
+      elapsed = time.time() - start
+      self.assertTrue( result['OK'] )
+      self.assertEqual( second.calls, [ [ '/b', '/c' ] ] )
+      self.assertEqual( sorted( result['Value']['Successful'] ), [ '/b', '/c' ] )
+      self.assertEqual( result['Value']['Failed']['/a'], { 'Master' : 'Failed', 'Third' : 'Down' } )
+      self.assertEqual( result['Value']['Failed']['/b'], { 'Second' : 'Failed', 'Third' : 'Down' } )
+      self.assertEqual( elapsed < 0.3, concurrent )
+      timings = fileCatalog.getCatalogTimings()['Value']
+      self.assertEqual( timings['Second']['addFile']['Calls'], 1 )
+
+  def test_read( self ):
+    """ The first catalog giving an answer wins, slow catalogs time out
+    """
+    lfns = [ '/a', '/b' ]
+    for concurrent in ( False, True ):
+      first = FakeCatalog( failedLFNs = [ '/a' ] )
+      second = FakeCatalog( delay = 0.1 )
+      fileCatalog = self.getFileCatalog( [ ( 'First', first, True ), ( 'Second', second, False ) ], concurrent )
+      result = fileCatalog.exists( lfns )
+      self.assertTrue( result['OK'] )
+      self.assertEqual( sorted( result['Value']['Successful'] ), lfns )
+      self.assertEqual( result['Value']['Failed'], {} )
+    slow = FakeCatalog( delay = 1. )
+    fileCatalog = self.getFileCatalog( [ ( 'First', FakeCatalog( failedLFNs = [ '/a' ] ), True ),
+                                         ( 'Slow', slow, False ) ], True )
+    fileCatalog.catalogTimeouts['Slow'] = 0.1
+    result = fileCatalog.exists( lfns )
+    self.assertEqual( result['Value']['Failed'], { '/a' : 'Failed' } )
+    self.assertEqual( fileCatalog.getCatalogTimings()['Value']['Slow']['exists']['Timeouts'], 1 )
+
+  def test_writeOrder( self ):
+    """ The results are merged in the order of the catalogs, not with the masters first
+    """
+    results = []
+    for concurrent in ( False, True ):
+      first = FakeCatalog( value = 'first' )
+      master = FakeCatalog( value = 'master' )
+      fileCatalog = self.getFileCatalog( [ ( 'First', first, False ), ( 'Master', master, True ) ], concurrent )
+      results.append( fileCatalog.addFile( { '/a' : {} } ) )
+    self.assertEqual( results[0], S_OK( 'master' ) )
+    self.assertEqual( results[1], results[0] )
+
+  def test_writeTimeout( self ):
+    """ Slow write calls are waited for, they are not reported as failed while running
+    """
+    slow = FakeCatalog( delay = 0.3 )
+    fileCatalog = self.getFileCatalog( [ ( 'Master', FakeCatalog(), True ), ( 'Slow', slow, False ) ], True )
+    fileCatalog.catalogTimeouts['Slow'] = 0.1
+    result = fileCatalog.addFile( { '/a' : {} } )
+    self.assertEqual( result['Value']['Successful']['/a'], { 'Master' : True, 'Slow' : True } )
+    self.assertEqual( result['Value']['Failed'], {} )
+
+  def test_threads( self ):
+    """ The calls of several threads on the same object go to the right methods, with the
+        credentials of the calling thread
+    """
+    catalog = FakeCatalog( delay = 0.01 )
+    fileCatalog = self.getFileCatalog( [ ( 'Master', catalog, True ), ( 'Other', FakeCatalog(), False ) ], True )
+    errors = []
+    def run( method, prefix ):
+      ThreadConfig().setID( '/CN=%s' % method, 'group' )
+      for i in range( 20 ):
+        lfn = '/%s/%d' % ( method, i )
+        result = getattr( fileCatalog, method )( { lfn : {} } )
+        if sorted( result['Value']['Successful'] ) != [ prefix + lfn ]:
+          errors.append( ( method, result ) )
+    threads = [ threading.Thread( target = run, args = ( 'addFile', '' ) ),
+                threading.Thread( target = run, args = ( 'removeFile', 'removed:' ) ) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual( errors, [] )
+    self.assertEqual( set( catalog.ids ), set( [ ( '/CN=addFile', 'group' ), ( '/CN=removeFile', 'group' ) ] ) )
+    for callLfns, ( dn, _group ) in zip( catalog.calls, catalog.ids ):
+      self.assert_( dn[4:] in callLfns[0] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( FileCatalogTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
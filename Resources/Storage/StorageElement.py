@@ -5,6 +5,8 @@ from types import ListType
 __RCSID__ = "$Id$"
 # # custom duty
 import re
+import time
+import threading
 # # from DIRAC
 from DIRAC import gLogger, gConfig
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR, returnSingleResult
@@ -12,6 +14,7 @@ from DIRAC.Resources.Storage.StorageFactory import StorageFactory
 from DIRAC.Core.Utilities.Pfn import pfnparse
 from DIRAC.Core.Utilities.SiteSEMapping import getSEsForSite
 from DIRAC.Core.Security.ProxyInfo import getVOfromProxyGroup
+from DIRAC.Core.DISET.ThreadConfig import ThreadConfig
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.Core.Utilities.DictCache import DictCache
 from DIRAC.Resources.Utilities import checkArgumentFormat
@@ -49,6 +52,12 @@ class StorageElementItem( object ):
   self.remotePlugins is a list of the remote protocols that were created by StorageFactory
   self.protocolOptions is a list of dictionaries containing the options found in the CS. (should be removed)
 
+  The operations on independent files ( exists, getFileMetadata, removeFile, ... ) are split in chunks
+  of BulkChunkSize files, BulkWorkers chunks being executed at the same time by each plugin. Both options
+  are taken from the SE section or from /Resources/StorageElements, by default there is no splitting.
+  Each worker thread uses its own instance of the plugin.
+  getOperationStatistics gives the number of files, time and throughput of the operations per method.
+
 
 
   dynamic method :
@@ -165,6 +174,18 @@ class StorageElementItem( object ):
 
     self.log = gLogger.getSubLogger( "SE[%s]" % self.name )
     self.useCatalogURL = gConfig.getValue( '/Resources/StorageElements/%s/UseCatalogURL' % self.name, False )
+    # The bulk operations are split in chunks of BulkChunkSize files ( 0 for no splitting ),
+    # BulkWorkers chunks being executed at the same time by each plugin
+    self.bulkChunkSize = gConfig.getValue( '/Resources/StorageElements/%s/BulkChunkSize' % self.name,
+                                           gConfig.getValue( '/Resources/StorageElements/BulkChunkSize', 0 ) )
+    self.bulkWorkers = max( 1, gConfig.getValue( '/Resources/StorageElements/%s/BulkWorkers' % self.name,
+                                                 gConfig.getValue( '/Resources/StorageElements/BulkWorkers', 1 ) ) )
+    # methodName -> [ calls, files, failed files, chunks, time ]
+    self.__statistics = {}
+    self.__statisticsLock = threading.Lock()
+    # storage -> instances of its plugin not used by a chunk worker
+    self.__spareStorages = {}
+    self.__spareStoragesLock = threading.Lock()
 
     #                         'getTransportURL',
     self.readMethods = [ 'getFile',
@@ -182,6 +203,12 @@ class StorageElementItem( object ):
 
     self.removeMethods = [ 'removeFile', 'removeDirectory' ]
 
+    # Methods in which the files are independent, that can be executed by chunks
+    self.chunkMethods = [ 'exists', 'isFile', 'isDirectory', 'getFileMetadata', 'getFileSize',
+                          'getDirectoryMetadata', 'getDirectorySize', 'listDirectory',
+                          'removeFile', 'removeDirectory', 'prestageFile', 'prestageFileStatus',
+                          'pinFile', 'releaseFile' ]
+
     self.checkMethods = [ 'exists',
                           'getDirectoryMetadata',
                           'getDirectorySize',
@@ -193,6 +220,7 @@ class StorageElementItem( object ):
                            ]
 
     self.okMethods = [ 'getLocalProtocols',
+                       'getOperationStatistics',
                        'getProtocols',
                        'getRemoteProtocols',
                        'getStorageElementName',
@@ -677,23 +705,20 @@ class StorageElementItem( object ):
         urlDict = res['Value']['Successful']  # url : lfn
         failed.update( res['Value']['Failed'] )
       else:
-        urlDict = dict( [ ( lfn, lfn ) for lfn in lfnDict ] )
+        urlDict = dict( [ ( lfnName, lfnName ) for lfnName in lfnDict ] )
       if not len( urlDict ):
         self.log.verbose( "StorageElement.__executeMethod No urls generated for protocol %s." % pluginName )
       else:
         self.log.verbose( "StorageElement.__executeMethod: Attempting to perform '%s' for %s physical files" % ( self.methodName,
                                                                                                     len( urlDict ) ) )
-        fcn = None
-        if hasattr( storage, self.methodName ) and callable( getattr( storage, self.methodName ) ):
-          fcn = getattr( storage, self.methodName )
-        if not fcn:
+        if not callable( getattr( storage, self.methodName, None ) ):
           return S_ERROR( "StorageElement.__executeMethod: unable to invoke %s, it isn't a member function of storage" )
 
         urlsToUse = {}  # url : the value of the lfn dictionary for the lfn of this url
         for url in urlDict:
           urlsToUse[url] = lfnDict[urlDict[url]]
 
-        res = fcn( urlsToUse, *args, **kwargs )
+        res = self.__executeChunks( self.methodName, storage, urlsToUse, args, kwargs )
         if not res['OK']:
           errStr = "StorageElement.__executeMethod: Completely failed to perform %s." % self.methodName
           self.log.debug( errStr, '%s with plugin %s: %s' % ( self.name, pluginName, res['Message'] ) )
@@ -720,6 +745,138 @@ class StorageElementItem( object ):
     return S_OK( { 'Failed': failed, 'Successful': successful } )
 
 
+  def __executeChunks( self, methodName, storage, urlDict, args, kwargs ):
+    """ Execute a plugin method on the urls in chunks of bulkChunkSize, up to bulkWorkers
+        chunks at the same time, and merge the results of the chunks.
+        :returns the result of the plugin method, S_ERROR only if all the chunks failed
+    """
+    urls = urlDict.keys()
+    chunkSize = len( urls )
+    if self.bulkChunkSize > 0 and methodName in self.chunkMethods:
+      chunkSize = self.bulkChunkSize
+    chunks = [ dict( [ ( url, urlDict[url] ) for url in urls[i:i + chunkSize] ] )
+               for i in range( 0, len( urls ), chunkSize ) ] or [ {} ]
+
+    start = time.time()
+    if len( chunks ) == 1:
+      res = getattr( storage, methodName )( chunks[0], *args, **kwargs )
+      results = [ res ]
+    else:
+      results = [ None ] * len( chunks )
+      nextChunk = [ 0 ]
+      chunkLock = threading.Lock()
+      # The credentials delegated to this thread are used by the workers too
+      threadID = ThreadConfig().dump()
+      def worker( workerStorage ):
+        ThreadConfig().load( threadID )
+        fcn = getattr( workerStorage, methodName )
+        while True:
+          chunkLock.acquire()
+          try:
+            index = nextChunk[0]
+            nextChunk[0] += 1
+          finally:
+            chunkLock.release()
+          if index >= len( chunks ):
+            return
+          try:
+            results[index] = fcn( chunks[index], *args, **kwargs )
+          except Exception, x:
+            self.log.exception( "StorageElement.__executeChunks: exception in %s" % methodName, lException = x )
+            results[index] = S_ERROR( "Exception in %s: %s" % ( methodName, str( x ) ) )
+      # The first worker uses the storage itself, the others their own instance of the plugin
+      workerStorages = [ storage ]
+      for _i in range( min( self.bulkWorkers, len( chunks ) ) - 1 ):
+        result = self.__getSpareStorage( storage )
+        if not result['OK']:
+          self.log.warn( "StorageElement.__executeChunks: fewer workers for %s" % methodName, result['Message'] )
+          break
+        workerStorages.append( result['Value'] )
+      workers = [ threading.Thread( target = worker, args = ( workerStorage, ) ) for workerStorage in workerStorages ]
+      for thread in workers:
+        thread.start()
+      for thread in workers:
+        thread.join()
+      self.__releaseSpareStorages( storage, workerStorages[1:] )
+
+      successful = {}
+      failed = {}
+      for chunk, chunkRes in zip( chunks, results ):
+        if chunkRes['OK']:
+          successful.update( chunkRes['Value']['Successful'] )
+          failed.update( chunkRes['Value']['Failed'] )
+        else:
+          for url in chunk:
+            failed[url] = chunkRes['Message']
+      res = S_OK( { 'Successful' : successful, 'Failed' : failed } )
+      if not [ chunkRes for chunkRes in results if chunkRes['OK'] ]:
+        res = results[0]
+
+    elapsed = time.time() - start
+    numFailed = len( urls )
+    if res['OK']:
+      numFailed = len( urls ) - len( res['Value'].get( 'Successful', {} ) )
+    self.__addStatistics( methodName, len( urls ), numFailed, len( chunks ), elapsed )
+    self.log.verbose( "StorageElement.__executeChunks: %s on %d files in %d chunks took %.1f s (%.1f files/s)" %
+                      ( methodName, len( urls ), len( chunks ), elapsed, len( urls ) / max( elapsed, 0.001 ) ) )
+    return res
+
+  def __getSpareStorage( self, storage ):
+    """ Get an instance of the plugin of storage for a chunk worker. The plugins, with their gfal
+        contexts, are not meant to be used by several threads at the same time
+    """
+    self.__spareStoragesLock.acquire()
+    try:
+      spares = self.__spareStorages.setdefault( storage, [] )
+      if spares:
+        return S_OK( spares.pop() )
+    finally:
+      self.__spareStoragesLock.release()
+    result = StorageFactory( vo = self.vo ).getStorage( storage.getParameters() )
+    if not result['OK']:
+      return result
+    result['Value'].setStorageElement( self )
+    return result
+
+  def __releaseSpareStorages( self, storage, spares ):
+    """ Give back the plugin instances used by the chunk workers
+    """
+    self.__spareStoragesLock.acquire()
+    try:
+      self.__spareStorages.setdefault( storage, [] ).extend( spares )
+    finally:
+      self.__spareStoragesLock.release()
+
+  def __addStatistics( self, methodName, numFiles, numFailed, numChunks, elapsed ):
+    """ Account an execution of a plugin method
+    """
+    self.__statisticsLock.acquire()
+    try:
+      stats = self.__statistics.setdefault( methodName, [ 0, 0, 0, 0, 0. ] )
+      stats[0] += 1
+      stats[1] += numFiles
+      stats[2] += numFailed
+      stats[3] += numChunks
+      stats[4] += elapsed
+    finally:
+      self.__statisticsLock.release()
+
+  def getOperationStatistics( self ):
+    """ Get the statistics of the operations executed on this SE by the plugins:
+        { method : { 'Calls', 'Files', 'FailedFiles', 'Chunks', 'Time', 'Throughput' } }
+        the throughput being in files per second
+    """
+    self.__statisticsLock.acquire()
+    try:
+      statistics = {}
+      for methodName, ( calls, files, failedFiles, chunks, elapsed ) in self.__statistics.items():
+        statistics[methodName] = { 'Calls' : calls, 'Files' : files, 'FailedFiles' : failedFiles,
+                                   'Chunks' : chunks, 'Time' : elapsed,
+                                   'Throughput' : files / elapsed if elapsed else 0. }
+    finally:
+      self.__statisticsLock.release()
+    return S_OK( statistics )
+
   def __getattr__( self, name ):
     """ Forwards the equivalent Storage calls to StorageElement.__executeMethod"""
     # We take either the equivalent name, or the name itself
@@ -0,0 +1,157 @@
+""" Unit tests of the chunked execution of the plugin methods in StorageElement
+"""
+
+import threading
+import time
+import unittest
+
+from mock import patch
+
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.Core.DISET.ThreadConfig import ThreadConfig
+from DIRAC.Resources.Storage.StorageElement import StorageElementItem
+
+class FakePlugin( object ):
+  """ Plugin failing the urls in failedURLs and the chunks with a url in failedChunkURLs,
+      checking that it is not used by two threads at the same time
+  """
+
+  instances = []
+
+  def __init__( self, failedURLs = None, failedChunkURLs = None ):
+    self.failedURLs = failedURLs or []
+    self.failedChunkURLs = failedChunkURLs or []
+    self.chunks = []
+    self.ids = []
+    self.running = False
+    self.concurrentUse = False
+    self.se = None
+    FakePlugin.instances.append( self )
+
+  def getParameters( self ):
+    return { 'FailedURLs' : self.failedURLs, 'FailedChunkURLs' : self.failedChunkURLs }
+
+  def setStorageElement( self, se ):
+    self.se = se
+
+  def exists( self, urls ):
+    if self.running:
+      self.concurrentUse = True
+    self.running = True
+    try:
+      self.chunks.append( sorted( urls ) )
+      self.ids.append( ThreadConfig().getID() )
+      time.sleep( 0.05 )
+      for url in urls:
+        if url in self.failedChunkURLs:
+          return S_ERROR( 'Chunk failed' )
+      return S_OK( { 'Successful' : dict( [ ( url, True ) for url in urls if url not in self.failedURLs ] ),
+                     'Failed' : dict( [ ( url, 'No such file' ) for url in urls if url in self.failedURLs ] ) } )
+    finally:
+      self.running = False
+
+class FakeStorageFactory( object ):
+
+  def __init__( self, vo = None ):
+    pass
+
+  def getStorage( self, parameters ):
+    return S_OK( FakePlugin( parameters['FailedURLs'], parameters['FailedChunkURLs'] ) )
+
+class ExecuteChunksTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    FakePlugin.instances = []
+    self.se = object.__new__( StorageElementItem )
+    self.se.log = gLogger.getSubLogger( 'SE[Test]' )
+    self.se.vo = 'test'
+    self.se.bulkChunkSize = 2
+    self.se.bulkWorkers = 3
+    self.se.chunkMethods = [ 'exists' ]
+    self.se._StorageElementItem__statistics = {}
+    self.se._StorageElementItem__statisticsLock = threading.Lock()
+    self.se._StorageElementItem__spareStorages = {}
+    self.se._StorageElementItem__spareStoragesLock = threading.Lock()
+    self.urls = dict( [ ( 'srm://se/file%d' % i, False ) for i in range( 9 ) ] )
+    self.patcher = patch( 'DIRAC.Resources.Storage.StorageElement.StorageFactory', FakeStorageFactory )
+    self.patcher.start()
+
+  def tearDown( self ):
+    self.patcher.stop()
+
+  def executeChunks( self, plugin ):
+    return self.se._StorageElementItem__executeChunks( 'exists', plugin, self.urls, (), {} )
+
+  def test_merge( self ):
+    """ The chunks are run by one plugin instance per worker and their results merged
+    """
+    plugin = FakePlugin( failedURLs = [ 'srm://se/file3' ] )
+    res = self.executeChunks( plugin )
+    self.assert_( res['OK'] )
+    self.assertEqual( sorted( res['Value']['Successful'] ), sorted( self.urls.keys() )[:3] + sorted( self.urls.keys() )[4:] )
+    self.assertEqual( res['Value']['Failed'], { 'srm://se/file3' : 'No such file' } )
+    self.assertEqual( len( FakePlugin.instances ), 3 )
+    chunks = []
+    for instance in FakePlugin.instances:
+      self.assertFalse( instance.concurrentUse )
+      chunks.extend( instance.chunks )
+      if instance is not plugin:
+        self.assert_( instance.se is self.se )
+    self.assertEqual( len( chunks ), 5 )
+    self.assertEqual( sorted( sum( chunks, [] ) ), sorted( self.urls ) )
+    # The instances are reused by the next calls
+    self.executeChunks( plugin )
+    self.assertEqual( len( FakePlugin.instances ), 3 )
+    statistics = self.se.getOperationStatistics()['Value']['exists']
+    self.assertEqual( ( statistics['Calls'], statistics['Files'], statistics['FailedFiles'], statistics['Chunks'] ),
+                      ( 2, 18, 2, 10 ) )
+
+  def test_credentials( self ):
+    """ The workers use the credentials delegated to the calling thread
+    """
+    plugin = FakePlugin()
+    results = []
+    def run():
+      ThreadConfig().setID( '/CN=user', 'group' )
+      results.append( self.executeChunks( plugin ) )
+    thread = threading.Thread( target = run )
+    thread.start()
+    thread.join()
+    self.assert_( results[0]['OK'] )
+    ids = sum( [ instance.ids for instance in FakePlugin.instances ], [] )
+    self.assertEqual( len( ids ), 5 )
+    self.assertEqual( set( ids ), set( [ ( '/CN=user', 'group' ) ] ) )
+
+  def test_partialFailure( self ):
+    """ The files of a failed chunk get its error
+    """
+    plugin = FakePlugin( failedChunkURLs = [ 'srm://se/file0' ] )
+    res = self.executeChunks( plugin )
+    self.assert_( res['OK'] )
+    self.assertEqual( len( res['Value']['Successful'] ), 7 )
+    # file0 and the other file of its chunk
+    self.assertEqual( len( res['Value']['Failed'] ), 2 )
+    self.assert_( 'srm://se/file0' in res['Value']['Failed'] )
+    self.assertEqual( set( res['Value']['Failed'].values() ), set( [ 'Chunk failed' ] ) )
+
+  def test_allFailed( self ):
+    """ S_ERROR when all the chunks failed, for the failover to the next plugin
+    """
+    plugin = FakePlugin( failedChunkURLs = self.urls.keys() )
+    res = self.executeChunks( plugin )
+    self.assertFalse( res['OK'] )
+    self.assertEqual( res['Message'], 'Chunk failed' )
+
+  def test_noChunks( self ):
+    """ A single call with the plugin when the chunks are disabled
+    """
+    self.se.bulkChunkSize = 0
+    plugin = FakePlugin()
+    res = self.executeChunks( plugin )
+    self.assertEqual( len( res['Value']['Successful'] ), 9 )
+    self.assertEqual( plugin.chunks, [ sorted( self.urls ) ] )
+    self.assertEqual( len( FakePlugin.instances ), 1 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ExecuteChunksTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
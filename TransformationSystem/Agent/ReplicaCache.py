@@ -0,0 +1,155 @@
+""" On-disk replica cache used by the TransformationAgent
+
+    The replicas obtained from the catalog are stored in a local sqlite file,
+    one row per ( TransID, LFN ) with the time of the update. Entries are added,
+    removed and expired with single statements, so nothing has to be kept in memory
+    or rewritten when a small part of the cache changes.
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import time
+import sqlite3
+import threading
+
+from DIRAC.Core.Utilities import DEncode
+from DIRAC.Core.Utilities.List import breakListIntoChunks
+
+# sqlite has a limit of 999 variables per statement
+QUERY_CHUNK_SIZE = 500
+
+class ReplicaCache( object ):
+  """ Thread safe replica cache in a sqlite file, shared by the threads of the agent
+  """
+
+  def __init__( self, dbFile ):
+    """ c'tor
+
+    :param str dbFile: path of the sqlite file, created if it doesn't exist
+    """
+    self.dbFile = dbFile
+    self.__lock = threading.Lock()
+    dirName = os.path.dirname( dbFile )
+    if dirName and not os.path.isdir( dirName ):
+      os.makedirs( dirName )
+    self.__conn = sqlite3.connect( dbFile, check_same_thread = False )
+    # This is a cache that can be rebuilt from the catalog, no need to wait for the disk
+    self.__conn.execute( "PRAGMA synchronous = OFF" )
+    self.__conn.execute( "CREATE TABLE IF NOT EXISTS Replicas ( TransID INTEGER NOT NULL, LFN TEXT NOT NULL, "
+                         "UpdateTime REAL NOT NULL, Replicas BLOB, PRIMARY KEY ( TransID, LFN ) )" )
+    self.__conn.execute( "CREATE INDEX IF NOT EXISTS TransTime ON Replicas ( TransID, UpdateTime )" )
+    self.__conn.commit()
+
+  def close( self ):
+    """ Close the sqlite connection
+    """
+    self.__lock.acquire()
+    try:
+      if self.__conn:
+        self.__conn.close()
+        self.__conn = None
+    finally:
+      self.__lock.release()
+
+  def __execute( self, statement, valuesList, many = False ):
+    """ Execute a statement in its own transaction, return the number of rows changed
+    """
+    self.__lock.acquire()
+    try:
+      try:
+        if many:
+          cursor = self.__conn.executemany( statement, valuesList )
+        else:
+          cursor = self.__conn.execute( statement, valuesList )
+        self.__conn.commit()
+      except Exception:
+        self.__conn.rollback()
+        raise
+      return cursor.rowcount
+    finally:
+      self.__lock.release()
+
+  def addReplicas( self, transID, replicaDict, updateTime = None ):
+    """ Add or replace the replicas of a set of LFNs
+
+    :param int transID: transformation ID
+    :param dict replicaDict: { lfn : replicas }
+    :param float updateTime: epoch of the update, now by default
+    """
+    if not replicaDict:
+      return 0
+    if updateTime is None:
+      updateTime = time.time()
+    rows = [ ( transID, lfn, updateTime, sqlite3.Binary( DEncode.encode( replicas ) ) )
+             for lfn, replicas in replicaDict.iteritems() ]
+    return self.__execute( "INSERT OR REPLACE INTO Replicas ( TransID, LFN, UpdateTime, Replicas ) "
+                           "VALUES ( ?, ?, ?, ? )", rows, many = True )
+
+  def getReplicas( self, transID, lfns ):
+    """ Get the cached replicas of a list of LFNs
+
+    :return: { lfn : replicas } for the LFNs found in the cache
+    """
+    result = {}
+    for chunk in breakListIntoChunks( list( lfns ), QUERY_CHUNK_SIZE ):
+      statement = "SELECT LFN, Replicas FROM Replicas WHERE TransID = ? AND LFN IN ( %s )" % \
+                  ",".join( [ "?" ] * len( chunk ) )
+      self.__lock.acquire()
+      try:
+        rows = self.__conn.execute( statement, [ transID ] + chunk ).fetchall()
+      finally:
+        self.__lock.release()
+      for lfn, replicas in rows:
+        result[ lfn ] = DEncode.decode( str( replicas ) )[0]
+    return result
+
+  def removeLFNs( self, transID, lfns ):
+    """ Remove a list of LFNs from the cache, return the number of removed entries
+    """
+    removed = 0
+    for chunk in breakListIntoChunks( list( lfns ), QUERY_CHUNK_SIZE ):
+      removed += self.__execute( "DELETE FROM Replicas WHERE TransID = ? AND LFN IN ( %s )" %
+                                 ",".join( [ "?" ] * len( chunk ) ), [ transID ] + chunk )
+    return removed
+
+  def keepLFNs( self, transID, lfns ):
+    """ Remove from the cache the LFNs of a transformation that are not in a list,
+        return the number of removed entries
+    """
+    self.__lock.acquire()
+    try:
+      try:
+        self.__conn.execute( "CREATE TEMP TABLE IF NOT EXISTS KeepLFNs ( LFN TEXT PRIMARY KEY )" )
+        self.__conn.execute( "DELETE FROM KeepLFNs" )
+        self.__conn.executemany( "INSERT OR IGNORE INTO KeepLFNs ( LFN ) VALUES ( ? )", [ ( lfn, ) for lfn in lfns ] )
+        cursor = self.__conn.execute( "DELETE FROM Replicas WHERE TransID = ? AND LFN NOT IN "
+                                      "( SELECT LFN FROM KeepLFNs )", ( transID, ) )
+        self.__conn.execute( "DELETE FROM KeepLFNs" )
+        self.__conn.commit()
+      except Exception:
+        self.__conn.rollback()
+        raise
+      return cursor.rowcount
+    finally:
+      self.__lock.release()
+
+  def removeOlderThan( self, transID, timeLimit ):
+    """ Remove the entries of a transformation updated before an epoch,
+        return the number of removed entries
+    """
+    return self.__execute( "DELETE FROM Replicas WHERE TransID = ? AND UpdateTime < ?", ( transID, timeLimit ) )
+
+  def clearTransformation( self, transID ):
+    """ Remove all the entries of a transformation, return the number of removed entries
+    """
+    return self.__execute( "DELETE FROM Replicas WHERE TransID = ?", ( transID, ) )
+
+  def countLFNs( self, transID ):
+    """ Get the number of LFNs cached for a transformation
+    """
+    self.__lock.acquire()
+    try:
+      return self.__conn.execute( "SELECT COUNT(*) FROM Replicas WHERE TransID = ?", ( transID, ) ).fetchone()[0]
+    finally:
+      self.__lock.release()
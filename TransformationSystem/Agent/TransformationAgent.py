@@ -1,7 +1,7 @@
 """  TransformationAgent processes transformations found in the transformation database.
 """
 
-import time, Queue, os, datetime, pickle
+import time, Queue, os, datetime, calendar, pickle
 from DIRAC                                                          import S_OK, S_ERROR
 from DIRAC.Core.Base.AgentModule                                    import AgentModule
 from DIRAC.Core.Utilities.ThreadPool                                import ThreadPool
@@ -10,6 +10,7 @@ from DIRAC.Core.Utilities.List                                      import break
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations            import Operations
 from DIRAC.TransformationSystem.Client.TransformationClient         import TransformationClient
 from DIRAC.TransformationSystem.Agent.TransformationAgentsUtilities import TransformationAgentsUtilities
+from DIRAC.TransformationSystem.Agent.ReplicaCache                  import ReplicaCache
 from DIRAC.DataManagementSystem.Client.DataManager                  import DataManager
 
 __RCSID__ = "$Id$"
@@ -49,8 +50,7 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     # Validity of the cache
     self.replicaCache = None
     self.replicaCacheValidity = None
-    self.writingCache = False
-    self.removedFromCache = 0
+    self.cacheChecked = set()
 
     self.noUnusedDelay = 0
     self.unusedFiles = {}
@@ -80,7 +80,7 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     # clients
     self.transfClient = TransformationClient()
 
-    # for caching using a pickle file
+    # for caching using a sqlite file (pickle files are from older versions and are imported)
     self.workDirectory = self.am_getWorkDirectory()
     self.cacheFile = os.path.join( self.workDirectory, 'ReplicaCache.pkl' )
     self.controlDirectory = self.am_getControlDirectory()
@@ -89,7 +89,8 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     self.lastFileOffset = {}
 
     # Validity of the cache
-    self.replicaCache = {}
+    self.replicaCache = ReplicaCache( os.path.join( self.workDirectory, 'ReplicaCache.db' ) )
+    self.cacheChecked = set()
     self.replicaCacheValidity = self.am_getOption( 'ReplicaCacheValidity', 2 )
 
     self.noUnusedDelay = self.am_getOption( 'NoUnusedDelay', 6 )
@@ -117,7 +118,7 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
       while self.transInThread:
         time.sleep( 2 )
       self._logInfo( "Threads are empty, terminating the agent..." , method = method )
-    self.__writeCache()
+    self.replicaCache.close()
     return S_OK()
 
   def execute( self ):
@@ -232,7 +233,7 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     if not transFiles['Value']:
       return S_OK()
 
-    if transID not in self.replicaCache:
+    if transID not in self.cacheChecked:
       self.__readCache( transID )
     transFiles = transFiles['Value']
     lfns = [ f['LFN'] for f in transFiles ]
@@ -429,17 +430,14 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     dataReplicas = {}
     nLfns = len( lfns )
     self._logVerbose( "Getting replicas for %d files" % nLfns, method = method, transID = transID )
-    cachedReplicaSets = self.replicaCache.get( transID, {} )
-    cachedReplicas = {}
-    # Merge all sets of replicas
-    for replicas in cachedReplicaSets.values():
-      cachedReplicas.update( replicas )
-    self._logInfo( "Number of cached replicas: %d" % len( cachedReplicas ), method = method, transID = transID )
-    setCached = set( cachedReplicas )
+    self._logInfo( "Number of cached replicas: %d" % self.__filesInCache( transID ), method = method, transID = transID )
     setLfns = set( lfns )
-    for lfn in setLfns & setCached:
-      dataReplicas[lfn] = cachedReplicas[lfn]
-    newLFNs = setLfns - setCached
+    # Only the replicas of the requested LFNs are read from the cache
+    try:
+      dataReplicas = self.replicaCache.getReplicas( transID, setLfns )
+    except Exception:
+      self._logException( "Failed to read replica cache", method = method, transID = transID )
+    newLFNs = setLfns - set( dataReplicas )
     self._logInfo( "ReplicaCache hit for %d out of %d LFNs" % ( len( dataReplicas ), nLfns ),
                    method = method, transID = transID )
     if newLFNs:
@@ -462,7 +460,6 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
                       method = method, transID = transID )
       dataReplicas.update( newReplicas )
       noReplicas = newLFNs - set( dataReplicas )
-      self.__writeCache( transID )
       if noReplicas:
         self._logWarn( "Found %d files without replicas (or only in Failover)" % len( noReplicas ),
                        method = method, transID = transID )
@@ -528,42 +525,39 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
   def __updateCache( self, transID, newReplicas ):
     """ Add replicas to the cache
     """
-    self.replicaCache.setdefault( transID, {} )[datetime.datetime.utcnow()] = newReplicas
-#    if len( newReplicas ) > 5000:
-#      self.__writeCache( transID )
+    try:
+      self.replicaCache.addReplicas( transID, newReplicas )
+    except Exception:
+      self._logException( "Failed to add replicas to the cache", method = '__updateCache', transID = transID )
 
   def __clearCacheForTrans( self, transID ):
     """ Remove all replicas for a transformation
     """
-    self.replicaCache.pop( transID , None )
+    try:
+      self.replicaCache.clearTransformation( transID )
+    except Exception:
+      self._logException( "Failed to clear replica cache", method = '__clearCacheForTrans', transID = transID )
 
   def __cleanReplicas( self, transID, lfns ):
     """ Remove cached replicas that are not in a list
     """
-    cachedReplicas = set()
-    for replicas in self.replicaCache.get( transID, {} ).values():
-      cachedReplicas.update( replicas )
-    toRemove = cachedReplicas - set( lfns )
-    if toRemove:
-      self._logInfo( "Remove %d files from cache" % len( toRemove ), method = '__cleanReplicas', transID = transID )
-      self.__removeFromCache( transID, toRemove )
+    try:
+      removed = self.replicaCache.keepLFNs( transID, lfns )
+    except Exception:
+      self._logException( "Failed to clean replica cache", method = '__cleanReplicas', transID = transID )
+      return
+    if removed:
+      self._logInfo( "Removed %d files from cache" % removed, method = '__cleanReplicas', transID = transID )
 
   def __cleanCache( self, transID ):
     """ Cleans the cache
     """
     try:
-      if transID in self.replicaCache:
-        timeLimit = datetime.datetime.utcnow() - datetime.timedelta( days = self.replicaCacheValidity )
-        for updateTime in set( self.replicaCache[transID] ):
-          nCache = len( self.replicaCache[transID][updateTime] )
-          if updateTime < timeLimit or not nCache:
-            self._logInfo( "Clear %s replicas for transformation %s, time %s" %
-                           ( '%d cached' % nCache if nCache else 'empty cache' , str( transID ), str( updateTime ) ),
-                           transID = transID, method = '__cleanCache' )
-            del self.replicaCache[transID][updateTime]
-        # Remove empty transformations
-        if not self.replicaCache[transID]:
-          del self.replicaCache[transID]
+      timeLimit = time.time() - self.replicaCacheValidity * 86400
+      removed = self.replicaCache.removeOlderThan( transID, timeLimit )
+      if removed:
+        self._logInfo( "Cleared %d cached replicas older than %s days" % ( removed, self.replicaCacheValidity ),
+                       transID = transID, method = '__cleanCache' )
     except Exception:
       self._logException( "Exception when cleaning replica cache:" )
 
@@ -571,83 +565,62 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     removed = self.__removeFromCache( transID, lfns )
     if removed:
       self._logInfo( "Removed %d replicas from cache" % removed, method = '__removeFilesFromCache', transID = transID )
-      self.__writeCache( transID )
 
   def __removeFromCache( self, transID, lfns ):
-    if transID not in self.replicaCache:
-      return
-    removed = 0
-    if self.replicaCache[transID] and lfns:
-      for lfn in lfns:
-        for timeKey in self.replicaCache[transID]:
-          if self.replicaCache[transID][timeKey].pop( lfn, None ):
-            removed += 1
-    return removed
+    if not lfns:
+      return 0
+    try:
+      return self.replicaCache.removeLFNs( transID, lfns )
+    except Exception:
+      self._logException( "Failed to remove replicas from cache", method = '__removeFromCache', transID = transID )
+      return 0
 
   def __cacheFile( self, transID ):
     return self.cacheFile.replace( '.pkl', '_%s.pkl' % str( transID ) )
 
   @gSynchro
   def __readCache( self, transID ):
-    """ Reads from the cache
+    """ The cache is read lazily from the sqlite file. This only imports the pickle files
+        written by older versions of the agent, then removes them
     """
-    if transID in self.replicaCache:
+    if transID in self.cacheChecked:
       return
+    method = '__readCache'
+    fileName = self.__cacheFile( transID )
+    if not os.path.exists( fileName ):
+      # This is as a transitory measure for migrating from single to multiple cache files
+      fileName = self.cacheFile
     try:
-      method = '__readCache'
-      fileName = self.__cacheFile( transID )
-      if not os.path.exists( fileName ):
-        # This is as a transitory measure for migrating from single to multiple cache files
-        fileName = self.cacheFile
+      if os.path.exists( fileName ):
         cacheFile = open( fileName, 'r' )
         cache = pickle.load( cacheFile )
-        for t_id in [t_id for t_id in cache if t_id not in self.replicaCache]:
-          self.replicaCache[t_id] = cache[t_id]
-        self.replicaCache[transID] = cache.get( transID, {} )
-      else:
-        cacheFile = open( fileName, 'r' )
-        self.replicaCache[transID] = pickle.load( cacheFile )
-      cacheFile.close()
-      self._logInfo( "Successfully loaded replica cache from file %s (%d files)" %
-                     ( fileName, self.__filesInCache( transID ) ),
-                     method = method, transID = transID )
+        cacheFile.close()
+        if fileName == self.cacheFile:
+          transCaches = cache
+        else:
+          transCaches = { transID : cache }
+        nFiles = 0
+        for t_id, transCache in transCaches.items():
+          for updateTime, replicas in transCache.items():
+            nFiles += self.replicaCache.addReplicas( t_id, replicas,
+                                                     updateTime = calendar.timegm( updateTime.timetuple() ) )
+          self.cacheChecked.add( t_id )
+        os.remove( fileName )
+        self._logInfo( "Successfully imported replica cache file %s (%d files)" % ( fileName, nFiles ),
+                       method = method, transID = transID )
     except Exception:
-      self._logException( "Failed to load replica cache from file %s" % fileName,
+      self._logException( "Failed to import replica cache file %s" % fileName,
                           method = method, transID = transID )
-      self.replicaCache[transID] = {}
+    self.cacheChecked.add( transID )
+    self._logInfo( "Replica cache contains %d files" % self.__filesInCache( transID ),
+                   method = method, transID = transID )
 
   def __filesInCache( self, transID ):
-    cache = self.replicaCache.get( transID, {} )
-    return sum( [len( lfns ) for lfns in cache.values()] )
-
-  @gSynchro
-  def __writeCache( self, transID = None ):
-    """ Writes the cache
-    """
-    method = '__writeCache'
     try:
-      startTime = time.time()
-      transList = [transID] if transID else set( self.replicaCache )
-      filesInCache = 0
-      nCache = 0
-      for t_id in transList:
-        # Protect the copy of the cache
-        filesInCache += self.__filesInCache( t_id )
-        # write to a temporary file in order to avoid corrupted files
-        cacheFile = self.__cacheFile( t_id )
-        tmpFile = cacheFile + '.tmp'
-        f = open( tmpFile, 'w' )
-        pickle.dump( self.replicaCache.get( t_id, {} ), f )
-        f.close()
-        # Now rename the file as it shold
-        os.rename( tmpFile, cacheFile )
-        nCache += 1
-      self._logInfo( "Successfully wrote %d replica cache file(s) (%d files) in %.1f seconds" \
-                     % ( nCache, filesInCache, time.time() - startTime ),
-                     method = method, transID = transID if transID else None )
+      return self.replicaCache.countLFNs( transID )
     except Exception:
-      self._logException( "Could not write replica cache file %s" % cacheFile,
-                          method = method, transID = t_id )
+      self._logException( "Failed to count cached replicas", method = '__filesInCache', transID = transID )
+      return 0
 
   def __generatePluginObject( self, plugin, clients ):
     """ This simply instantiates the TransformationPlugin class with the relevant plugin name
@@ -674,9 +647,7 @@ class TransformationAgent( AgentModule, TransformationAgentsUtilities ):
     """
     if invalidateCache:
       try:
-        if transID in self.replicaCache:
+        if self.replicaCache.clearTransformation( transID ):
           self._logInfo( "Removed cached replicas for transformation" , method = 'pluginCallBack', transID = transID )
-          self.replicaCache.pop( transID )
-          self.__writeCache( transID )
       except:
         pass
@@ -0,0 +1,69 @@
+""" Unit tests of the sqlite replica cache of the TransformationAgent
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from DIRAC.TransformationSystem.Agent.ReplicaCache import ReplicaCache
+
+class ReplicaCacheTestCase( unittest.TestCase ):
+  """ Base class for the ReplicaCache test cases
+  """
+
+  def setUp( self ):
+    self.tmpDir = tempfile.mkdtemp()
+    self.cache = ReplicaCache( os.path.join( self.tmpDir, 'ReplicaCache.db' ) )
+
+  def tearDown( self ):
+    self.cache.close()
+    shutil.rmtree( self.tmpDir )
+
+  def test_addGet( self ):
+    """ Replicas are only returned for the requested LFNs of the transformation
+    """
+    self.cache.addReplicas( 1, { '/lhcb/a' : ['CERN-DST', 'CNAF-DST'], '/lhcb/b' : ['PIC-DST'] } )
+    self.cache.addReplicas( 2, { '/lhcb/a' : ['GRIDKA-DST'] } )
+    self.assertEqual( self.cache.getReplicas( 1, ['/lhcb/a', '/lhcb/c'] ), { '/lhcb/a' : ['CERN-DST', 'CNAF-DST'] } )
+    self.assertEqual( self.cache.getReplicas( 2, ['/lhcb/a', '/lhcb/b'] ), { '/lhcb/a' : ['GRIDKA-DST'] } )
+    self.assertEqual( self.cache.countLFNs( 1 ), 2 )
+    # Updating an LFN replaces its replicas
+    self.cache.addReplicas( 1, { '/lhcb/a' : ['RAL-DST'] } )
+    self.assertEqual( self.cache.getReplicas( 1, ['/lhcb/a'] ), { '/lhcb/a' : ['RAL-DST'] } )
+    self.assertEqual( self.cache.countLFNs( 1 ), 2 )
+
+  def test_remove( self ):
+    """ Removal of LFNs, of all the LFNs not in a list, and of a transformation
+    """
+    lfns = [ '/lhcb/file%d' % i for i in xrange( 1200 ) ]
+    self.cache.addReplicas( 1, dict.fromkeys( lfns, ['CERN-DST'] ) )
+    self.cache.addReplicas( 2, dict.fromkeys( lfns[:10], ['CERN-DST'] ) )
+    self.assertEqual( self.cache.removeLFNs( 1, lfns[:600] + ['/lhcb/unknown'] ), 600 )
+    self.assertEqual( self.cache.keepLFNs( 1, lfns[:700] ), 500 )
+    self.assertEqual( sorted( self.cache.getReplicas( 1, lfns ) ), sorted( lfns[600:700] ) )
+    self.assertEqual( self.cache.clearTransformation( 1 ), 100 )
+    self.assertEqual( self.cache.countLFNs( 1 ), 0 )
+    self.assertEqual( self.cache.countLFNs( 2 ), 10 )
+
+  def test_expiration( self ):
+    """ Only the entries older than the limit are removed
+    """
+    now = time.time()
+    self.cache.addReplicas( 1, { '/lhcb/old' : ['CERN-DST'] }, updateTime = now - 3 * 86400 )
+    self.cache.addReplicas( 1, { '/lhcb/new' : ['CERN-DST'] }, updateTime = now )
+    self.assertEqual( self.cache.removeOlderThan( 1, now - 2 * 86400 ), 1 )
+    self.assertEqual( self.cache.getReplicas( 1, ['/lhcb/old', '/lhcb/new'] ).keys(), ['/lhcb/new'] )
+
+  def test_persistency( self ):
+    """ The content is available after reopening the file
+    """
+    self.cache.addReplicas( 1, { '/lhcb/a' : ['CERN-DST'] } )
+    self.cache.close()
+    self.cache = ReplicaCache( os.path.join( self.tmpDir, 'ReplicaCache.db' ) )
+    self.assertEqual( self.cache.getReplicas( 1, ['/lhcb/a'] ), { '/lhcb/a' : ['CERN-DST'] } )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ReplicaCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
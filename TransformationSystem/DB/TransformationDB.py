@@ -17,6 +17,7 @@ from DIRAC.Core.Utilities.List                            import stringListToStr
 from DIRAC.Core.Utilities.Shifter                         import setupShifterProxyInEnv
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations  import Operations
 from DIRAC.Core.Utilities.Subprocess                      import pythonCall
+from DIRAC.TransformationSystem.DB.TransformationFileFilter import TransformationFileFilter
 
 __RCSID__ = "$Id$"
 
@@ -43,6 +44,7 @@ class TransformationDB( DB ):
 
     self.lock = threading.Lock()
     self.filters = ()
+    self.fileFilter = TransformationFileFilter()
     res = self.__updateFilters()
     if not res['OK']:
       gLogger.fatal( "Failed to create filters" )
@@ -173,7 +175,8 @@ class TransformationDB( DB ):
     self.lock.release()
     # If the transformation has an input data specification
     if fileMask:
-      self.filters.append( ( transID, re.compile( fileMask ) ) )
+      self.fileFilter.addMask( transID, fileMask )
+      self.filters = self.fileFilter.getFilters()
 
     if inheritedFrom:
       res = self._getTransformationID( inheritedFrom, connection = connection )
@@ -359,36 +362,33 @@ class TransformationDB( DB ):
     """ Get filters for all defined input streams in all the transformations.
         If transID argument is given, get filters only for this transformation.
     """
-    resultList = []
+    masks = []
     # Define the general filter first
     self.database_name = self.__class__.__name__
     value = Operations().getValue( 'InputDataFilter/%sFilter' % self.database_name, '' )
     if value:
-      refilter = re.compile( value )
-      resultList.append( ( 0, refilter ) )
+      masks.append( ( 0, value ) )
     # Per transformation filters
     req = "SELECT TransformationID,FileMask FROM Transformations;"
     res = self._query( req, connection )
     if not res['OK']:
       return res
-    for transID, mask in res['Value']:
-      if mask:
-        refilter = re.compile( mask )
-        resultList.append( ( transID, refilter ) )
-    self.filters = resultList
-    return S_OK( resultList )
+    masks += [ ( transID, mask ) for transID, mask in res['Value'] if mask ]
+    # Only the masks that changed are recompiled
+    changes = self.fileFilter.setMasks( masks )
+    if changes:
+      gLogger.verbose( "Updated %d transformation file filters" % changes )
+    self.filters = self.fileFilter.getFilters()
+    return S_OK( self.filters )
 
   def __filterFile( self, lfn, filters = None ):
     """Pass the input file through a supplied filter or those currently active """
+    if not filters:
+      return self.fileFilter.match( lfn )
     result = []
-    if filters:
-      for transID, refilter in filters:
-        if refilter.search( lfn ):
-          result.append( transID )
-    else:
-      for transID, refilter in self.filters:
-        if refilter.search( lfn ):
-          result.append( transID )
+    for transID, refilter in filters:
+      if refilter.search( lfn ):
+        result.append( transID )
     return result
 
   ###########################################################################
@@ -694,10 +694,7 @@ class TransformationDB( DB ):
   def __addExistingFiles( self, transID, connection = False ):
     """ Add files that already exist in the DataFiles table to the transformation specified by the transID
     """
-    for tID, _filter in self.filters:
-      if tID == transID:
-        filters = [( tID, filter )]
-        break
+    filters = [( tID, refilter ) for tID, refilter in self.filters if tID == transID]
     if not filters:
       return S_ERROR( 'No filters defined for transformation %d' % transID )
     res = self.__getAllFileIDs( connection = connection )
@@ -0,0 +1,246 @@
+""" Matcher of the LFNs against the FileMask of all the transformations, used by
+    TransformationDB to select the transformations a new file belongs to.
+
+    Running all the masks on each file is avoided by classifying them once:
+      - masks anchored with '^' that start with a literal prefix are stored in a
+        character trie, a single walk along the LFN gives the candidate masks and
+        only the rest of the mask is then matched after the prefix
+      - non anchored masks starting with a literal ( possibly after '.*' ) are only
+        run on the LFNs containing that literal
+      - all the other masks are run on every LFN
+
+    The result is the same as running re.search( mask, lfn ) for every mask.
+"""
+
+__RCSID__ = "$Id$"
+
+import re
+import threading
+
+# Characters with a special meaning in a regular expression
+_specialChars = frozenset( '.^$*+?{}[]|()\\' )
+# Quantifiers applying to the preceding character
+_quantifiers = frozenset( '*+?{' )
+# Inline flags change the meaning of the whole pattern
+_inlineFlags = re.compile( r'\(\?[iLmsux]+\)' )
+
+def _hasTopLevelAlternation( mask ):
+  """ Check if there is a '|' outside any group in a regular expression
+  """
+  depth = 0
+  inClass = False
+  i = 0
+  while i < len( mask ):
+    char = mask[i]
+    if char == '\\':
+      i += 2
+      continue
+    if inClass:
+      if char == ']':
+        inClass = False
+    elif char == '[':
+      inClass = True
+      # a ']' just after '[' or '[^' is a literal
+      if mask[i + 1:i + 2] == '^':
+        i += 1
+      if mask[i + 1:i + 2] == ']':
+        i += 1
+    elif char == '(':
+      depth += 1
+    elif char == ')':
+      depth -= 1
+    elif char == '|' and depth == 0:
+      return True
+    i += 1
+  return False
+
+def _literalPrefix( mask ):
+  """ Get the literal characters any match of the pattern has to start with
+
+  :return: tuple ( literal, end ) where end is the position in the mask after the literal
+  """
+  literal = []
+  i = 0
+  while i < len( mask ):
+    char = mask[i]
+    if char == '\\':
+      escaped = mask[i + 1:i + 2]
+      # \d, \w, \A, \1... are not literals
+      if not escaped or escaped.isalnum():
+        break
+      nextPos = i + 2
+    elif char in _specialChars:
+      break
+    else:
+      escaped = char
+      nextPos = i + 1
+    if mask[nextPos:nextPos + 1] in _quantifiers:
+      # The character is left to the residual pattern with its quantifier
+      break
+    literal.append( escaped )
+    i = nextPos
+  return ''.join( literal ), i
+
+def analyzeMask( mask ):
+  """ Classify a mask
+
+  :return: tuple ( kind, literal, residual ) where kind is 'prefix', 'substring' or 'regex',
+           literal the literal part of the mask and residual the pattern to match after the
+           literal, None if the literal is enough
+  """
+  if not mask or _hasTopLevelAlternation( mask ) or _inlineFlags.search( mask ):
+    return ( 'regex', '', mask )
+  anchored = mask.startswith( '^' )
+  start = 1 if anchored else 0
+  # A leading '.*' does not change what a search finds in a single line LFN
+  while not anchored and mask.startswith( '.*', start ):
+    start += 2
+  literal, end = _literalPrefix( mask[start:] )
+  if not literal:
+    return ( 'regex', '', mask )
+  residual = mask[start + end:]
+  if anchored:
+    return ( 'prefix', literal, residual if residual else None )
+  # For non anchored masks the literal is only a pre-selection, the full mask is run
+  return ( 'substring', literal, mask if residual or start else None )
+
+class TransformationFileFilter( object ):
+  """ Thread safe combined matcher of the transformation file masks.
+      Updates replace the structures used by match() instead of modifying them,
+      so matching can go on without holding the lock
+  """
+
+  def __init__( self ):
+    self.__lock = threading.Lock()
+    # transID -> ( mask, compiled regex )
+    self.__masks = {}
+    # Trie of the literal prefixes, each node is [ { char : node }, ( ( transID, residual ), ... ) ]
+    self.__trie = [ {}, () ]
+    # ( ( literal, transID, compiled regex or None ), ... )
+    self.__substrings = ()
+    # ( ( transID, compiled regex ), ... )
+    self.__regexes = ()
+
+  def __len__( self ):
+    return len( self.__masks )
+
+  def getMask( self, transID ):
+    """ Get the mask of a transformation, None if it has no mask
+    """
+    return self.__masks.get( transID, ( None, None ) )[0]
+
+  def getFilters( self ):
+    """ Get the list of ( transID, compiled regex ) of all the masks
+    """
+    return [ ( transID, refilter ) for transID, ( _mask, refilter ) in sorted( self.__masks.items() ) ]
+
+  def setMasks( self, masks ):
+    """ Set all the masks, only the transformations whose mask changed are updated
+
+    :param masks: list of ( transID, mask )
+    :return: number of masks added, changed or removed
+    """
+    newMasks = dict( [ ( transID, mask ) for transID, mask in masks if mask ] )
+    self.__lock.acquire()
+    try:
+      changes = 0
+      for transID in [ transID for transID in self.__masks if transID not in newMasks ]:
+        self.__remove( transID )
+        changes += 1
+      for transID, mask in newMasks.items():
+        if self.__masks.get( transID, ( None, None ) )[0] != mask:
+          self.__remove( transID )
+          self.__add( transID, mask )
+          changes += 1
+      return changes
+    finally:
+      self.__lock.release()
+
+  def addMask( self, transID, mask ):
+    """ Add or replace the mask of a transformation
+    """
+    self.__lock.acquire()
+    try:
+      self.__remove( transID )
+      if mask:
+        self.__add( transID, mask )
+    finally:
+      self.__lock.release()
+
+  def removeMask( self, transID ):
+    """ Remove the mask of a transformation
+    """
+    self.__lock.acquire()
+    try:
+      self.__remove( transID )
+    finally:
+      self.__lock.release()
+
+  def match( self, lfn ):
+    """ Get the IDs of the transformations whose mask matches the LFN
+    """
+    result = []
+    node = self.__trie
+    pos = 0
+    # Walk down the trie as long as the LFN follows a known prefix
+    while node:
+      for transID, residual in node[1]:
+        if residual is None or residual.match( lfn, pos ):
+          result.append( transID )
+      if pos >= len( lfn ):
+        break
+      node = node[0].get( lfn[pos] )
+      pos += 1
+    for literal, transID, refilter in self.__substrings:
+      if literal in lfn and ( refilter is None or refilter.search( lfn ) ):
+        result.append( transID )
+    for transID, refilter in self.__regexes:
+      if refilter.search( lfn ):
+        result.append( transID )
+    return result
+
+  def __add( self, transID, mask ):
+    """ Add a mask, the lock has to be held
+    """
+    refilter = re.compile( mask )
+    kind, literal, residual = analyzeMask( mask )
+    if kind == 'prefix':
+      # Copy the path to the node so that a concurrent walk never sees a partial update
+      self.__trie = self.__copyPath( self.__trie, literal,
+                                     lambda entries: entries + ( ( transID, re.compile( residual ) if residual else None ), ) )
+    elif kind == 'substring':
+      self.__substrings += ( ( literal, transID, refilter if residual else None ), )
+    else:
+      self.__regexes += ( ( transID, refilter ), )
+    self.__masks[transID] = ( mask, refilter )
+
+  def __remove( self, transID ):
+    """ Remove a mask, the lock has to be held
+    """
+    if transID not in self.__masks:
+      return
+    mask = self.__masks.pop( transID )[0]
+    kind, literal, _residual = analyzeMask( mask )
+    if kind == 'prefix':
+      self.__trie = self.__copyPath( self.__trie, literal,
+                                     lambda entries: tuple( [ entry for entry in entries if entry[0] != transID ] ) )
+    elif kind == 'substring':
+      self.__substrings = tuple( [ entry for entry in self.__substrings if entry[1] != transID ] )
+    else:
+      self.__regexes = tuple( [ entry for entry in self.__regexes if entry[0] != transID ] )
+
+  def __copyPath( self, node, literal, updateEntries ):
+    """ Return a copy of a trie node where the entries of the node reached by the literal
+        are replaced by updateEntries( entries ). Empty branches are pruned
+    """
+    if not literal:
+      newNode = [ node[0], updateEntries( node[1] ) ]
+    else:
+      children = dict( node[0] )
+      child = self.__copyPath( children.get( literal[0], [ {}, () ] ), literal[1:], updateEntries )
+      if child[0] or child[1]:
+        children[literal[0]] = child
+      else:
+        children.pop( literal[0], None )
+      newNode = [ children, node[1] ]
+    return newNode
@@ -0,0 +1,86 @@
+""" Unit tests of the combined matcher of the transformation file masks
+"""
+
+import re
+import unittest
+
+from DIRAC.TransformationSystem.DB.TransformationFileFilter import TransformationFileFilter, analyzeMask
+
+masks = [ '^/lhcb/MC/2012/ALLSTREAMS.DST/',
+          '^/lhcb/MC/2012/.*\\.DST$',
+          '^/lhcb/data/2012/RAW/FULL/LHCb/COLLISION12/1[0-9]+/',
+          '^/lhcb/user/a+b',
+          '^/lhcb/validation\\.test/',
+          '/RAW/',
+          'SIM$',
+          '.*\\.xdigi',
+          '^/lhcb/MC/|^/lhcb/data/',
+          '(?i)^/LHCB/mc/2011/',
+          '^[/]lhcb/LHCb/',
+          '^/lhcb/freezer/x?y' ]
+
+lfns = [ '/lhcb/MC/2012/ALLSTREAMS.DST/00012345/0000/00012345_00000001_1.allstreams.dst',
+         '/lhcb/MC/2012/SIM/00012345/0000/00012345_00000001_1.sim',
+         '/lhcb/MC/2012/ALLSTREAMS.DST',
+         '/lhcb/MC/2011/SIM/00012345/0000/00012345_00000001_1.DST',
+         '/lhcb/data/2012/RAW/FULL/LHCb/COLLISION12/114753/114753_0000000016.raw',
+         '/lhcb/data/2012/RAW/FULL/LHCb/COLLISION12/x/114753_0000000016.raw',
+         '/lhcb/user/aab/file.SIM',
+         '/lhcb/user/b/file.xdigi',
+         '/lhcb/validation.test/file',
+         '/lhcb/validationXtest/file',
+         '/lhcb/LHCb/file',
+         '/lhcb/freezer/y',
+         '/lhcb/freezer/xy',
+         '/lhcb/freezer/z',
+         '/lhcb/',
+         '' ]
+
+class TransformationFileFilterTestCase( unittest.TestCase ):
+  """ Base class for the TransformationFileFilter test cases
+  """
+
+  def setUp( self ):
+    self.fileFilter = TransformationFileFilter()
+    self.fileFilter.setMasks( [ ( transID, mask ) for transID, mask in enumerate( masks ) ] )
+
+  def __reference( self, currentMasks ):
+    """ Result of running all the masks one by one """
+    return dict( [ ( lfn, sorted( [ transID for transID, mask in currentMasks if re.search( mask, lfn ) ] ) )
+                   for lfn in lfns ] )
+
+  def __result( self ):
+    return dict( [ ( lfn, sorted( self.fileFilter.match( lfn ) ) ) for lfn in lfns ] )
+
+  def test_analyze( self ):
+    """ Classification of the masks
+    """
+    self.assertEqual( analyzeMask( '^/lhcb/MC/2012/ALLSTREAMS.DST/' ), ( 'prefix', '/lhcb/MC/2012/ALLSTREAMS', '.DST/' ) )
+    self.assertEqual( analyzeMask( '^/lhcb/validation\\.test/' ), ( 'prefix', '/lhcb/validation.test/', None ) )
+    self.assertEqual( analyzeMask( '^/lhcb/user/a+b' ), ( 'prefix', '/lhcb/user/', 'a+b' ) )
+    self.assertEqual( analyzeMask( '/RAW/' ), ( 'substring', '/RAW/', None ) )
+    self.assertEqual( analyzeMask( '.*\\.xdigi' ), ( 'substring', '.xdigi', '.*\\.xdigi' ) )
+    self.assertEqual( analyzeMask( '^/lhcb/MC/|^/lhcb/data/' )[0], 'regex' )
+    self.assertEqual( analyzeMask( '(?i)^/LHCB/mc/2011/' )[0], 'regex' )
+
+  def test_match( self ):
+    """ Same result as running all the masks
+    """
+    self.assertEqual( self.__result(), self.__reference( list( enumerate( masks ) ) ) )
+
+  def test_update( self ):
+    """ Masks removed, changed and added are taken into account
+    """
+    newMasks = list( enumerate( masks ) )[2:]
+    newMasks[0] = ( 2, '^/lhcb/data/2012/' )
+    newMasks.append( ( 100, '^/lhcb/MC/2012/ALLSTREAMS' ) )
+    self.assertEqual( self.fileFilter.setMasks( newMasks ), 4 )
+    self.assertEqual( self.__result(), self.__reference( newMasks ) )
+    self.assertEqual( self.fileFilter.setMasks( newMasks ), 0 )
+    self.fileFilter.removeMask( 100 )
+    self.assertEqual( self.__result(), self.__reference( newMasks[:-1] ) )
+    self.assertEqual( len( self.fileFilter ), len( newMasks ) - 1 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( TransformationFileFilterTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,97 @@
+""" Benchmark of the selection of the transformations of new files done by
+    TransformationDB.addFile: all the FileMask regexes run one by one on each LFN
+    compared with the combined TransformationFileFilter.
+
+    The masks are a mix of anchored prefixes ( most of the production masks ), non anchored
+    literals and generic regexes. The results of both methods are also compared.
+
+    Usage: python TransformationFileFilterBenchmark.py [ numLFNs [ numMasks ] ]
+"""
+
+__RCSID__ = "$Id$"
+
+import re
+import sys
+import time
+import random
+
+from DIRAC.TransformationSystem.DB.TransformationFileFilter import TransformationFileFilter
+
+years = range( 2009, 2016 )
+fileTypes = [ 'ALLSTREAMS.DST', 'BHADRON.MDST', 'DIMUON.DST', 'EW.DST', 'RAW', 'SIM', 'DIGI', 'LDST' ]
+
+def generateMasks( numMasks ):
+  """ Random masks: 80% anchored prefixes, 10% non anchored literals, 10% generic regexes """
+  masks = []
+  for transID in xrange( 1, numMasks + 1 ):
+    year = random.choice( years )
+    fileType = random.choice( fileTypes )
+    prod = random.randint( 10000, 99999 )
+    kind = random.random()
+    if kind < 0.4:
+      mask = '^/lhcb/MC/%s/%s/%08d/' % ( year, fileType, prod )
+    elif kind < 0.8:
+      mask = '^/lhcb/LHCb/Collision%s/%s/%08d/.*\\.%s$' % ( year % 100, fileType, prod, fileType.split( '.' )[-1].lower() )
+    elif kind < 0.9:
+      mask = '/%08d/0001/' % prod
+    else:
+      mask = '.*/%s/%08d_[0-9]+_1\\.%s' % ( year, prod, fileType.lower() )
+    masks.append( ( transID, mask ) )
+  return masks
+
+def generateLFNs( numLFNs, masks ):
+  """ Random LFNs, some of them in the productions of the masks """
+  prods = [ int( re.search( '[0-9]{8}', mask ).group() ) for _transID, mask in masks ]
+  lfns = []
+  for i in xrange( numLFNs ):
+    year = random.choice( years )
+    fileType = random.choice( fileTypes )
+    prod = random.choice( prods ) if random.random() < 0.5 else random.randint( 10000, 99999 )
+    top = random.choice( [ '/lhcb/MC/%s' % year, '/lhcb/LHCb/Collision%s' % ( year % 100 ) ] )
+    lfns.append( '%s/%s/%08d/%04d/%08d_%08d_1.%s' % ( top, fileType, prod, i % 10, prod, i, fileType.lower() ) )
+  return lfns
+
+def runRegexes( filters, lfns ):
+  """ What TransformationDB.__filterFile used to do """
+  result = []
+  for lfn in lfns:
+    result.append( [ transID for transID, refilter in filters if refilter.search( lfn ) ] )
+  return result
+
+def runFileFilter( fileFilter, lfns ):
+  result = []
+  for lfn in lfns:
+    result.append( fileFilter.match( lfn ) )
+  return result
+
+if __name__ == '__main__':
+  numLFNs = int( sys.argv[1] ) if len( sys.argv ) > 1 else 1000000
+  numMasks = int( sys.argv[2] ) if len( sys.argv ) > 2 else 500
+  random.seed( 12345 )
+  masks = generateMasks( numMasks )
+  lfns = generateLFNs( numLFNs, masks )
+  print "%d LFNs, %d masks" % ( numLFNs, numMasks )
+
+  start = time.time()
+  fileFilter = TransformationFileFilter()
+  fileFilter.setMasks( masks )
+  print "Filter built in %.3f s" % ( time.time() - start )
+  start = time.time()
+  fileFilter.setMasks( masks[:-1] + [ ( numMasks, '^/lhcb/MC/2012/SIM/' ) ] )
+  print "Filter updated for one changed mask in %.3f s" % ( time.time() - start )
+  fileFilter.setMasks( masks )
+
+  start = time.time()
+  filterResult = runFileFilter( fileFilter, lfns )
+  filterTime = time.time() - start
+  print "TransformationFileFilter: %8.2f s ( %6.2f us/LFN )" % ( filterTime, filterTime * 1e6 / numLFNs )
+
+  filters = [ ( transID, re.compile( mask ) ) for transID, mask in masks ]
+  start = time.time()
+  regexResult = runRegexes( filters, lfns )
+  regexTime = time.time() - start
+  print "All regexes:              %8.2f s ( %6.2f us/LFN )" % ( regexTime, regexTime * 1e6 / numLFNs )
+
+  different = len( [ 1 for res1, res2 in zip( filterResult, regexResult ) if sorted( res1 ) != sorted( res2 ) ] )
+  print "Matched LFNs: %d, speedup: %.1f, different results: %d" % \
+        ( len( [ 1 for res in regexResult if res ] ), regexTime / filterTime, different )
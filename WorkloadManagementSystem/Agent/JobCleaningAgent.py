@@ -11,7 +11,7 @@
 
 __RCSID__ = "$Id$"
 
-from DIRAC                                                     import S_OK, gLogger
+from DIRAC                                                     import S_OK, S_ERROR, gLogger
 from DIRAC.Core.Base.AgentModule                               import AgentModule
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations       import Operations
 from DIRAC.WorkloadManagementSystem.DB.JobDB                   import JobDB
@@ -52,6 +52,7 @@ class JobCleaningAgent( AgentModule ):
     self.jobLoggingDB = None
 
     self.maxJobsAtOnce = 100
+    self.maxJobsPerCycle = 0
     self.jobByJob = False
     self.throttlingPeriod = 0.
 
@@ -76,8 +77,10 @@ class JobCleaningAgent( AgentModule ):
       self.prod_types = Operations().getValue( 'Transformations/DataProcessing', ['MCSimulation', 'Merge'] )
     gLogger.info( "Will exclude the following Production types from cleaning %s" % ( ', '.join( self.prod_types ) ) )
     self.maxJobsAtOnce = self.am_getOption( 'MaxJobsAtOnce', 500 )
+    self.maxJobsPerCycle = self.am_getOption( 'MaxJobsPerCycle', 0 )
     self.jobByJob = self.am_getOption( 'JobByJob', False )
     self.throttlingPeriod = self.am_getOption('ThrottlingPeriod', 0.)
+    self.heartBeatLoggingRetention = self.am_getOption( 'HeartBeatLoggingRetention', 0 )
     
     self.removeStatusDelay['Done'] = self.am_getOption( 'RemoveStatusDelay/Done', 7 )
     self.removeStatusDelay['Killed'] = self.am_getOption( 'RemoveStatusDelay/Killed', 7 )
@@ -102,6 +105,13 @@ class JobCleaningAgent( AgentModule ):
   def execute( self ):
     """ Remove jobs in various status
     """
+    # Thin the heart beat log
+    if self.heartBeatLoggingRetention:
+      result = self.jobDB.cleanHeartBeatLogging( self.heartBeatLoggingRetention )
+      if not result['OK']:
+        gLogger.warn( 'Failed to clean the heart beat logging', result['Message'] )
+      else:
+        gLogger.info( 'Removed %s old heart beat logging records' % result['Value'] )
     #Delete jobs in "Deleted" state
     result = self.removeJobsByStatus( { 'Status' : 'Deleted' } )
     if not result[ 'OK' ]:
@@ -128,24 +138,39 @@ class JobCleaningAgent( AgentModule ):
     return S_OK()
 
   def removeJobsByStatus( self, condDict, delay = False ):
-    """ Remove deleted jobs
+    """ Remove deleted jobs, MaxJobsAtOnce at a time and up to MaxJobsPerCycle ( 0 for all of them ).
+        The selected jobs are read from the DB as they are removed
     """
+    limit = self.maxJobsPerCycle or None
     if delay:
       gLogger.verbose( "Removing jobs with %s and older than %s" % ( condDict, delay ) )
-      result = self.jobDB.selectJobs( condDict, older = delay, limit = self.maxJobsAtOnce )
+      result = self.jobDB.selectJobsIter( condDict, older = delay, limit = limit, chunkSize = self.maxJobsAtOnce )
     else:
       gLogger.verbose( "Removing jobs with %s " % condDict )
-      result = self.jobDB.selectJobs( condDict, limit = self.maxJobsAtOnce )
+      result = self.jobDB.selectJobsIter( condDict, limit = limit, chunkSize = self.maxJobsAtOnce )
 
     if not result['OK']:
       return result
 
-    jobList = result['Value']
-    if len(jobList) > self.maxJobsAtOnce:
-      jobList = jobList[:self.maxJobsAtOnce]
+    jobList = []
+    try:
+      for jobID in result['Value']:
+        jobList.append( jobID )
+        if len( jobList ) >= self.maxJobsAtOnce:
+          result = self.__removeJobs( condDict, jobList )
+          if not result['OK']:
+            return result
+          jobList = []
+    except Exception, x:
+      gLogger.exception( "Failed to read the jobs to remove", lException = x )
+      return S_ERROR( "Failed to read the jobs to remove: %s" % x )
     if not jobList:
       return S_OK()
+    return self.__removeJobs( condDict, jobList )
 
+  def __removeJobs( self, condDict, jobList ):
+    """ Remove a list of jobs from the WMS
+    """
     self.log.notice( "Deleting %s jobs for %s" % ( len( jobList ), condDict ) )
 
     count = 0
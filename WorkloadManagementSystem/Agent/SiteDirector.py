@@ -12,6 +12,8 @@ import tempfile
 import random
 import socket
 import hashlib
+import time
+import threading
 
 import DIRAC
 from DIRAC                                                 import S_OK, S_ERROR, gConfig
@@ -41,6 +43,9 @@ WAITING_PILOT_STATUS = ['Submitted', 'Waiting', 'Scheduled', 'Ready']
 FINAL_PILOT_STATUS = ['Aborted', 'Failed', 'Done']
 MAX_PILOTS_TO_SUBMIT = 100
 MAX_JOBS_IN_FILLMODE = 5
+# CE types changing the process environment, e.g. ARC sets X509_USER_PROXY in os.environ,
+# only one queue of each of these types is processed at a time
+SERIAL_CE_TYPES = ['ARC']
 
 class SiteDirector( AgentModule ):
   """
@@ -65,6 +70,21 @@ class SiteDirector( AgentModule ):
     self.firstPass = True
     self.maxJobsInFillMode = MAX_JOBS_IN_FILLMODE
     self.maxPilotsToSubmit = MAX_PILOTS_TO_SUBMIT
+    # Queue being processed -> key of the slot it holds, None once a timed out queue released it.
+    # Kept across the cycles, the threads of the timed out queues can go on in the next cycles
+    self.busyQueues = {}
+    self.busyQueuesLock = threading.Lock()
+    # Pilots being submitted per task queue
+    self.pilotsInSubmission = {}
+    self.submissionLock = threading.Lock()
+    # Time spent in each queue in the last cycle, per action
+    self.queueCycleTimes = {}
+    # Compressed and encoded pilot files, reused until the files or the pilot version change
+    self.pilotBundle = None
+    self.pilotBundleStats = None
+    self.pilotBundleChecksum = None
+    self.pilotBundleVersion = None
+    self.pilotBundleLock = threading.Lock()
     return S_OK()
 
   def beginExecution( self ):
@@ -121,6 +141,11 @@ class SiteDirector( AgentModule ):
     self.pilotWaitingTime = self.am_getOption( 'MaxPilotWaitingTime', 3600 )
     self.failedQueueCycleFactor = self.am_getOption( 'FailedQueueCycleFactor', 10 )
     self.pilotStatusUpdateCycleFactor = self.am_getOption( 'PilotStatusUpdateCycleFactor', 10 ) 
+    # Concurrent processing of the queues
+    self.maxConcurrentQueues = self.am_getOption( 'MaxConcurrentQueues', 1 )
+    self.maxConcurrentQueuesPerCE = self.am_getOption( 'MaxConcurrentQueuesPerCE', 2 )
+    self.queueTimeout = self.am_getOption( 'QueueTimeout', 900 )
+    self.serialCETypes = self.am_getOption( 'SerialCETypes', SERIAL_CE_TYPES )
 
     # Flags
     self.updateStatus = self.am_getOption( 'UpdatePilotStatus', True )
@@ -175,10 +200,13 @@ class SiteDirector( AgentModule ):
     self.log.always( 'PilotGroup:', self.pilotGroup )
     self.log.always( 'MaxPilotsToSubmit:', self.maxPilotsToSubmit )
     self.log.always( 'MaxJobsInFillMode:', self.maxJobsInFillMode )
+    self.log.always( 'MaxConcurrentQueues:', self.maxConcurrentQueues )
 
     self.localhost = socket.getfqdn()
     self.proxy = ''
 
+    self.__setPilotVersion( Operations.Operations( group = self.pilotGroup ).getValue( "Pilot/Version", [] ) )
+
     if self.firstPass:
       if self.queueDict:
         self.log.always( "Agent will serve queues:" )
@@ -332,6 +360,153 @@ class SiteDirector( AgentModule ):
 
     return S_OK()
 
+  def __executeQueues( self, action, queueFunction, queues, *args ):
+    """ Execute queueFunction( queue, *args ) for the queues, return { queue : result }
+
+        With MaxConcurrentQueues > 1 the queues are processed in that many threads, with at most
+        MaxConcurrentQueuesPerCE queues of the same CE at a time, and one queue at a time for the
+        CE types in SerialCETypes. A queue not done after QueueTimeout seconds is counted as failed
+        and is skipped until its thread is over. In sequential mode the execution stops at the first
+        error.
+    """
+    start = time.time()
+    results = {}
+    queueTimes = {}
+    self.busyQueuesLock.acquire()
+    try:
+      busyQueues = [ queue for queue in queues if queue in self.busyQueues ]
+    finally:
+      self.busyQueuesLock.release()
+    if busyQueues:
+      self.log.warn( 'Queues still busy since a previous cycle, skipping:', ', '.join( busyQueues ) )
+      queues = [ queue for queue in queues if queue not in busyQueues ]
+    if self.maxConcurrentQueues > 1:
+      self.__executeQueuesInThreads( queueFunction, queues, args, results, queueTimes )
+    else:
+      for queue in queues:
+        results[queue] = self.__executeQueue( queueFunction, queue, args, queueTimes )
+        if not results[queue]['OK']:
+          break
+
+    self.queueCycleTimes[action] = queueTimes
+    for queue in queueTimes:
+      self.log.verbose( '%s for queue %s took %.1f s' % ( action, queue, queueTimes[queue] ) )
+    slowest = sorted( queueTimes, key = queueTimes.get, reverse = True )[:3]
+    self.log.info( '%s for %d queues took %.1f s, slowest: %s' % \
+                   ( action, len( queueTimes ), time.time() - start,
+                     ', '.join( [ '%s (%.1f s)' % ( queue, queueTimes[queue] ) for queue in slowest ] ) ) )
+    return results
+
+  def __executeQueue( self, queueFunction, queue, args, queueTimes ):
+    """ Execute queueFunction for one queue and account its time
+    """
+    start = time.time()
+    try:
+      result = queueFunction( queue, *args )
+    except Exception, x:
+      self.log.exception( 'Exception while processing queue %s' % queue, lException = x )
+      result = S_ERROR( 'Exception while processing queue %s: %s' % ( queue, str( x ) ) )
+    queueTimes[queue] = time.time() - start
+    return result
+
+  def __getQueueSlot( self, queue ):
+    """ Get the key and the size of the slot shared by the queues that can not all run at once
+    """
+    ceType = self.queueDict[queue].get( 'CEType' )
+    if ceType in self.serialCETypes:
+      return ( 'CEType', ceType ), 1
+    return ( 'CE', self.queueDict[queue]['CEName'] ), self.maxConcurrentQueuesPerCE
+
+  def __executeQueuesInThreads( self, queueFunction, queues, args, results, queueTimes ):
+    """ Process the queues in MaxConcurrentQueues threads, see __executeQueues
+
+        The slots are counted from self.busyQueues, so a serial slot held by a queue timed out
+        in a previous cycle stays taken until its thread is over
+    """
+    lock = self.busyQueuesLock
+    waitingQueues = list( queues )
+    # queue -> start time
+    runningQueues = {}
+    timedOutQueues = set()
+
+    def slotUsage( slotKey ):
+      """ Number of queues holding the slot, to be called with the lock """
+      return len( [ key for key in self.busyQueues.values() if key == slotKey ] )
+
+    def nextQueue():
+      """ First waiting queue whose slot is free, to be called with the lock """
+      for queue in waitingQueues:
+        slotKey, slotSize = self.__getQueueSlot( queue )
+        if slotUsage( slotKey ) < slotSize:
+          waitingQueues.remove( queue )
+          runningQueues[queue] = time.time()
+          self.busyQueues[queue] = slotKey
+          return queue
+      return None
+
+    def worker():
+      while True:
+        lock.acquire()
+        try:
+          if not waitingQueues:
+            return
+          queue = nextQueue()
+        finally:
+          lock.release()
+        if queue is None:
+          # All the remaining queues are on busy CEs
+          time.sleep( 0.1 )
+          continue
+        result = self.__executeQueue( queueFunction, queue, args, queueTimes )
+        lock.acquire()
+        try:
+          del runningQueues[queue]
+          del self.busyQueues[queue]
+          if queue in timedOutQueues:
+            # Another thread took over meanwhile
+            return
+          results[queue] = result
+        finally:
+          lock.release()
+
+    def startWorker():
+      thread = threading.Thread( target = worker )
+      thread.setDaemon( True )
+      thread.start()
+
+    for _i in range( min( self.maxConcurrentQueues, len( queues ) ) ):
+      startWorker()
+    while True:
+      lock.acquire()
+      try:
+        now = time.time()
+        for queue, queueStart in runningQueues.items():
+          if queue not in timedOutQueues and now - queueStart > self.queueTimeout:
+            self.log.error( 'Queue %s not done after %d s, leaving it for this cycle' % ( queue, self.queueTimeout ) )
+            timedOutQueues.add( queue )
+            queueTimes[queue] = now - queueStart
+            results[queue] = S_ERROR( 'Queue %s not done after %d s' % ( queue, self.queueTimeout ) )
+            self.failedQueues[queue] = self.failedQueues.get( queue, 0 ) + 1
+            if self.busyQueues[queue][0] == 'CE':
+              # The other queues of the CE can go on, a serial slot is kept until the thread is over
+              self.busyQueues[queue] = None
+            # Replace the stuck thread
+            startWorker()
+        # Slots held by the queues timed out in this cycle or in a previous one
+        stuckSlots = set( [ key for queue, key in self.busyQueues.items()
+                            if key and ( queue not in runningQueues or queue in timedOutQueues ) ] )
+        skippedQueues = [ queue for queue in waitingQueues if self.__getQueueSlot( queue )[0] in stuckSlots ]
+        if skippedQueues:
+          self.log.warn( 'Queues waiting for a stuck queue, skipping them in this cycle:', ', '.join( skippedQueues ) )
+          for queue in skippedQueues:
+            waitingQueues.remove( queue )
+        done = not waitingQueues and not [ queue for queue in runningQueues if queue not in timedOutQueues ]
+      finally:
+        lock.release()
+      if done:
+        break
+      time.sleep( 0.2 )
+
   def submitJobs( self ):
     """ Go through defined computing elements and submit jobs if necessary
     """
@@ -403,120 +578,155 @@ class SiteDirector( AgentModule ):
 
     queues = self.queueDict.keys()
     random.shuffle( queues )
+    results = self.__executeQueues( 'Submission', self.__submitToQueue, queues,
+                                    rpcMatcher, anySite, jobSites, testSites, siteMaskList )
     totalSubmittedPilots = 0
     matchedQueues = 0
-    for queue in queues:
-
-      # Check if the queue failed previously
-      failedCount = self.failedQueues.setdefault( queue, 0 ) % self.failedQueueCycleFactor
-      if failedCount != 0:
-        self.log.warn( "%s queue failed recently, skipping %d cycles" % ( queue, 10-failedCount ) )
-        self.failedQueues[queue] += 1
+    errorResult = None
+    for queue in results:
+      result = results[queue]
+      if not result['OK']:
+        self.log.error( 'Errors in the submission to queue %s:' % queue, result['Message'] )
+        errorResult = errorResult or result
         continue
+      submittedPilots, matched = result['Value']
+      totalSubmittedPilots += submittedPilots
+      if matched:
+        matchedQueues += 1
 
-      ce = self.queueDict[queue]['CE']
-      ceName = self.queueDict[queue]['CEName']
-      ceType = self.queueDict[queue]['CEType']
-      queueName = self.queueDict[queue]['QueueName']
-      siteName = self.queueDict[queue]['Site']
-      platform = self.queueDict[queue]['Platform']
-      siteMask = siteName in siteMaskList
+    self.log.info( "%d pilots submitted in total in this cycle, %d matched queues" % ( totalSubmittedPilots, matchedQueues ) )
+    if errorResult:
+      return errorResult
+    return S_OK()
 
-      if not anySite and siteName not in jobSites:
-        self.log.verbose( "Skipping queue %s at %s: no workload expected" % (queueName, siteName) )
-        continue
-      if not siteMask and siteName not in testSites:
-        self.log.verbose( "Skipping queue %s at site %s not in the mask" % (queueName, siteName) )
-        continue
+  def __submitToQueue( self, queue, rpcMatcher, anySite, jobSites, testSites, siteMaskList ):
+    """ Submit the pilots needed by the queue
 
-      if 'CPUTime' in self.queueDict[queue]['ParametersDict'] :
-        queueCPUTime = int( self.queueDict[queue]['ParametersDict']['CPUTime'] )
-      else:
-        self.log.warn( 'CPU time limit is not specified for queue %s, skipping...' % queue )
-        continue
-      if queueCPUTime > self.maxQueueLength:
-        queueCPUTime = self.maxQueueLength
-
-      # Prepare the queue description to look for eligible jobs
-      ceDict = ce.getParameterDict()
-      ceDict[ 'GridCE' ] = ceName
-      #if not siteMask and 'Site' in ceDict:
-      #  self.log.info( 'Site not in the mask %s' % siteName )
-      #  self.log.info( 'Removing "Site" from matching Dict' )
-      #  del ceDict[ 'Site' ]
-      if not siteMask:
-        ceDict['JobType'] = "Test"
-      if self.vo:
-        ceDict['Community'] = self.vo
-      if self.voGroups:
-        ceDict['OwnerGroup'] = self.voGroups
-
-      # This is a hack to get rid of !
-      ceDict['SubmitPool'] = self.defaultSubmitPools
-      
-      result = Resources.getCompatiblePlatforms( platform )
-      if not result['OK']:
-        continue
-      ceDict['Platform'] = result['Value']
+        :return: S_OK( ( number of submitted pilots, True if there are eligible jobs ) ), S_ERROR on
+                 errors stopping the submission cycle
+    """
 
-      # Get the number of eligible jobs for the target site/queue
-      result = rpcMatcher.getMatchingTaskQueues( ceDict )
-      if not result['OK']:
-        self.log.error( 'Could not retrieve TaskQueues from TaskQueueDB', result['Message'] )
-        return result
-      taskQueueDict = result['Value']
-      if not taskQueueDict:
-        self.log.verbose( 'No matching TQs found for %s' % queue )
-        continue
+    # Check if the queue failed previously
+    failedCount = self.failedQueues.setdefault( queue, 0 ) % self.failedQueueCycleFactor
+    if failedCount != 0:
+      self.log.warn( "%s queue failed recently, skipping %d cycles" % ( queue, 10-failedCount ) )
+      self.failedQueues[queue] += 1
+      return S_OK( ( 0, False ) )
 
-      matchedQueues += 1
-      totalTQJobs = 0
-      tqIDList = taskQueueDict.keys()
-      for tq in taskQueueDict:
-        totalTQJobs += taskQueueDict[tq]['Jobs']
-
-      self.log.verbose( '%d job(s) from %d task queue(s) are eligible for %s queue' % (totalTQJobs, len( tqIDList ), queue) )
-
-      # Get the number of already waiting pilots for these task queues
-      totalWaitingPilots = 0
-      if self.pilotWaitingFlag:
-        lastUpdateTime = dateTime() - self.pilotWaitingTime * second
-        result = pilotAgentsDB.countPilots( { 'TaskQueueID': tqIDList,
-                                              'Status': WAITING_PILOT_STATUS },
-                                              None, lastUpdateTime )
-        if not result['OK']:
-          self.log.error( 'Failed to get Number of Waiting pilots', result['Message'] )
-          totalWaitingPilots = 0
-        else:
-          totalWaitingPilots = result['Value']
-          self.log.verbose( 'Waiting Pilots for TaskQueue %s:' % tqIDList, totalWaitingPilots )
-      if totalWaitingPilots >= totalTQJobs:
-        self.log.verbose( "%d waiting pilots already for all the available jobs" % totalWaitingPilots )
-        continue
+    ce = self.queueDict[queue]['CE']
+    ceName = self.queueDict[queue]['CEName']
+    ceType = self.queueDict[queue]['CEType']
+    queueName = self.queueDict[queue]['QueueName']
+    siteName = self.queueDict[queue]['Site']
+    platform = self.queueDict[queue]['Platform']
+    siteMask = siteName in siteMaskList
+
+    if not anySite and siteName not in jobSites:
+      self.log.verbose( "Skipping queue %s at %s: no workload expected" % (queueName, siteName) )
+      return S_OK( ( 0, False ) )
+    if not siteMask and siteName not in testSites:
+      self.log.verbose( "Skipping queue %s at site %s not in the mask" % (queueName, siteName) )
+      return S_OK( ( 0, False ) )
+
+    if 'CPUTime' in self.queueDict[queue]['ParametersDict'] :
+      queueCPUTime = int( self.queueDict[queue]['ParametersDict']['CPUTime'] )
+    else:
+      self.log.warn( 'CPU time limit is not specified for queue %s, skipping...' % queue )
+      return S_OK( ( 0, False ) )
+    if queueCPUTime > self.maxQueueLength:
+      queueCPUTime = self.maxQueueLength
+
+    # Prepare the queue description to look for eligible jobs
+    ceDict = ce.getParameterDict()
+    ceDict[ 'GridCE' ] = ceName
+    #if not siteMask and 'Site' in ceDict:
+    #  self.log.info( 'Site not in the mask %s' % siteName )
+    #  self.log.info( 'Removing "Site" from matching Dict' )
+    #  del ceDict[ 'Site' ]
+    if not siteMask:
+      ceDict['JobType'] = "Test"
+    if self.vo:
+      ceDict['Community'] = self.vo
+    if self.voGroups:
+      ceDict['OwnerGroup'] = self.voGroups
+
+    # This is a hack to get rid of !
+    ceDict['SubmitPool'] = self.defaultSubmitPools
+
+    result = Resources.getCompatiblePlatforms( platform )
+    if not result['OK']:
+      return S_OK( ( 0, False ) )
+    ceDict['Platform'] = result['Value']
+
+    # Get the number of eligible jobs for the target site/queue
+    result = rpcMatcher.getMatchingTaskQueues( ceDict )
+    if not result['OK']:
+      self.log.error( 'Could not retrieve TaskQueues from TaskQueueDB', result['Message'] )
+      return result
+    taskQueueDict = result['Value']
+    if not taskQueueDict:
+      self.log.verbose( 'No matching TQs found for %s' % queue )
+      return S_OK( ( 0, False ) )
 
-      self.log.verbose( "%d waiting pilots for the total of %d eligible jobs for %s" % (totalWaitingPilots, totalTQJobs, queue) )
+    totalTQJobs = 0
+    tqIDList = taskQueueDict.keys()
+    for tq in taskQueueDict:
+      totalTQJobs += taskQueueDict[tq]['Jobs']
 
+    self.log.verbose( '%d job(s) from %d task queue(s) are eligible for %s queue' % (totalTQJobs, len( tqIDList ), queue) )
+
+    # Get the number of already waiting pilots for these task queues
+    totalWaitingPilots = 0
+    if self.pilotWaitingFlag:
+      lastUpdateTime = dateTime() - self.pilotWaitingTime * second
+      result = pilotAgentsDB.countPilots( { 'TaskQueueID': tqIDList,
+                                            'Status': WAITING_PILOT_STATUS },
+                                            None, lastUpdateTime )
+      if not result['OK']:
+        self.log.error( 'Failed to get Number of Waiting pilots', result['Message'] )
+        totalWaitingPilots = 0
+      else:
+        totalWaitingPilots = result['Value']
+        self.log.verbose( 'Waiting Pilots for TaskQueue %s:' % tqIDList, totalWaitingPilots )
+    if totalWaitingPilots >= totalTQJobs:
+      self.log.verbose( "%d waiting pilots already for all the available jobs" % totalWaitingPilots )
+      return S_OK( ( 0, True ) )
+
+    # Book the pilots for the task queues together with the check of the pilots being submitted
+    # for them by the other queues, the booking is trimmed to the available slots below
+    pilotsInSubmission, bookedPilots = self.__bookPilots( tqIDList, totalTQJobs - totalWaitingPilots,
+                                                          countBooked = self.pilotWaitingFlag )
+    totalWaitingPilots += pilotsInSubmission
+    if not bookedPilots:
+      self.log.verbose( "%d waiting or submitted pilots already for all the available jobs" % totalWaitingPilots )
+      return S_OK( ( 0, True ) )
+
+    self.log.verbose( "%d waiting pilots for the total of %d eligible jobs for %s" % (totalWaitingPilots, totalTQJobs, queue) )
+
+    submittedPilots = 0
+    try:
       # Get the working proxy
       cpuTime = queueCPUTime + 86400
       self.log.verbose( "Getting pilot proxy for %s/%s %d long" % ( self.pilotDN, self.pilotGroup, cpuTime ) )
       result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, cpuTime )
       if not result['OK']:
         return result
-      self.proxy = result['Value']
-      ce.setProxy( self.proxy, cpuTime - 60 )
+      proxy = result['Value']
+      self.proxy = proxy
+      ce.setProxy( proxy, cpuTime - 60 )
 
       # Get the number of available slots on the target site/queue
       totalSlots = self.__getQueueSlots( queue )
       if totalSlots == 0:
         self.log.debug( '%s: No slots available' % queue )
-        continue
+        return S_OK( ( 0, True ) )
 
-      pilotsToSubmit = max( 0, min( totalSlots, totalTQJobs - totalWaitingPilots ) )
+      # The booking is at most MAX_PILOTS_TO_SUBMIT
+      pilotsToSubmit = max( 0, min( totalSlots, bookedPilots ) )
       self.log.info( '%s: Slots=%d, TQ jobs=%d, Pilots: waiting %d, to submit=%d' % \
                               ( queue, totalSlots, totalTQJobs, totalWaitingPilots, pilotsToSubmit ) )
-
-      # Limit the number of pilots to submit to MAX_PILOTS_TO_SUBMIT
-      pilotsToSubmit = min( self.maxPilotsToSubmit, pilotsToSubmit )
+      self.__addPilotsInSubmission( tqIDList, pilotsToSubmit - bookedPilots )
+      bookedPilots = pilotsToSubmit
 
       while pilotsToSubmit > 0:
         self.log.info( 'Going to submit %d pilots to %s queue' % ( pilotsToSubmit, queue ) )
@@ -525,10 +735,10 @@ class SiteDirector( AgentModule ):
         jobExecDir = ''
         if ceType == 'CREAM':
           jobExecDir = '.'
-        jobExecDir = self.queueDict[queue]['ParametersDict'].get( 'JobExecDir', jobExecDir )          
-        httpProxy = self.queueDict[queue]['ParametersDict'].get( 'HttpProxy', '' )          
+        jobExecDir = self.queueDict[queue]['ParametersDict'].get( 'JobExecDir', jobExecDir )
+        httpProxy = self.queueDict[queue]['ParametersDict'].get( 'HttpProxy', '' )
 
-        result = self.__getExecutable( queue, pilotsToSubmit, bundleProxy, httpProxy, jobExecDir )
+        result = self.__getExecutable( queue, pilotsToSubmit, bundleProxy, httpProxy, jobExecDir, proxy )
         if not result['OK']:
           return result
 
@@ -537,59 +747,98 @@ class SiteDirector( AgentModule ):
         os.unlink( executable )
         if not result['OK']:
           self.log.error( 'Failed submission to queue %s:\n' % queue, result['Message'] )
-          pilotsToSubmit = 0
           self.failedQueues[queue] += 1
-          continue
+          break
 
         pilotsToSubmit = pilotsToSubmit - pilotSubmissionChunk
-        # Add pilots to the PilotAgentsDB assign pilots to TaskQueue proportionally to the
-        # task queue priorities
         pilotList = result['Value']
         self.queueSlots[queue]['AvailableSlots'] -= len( pilotList )
-        totalSubmittedPilots += len( pilotList )
+        submittedPilots += len( pilotList )
         self.log.info( 'Submitted %d pilots to %s@%s' % ( len( pilotList ), queueName, ceName ) )
         stampDict = {}
         if result.has_key( 'PilotStampDict' ):
           stampDict = result['PilotStampDict']
-        tqPriorityList = []
-        sumPriority = 0.
-        for tq in taskQueueDict:
-          sumPriority += taskQueueDict[tq]['Priority']
-          tqPriorityList.append( ( tq, sumPriority ) )
-        rndm = random.random()*sumPriority
-        tqDict = {}
-        for pilotID in pilotList:
-          rndm = random.random() * sumPriority
-          for tq, prio in tqPriorityList:
-            if rndm < prio:
-              tqID = tq
-              break
-          if not tqDict.has_key( tqID ):
-            tqDict[tqID] = []
-          tqDict[tqID].append( pilotID )
-
-        for tqID, pilotList in tqDict.items():
-          result = pilotAgentsDB.addPilotTQReference( pilotList,
-                                                      tqID,
-                                                      self.pilotDN,
-                                                      self.pilotGroup,
-                                                      self.localhost,
-                                                      ceType,
-                                                      '',
-                                                      stampDict )
-          if not result['OK']:
-            self.log.error( 'Failed add pilots to the PilotAgentsDB: ', result['Message'] )
-            continue
-          for pilot in pilotList:
-            result = pilotAgentsDB.setPilotStatus( pilot, 'Submitted', ceName,
-                                                  'Successfully submitted by the SiteDirector',
-                                                  siteName, queueName )
-            if not result['OK']:
-              self.log.error( 'Failed to set pilot status: ', result['Message'] )
-              continue
+        self.__registerPilots( queue, taskQueueDict, pilotList, stampDict )
+    finally:
+      self.__addPilotsInSubmission( tqIDList, -bookedPilots )
 
-    self.log.info( "%d pilots submitted in total in this cycle, %d matched queues" % ( totalSubmittedPilots, matchedQueues ) )
-    return S_OK()
+    return S_OK( ( submittedPilots, True ) )
+
+  def __registerPilots( self, queue, taskQueueDict, pilotList, stampDict ):
+    """ Add the pilots to the PilotAgentsDB, assign pilots to TaskQueue proportionally to the
+        task queue priorities
+    """
+    ceName = self.queueDict[queue]['CEName']
+    ceType = self.queueDict[queue]['CEType']
+    queueName = self.queueDict[queue]['QueueName']
+    siteName = self.queueDict[queue]['Site']
+
+    tqPriorityList = []
+    sumPriority = 0.
+    for tq in taskQueueDict:
+      sumPriority += taskQueueDict[tq]['Priority']
+      tqPriorityList.append( ( tq, sumPriority ) )
+    tqDict = {}
+    for pilotID in pilotList:
+      rndm = random.random() * sumPriority
+      for tq, prio in tqPriorityList:
+        if rndm < prio:
+          tqID = tq
+          break
+      if not tqDict.has_key( tqID ):
+        tqDict[tqID] = []
+      tqDict[tqID].append( pilotID )
+
+    for tqID, tqPilotList in tqDict.items():
+      result = pilotAgentsDB.addPilotTQReference( tqPilotList,
+                                                  tqID,
+                                                  self.pilotDN,
+                                                  self.pilotGroup,
+                                                  self.localhost,
+                                                  ceType,
+                                                  '',
+                                                  stampDict )
+      if not result['OK']:
+        self.log.error( 'Failed add pilots to the PilotAgentsDB: ', result['Message'] )
+        continue
+      # One update for all the pilots of the task queue
+      result = pilotAgentsDB.setPilotStatus( tqPilotList, 'Submitted', ceName,
+                                             'Successfully submitted by the SiteDirector',
+                                             siteName, queueName )
+      if not result['OK']:
+        self.log.error( 'Failed to set pilot status: ', result['Message'] )
+
+  def __bookPilots( self, tqIDList, neededPilots, countBooked = True ):
+    """ Book at once up to neededPilots pilots, at most MAX_PILOTS_TO_SUBMIT, for the task queues, less
+        the pilots already booked for them by the other queues if countBooked
+
+        :return: ( number of pilots booked by the other queues, number of pilots booked )
+    """
+    self.submissionLock.acquire()
+    try:
+      pilotsInSubmission = 0
+      if countBooked:
+        pilotsInSubmission = sum( [ self.pilotsInSubmission.get( tqID, 0 ) for tqID in tqIDList ] )
+      bookedPilots = max( 0, min( self.maxPilotsToSubmit, neededPilots - pilotsInSubmission ) )
+      if bookedPilots:
+        for tqID in tqIDList:
+          self.pilotsInSubmission[tqID] = self.pilotsInSubmission.get( tqID, 0 ) + bookedPilots
+      return pilotsInSubmission, bookedPilots
+    finally:
+      self.submissionLock.release()
+
+  def __addPilotsInSubmission( self, tqIDList, pilots ):
+    """ Book ( or release with a negative number ) the pilots a queue is about to submit for the task
+        queues, so that the queues processed at the same time do not submit pilots for the same jobs
+    """
+    self.submissionLock.acquire()
+    try:
+      for tqID in tqIDList:
+        self.pilotsInSubmission[tqID] = self.pilotsInSubmission.get( tqID, 0 ) + pilots
+        if self.pilotsInSubmission[tqID] <= 0:
+          del self.pilotsInSubmission[tqID]
+    finally:
+      self.submissionLock.release()
 
   def __getQueueSlots( self, queue ):
     """ Get the number of available slots in the queue
@@ -628,12 +877,14 @@ class SiteDirector( AgentModule ):
     return totalSlots
 
 #####################################################################################
-  def __getExecutable( self, queue, pilotsToSubmit, bundleProxy = True, httpProxy = '', jobExecDir = '' ):
-    """ Prepare the full executable for queue
+  def __getExecutable( self, queue, pilotsToSubmit, bundleProxy = True, httpProxy = '', jobExecDir = '',
+                       proxy = None ):
+    """ Prepare the full executable for queue, with the given proxy or the last one obtained
     """
 
-    proxy = None
-    if bundleProxy:
+    if not bundleProxy:
+      proxy = None
+    elif proxy is None:
       proxy = self.proxy
     pilotOptions, pilotsToSubmit = self._getPilotOptions( queue, pilotsToSubmit )
     if pilotOptions is None:
@@ -768,24 +1019,11 @@ class SiteDirector( AgentModule ):
       if proxy is not None:
         compressedAndEncodedProxy = base64.encodestring( bz2.compress( proxy.dumpAllToString()['Value'] ) )
         proxyFlag = 'True'
-      compressedAndEncodedPilot = base64.encodestring( bz2.compress( open( self.pilot, "rb" ).read(), 9 ) )
-      compressedAndEncodedInstall = base64.encodestring( bz2.compress( open( self.install, "rb" ).read(), 9 ) )
-      compressedAndEncodedExtra = {}
-      for module in self.extraModules:
-        moduleName = os.path.basename( module )
-        compressedAndEncodedExtra[moduleName] = base64.encodestring( bz2.compress( open( module, "rb" ).read(), 9 ) )
+      pilotBundle = self.__getPilotBundle()
     except:
       self.log.exception( 'Exception during file compression of proxy, dirac-pilot or dirac-install' )
       return S_ERROR( 'Exception during file compression of proxy, dirac-pilot or dirac-install' )
 
-    # Extra modules
-    mStringList = []
-    for moduleName in compressedAndEncodedExtra:
-      mString = """open( '%s', "w" ).write(bz2.decompress( base64.decodestring( \"\"\"%s\"\"\" ) ) )""" % \
-                ( moduleName, compressedAndEncodedExtra[moduleName] )
-      mStringList.append( mString )
-    extraModuleString = '\n  '.join( mStringList ) 
-  
     localPilot = """#!/bin/bash
 /usr/bin/env python << EOF
 #
@@ -829,9 +1067,9 @@ shutil.rmtree( pilotWorkingDirectory )
 
 EOF
 """ % { 'compressedAndEncodedProxy': compressedAndEncodedProxy,
-        'compressedAndEncodedPilot': compressedAndEncodedPilot,
-        'compressedAndEncodedInstall': compressedAndEncodedInstall,
-        'extraModuleString': extraModuleString,
+        'compressedAndEncodedPilot': pilotBundle['Pilot'],
+        'compressedAndEncodedInstall': pilotBundle['Install'],
+        'extraModuleString': pilotBundle['ExtraModules'],
         'httpProxy': httpProxy,
         'pilotExecDir': pilotExecDir,
         'pilotScript': os.path.basename( self.pilot ),
@@ -845,184 +1083,283 @@ EOF
     pilotWrapper.close()
     return name
 
+  def __setPilotVersion( self, pilotVersion ):
+    """ A new pilot version gets a new pilot bundle
+    """
+    if pilotVersion == self.pilotBundleVersion:
+      return
+    if self.pilotBundleVersion is not None:
+      self.log.info( 'Pilot version changed to %s, dropping the pilot bundle' % ','.join( pilotVersion ) )
+    self.pilotBundleLock.acquire()
+    try:
+      self.pilotBundle = None
+      self.pilotBundleStats = None
+      self.pilotBundleChecksum = None
+      self.pilotBundleVersion = pilotVersion
+    finally:
+      self.pilotBundleLock.release()
+
+  def __getPilotBundle( self ):
+    """ Get the compressed and encoded pilot, install and extra module files
+
+        They are compressed again only when their content changes, the files are read
+        again only when their size or modification time change
+    """
+    fileList = [ self.pilot, self.install ] + self.extraModules
+    fileStats = []
+    for fileName in fileList:
+      fileStat = os.stat( fileName )
+      fileStats.append( ( fileName, fileStat.st_size, fileStat.st_mtime ) )
+
+    self.pilotBundleLock.acquire()
+    try:
+      if self.pilotBundle and fileStats == self.pilotBundleStats:
+        return self.pilotBundle
+
+      contents = [ open( fileName, "rb" ).read() for fileName in fileList ]
+      checksum = hashlib.md5()
+      for fileName, content in zip( fileList, contents ):
+        checksum.update( os.path.basename( fileName ) )
+        checksum.update( hashlib.md5( content ).hexdigest() )
+      checksum = checksum.hexdigest()
+      if self.pilotBundle and checksum == self.pilotBundleChecksum:
+        self.pilotBundleStats = fileStats
+        return self.pilotBundle
+
+      encodedContents = [ base64.encodestring( bz2.compress( content, 9 ) ) for content in contents ]
+      # Extra modules
+      mStringList = []
+      for module, encodedContent in zip( self.extraModules, encodedContents[2:] ):
+        mString = """open( '%s', "w" ).write(bz2.decompress( base64.decodestring( \"\"\"%s\"\"\" ) ) )""" % \
+                  ( os.path.basename( module ), encodedContent )
+        mStringList.append( mString )
+
+      self.log.info( 'New pilot bundle with checksum %s' % checksum )
+      self.pilotBundle = { 'Pilot': encodedContents[0],
+                           'Install': encodedContents[1],
+                           'ExtraModules': '\n  '.join( mStringList ) }
+      self.pilotBundleStats = fileStats
+      self.pilotBundleChecksum = checksum
+      return self.pilotBundle
+    finally:
+      self.pilotBundleLock.release()
+
   def updatePilotStatus( self ):
     """ Update status of pilots in transient states
     """
-    for queue in self.queueDict:
-      ce = self.queueDict[queue]['CE']
-      ceName = self.queueDict[queue]['CEName']
-      queueName = self.queueDict[queue]['QueueName']
-      ceType = self.queueDict[queue]['CEType']
-      siteName = self.queueDict[queue]['Site']
-      abortedPilots = 0
-
-      result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
-                                            'Queue':queueName,
-                                            'GridType':ceType,
-                                            'GridSite':siteName,
-                                            'Status':TRANSIENT_PILOT_STATUS,
-                                            'OwnerDN': self.pilotDN,
-                                            'OwnerGroup': self.pilotGroup } )
+    results = self.__executeQueues( 'Status update', self.__updateQueuePilots, self.queueDict.keys() )
+    # The accounting of all the queues is sent at once
+    accountingDict = {}
+    errorResult = None
+    for queue in results:
+      result = results[queue]
       if not result['OK']:
-        self.log.error( 'Failed to select pilots: %s' % result['Message'] )
-        continue
-      pilotRefs = result['Value']
-      if not pilotRefs:
+        self.log.error( 'Errors in updating pilot status of queue %s:' % queue, result['Message'] )
+        errorResult = errorResult or result
         continue
-
-      result = pilotAgentsDB.getPilotInfo( pilotRefs )
+      accountingDict.update( result['Value'] )
+    if accountingDict:
+      result = self.sendPilotAccounting( accountingDict )
       if not result['OK']:
-        self.log.error( 'Failed to get pilots info from DB', result['Message'] )
-        continue
-      pilotDict = result['Value']
+        self.log.error( 'Failed to send pilot agent accounting' )
+    if errorResult:
+      return errorResult
+    return S_OK()
 
-      stampedPilotRefs = []
-      for pRef in pilotDict:
-        if pilotDict[pRef]['PilotStamp']:
-          stampedPilotRefs.append( pRef + ":::" + pilotDict[pRef]['PilotStamp'] )
-        else:
-          stampedPilotRefs = list( pilotRefs )
-          break
+  def __updateQueuePilots( self, queue ):
+    """ Update the pilots of the queue and retrieve their output
 
-      result = ce.isProxyValid()
-      if not result['OK']:
-        result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 23400 )
-        if not result['OK']:
-          return result
-        self.proxy = result['Value']
-        ce.setProxy( self.proxy, 23300 )
+        :return: S_OK( pilot info dict of the pilots to be sent to the accounting )
+    """
+    result = self.__updateQueuePilotStatus( queue )
+    if not result['OK']:
+      return result
+    # The pilot can be in Done state set by the job agent check if the output is retrieved
+    return self.__retrieveQueuePilotOutput( queue )
 
-      result = ce.getJobStatus( stampedPilotRefs )
+  def __updateQueuePilotStatus( self, queue ):
+    """ Update status of the pilots of the queue in transient states
+    """
+    ce = self.queueDict[queue]['CE']
+    ceName = self.queueDict[queue]['CEName']
+    queueName = self.queueDict[queue]['QueueName']
+    ceType = self.queueDict[queue]['CEType']
+    siteName = self.queueDict[queue]['Site']
+    abortedPilots = 0
+
+    result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
+                                          'Queue':queueName,
+                                          'GridType':ceType,
+                                          'GridSite':siteName,
+                                          'Status':TRANSIENT_PILOT_STATUS,
+                                          'OwnerDN': self.pilotDN,
+                                          'OwnerGroup': self.pilotGroup } )
+    if not result['OK']:
+      self.log.error( 'Failed to select pilots: %s' % result['Message'] )
+      return S_OK()
+    pilotRefs = result['Value']
+    if not pilotRefs:
+      return S_OK()
+
+    result = pilotAgentsDB.getPilotInfo( pilotRefs )
+    if not result['OK']:
+      self.log.error( 'Failed to get pilots info from DB', result['Message'] )
+      return S_OK()
+    pilotDict = result['Value']
+
+    stampedPilotRefs = []
+    for pRef in pilotDict:
+      if pilotDict[pRef]['PilotStamp']:
+        stampedPilotRefs.append( pRef + ":::" + pilotDict[pRef]['PilotStamp'] )
+      else:
+        stampedPilotRefs = list( pilotRefs )
+        break
+
+    result = ce.isProxyValid()
+    if not result['OK']:
+      result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 23400 )
       if not result['OK']:
-        self.log.error( 'Failed to get pilots status from CE', '%s: %s' % ( ceName, result['Message'] ) )
-        continue
-      pilotCEDict = result['Value']
+        return result
+      ce.setProxy( result['Value'], 23300 )
 
-      for pRef in pilotRefs:
-        newStatus = ''
-        oldStatus = pilotDict[pRef]['Status']
-        ceStatus = pilotCEDict[pRef]
-        lastUpdateTime = pilotDict[pRef]['LastUpdateTime']
-        sinceLastUpdate = dateTime() - lastUpdateTime
-
-        if oldStatus == ceStatus and ceStatus != "Unknown":
-          # Normal status did not change, continue
+    result = ce.getJobStatus( stampedPilotRefs )
+    if not result['OK']:
+      self.log.error( 'Failed to get pilots status from CE', '%s: %s' % ( ceName, result['Message'] ) )
+      return S_OK()
+    pilotCEDict = result['Value']
+
+    # New status -> pilots, updated at once
+    statusUpdates = {}
+    for pRef in pilotRefs:
+      newStatus = ''
+      oldStatus = pilotDict[pRef]['Status']
+      ceStatus = pilotCEDict[pRef]
+      lastUpdateTime = pilotDict[pRef]['LastUpdateTime']
+      sinceLastUpdate = dateTime() - lastUpdateTime
+
+      if oldStatus == ceStatus and ceStatus != "Unknown":
+        # Normal status did not change, continue
+        continue
+      elif ceStatus == "Unknown" and oldStatus == "Unknown":
+        if sinceLastUpdate < 3600*second:
+          # Allow 1 hour of Unknown status assuming temporary problems on the CE
           continue
-        elif ceStatus == "Unknown" and oldStatus == "Unknown":
-          if sinceLastUpdate < 3600*second:
-            # Allow 1 hour of Unknown status assuming temporary problems on the CE
-            continue
+        else:
+          newStatus = 'Aborted'
+      elif ceStatus == "Unknown" and not oldStatus in FINAL_PILOT_STATUS:
+        # Possible problems on the CE, let's keep the Unknown status for a while
+        newStatus = 'Unknown'
+      elif ceStatus != 'Unknown' :
+        # Update the pilot status to the new value
+        newStatus = ceStatus
+
+      if newStatus:
+        self.log.info( 'Updating status to %s for pilot %s' % ( newStatus, pRef ) )
+        statusUpdates.setdefault( newStatus, [] ).append( pRef )
+        if newStatus == "Aborted":
+          abortedPilots += 1
+      # Retrieve the pilot output now
+      if newStatus in FINAL_PILOT_STATUS:
+        if pilotDict[pRef]['OutputReady'].lower() == 'false' and self.getOutput:
+          self.log.info( 'Retrieving output for pilot %s' % pRef )
+          pilotStamp = pilotDict[pRef]['PilotStamp']
+          pRefStamp = pRef
+          if pilotStamp:
+            pRefStamp = pRef + ':::' + pilotStamp
+          result = ce.getJobOutput( pRefStamp )
+          if not result['OK']:
+            self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
           else:
-            newStatus = 'Aborted'
-        elif ceStatus == "Unknown" and not oldStatus in FINAL_PILOT_STATUS:
-          # Possible problems on the CE, let's keep the Unknown status for a while
-          newStatus = 'Unknown'
-        elif ceStatus != 'Unknown' :
-          # Update the pilot status to the new value
-          newStatus = ceStatus
-
-        if newStatus:
-          self.log.info( 'Updating status to %s for pilot %s' % ( newStatus, pRef ) )
-          result = pilotAgentsDB.setPilotStatus( pRef, newStatus, '', 'Updated by SiteDirector' )
-          if newStatus == "Aborted":
-            abortedPilots += 1
-        # Retrieve the pilot output now
-        if newStatus in FINAL_PILOT_STATUS:
-          if pilotDict[pRef]['OutputReady'].lower() == 'false' and self.getOutput:
-            self.log.info( 'Retrieving output for pilot %s' % pRef )
-            pilotStamp = pilotDict[pRef]['PilotStamp']
-            pRefStamp = pRef
-            if pilotStamp:
-              pRefStamp = pRef + ':::' + pilotStamp
-            result = ce.getJobOutput( pRefStamp )
-            if not result['OK']:
-              self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
+            output, error = result['Value']
+            if output:
+              result = pilotAgentsDB.storePilotOutput( pRef, output, error )
+              if not result['OK']:
+                self.log.error( 'Failed to store pilot output', result['Message'] )
             else:
-              output, error = result['Value']
-              if output:
-                result = pilotAgentsDB.storePilotOutput( pRef, output, error )
-                if not result['OK']:
-                  self.log.error( 'Failed to store pilot output', result['Message'] )
-              else:
-                self.log.warn( 'Empty pilot output not stored to PilotDB' )
-
-      # If something wrong in the queue, make a pause for the job submission
-      if abortedPilots:
-        self.failedQueues[queue] += 1 
+              self.log.warn( 'Empty pilot output not stored to PilotDB' )
 
-    # The pilot can be in Done state set by the job agent check if the output is retrieved
-    for queue in self.queueDict:
-      ce = self.queueDict[queue]['CE']
+    for newStatus, statusPilotRefs in statusUpdates.items():
+      result = pilotAgentsDB.setPilotStatus( statusPilotRefs, newStatus, '', 'Updated by SiteDirector' )
+      if not result['OK']:
+        self.log.error( 'Failed to set pilot status: ', result['Message'] )
+
+    # If something wrong in the queue, make a pause for the job submission
+    if abortedPilots:
+      self.failedQueues[queue] += 1
 
-      if not ce.isProxyValid( 120 ):
-        result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 1000 )
+    return S_OK()
+
+  def __retrieveQueuePilotOutput( self, queue ):
+    """ Retrieve the output of the pilots of the queue in final states, get the ones needing accounting
+    """
+    ce = self.queueDict[queue]['CE']
+
+    if not ce.isProxyValid( 120 ):
+      result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 1000 )
+      if not result['OK']:
+        return result
+      ce.setProxy( result['Value'], 940 )
+
+    ceName = self.queueDict[queue]['CEName']
+    queueName = self.queueDict[queue]['QueueName']
+    ceType = self.queueDict[queue]['CEType']
+    siteName = self.queueDict[queue]['Site']
+    result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
+                                         'Queue':queueName,
+                                         'GridType':ceType,
+                                         'GridSite':siteName,
+                                         'OutputReady':'False',
+                                         'Status':FINAL_PILOT_STATUS} )
+
+    if not result['OK']:
+      self.log.error( 'Failed to select pilots', result['Message'] )
+      return S_OK( {} )
+    pilotRefs = result['Value']
+    if not pilotRefs:
+      return S_OK( {} )
+    result = pilotAgentsDB.getPilotInfo( pilotRefs )
+    if not result['OK']:
+      self.log.error( 'Failed to get pilots info from DB', result['Message'] )
+      return S_OK( {} )
+    pilotDict = result['Value']
+    if self.getOutput:
+      for pRef in pilotRefs:
+        self.log.info( 'Retrieving output for pilot %s' % pRef )
+        pilotStamp = pilotDict[pRef]['PilotStamp']
+        pRefStamp = pRef
+        if pilotStamp:
+          pRefStamp = pRef + ':::' + pilotStamp
+        result = ce.getJobOutput( pRefStamp )
         if not result['OK']:
-          return result
-        ce.setProxy( self.proxy, 940 )
+          self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
+        else:
+          output, error = result['Value']
+          result = pilotAgentsDB.storePilotOutput( pRef, output, error )
+          if not result['OK']:
+            self.log.error( 'Failed to store pilot output', result['Message'] )
 
-      ceName = self.queueDict[queue]['CEName']
-      queueName = self.queueDict[queue]['QueueName']
-      ceType = self.queueDict[queue]['CEType']
-      siteName = self.queueDict[queue]['Site']
+    # Check if the accounting is to be sent
+    if self.sendAccounting:
       result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
                                            'Queue':queueName,
                                            'GridType':ceType,
                                            'GridSite':siteName,
-                                           'OutputReady':'False',
+                                           'AccountingSent':'False',
                                            'Status':FINAL_PILOT_STATUS} )
 
       if not result['OK']:
         self.log.error( 'Failed to select pilots', result['Message'] )
-        continue
+        return S_OK( {} )
       pilotRefs = result['Value']
       if not pilotRefs:
-        continue
+        return S_OK( {} )
       result = pilotAgentsDB.getPilotInfo( pilotRefs )
       if not result['OK']:
         self.log.error( 'Failed to get pilots info from DB', result['Message'] )
-        continue
-      pilotDict = result['Value']
-      if self.getOutput:
-        for pRef in pilotRefs:
-          self.log.info( 'Retrieving output for pilot %s' % pRef )
-          pilotStamp = pilotDict[pRef]['PilotStamp']
-          pRefStamp = pRef
-          if pilotStamp:
-            pRefStamp = pRef + ':::' + pilotStamp
-          result = ce.getJobOutput( pRefStamp )
-          if not result['OK']:
-            self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
-          else:
-            output, error = result['Value']
-            result = pilotAgentsDB.storePilotOutput( pRef, output, error )
-            if not result['OK']:
-              self.log.error( 'Failed to store pilot output', result['Message'] )
-
-      # Check if the accounting is to be sent
-      if self.sendAccounting:
-        result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
-                                             'Queue':queueName,
-                                             'GridType':ceType,
-                                             'GridSite':siteName,
-                                             'AccountingSent':'False',
-                                             'Status':FINAL_PILOT_STATUS} )
-
-        if not result['OK']:
-          self.log.error( 'Failed to select pilots', result['Message'] )
-          continue
-        pilotRefs = result['Value']
-        if not pilotRefs:
-          continue
-        result = pilotAgentsDB.getPilotInfo( pilotRefs )
-        if not result['OK']:
-          self.log.error( 'Failed to get pilots info from DB', result['Message'] )
-          continue
-        pilotDict = result['Value']
-        result = self.sendPilotAccounting( pilotDict )
-        if not result['OK']:
-          self.log.error( 'Failed to send pilot agent accounting' )
+        return S_OK( {} )
+      return S_OK( result['Value'] )
 
-    return S_OK()
+    return S_OK( {} )
 
   def sendPilotAccounting( self, pilotDict ):
     """ Send pilot accounting record
@@ -1057,20 +1394,14 @@ EOF
       retVal = gDataStoreClient.addRegister( pA )
       if not retVal[ 'OK' ]:
         self.log.error( 'Failed to send accounting info for pilot ', pRef )
-      else:
-        # Set up AccountingSent flag
-        result = pilotAgentsDB.setAccountingFlag( pRef )
-        if not result['OK']:
-          self.log.error( 'Failed to set accounting flag for pilot ', pRef )
 
     self.log.info( 'Committing accounting records for %d pilots' % len( pilotDict ) )
     result = gDataStoreClient.commit()
     if result['OK']:
-      for pRef in pilotDict:
-        self.log.verbose( 'Setting AccountingSent flag for pilot %s' % pRef )
-        result = pilotAgentsDB.setAccountingFlag( pRef )
-        if not result['OK']:
-          self.log.error( 'Failed to set accounting flag for pilot ', pRef )
+      self.log.verbose( 'Setting AccountingSent flag for %d pilots' % len( pilotDict ) )
+      result = pilotAgentsDB.setAccountingFlag( pilotDict.keys() )
+      if not result['OK']:
+        self.log.error( 'Failed to set accounting flag for pilots ', result['Message'] )
     else:
       return result
 
@@ -0,0 +1,348 @@
+""" Unit tests of the SiteDirector concurrent processing of the queues and pilot bundle
+"""
+
+import base64
+import bz2
+import os
+import shutil
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+from mock import MagicMock, patch
+
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.WorkloadManagementSystem.Agent.SiteDirector import SiteDirector
+
+class FakeQueueFunction( object ):
+  """ Queue function recording how many queues of each CE run at the same time
+  """
+
+  def __init__( self, queueDict, duration = 0.05 ):
+    self.queueDict = queueDict
+    self.duration = duration
+    self.lock = threading.Lock()
+    self.running = {}
+    self.maxRunning = {}
+    self.called = []
+    # queue -> event to wait for instead of the duration
+    self.hanging = {}
+    self.failing = set()
+
+  def __call__( self, queue, *args ):
+    key = self.queueDict[queue]['CEName']
+    if self.queueDict[queue]['CEType'] == 'ARC':
+      key = 'ARC'
+    self.lock.acquire()
+    try:
+      self.called.append( ( queue, args ) )
+      self.running[key] = self.running.get( key, 0 ) + 1
+      self.maxRunning[key] = max( self.maxRunning.get( key, 0 ), self.running[key] )
+    finally:
+      self.lock.release()
+    if queue in self.hanging:
+      self.hanging[queue].wait( 30 )
+    else:
+      time.sleep( self.duration )
+    self.lock.acquire()
+    try:
+      self.running[key] -= 1
+    finally:
+      self.lock.release()
+    if queue in self.failing:
+      return S_ERROR( 'Failed queue %s' % queue )
+    return S_OK( queue )
+
+class SiteDirectorTestCase( unittest.TestCase ):
+  """ Base class for the SiteDirector test cases
+  """
+
+  def setUp( self ):
+    self.director = types.InstanceType( SiteDirector )
+    self.director.log = gLogger.getSubLogger( 'SiteDirector' )
+    self.director.queueDict = {}
+    for ceName, ceType, numQueues in ( ( 'ce1.example.org', 'CREAM', 4 ),
+                                       ( 'ce2.example.org', 'CREAM', 2 ),
+                                       ( 'arc1.example.org', 'ARC', 2 ),
+                                       ( 'arc2.example.org', 'ARC', 1 ) ):
+      for iQueue in range( numQueues ):
+        self.director.queueDict[ '%s_q%d' % ( ceName, iQueue ) ] = { 'CEName' : ceName, 'CEType' : ceType }
+    self.director.busyQueues = {}
+    self.director.busyQueuesLock = threading.Lock()
+    self.director.failedQueues = {}
+    self.director.queueCycleTimes = {}
+    self.director.pilotsInSubmission = {}
+    self.director.submissionLock = threading.Lock()
+    self.director.maxConcurrentQueues = 4
+    self.director.maxConcurrentQueuesPerCE = 2
+    self.director.queueTimeout = 900
+    self.director.serialCETypes = [ 'ARC' ]
+    self.queueFunction = FakeQueueFunction( self.director.queueDict )
+
+  def tearDown( self ):
+    for event in self.queueFunction.hanging.values():
+      event.set()
+
+  def executeQueues( self, queues ):
+    return self.director._SiteDirector__executeQueues( 'Test', self.queueFunction, queues, 'arg' )
+
+class ExecuteQueuesTestCase( SiteDirectorTestCase ):
+
+  def test_sequential( self ):
+    """ One queue at a time, stopping at the first error
+    """
+    self.director.maxConcurrentQueues = 1
+    queues = sorted( self.director.queueDict )
+    self.queueFunction.failing.add( queues[2] )
+    results = self.executeQueues( queues )
+    self.assertEqual( sorted( results ), queues[:3] )
+    self.assertFalse( results[queues[2]]['OK'] )
+    self.assertEqual( self.queueFunction.called, [ ( queue, ( 'arg', ) ) for queue in queues[:3] ] )
+    self.assertEqual( max( self.queueFunction.maxRunning.values() ), 1 )
+    self.assertEqual( sorted( self.director.queueCycleTimes['Test'] ), queues[:3] )
+
+  def test_threads( self ):
+    """ All the queues are processed, with the CE limits
+    """
+    queues = sorted( self.director.queueDict )
+    self.queueFunction.failing.add( queues[2] )
+    results = self.executeQueues( queues )
+    self.assertEqual( sorted( results ), queues )
+    for queue in queues:
+      self.assertEqual( results[queue]['OK'], queue != queues[2] )
+    self.assertEqual( self.queueFunction.maxRunning['ce1.example.org'], 2 )
+    self.assertEqual( self.queueFunction.maxRunning['ARC'], 1 )
+    self.assertEqual( self.director.busyQueues, {} )
+
+  def test_timeout( self ):
+    """ A stuck queue does not block the other queues of its CE
+    """
+    self.director.maxConcurrentQueuesPerCE = 1
+    self.director.queueTimeout = 1
+    queues = [ 'ce2.example.org_q0', 'ce2.example.org_q1' ]
+    self.queueFunction.hanging[queues[0]] = threading.Event()
+    start = time.time()
+    results = self.executeQueues( queues )
+    self.assert_( time.time() - start < 5 )
+    self.assertFalse( results[queues[0]]['OK'] )
+    self.assert_( results[queues[1]]['OK'] )
+    self.assertEqual( self.director.failedQueues[queues[0]], 1 )
+    # The stuck queue is skipped until it is over
+    self.assertEqual( sorted( self.director.busyQueues ), [ queues[0] ] )
+    self.assertEqual( sorted( self.executeQueues( queues ) ), [ queues[1] ] )
+    self.queueFunction.hanging[queues[0]].set()
+    for _i in range( 50 ):
+      if not self.director.busyQueues:
+        break
+      time.sleep( 0.1 )
+    self.assertEqual( self.director.busyQueues, {} )
+    # Its late result is not reported
+    self.assertFalse( results[queues[0]]['OK'] )
+
+  def test_serialTimeout( self ):
+    """ The queues of a serial CE type are not run next to a stuck one
+    """
+    self.director.queueTimeout = 1
+    queues = [ 'arc1.example.org_q0', 'arc2.example.org_q0', 'ce1.example.org_q0' ]
+    self.queueFunction.hanging[queues[0]] = threading.Event()
+    results = self.executeQueues( queues )
+    self.assertFalse( results[queues[0]]['OK'] )
+    self.assertFalse( queues[1] in results )
+    self.assert_( results[queues[2]]['OK'] )
+    self.assertEqual( self.queueFunction.maxRunning['ARC'], 1 )
+
+  def test_serialTimeoutNextCycle( self ):
+    """ The slot of a stuck serial queue stays taken in the next cycles until its thread is over
+    """
+    self.director.queueTimeout = 1
+    queues = [ 'arc1.example.org_q0', 'arc2.example.org_q0' ]
+    self.queueFunction.hanging[queues[0]] = threading.Event()
+    self.executeQueues( queues[:1] )
+    self.assertEqual( self.director.busyQueues, { queues[0] : ( 'CEType', 'ARC' ) } )
+    self.assertEqual( self.executeQueues( queues[1:] ), {} )
+    self.assertEqual( self.queueFunction.maxRunning['ARC'], 1 )
+    self.queueFunction.hanging[queues[0]].set()
+    for _i in range( 50 ):
+      if not self.director.busyQueues:
+        break
+      time.sleep( 0.1 )
+    self.assert_( self.executeQueues( queues[1:] )[queues[1]]['OK'] )
+
+  def test_pilotBooking( self ):
+    """ The pilots booked by a queue are seen by the others until they are released
+    """
+    self.director.maxPilotsToSubmit = 100
+    bookPilots = self.director._SiteDirector__bookPilots
+    addPilots = self.director._SiteDirector__addPilotsInSubmission
+    self.assertEqual( bookPilots( [ 1, 2 ], 10 ), ( 0, 10 ) )
+    self.assertEqual( bookPilots( [ 2 ], 15 ), ( 10, 5 ) )
+    self.assertEqual( bookPilots( [ 2, 3 ], 15 ), ( 15, 0 ) )
+    self.assertEqual( bookPilots( [ 3 ], 500 ), ( 0, 100 ) )
+    # Not counting the other bookings
+    self.assertEqual( bookPilots( [ 2 ], 1, countBooked = False ), ( 0, 1 ) )
+    addPilots( [ 1, 2 ], -10 )
+    addPilots( [ 2 ], -6 )
+    addPilots( [ 3 ], -100 )
+    self.assertEqual( self.director.pilotsInSubmission, {} )
+
+class SubmitToQueueTestCase( SiteDirectorTestCase ):
+
+  def setUp( self ):
+    SiteDirectorTestCase.setUp( self )
+    self.submitted = []
+    for queue in ( 'ce1.example.org_q0', 'ce2.example.org_q0' ):
+      ce = MagicMock()
+      ce.getParameterDict.return_value = {}
+      ce.submitJob.side_effect = self.submitJob
+      self.director.queueDict[queue].update( { 'CE' : ce, 'QueueName' : queue, 'Site' : 'LCG.Example.org',
+                                               'Platform' : 'x86_64', 'ParametersDict' : { 'CPUTime' : 1000 } } )
+    for attribute, value in ( ( 'failedQueueCycleFactor', 10 ), ( 'maxQueueLength', 86400 ), ( 'vo', 'test' ),
+                              ( 'voGroups', [] ), ( 'defaultSubmitPools', '' ), ( 'pilotWaitingFlag', True ),
+                              ( 'pilotWaitingTime', 3600 ), ( 'pilotDN', '/DN=pilot' ),
+                              ( 'pilotGroup', 'pilot' ), ( 'maxPilotsToSubmit', 100 ), ( 'queueSlots', {} ) ):
+      setattr( self.director, attribute, value )
+    self.director._SiteDirector__getQueueSlots = self.getQueueSlots
+    self.director._SiteDirector__getExecutable = lambda queue, pilots, *args: S_OK( ( '/dev/null', pilots ) )
+    self.director._SiteDirector__registerPilots = lambda *args: None
+    self.rpcMatcher = MagicMock()
+    self.rpcMatcher.getMatchingTaskQueues.return_value = S_OK( { 1 : { 'Jobs' : 10, 'Priority' : 1 } } )
+    self.patchers = [ patch( 'DIRAC.WorkloadManagementSystem.Agent.SiteDirector.%s' % name )
+                      for name in ( 'Resources', 'pilotAgentsDB', 'gProxyManager', 'os.unlink' ) ]
+    resources, pilotDB, proxyManager, _unlink = [ patcher.start() for patcher in self.patchers ]
+    resources.getCompatiblePlatforms.return_value = S_OK( [ 'x86_64' ] )
+    # 4 pilots waiting for the 10 jobs
+    pilotDB.countPilots.return_value = S_OK( 4 )
+    proxyManager.getPilotProxyFromDIRACGroup.return_value = S_OK( 'proxy' )
+
+  def tearDown( self ):
+    for patcher in self.patchers:
+      patcher.stop()
+    SiteDirectorTestCase.tearDown( self )
+
+  def getQueueSlots( self, queue ):
+    # Round trip to the CE
+    time.sleep( 0.2 )
+    return self.director.queueSlots.setdefault( queue, { 'AvailableSlots' : 50 } )['AvailableSlots']
+
+  def submitJob( self, executable, proxy, numberOfJobs ):
+    self.submitted.append( numberOfJobs )
+    return S_OK( [ 'pilot%d' % i for i in range( numberOfJobs ) ] )
+
+  def submitToQueue( self, queue ):
+    return self.director._SiteDirector__submitToQueue( queue, self.rpcMatcher, True, [], [], [ 'LCG.Example.org' ] )
+
+  def test_concurrentSubmission( self ):
+    """ Two queues serving the same task queue do not submit pilots for the same jobs
+    """
+    results = {}
+    def submit( queue ):
+      results[queue] = self.submitToQueue( queue )
+    threads = [ threading.Thread( target = submit, args = ( queue, ) )
+                for queue in ( 'ce1.example.org_q0', 'ce2.example.org_q0' ) ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join( 10 )
+    self.assertEqual( self.submitted, [ 6 ] )
+    self.assertEqual( sorted( [ result['Value'] for result in results.values() ] ), [ ( 0, True ), ( 6, True ) ] )
+    self.assertEqual( self.director.pilotsInSubmission, {} )
+
+  def test_trimmedBooking( self ):
+    """ The booking is trimmed to the available slots while submitting
+    """
+    self.director.queueSlots['ce1.example.org_q0'] = { 'AvailableSlots' : 2 }
+    bookings = []
+    self.director._SiteDirector__registerPilots = \
+      lambda *args: bookings.append( dict( self.director.pilotsInSubmission ) )
+    self.assertEqual( self.submitToQueue( 'ce1.example.org_q0' )['Value'], ( 2, True ) )
+    self.assertEqual( bookings, [ { 1 : 2 } ] )
+    self.assertEqual( self.director.pilotsInSubmission, {} )
+
+class PilotBundleTestCase( SiteDirectorTestCase ):
+
+  def setUp( self ):
+    SiteDirectorTestCase.setUp( self )
+    self.tmpDir = tempfile.mkdtemp()
+    self.director.pilot = self.writeFile( 'dirac-pilot.py', 'pilot' )
+    self.director.install = self.writeFile( 'dirac-install.py', 'install' )
+    self.director.extraModules = [ self.writeFile( 'pilotTools.py', 'tools' ) ]
+    self.director.pilotBundle = None
+    self.director.pilotBundleStats = None
+    self.director.pilotBundleChecksum = None
+    self.director.pilotBundleVersion = None
+    self.director.pilotBundleLock = threading.Lock()
+    self.director._SiteDirector__setPilotVersion( [ 'v1r0' ] )
+
+  def tearDown( self ):
+    SiteDirectorTestCase.tearDown( self )
+    shutil.rmtree( self.tmpDir )
+
+  def writeFile( self, fileName, content, mtime = None ):
+    fileName = os.path.join( self.tmpDir, fileName )
+    open( fileName, 'w' ).write( content )
+    if mtime:
+      os.utime( fileName, ( mtime, mtime ) )
+    return fileName
+
+  def getBundle( self ):
+    return self.director._SiteDirector__getPilotBundle()
+
+  def test_reuse( self ):
+    """ The bundle is not built again while the files do not change
+    """
+    bundle = self.getBundle()
+    self.assertEqual( bz2.decompress( base64.decodestring( bundle['Pilot'] ) ), 'pilot' )
+    self.assertEqual( bz2.decompress( base64.decodestring( bundle['Install'] ) ), 'install' )
+    self.assert_( "open( 'pilotTools.py'" in bundle['ExtraModules'] )
+    # The files are not even read
+    with patch( 'DIRAC.WorkloadManagementSystem.Agent.SiteDirector.open', create = True,
+                side_effect = AssertionError( 'Pilot files read again' ) ):
+      self.assert_( self.getBundle() is bundle )
+    # Same version, nothing changes
+    self.director._SiteDirector__setPilotVersion( [ 'v1r0' ] )
+    self.assert_( self.getBundle() is bundle )
+
+  def test_touchedFiles( self ):
+    """ Files with a new size or modification time are read again, the bundle is kept if
+        their content did not change
+    """
+    bundle = self.getBundle()
+    self.writeFile( 'dirac-pilot.py', 'pilot', mtime = time.time() + 100 )
+    self.assert_( self.getBundle() is bundle )
+    self.writeFile( 'pilotTools.py', 'tools', mtime = time.time() + 200 )
+    self.assert_( self.getBundle() is bundle )
+
+  def test_changedFiles( self ):
+    """ A new bundle is built when the content of a file changes
+    """
+    bundle = self.getBundle()
+    checksum = self.director.pilotBundleChecksum
+    self.writeFile( 'dirac-pilot.py', 'new pilot', mtime = time.time() + 100 )
+    newBundle = self.getBundle()
+    self.assert_( newBundle is not bundle )
+    self.assertEqual( bz2.decompress( base64.decodestring( newBundle['Pilot'] ) ), 'new pilot' )
+    self.assertNotEqual( self.director.pilotBundleChecksum, checksum )
+    # Same size, new modification time
+    self.writeFile( 'pilotTools.py', 'TOOLS', mtime = time.time() + 200 )
+    lastBundle = self.getBundle()
+    self.assert_( lastBundle is not newBundle )
+    self.assertEqual( lastBundle['Pilot'], newBundle['Pilot'] )
+    self.assertNotEqual( lastBundle['ExtraModules'], newBundle['ExtraModules'] )
+
+  def test_pilotVersion( self ):
+    """ A new pilot version drops the bundle
+    """
+    bundle = self.getBundle()
+    self.director._SiteDirector__setPilotVersion( [ 'v2r0' ] )
+    self.assertEqual( self.director.pilotBundle, None )
+    newBundle = self.getBundle()
+    self.assert_( newBundle is not bundle )
+    self.assertEqual( newBundle, bundle )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ExecuteQueuesTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( SubmitToQueueTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( PilotBundleTestCase ) )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -100,6 +100,29 @@ class Limiter( object ):
 
     return negativeCond
 
+  def isSiteLimited( self, siteName ):
+    """ Check if running limits or matching delays are defined for the site
+    """
+    sections = []
+    if self.__opsHelper.getValue( "JobScheduling/CheckJobLimits", True ):
+      sections.append( self.__runningLimitSection )
+    if self.__opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True ):
+      sections.append( self.__matchingDelaySection )
+    for section in sections:
+      result = self.__extractCSData( "%s/%s" % ( section, siteName ) )
+      if result['OK'] and result['Value']:
+        return True
+    return False
+
+  def invalidateRunningCounters( self, siteName ):
+    """ Forget the cached numbers of running jobs of the site, to count the jobs just matched
+    """
+    result = self.__extractCSData( "%s/%s" % ( self.__runningLimitSection, siteName ) )
+    if not result['OK']:
+      return
+    for attName in result['Value']:
+      self.condCache.delete( "Running:%s:%s" % ( siteName, attName ) )
+
   def __mergeCond( self, negCond, addCond ):
     """ Merge two negative dicts
     """
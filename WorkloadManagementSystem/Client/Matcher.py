@@ -6,9 +6,9 @@
 __RCSID__ = "$Id"
 
 import time
-from types import StringTypes
+from types import StringTypes, ListType, TupleType, DictType
 
-from DIRAC import gLogger, gMonitor
+from DIRAC import gLogger, gMonitor, S_OK, S_ERROR
 
 from DIRAC.Core.Utilities.ClassAd.ClassAdLight import ClassAd
 from DIRAC.Core.Security import Properties
@@ -59,71 +59,161 @@ class Matcher( object ):
   def selectJob( self, resourceDescription, credDict ):
     """ Main job selection function to find the highest priority job matching the resource capacity
     """
+    result = self.selectJobs( resourceDescription, credDict, 1 )
+    if type( result ) == DictType:
+      # An S_ERROR coming from the DBs
+      return result
+    return result[0]
+
+
+  def selectJobs( self, resourceDescription, credDict, maxJobs ):
+    """ Bulk version of selectJob: select up to maxJobs jobs matching the resource capacity in one pass.
+        The resource description is processed once and the job information is retrieved
+        and updated for all the matched jobs together. For the sites with running limits or
+        matching delays the jobs are matched one by one, with the limits checked again each time.
+
+        Returns a list of dictionaries, each one with the same content as the selectJob result
+    """
 
     startTime = time.time()
 
     resourceDict = self._getResourceDict( resourceDescription, credDict )
+    site = resourceDict['Site']
+
+    batchSize = maxJobs
+    if self.limiter.isSiteLimited( site ):
+      batchSize = 1
+
+    resultList = []
+    noMatchMessage = "No match found"
+    while len( resultList ) < maxJobs:
+      numJobs = min( batchSize, maxJobs - len( resultList ) )
+      negativeCond = self.limiter.getNegativeCondForSite( site )
+      result = self.tqDB.matchAndGetJobs( resourceDict, numJobs, negativeCond = negativeCond )
+      if not result['OK']:
+        if not resultList:
+          return result
+        self.log.warn( "Stopping the match after %s jobs" % len( resultList ), result['Message'] )
+        break
+      if not result['Value']['matchFound']:
+        break
+      jobIDs = [ jobID for jobID, _tqID in result['Value']['jobs'] ]
+
+      result = self.__assignJobs( resourceDict, jobIDs )
+      if not result['OK']:
+        if not resultList:
+          raise RuntimeError( result['Message'] )
+        self.log.warn( "Stopping the match after %s jobs" % len( resultList ), result['Message'] )
+        break
+      if not result['Value']:
+        noMatchMessage = "None of the matched jobs is in Waiting state"
+      resultList.extend( result['Value'] )
+      if batchSize == 1:
+        # The limits of the site are computed again with the new matched job
+        self.limiter.invalidateRunningCounters( site )
+      if batchSize == maxJobs or len( jobIDs ) < numJobs:
+        # All the jobs were matched at once, or no more jobs in the matching task queues
+        break
+
+    if not resultList:
+      self.log.info( noMatchMessage )
+      raise RuntimeError( noMatchMessage )
+
+    if not resourceDict.get( 'PilotInfoReportedFlag', False ):
+      self._updatePilotInfo( resourceDict, [ jobDict['JobID'] for jobDict in resultList ] )
 
-    negativeCond = self.limiter.getNegativeCondForSite( resourceDict['Site'] )
-    result = self.tqDB.matchAndGetJob( resourceDict, negativeCond = negativeCond )
+    matchTime = time.time() - startTime
+    self.log.info( "Match time for %s jobs: [%s]" % ( len( resultList ), str( matchTime ) ) )
+    gMonitor.addMark( "matchTime", matchTime )
+
+    return resultList
 
-    if not result['OK']:
-      return result
-    result = result['Value']
-    if not result['matchFound']:
-      self.log.info( "No match found" )
-      raise RuntimeError( "No match found" )
 
-    jobID = result['jobId']
-    resAtt = self.jobDB.getJobAttributes( jobID, ['OwnerDN', 'OwnerGroup', 'Status'] )
+  def __assignJobs( self, resourceDict, jobIDs ):
+    """ Check the jobs extracted from the task queues, set them to Matched and get their description.
+        The jobs that can not be given to the pilot are rescheduled or failed, not left Matched
+
+        Returns S_OK( list of job dictionaries )
+    """
+    resAtt = self.jobDB.getAttributesForJobList( jobIDs, ['OwnerDN', 'OwnerGroup', 'Status'] )
     if not resAtt['OK']:
-      raise RuntimeError( 'Could not retrieve job attributes' )
-    if not resAtt['Value']:
-      raise RuntimeError( "No attributes returned for job" )
-    if not resAtt['Value']['Status'] == 'Waiting':
-      self.log.error( 'Job matched by the TQ is not in Waiting state', str( jobID ) )
-      result = self.tqDB.deleteJob( jobID )
-      if not result[ 'OK' ]:
-        return result
-      raise RuntimeError( "Job %s is not in Waiting state" % str( jobID ) )
-
-    self._reportStatus( resourceDict, jobID )
-
-    result = self.jobDB.getJobJDL( jobID )
-    if not result['OK']:
-      raise RuntimeError( "Failed to get the job JDL" )
+      self.log.error( 'Could not retrieve job attributes', resAtt['Message'] )
+      self.__rescheduleJobs( jobIDs )
+      return S_ERROR( 'Could not retrieve job attributes' )
+    jobAttributes = resAtt['Value']
+    waitingJobIDs = []
+    for jobID in jobIDs:
+      if jobID not in jobAttributes:
+        self.log.error( "No attributes returned for job, not in the JobDB", str( jobID ) )
+      elif not jobAttributes[jobID]['Status'] == 'Waiting':
+        self.log.error( 'Job matched by the TQ is not in Waiting state', str( jobID ) )
+        result = self.tqDB.deleteJob( jobID )
+        if not result[ 'OK' ]:
+          self.log.error( 'Failed to delete job from the TQ', "%s: %s" % ( jobID, result['Message'] ) )
+      else:
+        waitingJobIDs.append( jobID )
+    if not waitingJobIDs:
+      return S_OK( [] )
 
-    resultDict = {}
-    resultDict['JDL'] = result['Value']
-    resultDict['JobID'] = jobID
+    self._reportStatus( resourceDict, waitingJobIDs )
 
-    matchTime = time.time() - startTime
-    self.log.info( "Match time: [%s]" % str( matchTime ) )
-    gMonitor.addMark( "matchTime", matchTime )
+    result = self.jobDB.getJobsJDL( waitingJobIDs )
+    if not result['OK']:
+      self.log.error( "Failed to get the job JDLs", result['Message'] )
+      self.__rescheduleJobs( waitingJobIDs )
+      return S_ERROR( "Failed to get the job JDLs" )
+    jdls = result['Value']
+    noJDLJobIDs = [ jobID for jobID in waitingJobIDs if jobID not in jdls ]
+    if noJDLJobIDs:
+      self.log.error( "Failed to get the job JDL", ",".join( [ str( jobID ) for jobID in noJDLJobIDs ] ) )
+      self.__failJobs( noJDLJobIDs, "Matcher: job JDL not found" )
 
     # Get some extra stuff into the response returned
-    resOpt = self.jobDB.getJobOptParameters( jobID )
+    resOpt = self.jobDB.getJobsOptParameters( waitingJobIDs )
     if resOpt['OK']:
-      for key, value in resOpt['Value'].items():
-        resultDict[key] = value
-    resAtt = self.jobDB.getJobAttributes( jobID, ['OwnerDN', 'OwnerGroup'] )
-    if not resAtt['OK']:
-      raise RuntimeError( 'Could not retrieve job attributes' )
-    if not resAtt['Value']:
-      raise RuntimeError( 'No attributes returned for job' )
+      optParameters = resOpt['Value']
+    else:
+      optParameters = {}
 
-    if self.opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True ):
-      self.limiter.updateDelayCounters( resourceDict['Site'], jobID )
+    checkMatchingDelay = self.opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True )
 
-    pilotInfoReportedFlag = resourceDict.get( 'PilotInfoReportedFlag', False )
-    if not pilotInfoReportedFlag:
-      self._updatePilotInfo( resourceDict, jobID )
+    resultList = []
+    for jobID in waitingJobIDs:
+      if jobID not in jdls:
+        continue
+      resultDict = dict( optParameters.get( jobID, {} ) )
+      resultDict['JDL'] = jdls[jobID]
+      resultDict['JobID'] = jobID
+      resultDict['DN'] = jobAttributes[jobID]['OwnerDN']
+      resultDict['Group'] = jobAttributes[jobID]['OwnerGroup']
+      resultDict['PilotInfoReportedFlag'] = True
+      resultList.append( resultDict )
 
-    resultDict['DN'] = resAtt['Value']['OwnerDN']
-    resultDict['Group'] = resAtt['Value']['OwnerGroup']
-    resultDict['PilotInfoReportedFlag'] = True
+      if checkMatchingDelay:
+        self.limiter.updateDelayCounters( resourceDict['Site'], jobID )
 
-    return resultDict
+    return S_OK( resultList )
+
+  def __rescheduleJobs( self, jobIDs ):
+    """ Give back to the optimizers the jobs taken out of the task queues that can not be served
+    """
+    for jobID in jobIDs:
+      result = self.jobDB.rescheduleJob( jobID )
+      if not result['OK']:
+        self.log.error( "Failed to reschedule job", "%s: %s" % ( jobID, result['Message'] ) )
+        continue
+      self.jlDB.addLoggingRecord( result['JobID'], result['Status'], result['MinorStatus'],
+                                  application = 'Unknown', source = 'Matcher' )
+
+  def __failJobs( self, jobIDs, minorStatus ):
+    """ Fail the jobs taken out of the task queues that can never be served
+    """
+    result = self.jobDB.setJobAttributes( jobIDs, ['Status', 'MinorStatus'], ['Failed', minorStatus] )
+    if not result['OK']:
+      self.log.error( "Problem reporting job status", "setJobAttributes: %s" % result['Message'] )
+    result = self.jlDB.addLoggingRecord( jobIDs, status = 'Failed', minor = minorStatus, source = 'Matcher' )
+    if not result['OK']:
+      self.log.error( "Problem reporting job status", "addLoggingRecord: %s" % result['Message'] )
 
 
   def _getResourceDict( self, resourceDescription, credDict ):
@@ -199,7 +289,7 @@ class Matcher( object ):
 
 
   def _reportStatus( self, resourceDict, jobID ):
-    """ Reports the status of the matched job in jobDB and jobLoggingDB
+    """ Reports the status of the matched job ( or list of jobs ) in jobDB and jobLoggingDB
 
         Do not fail if errors happen here
     """
@@ -244,6 +334,7 @@ class Matcher( object ):
 
   def _updatePilotInfo( self, resourceDict, jobID ):
     """ Update pilot information - do not fail if we don't manage to do it
+        jobID can be a list of jobs matched by the same pilot, the last one becomes the current job
 
         FIXME:  this part should not be done here, by the matcher. Instead, it should be done by the pilot itself.
                 Also, updating the job for pilot should be done by the JobAgent, since the jobAgent knows what job is running
@@ -260,14 +351,20 @@ class Matcher( object ):
       if not result['OK']:
         self.log.error( "Problem updating pilot information",
                         "; setPilotStatus. pilotReference: %s; %s" % ( pilotReference, result['Message'] ) )
-      result = self.pilotAgentsDB.setCurrentJobID( pilotReference, jobID )
+      jobIDList = jobID
+      if type( jobID ) not in ( ListType, TupleType ):
+        jobIDList = [ jobID ]
+      if not jobIDList:
+        return
+      result = self.pilotAgentsDB.setCurrentJobID( pilotReference, jobIDList[-1] )
       if not result['OK']:
         self.log.error( "Problem updating pilot information",
                         ";setCurrentJobID. pilotReference: %s; %s" % ( pilotReference, result['Message'] ) )
-      result = self.pilotAgentsDB.setJobForPilot( jobID, pilotReference, updateStatus = False )
-      if not result['OK']:
-        self.log.error( "Problem updating pilot information",
-                        "; setJobForPilot. pilotReference: %s; %s" % ( pilotReference, result['Message'] ) )
+      for jID in jobIDList:
+        result = self.pilotAgentsDB.setJobForPilot( jID, pilotReference, updateStatus = False )
+        if not result['OK']:
+          self.log.error( "Problem updating pilot information",
+                          "; setJobForPilot. pilotReference: %s; %s" % ( pilotReference, result['Message'] ) )
 
   def _checkCredentials( self, resourceDict, credDict ):
     """ Check if we can get a job given the passed credentials
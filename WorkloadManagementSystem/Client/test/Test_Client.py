@@ -7,7 +7,7 @@ import importlib
 
 from mock import MagicMock
 
-from DIRAC import S_OK
+from DIRAC import S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.Client.DownloadInputData import DownloadInputData
 from DIRAC.WorkloadManagementSystem.Client.Matcher import Matcher
 
@@ -141,6 +141,99 @@ class MatcherTestCase( ClientsTestCase ):
 
     self.assertEqual( res, resExpected )
 
+  def test_selectJobs( self ):
+
+    self.opsHelperMock.getValue.return_value = False
+    self.matcher.limiter = MagicMock()
+    self.matcher.limiter.isSiteLimited.return_value = False
+    self.jobDBMock.getSiteMask.return_value = S_OK( ['DIRAC.Jenkins.ch'] )
+    self.tqDBMock.matchAndGetJobs.return_value = S_OK( {'matchFound': True, 'jobs': [( 1, 10 ), ( 2, 10 ), ( 3, 11 )]} )
+    self.jobDBMock.getAttributesForJobList.return_value = S_OK( {1: {'OwnerDN': 'dn', 'OwnerGroup': 'group', 'Status': 'Waiting'},
+                                                                 2: {'OwnerDN': 'dn', 'OwnerGroup': 'group', 'Status': 'Killed'},
+                                                                 3: {'OwnerDN': 'dn', 'OwnerGroup': 'group', 'Status': 'Waiting'}} )
+    self.jobDBMock.getJobsJDL.return_value = S_OK( {1: 'JDL1', 3: 'JDL3'} )
+    self.jobDBMock.getJobsOptParameters.return_value = S_OK( {1: {'Opt': 'Value'}, 3: {}} )
+
+    res = self.matcher.selectJobs( {'Site': 'DIRAC.Jenkins.ch', 'CPUTime': 1000},
+                                   {'DN': 'dn', 'group': 'group', 'properties': []}, 3 )
+    self.assertEqual( [ r['JobID'] for r in res ], [1, 3] )
+    self.assertEqual( res[0]['JDL'], 'JDL1' )
+    self.assertEqual( res[0]['Opt'], 'Value' )
+    self.tqDBMock.deleteJob.assert_called_once_with( 2 )
+    self.jobDBMock.setJobAttributes.assert_called_once_with( [1, 3], ['Status', 'MinorStatus', 'ApplicationStatus', 'Site'],
+                                                             ['Matched', 'Assigned', 'Unknown', 'DIRAC.Jenkins.ch'] )
+
+  def test_selectJobsLimitedSite( self ):
+
+    self.opsHelperMock.getValue.return_value = False
+    self.matcher.limiter = MagicMock()
+    self.matcher.limiter.isSiteLimited.return_value = True
+    self.matcher.limiter.getNegativeCondForSite.side_effect = [ {}, {'JobType': ['User']}, {'JobType': ['User']} ]
+    self.jobDBMock.getSiteMask.return_value = S_OK( ['DIRAC.Jenkins.ch'] )
+    self.tqDBMock.matchAndGetJobs.side_effect = [ S_OK( {'matchFound': True, 'jobs': [( 1, 10 )]} ),
+                                                  S_OK( {'matchFound': True, 'jobs': [( 2, 11 )]} ),
+                                                  S_OK( {'matchFound': False, 'jobs': []} ) ]
+    self.jobDBMock.getAttributesForJobList.side_effect = lambda jobIDs, _attrs: \
+        S_OK( dict( [ ( jobID, {'OwnerDN': 'dn', 'OwnerGroup': 'group', 'Status': 'Waiting'} ) for jobID in jobIDs ] ) )
+    self.jobDBMock.getJobsJDL.side_effect = lambda jobIDs: S_OK( dict( [ ( jobID, 'JDL' ) for jobID in jobIDs ] ) )
+    self.jobDBMock.getJobsOptParameters.return_value = S_OK( {} )
+
+    res = self.matcher.selectJobs( {'Site': 'DIRAC.Jenkins.ch', 'CPUTime': 1000},
+                                   {'DN': 'dn', 'group': 'group', 'properties': []}, 5 )
+    self.assertEqual( [ r['JobID'] for r in res ], [1, 2] )
+    # One job per extraction, with the negative condition computed again each time
+    self.assertEqual( [ call[0][1] for call in self.tqDBMock.matchAndGetJobs.call_args_list ], [1, 1, 1] )
+    self.assertEqual( self.tqDBMock.matchAndGetJobs.call_args_list[1][1]['negativeCond'], {'JobType': ['User']} )
+    self.assertEqual( self.matcher.limiter.invalidateRunningCounters.call_count, 2 )
+
+  def test_selectJobsNoJDL( self ):
+
+    self.opsHelperMock.getValue.return_value = False
+    self.matcher.limiter = MagicMock()
+    self.matcher.limiter.isSiteLimited.return_value = False
+    self.jobDBMock.getSiteMask.return_value = S_OK( ['DIRAC.Jenkins.ch'] )
+    self.tqDBMock.matchAndGetJobs.return_value = S_OK( {'matchFound': True, 'jobs': [( 1, 10 ), ( 2, 10 )]} )
+    self.jobDBMock.getAttributesForJobList.return_value = S_OK( {1: {'OwnerDN': 'dn', 'OwnerGroup': 'group', 'Status': 'Waiting'},
+                                                                 2: {'OwnerDN': 'dn', 'OwnerGroup': 'group', 'Status': 'Waiting'}} )
+    self.jobDBMock.getJobsJDL.return_value = S_OK( {1: 'JDL1'} )
+    self.jobDBMock.getJobsOptParameters.return_value = S_OK( {} )
+
+    res = self.matcher.selectJobs( {'Site': 'DIRAC.Jenkins.ch', 'CPUTime': 1000},
+                                   {'DN': 'dn', 'group': 'group', 'properties': []}, 2 )
+    self.assertEqual( [ r['JobID'] for r in res ], [1] )
+    # The job without JDL is not left Matched
+    self.jobDBMock.setJobAttributes.assert_called_with( [2], ['Status', 'MinorStatus'],
+                                                        ['Failed', 'Matcher: job JDL not found'] )
+
+    # The jobs are given back if their JDLs can not be read at all
+    self.jobDBMock.getJobsJDL.return_value = S_ERROR( 'DB error' )
+    self.jobDBMock.rescheduleJob.side_effect = lambda jobID: { 'OK': True, 'Value': jobID, 'JobID': jobID,
+                                                               'Status': 'Received', 'MinorStatus': 'Job Rescheduled' }
+    self.assertRaises( RuntimeError, self.matcher.selectJobs, {'Site': 'DIRAC.Jenkins.ch', 'CPUTime': 1000},
+                       {'DN': 'dn', 'group': 'group', 'properties': []}, 2 )
+    self.assertEqual( [ call[0][0] for call in self.jobDBMock.rescheduleJob.call_args_list ], [1, 2] )
+
+  def test_selectJob( self ):
+
+    self.opsHelperMock.getValue.return_value = False
+    self.matcher.limiter = MagicMock()
+    self.matcher.limiter.isSiteLimited.return_value = False
+    self.jobDBMock.getSiteMask.return_value = S_OK( ['DIRAC.Jenkins.ch'] )
+    self.tqDBMock.matchAndGetJobs.return_value = S_OK( {'matchFound': True, 'jobs': [( 1, 10 )]} )
+    self.jobDBMock.getAttributesForJobList.return_value = S_OK( {1: {'OwnerDN': 'dn', 'OwnerGroup': 'group', 'Status': 'Waiting'}} )
+    self.jobDBMock.getJobsJDL.return_value = S_OK( {1: 'JDL1'} )
+    self.jobDBMock.getJobsOptParameters.return_value = S_OK( {} )
+
+    res = self.matcher.selectJob( {'Site': 'DIRAC.Jenkins.ch', 'CPUTime': 1000},
+                                  {'DN': 'dn', 'group': 'group', 'properties': []} )
+    self.assertEqual( res['JobID'], 1 )
+    self.assertEqual( res['DN'], 'dn' )
+    self.assertEqual( self.tqDBMock.matchAndGetJobs.call_args[0][1], 1 )
+
+    self.tqDBMock.matchAndGetJobs.return_value = S_OK( {'matchFound': False, 'jobs': []} )
+    self.assertRaises( RuntimeError, self.matcher.selectJob, {'Site': 'DIRAC.Jenkins.ch', 'CPUTime': 1000},
+                       {'DN': 'dn', 'group': 'group', 'properties': []} )
+
 
 #############################################################################
 # Test Suite run
@@ -9,11 +9,14 @@
     getAllJobAttributes()
     getDistinctJobAttributes()
     getAttributesForJobList()
+    getJobsSummaryPage()
     getJobParameter()
     getJobParameters()
     getAllJobParameters()
     getInputData()
     getJobJDL()
+    getJobsJDL()
+    getJobsOptParameters()
 
     selectJobs()
     selectJobsWithStatus()
@@ -24,6 +27,7 @@
     setJobParameters()
     setJobJDL()
     setJobStatus()
+    setJobsExecTime()
     setInputData()
 
     insertNewJobIntoDB()
@@ -44,6 +48,7 @@ __RCSID__ = "$Id$"
 
 import sys
 import operator
+from types                                                   import ListType, TupleType
 
 from DIRAC.Core.Utilities.ClassAd.ClassAdLight               import ClassAd
 from DIRAC                                                   import S_OK, S_ERROR, Time
@@ -156,6 +161,103 @@ class JobDB( DB ):
       return S_ERROR( 'JobDB.getAttributesForJobList: Failed\n%s' % str( x ) )
 
 
+#############################################################################
+  def getJobsSummaryPage( self, condDict, older = None, newer = None, timeStamp = 'LastUpdateTime',
+                          orderAttribute = 'JobID:DESC', maxItems = 25, offset = 0, after = None,
+                          attrList = None, tqDBName = None ):
+    """ Get the attributes of a page of the jobs selected by condDict, older and newer,
+        ordered by orderAttribute ( 'Name:ASC' or 'Name:DESC' ) and then by JobID.
+
+        The page starts after the job with the ( value of the order attribute, JobID ) given
+        in after, with a seek on the order attribute, or at offset if after is not given.
+        If tqDBName is given, the TaskQueueDB is on the same server and the TQ of the jobs
+        is taken from it in the same query.
+
+        Returns S_OK with a list of ( jobDict, TQId, after ), jobDict being as in
+        getAttributesForJobList, TQId None if not known and after being the seek
+        position of the next job
+    """
+    if not attrList:
+      attrList = self.jobAttributeNames
+    for attrName in attrList:
+      if attrName not in self.jobAttributeNames:
+        return S_ERROR( 'JobDB.getJobsSummaryPage: invalid attribute %s' % attrName )
+    orderName, orderType = ( orderAttribute.split( ':' ) + [ 'ASC' ] )[:2]
+    orderType = orderType.upper()
+    if orderName not in self.jobAttributeNames or orderType not in ( 'ASC', 'DESC' ):
+      return S_ERROR( 'JobDB.getJobsSummaryPage: invalid order %s' % orderAttribute )
+
+    try:
+      condition = self.buildCondition( condDict = condDict, older = older, newer = newer, timeStamp = timeStamp )
+    except Exception, x:
+      return S_ERROR( x )
+
+    if after:
+      lastValue, lastJobID = after
+      lastJobID = int( lastJobID )
+      comparison = '>'
+      if orderType == 'DESC':
+        comparison = '<'
+      if lastValue is None:
+        # NULLs come first in ascending order and last in descending order
+        if orderType == 'ASC':
+          seek = "( `%s` IS NOT NULL OR JobID > %d )" % ( orderName, lastJobID )
+        else:
+          seek = "( `%s` IS NULL AND JobID < %d )" % ( orderName, lastJobID )
+      else:
+        ret = self._escapeString( lastValue )
+        if not ret['OK']:
+          return ret
+        seek = "( `%s` %s %s OR ( `%s` = %s AND JobID %s %d )" % ( orderName, comparison, ret['Value'],
+                                                                  orderName, ret['Value'], comparison, lastJobID )
+        if orderType == 'DESC':
+          seek += " OR `%s` IS NULL" % orderName
+        seek += " )"
+      if condition.strip():
+        condition = "%s AND %s" % ( condition, seek )
+      else:
+        condition = "WHERE %s" % seek
+      offset = 0
+
+    outFields = list( attrList )
+    if 'JobID' not in outFields:
+      outFields.append( 'JobID' )
+    if orderName not in outFields:
+      outFields.append( orderName )
+    limit = "LIMIT %d" % int( maxItems )
+    if offset:
+      limit = "LIMIT %d OFFSET %d" % ( int( maxItems ), int( offset ) )
+    orderBy = "`%s` %s" % ( orderName, orderType )
+    if orderName != 'JobID':
+      orderBy += ", `JobID` %s" % orderType
+    cmd = "SELECT %s FROM Jobs %s ORDER BY %s %s" % ( ', '.join( [ '`%s`' % f for f in outFields ] ),
+                                                    condition, orderBy, limit )
+    if tqDBName:
+      cmd = "SELECT p.*, t.TQId FROM ( %s ) AS p LEFT JOIN `%s`.`tq_Jobs` AS t ON p.JobID = t.JobId " \
+            "ORDER BY %s" % ( cmd, tqDBName, orderBy.replace( '`', 'p.`', 1 ).replace( ', `', ', p.`' ) )
+    result = self._query( cmd )
+    if not result['OK']:
+      return result
+
+    jobIndex = outFields.index( 'JobID' )
+    orderIndex = outFields.index( orderName )
+    page = []
+    for row in result['Value']:
+      jobDict = {}
+      for i in range( len( attrList ) ):
+        try:
+          jobDict[attrList[i]] = row[i].tostring()
+        except Exception:
+          jobDict[attrList[i]] = str( row[i] )
+      tqID = None
+      if tqDBName and row[-1] is not None:
+        tqID = int( row[-1] )
+      lastValue = row[orderIndex]
+      if lastValue is not None:
+        lastValue = str( lastValue )
+      page.append( ( jobDict, tqID, ( lastValue, int( row[jobIndex] ) ) ) )
+    return S_OK( page )
+
 #############################################################################
   def getDistinctJobAttributes( self, attribute, condDict = None, older = None,
                                 newer = None, timeStamp = 'LastUpdateTime' ):
@@ -491,6 +593,35 @@ class JobDB( DB ):
     else:
       return S_ERROR( 'JobDB.getJobOptParameters: failed to retrieve parameters' )
 
+#############################################################################
+  def getJobsOptParameters( self, jobIDList, paramList = None ):
+    """ Get optimizer parameters for the given jobs with a single query.
+        Returns S_OK( { jobID : { name : value } } )
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    ret = self._escapeValues( jobIDList )
+    if not ret['OK']:
+      return ret
+    cmd = "SELECT JobID, Name, Value from OptimizerParameters WHERE JobID in (%s)" % ','.join( ret['Value'] )
+    if paramList:
+      ret = self._escapeValues( paramList )
+      if not ret['OK']:
+        return ret
+      cmd += " and Name in (%s)" % ','.join( ret['Value'] )
+
+    result = self._query( cmd )
+    if not result['OK']:
+      return S_ERROR( 'JobDB.getJobsOptParameters: failed to retrieve parameters' )
+    resultDict = dict( [ ( int( jobID ), {} ) for jobID in jobIDList ] )
+    for jobID, name, value in result['Value']:
+      try:
+        value = value.tostring()
+      except Exception:
+        pass
+      resultDict.setdefault( int( jobID ), {} )[name] = value
+    return S_OK( resultDict )
+
 #############################################################################
 
   def getInputData( self, jobID ):
@@ -601,6 +732,21 @@ class JobDB( DB ):
       return S_OK( [] )
     return S_OK( [ self._to_value( i ) for i in  res['Value'] ] )
 
+  def selectJobsIter( self, condDict, older = None, newer = None, timeStamp = 'LastUpdateTime',
+                      orderAttribute = None, limit = None, chunkSize = 1000 ):
+    """ Same as selectJobs, but return S_OK with a generator of the JobIDs that are read
+        from the server chunkSize at a time, to go through large selections in constant memory
+    """
+
+    self.log.debug( 'JobDB.selectJobsIter: retrieving jobs.' )
+
+    res = self.getFieldsIter( 'Jobs', ['JobID'], condDict = condDict, limit = limit,
+                              older = older, newer = newer, timeStamp = timeStamp, orderAttribute = orderAttribute,
+                              chunkSize = chunkSize )
+    if not res['OK']:
+      return res
+    return S_OK( ( self._to_value( row ) for row in res['Value'] ) )
+
 #############################################################################
   def setJobAttribute( self, jobID, attrName, attrValue, update = False, myDate = None ):
     """ Set an attribute value for job specified by jobID.
@@ -635,14 +781,18 @@ class JobDB( DB ):
 
 #############################################################################
   def setJobAttributes( self, jobID, attrNames, attrValues, update = False, myDate = None ):
-    """ Set an attribute value for job specified by jobID.
+    """ Set an attribute value for job specified by jobID, or for all the jobs
+        if a list of jobIDs is given.
         The LastUpdate time stamp is refreshed if explicitely requested
     """
 
-    ret = self._escapeString( jobID )
+    jobIDList = jobID
+    if type( jobID ) not in ( ListType, TupleType ):
+      jobIDList = [ jobID ]
+    ret = self._escapeValues( jobIDList )
     if not ret['OK']:
       return ret
-    jobID = ret['Value']
+    jobIDs = ','.join( ret['Value'] )
 
     if len( attrNames ) != len( attrValues ):
       return S_ERROR( 'JobDB.setAttributes: incompatible Argument length' )
@@ -660,7 +810,7 @@ class JobDB( DB ):
     if len( attr ) == 0:
       return S_ERROR( 'JobDB.setAttributes: Nothing to do' )
 
-    cmd = 'UPDATE Jobs SET %s WHERE JobID=%s' % ( ', '.join( attr ), jobID )
+    cmd = 'UPDATE Jobs SET %s WHERE JobID in ( %s )' % ( ', '.join( attr ), jobIDs )
 
     if myDate:
       cmd += ' AND LastUpdateTime < %s' % myDate
@@ -744,6 +894,28 @@ class JobDB( DB ):
     result = self._update( req )
     return result
 
+#############################################################################
+  def setJobsExecTime( self, timeName, dateDict ):
+    """ Set the StartExecTime or EndExecTime time stamp of several jobs with a single
+        UPDATE, dateDict being a { jobID : date } dictionary. As for setStartExecTime
+        and setEndExecTime, the time stamps already set are not changed
+    """
+    if timeName not in ( 'StartExecTime', 'EndExecTime' ):
+      return S_ERROR( 'JobDB.setJobsExecTime: invalid time stamp %s' % timeName )
+    if not dateDict:
+      return S_OK( 0 )
+
+    cases = []
+    for jobID, date in dateDict.items():
+      ret = self._escapeString( date )
+      if not ret['OK']:
+        return ret
+      cases.append( "WHEN %d THEN %s" % ( int( jobID ), ret['Value'] ) )
+    jobIDs = ','.join( [ str( int( jobID ) ) for jobID in dateDict ] )
+    req = "UPDATE Jobs SET %s = CASE JobID %s END WHERE JobID IN ( %s ) AND %s IS NULL" % ( timeName, ' '.join( cases ),
+                                                                                          jobIDs, timeName )
+    return self._update( req )
+
 #############################################################################
   def setJobParameter( self, jobID, key, value ):
     """ Set a parameter specified by name,value pair for the job JobID
@@ -773,20 +945,8 @@ class JobDB( DB ):
     if not parameters:
       return S_OK()
 
-    insertValueList = []
-    for name, value in parameters:
-      ret = self._escapeString( name )
-      if not ret['OK']:
-        return ret
-      e_name = ret['Value']
-      ret = self._escapeString( value )
-      if not ret['OK']:
-        return ret
-      e_value = ret['Value']
-      insertValueList.append( '(%s,%s,%s)' % ( jobID, e_name, e_value ) )
-
-    cmd = 'REPLACE JobParameters (JobID,Name,Value) VALUES %s' % ', '.join( insertValueList )
-    result = self._update( cmd )
+    rows = [ ( jobID, self._toStr( name ), self._toStr( value ) ) for name, value in parameters ]
+    result = self.insertFieldsMany( 'JobParameters', [ 'JobID', 'Name', 'Value' ], rows, replace = True )
     if not result['OK']:
       return S_ERROR( 'JobDB.setJobParameters: operation failed.' )
 
@@ -985,6 +1145,26 @@ class JobDB( DB ):
     else:
       return result
 
+#############################################################################
+  def getJobsJDL( self, jobIDList, original = False ):
+    """ Get the JDLs of the jobs in jobIDList with a single query.
+        Returns S_OK( { jobID : JDL } ), jobs without JDL are not in the result
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    ret = self._escapeValues( jobIDList )
+    if not ret['OK']:
+      return ret
+    if original:
+      cmd = "SELECT JobID, OriginalJDL FROM JobJDLs WHERE JobID in (%s)" % ','.join( ret['Value'] )
+    else:
+      cmd = "SELECT JobID, JDL FROM JobJDLs WHERE JobID in (%s)" % ','.join( ret['Value'] )
+
+    result = self._query( cmd )
+    if not result['OK']:
+      return result
+    return S_OK( dict( [ ( int( jobID ), jdl ) for jobID, jdl in result['Value'] ] ) )
+
 #############################################################################
   def insertNewJobIntoDB( self, jdl, owner, ownerDN, ownerGroup, diracSetup ):
     """ Insert the initial JDL into the Job database,
@@ -1842,13 +2022,8 @@ class JobDB( DB ):
     """
 
     # Set the time stamp first
-    ret = self._escapeString( jobID )
-    if not ret['OK']:
-      return ret
-    e_jobID = ret['Value']
-
-    req = "UPDATE Jobs SET HeartBeatTime=UTC_TIMESTAMP(), Status='Running' WHERE JobID=%s" % e_jobID
-    result = self._update( req )
+    req = "UPDATE Jobs SET HeartBeatTime=UTC_TIMESTAMP(), Status='Running' WHERE JobID=%s"
+    result = self._update( req, args = ( jobID, ) )
     if not result['OK']:
       return S_ERROR( 'Failed to set the heart beat time: ' + result['Message'] )
 
@@ -1861,27 +2036,73 @@ class JobDB( DB ):
       self.log.warn( result['Message'] )
 
     # Add dynamic data to the job heart beat log
-    # start = time.time()
-    valueList = []
-    for key, value in dynamicDataDict.items():
-      result = self._escapeString( key )
+    rows = [ ( jobID, self._toStr( key ), self._toStr( value ) ) for key, value in dynamicDataDict.items() ]
+    if rows:
+      result = self.insertFieldsMany( 'HeartBeatLoggingInfo', [ 'JobID', 'Name', 'Value' ], rows,
+                                      exprDict = { 'HeartBeatTime' : 'UTC_TIMESTAMP()' } )
       if not result['OK']:
-        self.log.warn( 'Failed to escape string ' + key )
-        continue
-      e_key = result['Value']
-      result = self._escapeString( value )
-      if not result['OK']:
-        self.log.warn( 'Failed to escape string ' + value )
-        continue
-      e_value = result['Value']
-      valueList.append( "( %s, %s,%s,UTC_TIMESTAMP())" % ( e_jobID, e_key, e_value ) )
+        ok = False
+        self.log.warn( result['Message'] )
 
-    if valueList:
+    if ok:
+      return S_OK()
+    else:
+      return S_ERROR( 'Failed to store some or all the parameters' )
 
-      valueString = ','.join( valueList )
-      req = "INSERT INTO HeartBeatLoggingInfo (JobID,Name,Value,HeartBeatTime) VALUES "
-      req += valueString
+#####################################################################################
+  def setHeartBeatDataBulk( self, heartBeatTimes, staticDataDict, dynamicDataRows ):
+    """ Add the heart beat data of several jobs to the database:
+
+        heartBeatTimes: { jobID : time stamp of the last heart beat }
+        staticDataDict: { jobID : { name : value } } stored as job parameters
+        dynamicDataRows: [ ( jobID, name, value, heart beat time ) ] for the heart beat log
+
+        Unlike setHeartBeatData, only the Stalled and Matched jobs are set back to Running,
+        since the heart beats may be written after a final status of the job.
+        The data of the jobs that are not in the Jobs table anymore is dropped
+    """
+    ok = True
+    if heartBeatTimes:
+      cases = []
+      for jobID, heartBeatTime in heartBeatTimes.items():
+        ret = self._escapeString( heartBeatTime )
+        if not ret['OK']:
+          return ret
+        cases.append( "WHEN %d THEN %s" % ( int( jobID ), ret['Value'] ) )
+      jobIDs = ','.join( [ str( int( jobID ) ) for jobID in heartBeatTimes ] )
+      req = "UPDATE Jobs SET HeartBeatTime = CASE JobID %s END," \
+            " Status = IF( Status IN ( 'Stalled', 'Matched' ), 'Running', Status ) WHERE JobID IN ( %s )" % \
+            ( ' '.join( cases ), jobIDs )
       result = self._update( req )
+      if not result['OK']:
+        return S_ERROR( 'Failed to set the heart beat times: ' + result['Message'] )
+
+    # The rows of deleted or unknown jobs would make the whole multi-row inserts fail
+    jobIDs = set( staticDataDict ) | set( [ row[0] for row in dynamicDataRows ] )
+    existingJobIDs = set()
+    if jobIDs:
+      req = "SELECT JobID FROM Jobs WHERE JobID IN ( %s )" % ','.join( [ str( int( jobID ) ) for jobID in jobIDs ] )
+      result = self._query( req )
+      if not result['OK']:
+        return S_ERROR( 'Failed to get the existing jobs: ' + result['Message'] )
+      existingJobIDs = set( [ int( row[0] ) for row in result['Value'] ] )
+      missingJobIDs = [ jobID for jobID in jobIDs if int( jobID ) not in existingJobIDs ]
+      if missingJobIDs:
+        self.log.verbose( 'Dropping the heart beat data of jobs not in the DB:', str( sorted( missingJobIDs ) ) )
+
+    rows = [ ( jobID, self._toStr( name ), self._toStr( value ) ) for jobID, paramDict in staticDataDict.items()
+             for name, value in paramDict.items() if int( jobID ) in existingJobIDs ]
+    if rows:
+      result = self.__insertHeartBeatRows( 'JobParameters', [ 'JobID', 'Name', 'Value' ], rows )
+      if not result['OK']:
+        ok = False
+        self.log.warn( result['Message'] )
+
+    rows = [ ( jobID, self._toStr( name ), self._toStr( value ), str( heartBeatTime ) )
+             for jobID, name, value, heartBeatTime in dynamicDataRows if int( jobID ) in existingJobIDs ]
+    if rows:
+      result = self.__insertHeartBeatRows( 'HeartBeatLoggingInfo', [ 'JobID', 'Name', 'Value', 'HeartBeatTime' ],
+                                           rows )
       if not result['OK']:
         ok = False
         self.log.warn( result['Message'] )
@@ -1891,6 +2112,40 @@ class JobDB( DB ):
     else:
       return S_ERROR( 'Failed to store some or all the parameters' )
 
+  def __insertHeartBeatRows( self, tableName, fields, rows ):
+    """ Replace the rows of several jobs at once. If it fails, the rows are written job by job
+        and the ones of the jobs that can not be written are dropped
+    """
+    result = self.insertFieldsMany( tableName, fields, rows, replace = True )
+    if result['OK']:
+      return result
+    self.log.warn( 'Failed to write the rows of all the jobs, writing them job by job', result['Message'] )
+    jobRows = {}
+    for row in rows:
+      jobRows.setdefault( row[0], [] ).append( row )
+    for jobID, rowList in jobRows.items():
+      result = self.insertFieldsMany( tableName, fields, rowList, replace = True )
+      if not result['OK']:
+        # The job may have been deleted meanwhile, if the DB is down the next query fails as well
+        self.log.warn( 'Dropping the %s rows of job %s' % ( tableName, jobID ), result['Message'] )
+        result = self._query( "SELECT JobID FROM Jobs WHERE JobID=%d" % int( jobID ) )
+        if not result['OK']:
+          return result
+    return S_OK()
+
+#####################################################################################
+  def cleanHeartBeatLogging( self, olderThanHours ):
+    """ Remove the heart beat log records older than the given number of hours,
+        except the last record of each job and name, that getHeartBeatData and
+        the StalledJobAgent use for the last CPU and wall clock times
+    """
+    req = "DELETE h FROM HeartBeatLoggingInfo AS h JOIN " \
+          "( SELECT JobID, Name, MAX( HeartBeatTime ) AS LastTime FROM HeartBeatLoggingInfo " \
+          "GROUP BY JobID, Name ) AS l ON h.JobID = l.JobID AND h.Name = l.Name " \
+          "WHERE h.HeartBeatTime < l.LastTime AND h.HeartBeatTime < UTC_TIMESTAMP() - INTERVAL %d HOUR" % \
+          int( olderThanHours )
+    return self._update( req )
+
 #####################################################################################
   def getHeartBeatData( self, jobID ):
     """ Retrieve the job's heart beat data
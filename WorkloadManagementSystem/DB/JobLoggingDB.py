@@ -2,12 +2,14 @@
     The following methods are provided
 
     addLoggingRecord()
+    addLoggingRecords()
     getJobLoggingInfo()
     getWMSTimeStamps()
+    getLastStatusTimes()
 """
 
 import time
-from types                import StringTypes, IntType, LongType
+from types                import StringTypes, IntType, LongType, ListType, TupleType
 
 from DIRAC                import gLogger, S_OK, S_ERROR
 from DIRAC.Core.Utilities import Time
@@ -32,24 +34,10 @@ class JobLoggingDB( DB ):
     self.gLogger = gLogger
 
 #############################################################################
-  def addLoggingRecord( self,
-                       jobID,
-                       status = 'idem',
-                       minor = 'idem',
-                       application = 'idem',
-                       date = '',
-                       source = 'Unknown' ):
-
-    """ Add a new entry to the JobLoggingDB table. One, two or all the three status
-        components can be specified. Optionaly the time stamp of the status can
-        be provided in a form of a string in a format '%Y-%m-%d %H:%M:%S' or
-        as datetime.datetime object. If the time stamp is not provided the current
-        UTC time is used.
+  def __getStatusTime( self, date ):
+    """ Get the UTC datetime of a logging record and its StatusTimeOrder from the date
+        given as a string, a datetime object or empty for the current time
     """
-
-    event = 'status/minor/app=%s/%s/%s' % ( status, minor, application )
-    self.gLogger.info( "Adding record for job " + str( jobID ) + ": '" + event + "' from " + source )
-
     if not date:
       # Make the UTC datetime string and float
       _date = Time.dateTime()
@@ -76,12 +64,55 @@ class JobLoggingDB( DB ):
         _date = Time.dateTime()
         epoc = time.mktime( _date.timetuple() ) - MAGIC_EPOC_NUMBER
         time_order = round( epoc, 3 )
+    return _date, time_order
+
+#############################################################################
+  def addLoggingRecord( self,
+                       jobID,
+                       status = 'idem',
+                       minor = 'idem',
+                       application = 'idem',
+                       date = '',
+                       source = 'Unknown' ):
+
+    """ Add a new entry to the JobLoggingDB table. One, two or all the three status
+        components can be specified. Optionaly the time stamp of the status can
+        be provided in a form of a string in a format '%Y-%m-%d %H:%M:%S' or
+        as datetime.datetime object. If the time stamp is not provided the current
+        UTC time is used. If jobID is a list, the same record is added for all the
+        jobs with a single INSERT.
+    """
+
+    jobIDList = jobID
+    if type( jobID ) not in ( ListType, TupleType ):
+      jobIDList = [ jobID ]
+    status, minor, application, source = [ self._toStr( value ) for value in ( status, minor, application, source ) ]
+    event = 'status/minor/app=%s/%s/%s' % ( status, minor, application )
+    self.gLogger.info( "Adding record for job " + ",".join( [ str( j ) for j in jobIDList ] ) + \
+                       ": '" + event + "' from " + source )
 
-    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
-          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
-           ( int( jobID ), status, minor, application, str( _date ), time_order, source )
+    _date, time_order = self.__getStatusTime( date )
 
-    return self._update( cmd )
+    rows = [ ( int( jID ), status, minor, application, str( _date ), time_order, source ) for jID in jobIDList ]
+    return self.insertFieldsMany( 'LoggingInfo', [ 'JobId', 'Status', 'MinorStatus', 'ApplicationStatus',
+                                                   'StatusTime', 'StatusTimeOrder', 'StatusSource' ], rows )
+
+#############################################################################
+  def addLoggingRecords( self, records ):
+    """ Add several entries to the JobLoggingDB table with multi-row INSERTs. Each
+        record is a ( jobID, status, minor, application, date, source ) tuple with the
+        same meaning as the arguments of addLoggingRecord
+    """
+    if not records:
+      return S_OK( 0 )
+    self.gLogger.verbose( "Adding %d logging records" % len( records ) )
+    rows = []
+    for jobID, status, minor, application, date, source in records:
+      _date, time_order = self.__getStatusTime( date )
+      rows.append( ( int( jobID ), self._toStr( status ), self._toStr( minor ), self._toStr( application ),
+                     str( _date ), time_order, self._toStr( source ) ) )
+    return self.insertFieldsMany( 'LoggingInfo', [ 'JobId', 'Status', 'MinorStatus', 'ApplicationStatus',
+                                                   'StatusTime', 'StatusTimeOrder', 'StatusSource' ], rows )
 
 #############################################################################
   def getJobLoggingInfo( self, jobID ):
@@ -160,3 +191,23 @@ class JobLoggingDB( DB ):
       result['LastTime'] = "Unknown"
 
     return S_OK( result )
+
+#############################################################################
+  def getLastStatusTimes( self, jobIDList ):
+    """ Get the time stamp of the latest logging record of each job as an epoch
+        float, as given by getWMSTimeStamps. Return a { jobID : epoch } dictionary,
+        the jobs without logging records are missing
+    """
+    if not jobIDList:
+      return S_OK( {} )
+    jobIDs = ','.join( [ str( int( jobID ) ) for jobID in jobIDList ] )
+    cmd = 'SELECT JobID,MAX(StatusTimeOrder) FROM LoggingInfo WHERE JobID IN (%s) GROUP BY JobID' % jobIDs
+    result = self._query( cmd )
+    if not result['OK']:
+      return result
+
+    lastTimes = {}
+    for jobID, etime in result['Value']:
+      if etime is not None:
+        lastTimes[ int( jobID ) ] = float( etime ) + MAGIC_EPOC_NUMBER
+    return S_OK( lastTimes )
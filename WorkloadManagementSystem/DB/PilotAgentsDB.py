@@ -76,12 +76,20 @@ class PilotAgentsDB( DB ):
 
     return S_OK()
 
+##########################################################################################
+  def __pilotRefCondition( self, pilotRef ):
+    """ SQL condition selecting one pilot reference or a list of them
+    """
+    if type( pilotRef ) == ListType:
+      return "PilotJobReference IN ('%s')" % "','".join( pilotRef )
+    return "PilotJobReference='%s'" % pilotRef
+
 ##########################################################################################
   def setPilotStatus( self, pilotRef, status, destination = None,
                       statusReason = None, gridSite = None, queue = None,
                       benchmark = None, currentJob = None,
                       updateTime = None, conn = False ):
-    """ Set pilot job LCG status """
+    """ Set pilot job LCG status, pilotRef can be a list of pilot references """
 
     setList = []
     setList.append( "Status='%s'" % status )
@@ -109,7 +117,7 @@ class PilotAgentsDB( DB ):
           setList.append( "GridSite='%s'" % gridSite )
 
     set_string = ','.join( setList )
-    req = "UPDATE PilotAgents SET " + set_string + " WHERE PilotJobReference='%s'" % pilotRef
+    req = "UPDATE PilotAgents SET " + set_string + " WHERE " + self.__pilotRefCondition( pilotRef )
     result = self._update( req, conn = conn )
     if not result['OK']:
       return result
@@ -335,10 +343,10 @@ class PilotAgentsDB( DB ):
 
 ##########################################################################################
   def setAccountingFlag( self, pilotRef, mark = 'True' ):
-    """ Set the pilot AccountingSent flag
+    """ Set the pilot AccountingSent flag, pilotRef can be a list of pilot references
     """
 
-    req = "UPDATE PilotAgents SET AccountingSent='%s' WHERE PilotJobReference='%s'" % ( mark, pilotRef )
+    req = "UPDATE PilotAgents SET AccountingSent='%s' WHERE %s" % ( mark, self.__pilotRefCondition( pilotRef ) )
     result = self._update( req )
     return result
 
@@ -3,11 +3,14 @@
 
 __RCSID__ = "$Id"
 
+import time
 import types
 import random
+import threading
 from DIRAC  import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.private.SharesCorrector import SharesCorrector
 from DIRAC.WorkloadManagementSystem.private.Queues import maxCPUSegments
+from DIRAC.WorkloadManagementSystem.private.TaskQueueMatchIndex import TaskQueueMatchIndex
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.Core.Utilities import List
 from DIRAC.Core.Utilities.DictCache import DictCache
@@ -42,6 +45,9 @@ class TaskQueueDB( DB ):
     self.__opsHelper = Operations()
     self.__ensureInsertionIsSingle = False
     self.__sharesCorrector = SharesCorrector( self.__opsHelper )
+    self.__matchIndex = None
+    self.__matchIndexLoadTime = 0
+    self.__matchIndexLock = threading.Lock()
     result = self.__initializeDB()
     if not result[ 'OK' ]:
       raise Exception( "Can't create tables: %s" % result[ 'Message' ] )
@@ -68,6 +74,92 @@ class TaskQueueDB( DB ):
   def getValidPilotTypes( self ):
     return self.__getCSOption( "AllPilotTypes", [ 'private' ] )
 
+  def isMatchIndexEnabled( self ):
+    return self.__getCSOption( "EnableMatchIndex", False )
+
+  def __getMatchIndex( self ):
+    """
+    Get the in-memory TQ match index if it is enabled, reloading it from the DB
+    when it is older than JobScheduling/MatchIndexRefreshTime
+    """
+    if not self.isMatchIndexEnabled():
+      self.__matchIndex = None
+      return None
+    refreshTime = self.__getCSOption( "MatchIndexRefreshTime", 60 )
+    if self.__matchIndex and time.time() - self.__matchIndexLoadTime < refreshTime:
+      return self.__matchIndex
+    #Only one thread reloads, the rest keep using the current index if there is one
+    if not self.__matchIndexLock.acquire( False ):
+      return self.__matchIndex
+    try:
+      result = self.__loadMatchIndex()
+      if not result[ 'OK' ]:
+        self.log.error( "Cannot load the TQ match index", result[ 'Message' ] )
+    finally:
+      self.__matchIndexLock.release()
+    return self.__matchIndex
+
+  def __loadMatchIndex( self, tqIdList = False ):
+    """
+    Load TQ definitions and job counts into the match index.
+    If tqIdList is given only those TQs are reloaded, otherwise the whole index is rebuilt
+    """
+    tqCond = ""
+    if tqIdList:
+      if not self.__matchIndex:
+        return S_OK()
+      tqCond = " WHERE TQId in ( %s )" % ", ".join( [ str( int( tqId ) ) for tqId in tqIdList ] )
+    loadTime = time.time()
+    sqlCmd = "SELECT TQId, Priority, %s FROM `tq_TaskQueues`%s" % ( ", ".join( singleValueDefFields ), tqCond )
+    result = self._query( sqlCmd )
+    if not result[ 'OK' ]:
+      return result
+    tqDefs = {}
+    for record in result[ 'Value' ]:
+      tqDefs[ record[0] ] = dict( zip( ( 'Priority', ) + singleValueDefFields, record[1:] ) )
+    for field in multiValueDefFields:
+      result = self._query( "SELECT TQId, Value FROM `tq_TQTo%s`%s" % ( field, tqCond ) )
+      if not result[ 'OK' ]:
+        return result
+      for tqId, value in result[ 'Value' ]:
+        if tqId in tqDefs:
+          tqDefs[ tqId ].setdefault( field, [] ).append( value )
+    sqlCmd = "SELECT TQId, Priority, MAX( RealPriority ), COUNT( JobId ) FROM `tq_Jobs`%s GROUP BY TQId, Priority" % tqCond
+    result = self._query( sqlCmd )
+    if not result[ 'OK' ]:
+      return result
+    if tqIdList:
+      matchIndex = self.__matchIndex
+      for tqId in tqIdList:
+        matchIndex.removeTaskQueue( tqId )
+    else:
+      matchIndex = TaskQueueMatchIndex()
+    for tqId in tqDefs:
+      matchIndex.setTaskQueue( tqId, tqDefs[ tqId ], tqDefs[ tqId ][ 'Priority' ] )
+    for tqId, jobPriority, realPriority, numJobs in result[ 'Value' ]:
+      if tqId in tqDefs:
+        matchIndex.setJobs( tqId, jobPriority, realPriority, numJobs )
+    if not tqIdList:
+      self.__matchIndex = matchIndex
+      self.__matchIndexLoadTime = loadTime
+      self.log.info( "Loaded %s TQs in the match index" % len( matchIndex ) )
+    return S_OK()
+
+  def __matchTaskQueuesInIndex( self, matchIndex, tqMatchDict, numQueuesToGet, negativeCond ):
+    """
+    Get the matching TQs from the index. tqMatchDict has to be the unescaped match definition
+    """
+    self.__resolvePlatformAliases( tqMatchDict )
+    jobSharingGroups = []
+    if 'OwnerDN' in tqMatchDict and 'OwnerGroup' in tqMatchDict:
+      groups = tqMatchDict[ 'OwnerGroup' ]
+      if type( groups ) not in ( types.ListType, types.TupleType ):
+        groups = [ groups ]
+      jobSharingGroups = [ group for group in groups
+                           if Properties.JOB_SHARING in CS.getPropertiesForGroup( group ) ]
+    return matchIndex.matchTaskQueues( tqMatchDict, numQueuesToGet = numQueuesToGet,
+                                       negativeCond = negativeCond, jobSharingGroups = jobSharingGroups )
+
   def __initializeDB( self ):
     """
     Create the tables
@@ -129,6 +221,7 @@ class TaskQueueDB( DB ):
     result = self._update( dropSQL )
     if not result[ 'OK' ]:
       return result
+    self.__matchIndexLoadTime = 0
     return self._createTables( self.__tablesDesc )
 
   def __strDict( self, dDict ):
@@ -215,6 +308,16 @@ class TaskQueueDB( DB ):
           return S_ERROR( "PilotType %s is invalid" % pilotType )
     return S_OK( tqDefDict )
 
+  def __resolvePlatformAliases( self, tqMatchDict ):
+    """
+    Confine the LHCbPlatform legacy option here, use Platform everywhere else
+    until the LHCbPlatform is no more used in the TaskQueueDB
+    """
+    if 'LHCbPlatform' in tqMatchDict and not "Platform" in tqMatchDict:
+      tqMatchDict['Platform'] = tqMatchDict['LHCbPlatform']
+    if 'SystemConfig' in tqMatchDict and not "Platform" in tqMatchDict:
+      tqMatchDict['Platform'] = tqMatchDict['SystemConfig']
+
   def _checkMatchDefinition( self, tqMatchDict ):
     """
     Check a task queue match dict is valid
@@ -236,12 +339,7 @@ class TaskQueueDB( DB ):
           return self._escapeString( value )
         return S_OK( value )
 
-    # Confine the LHCbPlatform legacy option here, use Platform everywhere else
-    # until the LHCbPlatform is no more used in the TaskQueueDB
-    if 'LHCbPlatform' in tqMatchDict and not "Platform" in tqMatchDict:
-      tqMatchDict['Platform'] = tqMatchDict['LHCbPlatform']
-    if 'SystemConfig' in tqMatchDict and not "Platform" in tqMatchDict:
-      tqMatchDict['Platform'] = tqMatchDict['SystemConfig']
+    self.__resolvePlatformAliases( tqMatchDict )
 
     for field in singleValueDefFields:
       if field not in tqMatchDict:
@@ -324,6 +422,7 @@ class TaskQueueDB( DB ):
     result = self._update( "DELETE FROM `tq_TaskQueues` WHERE Enabled >= 1 AND TQId not in ( SELECT DISTINCT TQId from `tq_Jobs` )", conn = connObj )
     if not result[ 'OK' ]:
       return result
+    self.__matchIndexLoadTime = 0
     for mvField in multiValueDefFields:
       result = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId not in ( SELECT DISTINCT TQId from `tq_TaskQueues` )" % mvField,
                              conn = connObj )
@@ -396,6 +495,11 @@ class TaskQueueDB( DB ):
       if not result[ 'OK' ]:
         self.log.error( "Error inserting job in TQ", "Job %s TQ %s: %s" % ( jobId, tqId, result[ 'Message' ] ) )
         return result
+      if self.__matchIndex:
+        if newTQ:
+          self.__loadMatchIndex( [ tqId ] )
+        else:
+          self.__matchIndex.addJob( tqId, int( jobPriority ), self.__hackJobPriority( jobPriority ) )
       if newTQ:
         self.recalculateTQSharesForEntity( tqDefDict[ 'OwnerDN' ], tqDefDict[ 'OwnerGroup' ], connObj = connObj )
     finally:
@@ -498,6 +602,28 @@ class TaskQueueDB( DB ):
     #Make a copy to avoid modification of original if escaping needs to be done
     tqMatchDict = dict( tqMatchDict )
     self.log.info( "Starting match for requirements", self.__strDict( tqMatchDict ) )
+    rawMatchDict = dict( tqMatchDict )
+    retVal = self._checkMatchDefinition( tqMatchDict )
+    if not retVal[ 'OK' ]:
+      self.log.error( "TQ match request check failed", retVal[ 'Message' ] )
+      return retVal
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return S_ERROR( "Can't connect to DB: %s" % retVal[ 'Message' ] )
+    connObj = retVal[ 'Value' ]
+    return self.__matchAndGetJob( tqMatchDict, rawMatchDict, numJobsPerTry, numQueuesPerTry, negativeCond, connObj )
+
+  def matchAndGetJobs( self, tqMatchDict, numJobs, numJobsPerTry = 50, numQueuesPerTry = 10, negativeCond = {} ):
+    """
+    Match and extract up to numJobs jobs for the same requirements. The match definition is
+    checked only once and the same DB connection is used for all the extractions.
+    Each job is still matched on its own: the TQ and the job priority are drawn again for every
+    job, so a bulk request gets the same share of each TQ as the same number of single requests
+      Returns S_OK( { 'matchFound' : True/False, 'jobs' : [ ( jobId, tqId ) ], 'tqMatch' : tqMatchDict } )
+    """
+    tqMatchDict = dict( tqMatchDict )
+    self.log.info( "Starting match of %s jobs for requirements" % numJobs, self.__strDict( tqMatchDict ) )
+    rawMatchDict = dict( tqMatchDict )
     retVal = self._checkMatchDefinition( tqMatchDict )
     if not retVal[ 'OK' ]:
       self.log.error( "TQ match request check failed", retVal[ 'Message' ] )
@@ -506,6 +632,33 @@ class TaskQueueDB( DB ):
     if not retVal[ 'OK' ]:
       return S_ERROR( "Can't connect to DB: %s" % retVal[ 'Message' ] )
     connObj = retVal[ 'Value' ]
+    #Only one job can match a given JobID
+    if 'JobID' in tqMatchDict:
+      numJobs = 1
+    jobs = []
+    while len( jobs ) < numJobs:
+      retVal = self.__matchAndGetJob( tqMatchDict, rawMatchDict, numJobsPerTry, numQueuesPerTry, negativeCond, connObj )
+      if not retVal[ 'OK' ]:
+        if jobs:
+          #Do not lose the jobs already taken out of the TQs
+          self.log.warn( "Stopping the match after %s jobs" % len( jobs ), retVal[ 'Message' ] )
+          break
+        return retVal
+      if not retVal[ 'Value' ][ 'matchFound' ]:
+        break
+      jobs.append( ( retVal[ 'Value' ][ 'jobId' ], retVal[ 'Value' ][ 'taskQueueId' ] ) )
+    return S_OK( { 'matchFound' : len( jobs ) > 0, 'jobs' : jobs, 'tqMatch' : tqMatchDict } )
+
+  def __matchAndGetJob( self, tqMatchDict, rawMatchDict, numJobsPerTry, numQueuesPerTry, negativeCond, connObj ):
+    """
+    Match and extract a job for an already checked match definition
+    """
+    #Requests for a given JobID always go through the DB
+    if 'JobID' not in tqMatchDict:
+      matchIndex = self.__getMatchIndex()
+      if matchIndex:
+        return self.__matchAndGetJobFromIndex( matchIndex, rawMatchDict, tqMatchDict, numJobsPerTry,
+                                               numQueuesPerTry, negativeCond, connObj )
     preJobSQL = "SELECT `tq_Jobs`.JobId, `tq_Jobs`.TQId FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s AND `tq_Jobs`.Priority = %s"
     prioSQL = "SELECT `tq_Jobs`.Priority FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1"
     postJobSQL = " ORDER BY `tq_Jobs`.JobId ASC LIMIT %s" % numJobsPerTry
@@ -560,6 +713,57 @@ class TaskQueueDB( DB ):
     self.log.info( "Could not find a match after %s match retries" % self.__maxMatchRetry )
     return S_ERROR( "Could not find a match after %s match retries" % self.__maxMatchRetry )
 
+  def __matchAndGetJobFromIndex( self, matchIndex, rawMatchDict, tqMatchDict, numJobsPerTry, numQueuesPerTry,
+                                 negativeCond, connObj ):
+    """
+    Match a job selecting the TQ and the job priority with the in-memory index.
+    The DB is only used to get the candidate jobs and to extract one of them
+    """
+    prioSQL = "SELECT `tq_Jobs`.Priority FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1"
+    jobSQL = "SELECT `tq_Jobs`.JobId FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s AND `tq_Jobs`.Priority = %s"
+    jobSQL = "%s ORDER BY `tq_Jobs`.JobId ASC LIMIT %s" % ( jobSQL, numJobsPerTry )
+    for _ in range( self.__maxMatchRetry ):
+      tqList = self.__matchTaskQueuesInIndex( matchIndex, dict( rawMatchDict ), numQueuesPerTry, negativeCond )
+      if len( tqList ) == 0:
+        self.log.info( "No TQ matches requirements" )
+        return S_OK( { 'matchFound' : False, 'tqMatch' : tqMatchDict } )
+      for tqId, tqOwnerDN, tqOwnerGroup in tqList:
+        self.log.info( "Trying to extract jobs from TQ %s" % tqId )
+        prio = matchIndex.pickJobPriority( tqId )
+        if prio is None:
+          #Jobs may have been inserted by another process after the last index load
+          retVal = self._query( prioSQL % tqId, conn = connObj )
+          if not retVal[ 'OK' ]:
+            return S_ERROR( "Can't retrieve winning priority for matching job: %s" % retVal[ 'Message' ] )
+          if len( retVal[ 'Value' ] ) == 0:
+            continue
+          prio = retVal[ 'Value' ][0][0]
+        retVal = self._query( jobSQL % ( tqId, prio ), conn = connObj )
+        if not retVal[ 'OK' ]:
+          return S_ERROR( "Can't begin transaction for matching job: %s" % retVal[ 'Message' ] )
+        jobList = [ row[0] for row in retVal[ 'Value' ] ]
+        if len( jobList ) == 0:
+          gLogger.info( "Task queue %s seems to be empty, triggering a cleaning" % tqId )
+          matchIndex.setJobs( tqId, prio, 0, 0 )
+          self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
+        while len( jobList ) > 0:
+          jobId = jobList.pop( random.randint( 0, len( jobList ) - 1 ) )
+          self.log.info( "Trying to extract job %s from TQ %s" % ( jobId, tqId ) )
+          retVal = self._update( "DELETE FROM `tq_Jobs` WHERE JobId = %s AND TQId = %s" % ( jobId, tqId ), conn = connObj )
+          if not retVal[ 'OK' ]:
+            msgFix = "Could not take job"
+            msgVar = " %s out from the TQ %s: %s" % ( jobId, tqId, retVal[ 'Message' ] )
+            self.log.error( msgFix, msgVar )
+            return S_ERROR( msgFix + msgVar )
+          if retVal[ 'Value' ] > 0:
+            matchIndex.removeJob( tqId, prio )
+            self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
+            self.log.info( "Extracted job %s with prio %s from TQ %s" % ( jobId, prio, tqId ) )
+            return S_OK( { 'matchFound' : True, 'jobId' : jobId, 'taskQueueId' : tqId, 'tqMatch' : tqMatchDict } )
+        self.log.info( "No jobs could be extracted from TQ %s" % tqId )
+    self.log.info( "Could not find a match after %s match retries" % self.__maxMatchRetry )
+    return S_ERROR( "Could not find a match after %s match retries" % self.__maxMatchRetry )
+
   def matchAndGetTaskQueue( self, tqMatchDict, numQueuesToGet = 1, skipMatchDictDef = False,
                             negativeCond = {}, connObj = False ):
     """ Get a queue that matches the requirements
@@ -567,9 +771,13 @@ class TaskQueueDB( DB ):
     #Make a copy to avoid modification of original if escaping needs to be done
     tqMatchDict = dict( tqMatchDict )
     if not skipMatchDictDef:
+      rawMatchDict = dict( tqMatchDict )
       retVal = self._checkMatchDefinition( tqMatchDict )
       if not retVal[ 'OK' ]:
         return retVal
+      matchIndex = self.__getMatchIndex()
+      if matchIndex:
+        return S_OK( self.__matchTaskQueuesInIndex( matchIndex, rawMatchDict, numQueuesToGet, negativeCond ) )
     retVal = self.__generateTQMatchSQL( tqMatchDict, numQueuesToGet = numQueuesToGet, negativeCond = negativeCond )
     if not retVal[ 'OK' ]:
       return retVal
@@ -753,13 +961,13 @@ class TaskQueueDB( DB ):
       if not retVal[ 'OK' ]:
         return S_ERROR( "Can't delete job: %s" % retVal[ 'Message' ] )
       connObj = retVal[ 'Value' ]
-    retVal = self._query( "SELECT t.TQId, t.OwnerDN, t.OwnerGroup FROM `tq_TaskQueues` t, `tq_Jobs` j WHERE j.JobId = %s AND t.TQId = j.TQId" % jobId, conn = connObj )
+    retVal = self._query( "SELECT t.TQId, t.OwnerDN, t.OwnerGroup, j.Priority FROM `tq_TaskQueues` t, `tq_Jobs` j WHERE j.JobId = %s AND t.TQId = j.TQId" % jobId, conn = connObj )
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not get job from task queue %s: %s" % ( jobId, retVal[ 'Message' ] ) )
     data = retVal[ 'Value' ]
     if not data:
       return S_OK( False )
-    tqId, tqOwnerDN, tqOwnerGroup = data[0]
+    tqId, tqOwnerDN, tqOwnerGroup, jobPriority = data[0]
     self.log.info( "Deleting job %s" % jobId )
     retVal = self._update( "DELETE FROM `tq_Jobs` WHERE JobId = %s" % jobId, conn = connObj )
     if not retVal[ 'OK' ]:
@@ -767,6 +975,8 @@ class TaskQueueDB( DB ):
     if retVal['Value'] == 0:
       #No job deleted
       return S_OK( False )
+    if self.__matchIndex:
+      self.__matchIndex.removeJob( tqId, jobPriority )
     #Always return S_OK() because job has already been taken out from the TQ
     self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
     return S_OK( True )
@@ -861,6 +1071,8 @@ class TaskQueueDB( DB ):
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     delTQ = retVal[ 'Value' ]
     if delTQ > 0:
+      if self.__matchIndex:
+        self.__matchIndex.removeTaskQueue( tqId )
       for mvField in multiValueDefFields:
         retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % ( mvField, tqId ), conn = connObj )
         if not retVal[ 'OK' ]:
@@ -893,6 +1105,8 @@ class TaskQueueDB( DB ):
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     delTQ = retVal[ 'Value' ]
+    if self.__matchIndex:
+      self.__matchIndex.removeTaskQueue( tqId )
     sqlCmd = "DELETE FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s" % tqId
     retVal = self._update( sqlCmd, conn = connObj )
     if not retVal[ 'OK' ]:
@@ -1144,7 +1358,10 @@ class TaskQueueDB( DB ):
     for prio in prioDict:
       tqList = ", ".join( [ str( tqId ) for tqId in prioDict[ prio ] ] )
       updateSQL = "UPDATE `tq_TaskQueues` SET Priority=%.4f WHERE TQId in ( %s )" % ( prio, tqList )
-      self._update( updateSQL, conn = connObj )
+      result = self._update( updateSQL, conn = connObj )
+      if result[ 'OK' ] and self.__matchIndex:
+        for tqId in prioDict[ prio ]:
+          self.__matchIndex.setTaskQueuePriority( tqId, prio )
     return S_OK()
 
   def getGroupShares( self ):
@@ -0,0 +1,183 @@
+########################################################################
+# File :    JobStatusIngestion_Benchmark
+########################################################################
+"""
+  Load test of the job status ingestion done by the JobStateUpdate service
+  against the configured JobDB and JobLoggingDB ( use test DBs! ).
+
+  Fake jobs are inserted, then several threads send setJobStatusBulk like
+  updates for them, as the JobReport of running jobs does. The updates are
+  applied one job at a time, as without StatusFlushWindow, and through the
+  coalescing JobStatusQueue. The throughput and the number of SQL statements
+  executed are printed for both, and the fake jobs are removed at the end.
+"""
+__RCSID__ = "$Id$"
+
+from DIRAC.Core.Base import Script
+from DIRAC import S_OK, S_ERROR
+
+Script.setUsageMessage( __doc__ )
+
+numJobs = 1000
+def setNumJobs( value ):
+  global numJobs
+  numJobs = int( value )
+  return S_OK()
+
+numUpdates = 5
+def setNumUpdates( value ):
+  global numUpdates
+  numUpdates = int( value )
+  return S_OK()
+
+numThreads = 10
+def setNumThreads( value ):
+  global numThreads
+  numThreads = int( value )
+  return S_OK()
+
+flushWindow = 1.
+def setFlushWindow( value ):
+  global flushWindow
+  flushWindow = float( value )
+  return S_OK()
+
+Script.registerSwitch( "j:", "numJobs=", "Number of jobs [%s]" % numJobs, setNumJobs )
+Script.registerSwitch( "u:", "numUpdates=", "Number of setJobStatusBulk calls per job [%s]" % numUpdates, setNumUpdates )
+Script.registerSwitch( "t:", "numThreads=", "Number of sending threads [%s]" % numThreads, setNumThreads )
+Script.registerSwitch( "w:", "flushWindow=", "Flush window of the queue in seconds [%s]" % flushWindow, setFlushWindow )
+Script.parseCommandLine( ignoreErrors = True )
+
+import sys
+import time
+import threading
+import datetime
+
+from DIRAC.Core.Utilities.QueryStatistics import gQueryStatistics
+from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
+from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
+from DIRAC.WorkloadManagementSystem.private.JobStatusQueue import JobStatusQueue
+
+# Far from the IDs of real jobs
+FIRST_JOB_ID = 900000000
+STATUS_SEQUENCE = [ ( 'Running', 'Job Initialization', '' ),
+                    ( 'Running', 'Application', '' ),
+                    ( '', '', 'Step 1 running' ),
+                    ( '', '', 'Step 2 running' ),
+                    ( 'Completed', 'Application Finished Successfully', '' ),
+                    ( 'Done', 'Execution Complete', '' ) ]
+
+def checkResult( result ):
+  if not result[ 'OK' ]:
+    print "ERROR: %s" % result[ 'Message' ]
+    sys.exit( 1 )
+  return result[ 'Value' ]
+
+def createJobs( jobDB, logDB, jobIDs ):
+  """ Insert the fake jobs as matched jobs """
+  checkResult( jobDB.insertFieldsMany( 'JobJDLs', [ 'JobID', 'JDL', 'JobRequirements', 'OriginalJDL' ],
+                                       [ ( jobID, '', '', '' ) for jobID in jobIDs ] ) )
+  checkResult( jobDB.insertFieldsMany( 'Jobs', [ 'JobID', 'Status', 'MinorStatus', 'Owner', 'JobName' ],
+                                       [ ( jobID, 'Matched', 'Assigned', 'benchmark', 'StatusIngestion' )
+                                         for jobID in jobIDs ] ) )
+  startTime = datetime.datetime.utcnow() - datetime.timedelta( hours = 1 )
+  checkResult( logDB.addLoggingRecords( [ ( jobID, 'Matched', 'Assigned', 'idem', startTime, 'Matcher' )
+                                          for jobID in jobIDs ] ) )
+
+def removeJobs( jobDB, logDB, jobIDs ):
+  jobDB.removeJobFromDB( jobIDs )
+  logDB.deleteJob( [ str( jobID ) for jobID in jobIDs ] )
+
+def generateUpdates( jobIDs ):
+  """ The statusDicts sent for the jobs, in sending order """
+  updates = []
+  for iUpdate in range( numUpdates ):
+    for jobID in jobIDs:
+      statusDict = {}
+      # Each call has a couple of records, as JobReport accumulates them
+      for iRecord in ( 2 * iUpdate, 2 * iUpdate + 1 ):
+        status, minor, application = STATUS_SEQUENCE[ min( iRecord, len( STATUS_SEQUENCE ) - 1 ) ]
+        date = datetime.datetime.utcnow() + datetime.timedelta( seconds = iRecord )
+        statusDict[ date.strftime( '%Y-%m-%d %H:%M:%S' ) ] = { 'Status' : status, 'MinorStatus' : minor,
+                                                                'ApplicationStatus' : application,
+                                                                'Source' : 'JobWrapper' }
+      updates.append( ( jobID, statusDict ) )
+  return updates
+
+def sendUpdates( updates, sendFunc ):
+  """ Send the updates with numThreads threads, return the elapsed time """
+  lock = threading.Lock()
+  errors = []
+  def sender():
+    while True:
+      lock.acquire()
+      try:
+        if not updates:
+          return
+        jobID, statusDict = updates.pop( 0 )
+      finally:
+        lock.release()
+      result = sendFunc( jobID, statusDict )
+      if not result[ 'OK' ]:
+        errors.append( result[ 'Message' ] )
+  threads = [ threading.Thread( target = sender ) for _ in range( numThreads ) ]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  if errors:
+    print "%s errors, first one: %s" % ( len( errors ), errors[0] )
+  return time.time() - start
+
+def countStatements():
+  return sum( [ stats[ 'Calls' ] for dbStats in gQueryStatistics.getStatistics().values()
+                for stats in dbStats.values() ] )
+
+def checkJobs( jobDB, jobIDs ):
+  """ All the jobs should have reached the last status """
+  statusDict = checkResult( jobDB.getAttributesForJobList( jobIDs, [ 'Status' ] ) )
+  notDone = [ jobID for jobID in jobIDs if statusDict.get( jobID, {} ).get( 'Status' ) != 'Done' ]
+  if notDone:
+    print "WARNING: %s jobs did not reach the Done status" % len( notDone )
+
+def report( name, elapsed, statements ):
+  numCalls = numJobs * numUpdates
+  print "%-10s calls: %7d  time: %8.2f s  calls/s: %9.1f  SQL statements: %7d  per call: %6.2f" % \
+        ( name, numCalls, elapsed, numCalls / elapsed, statements, float( statements ) / numCalls )
+
+jobDB = JobDB()
+logDB = JobLoggingDB()
+# Count the statements, whatever the QueryStatistics option of the DBs
+jobDB._queryStatistics = True
+logDB._queryStatistics = True
+
+directJobs = range( FIRST_JOB_ID, FIRST_JOB_ID + numJobs )
+queuedJobs = range( FIRST_JOB_ID + numJobs, FIRST_JOB_ID + 2 * numJobs )
+print "Inserting %s fake jobs" % ( 2 * numJobs )
+createJobs( jobDB, logDB, directJobs + queuedJobs )
+
+try:
+  # One job at a time, as without StatusFlushWindow
+  directQueue = JobStatusQueue( jobDB, logDB, flushWindow = 0 )
+  def processJob( jobID, statusDict ):
+    result = directQueue.processJobs( { jobID : statusDict } )
+    if result[ 'OK' ] and jobID in result[ 'Value' ]:
+      return S_ERROR( result[ 'Value' ][ jobID ] )
+    return result
+  gQueryStatistics.reset()
+  elapsed = sendUpdates( generateUpdates( directJobs ), processJob )
+  report( "Direct", elapsed, countStatements() )
+  checkJobs( jobDB, directJobs )
+
+  # Through the coalescing queue, including the time to write what is left
+  statusQueue = JobStatusQueue( jobDB, logDB, flushWindow = flushWindow )
+  gQueryStatistics.reset()
+  start = time.time()
+  sendUpdates( generateUpdates( queuedJobs ), statusQueue.addJobStatus )
+  checkResult( statusQueue.flush() )
+  report( "Queued", time.time() - start, countStatements() )
+  checkJobs( jobDB, queuedJobs )
+finally:
+  print "Removing the fake jobs"
+  removeJobs( jobDB, logDB, directJobs + queuedJobs )
@@ -0,0 +1,115 @@
+########################################################################
+# File :    TaskQueueDB_MatchBenchmark
+########################################################################
+"""
+  Benchmark of the TQ selection done by TaskQueueDB.matchAndGetTaskQueue
+  with the match SQL and with the in-memory TaskQueueMatchIndex.
+
+  Without --useDB only the in-memory index is benchmarked on randomly generated TQs.
+  With --useDB the TQs are inserted in the configured TaskQueueDB ( use a test DB! ),
+  and both the SQL and the in-memory selections are timed on the same content.
+"""
+__RCSID__ = "$Id$"
+
+from DIRAC.Core.Base import Script
+from DIRAC import S_OK
+
+Script.setUsageMessage( __doc__ )
+
+numTQs = 10000
+def setNumTQs( value ):
+  global numTQs
+  numTQs = int( value )
+  return S_OK()
+
+numMatches = 1000
+def setNumMatches( value ):
+  global numMatches
+  numMatches = int( value )
+  return S_OK()
+
+useDB = False
+def setUseDB( _value ):
+  global useDB
+  useDB = True
+  return S_OK()
+
+Script.registerSwitch( "t:", "numTQs=", "Number of task queues [%s]" % numTQs, setNumTQs )
+Script.registerSwitch( "m:", "numMatches=", "Number of matches to time [%s]" % numMatches, setNumMatches )
+Script.registerSwitch( "", "useDB", "Fill the TaskQueueDB and compare with the SQL match", setUseDB )
+Script.parseCommandLine( ignoreErrors = True )
+
+import sys
+import time
+import random
+
+from DIRAC.WorkloadManagementSystem.private.TaskQueueMatchIndex import TaskQueueMatchIndex
+
+sites = [ 'DIRAC.Site%s.ch' % i for i in range( 200 ) ]
+platforms = [ 'x86_64-slc5', 'x86_64-slc6', 'x86_64-centos7' ]
+tags = [ 'MultiProcessor', 'WholeNode', 'GPU' ]
+owners = [ ( '/DC=ch/CN=user%s' % i, 'group%s' % ( i % 5 ) ) for i in range( 100 ) ]
+
+def generateTQDefinition():
+  """ Random TQ definition """
+  ownerDN, ownerGroup = random.choice( owners )
+  tqDef = { 'OwnerDN' : ownerDN, 'OwnerGroup' : ownerGroup, 'Setup' : 'Benchmark',
+            'CPUTime' : random.choice( [ 3600, 86400, 172800 ] ),
+            'Sites' : random.sample( sites, random.randint( 0, 3 ) ),
+            'BannedSites' : random.sample( sites, random.randint( 0, 2 ) ),
+            'JobTypes' : [ random.choice( [ 'User', 'MCSimulation', 'Merge' ] ) ] }
+  if random.random() < 0.5:
+    tqDef[ 'Platforms' ] = [ random.choice( platforms ) ]
+  if random.random() < 0.1:
+    tqDef[ 'Tags' ] = [ random.choice( tags ) ]
+  return tqDef
+
+def generateMatchDefinition():
+  """ Random resource description """
+  return { 'Setup' : 'Benchmark', 'CPUTime' : random.choice( [ 3600, 86400, 172800 ] ),
+           'Site' : random.choice( sites ), 'Platform' : platforms,
+           'JobType' : [ 'User', 'MCSimulation', 'Merge' ] }
+
+def timeMatches( matchFunc, matchDicts ):
+  """ Time a list of matches, return the latencies in ms """
+  latencies = []
+  for matchDict in matchDicts:
+    start = time.time()
+    matchFunc( matchDict )
+    latencies.append( ( time.time() - start ) * 1000 )
+  return sorted( latencies )
+
+def report( name, latencies ):
+  """ Print latency statistics """
+  print "%-10s matches: %6d  mean: %8.3f ms  median: %8.3f ms  95%%: %8.3f ms" % \
+        ( name, len( latencies ), sum( latencies ) / len( latencies ), latencies[ len( latencies ) / 2 ],
+          latencies[ int( len( latencies ) * 0.95 ) ] )
+
+matchDicts = [ generateMatchDefinition() for _ in range( numMatches ) ]
+matchIndex = TaskQueueMatchIndex()
+
+if not useDB:
+  for tqId in range( 1, numTQs + 1 ):
+    matchIndex.setTaskQueue( tqId, generateTQDefinition(), random.random() * 100 )
+  report( "Index", timeMatches( lambda md: matchIndex.matchTaskQueues( md, numQueuesToGet = 10 ), matchDicts ) )
+  sys.exit( 0 )
+
+from DIRAC.WorkloadManagementSystem.DB.TaskQueueDB import TaskQueueDB
+
+tqDB = TaskQueueDB()
+print "Inserting %s TQs in the TaskQueueDB" % numTQs
+for jobId in range( 1, numTQs + 1 ):
+  result = tqDB.insertJob( 10000000 + jobId, generateTQDefinition(), 1 )
+  if not result[ 'OK' ]:
+    print "ERROR: %s" % result[ 'Message' ]
+    sys.exit( 1 )
+result = tqDB.retrieveTaskQueues()
+if not result[ 'OK' ]:
+  print "ERROR: %s" % result[ 'Message' ]
+  sys.exit( 1 )
+for tqId, tqData in result[ 'Value' ].items():
+  matchIndex.setTaskQueue( tqId, tqData, tqData[ 'Priority' ] )
+print "%s TQs in the DB" % len( matchIndex )
+
+report( "SQL", timeMatches( lambda md: tqDB.matchAndGetTaskQueue( md, numQueuesToGet = 10 ), matchDicts ) )
+report( "Index", timeMatches( lambda md: matchIndex.matchTaskQueues( md, numQueuesToGet = 10 ), matchDicts ) )
@@ -0,0 +1,64 @@
+""" Unit tests of the unicode values stored by the JobDB and the JobLoggingDB
+"""
+
+import types
+import unittest
+
+from DIRAC import gLogger, S_OK
+from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
+from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
+
+VALUE = u'Caf\xe9 \u2603'
+ENCODED = 'Caf\xc3\xa9 \xe2\x98\x83'
+
+def getDB( dbClass ):
+  """ DB instance recording the rows inserted instead of writing them
+  """
+  db = types.InstanceType( dbClass )
+  db.log = gLogger.getSubLogger( dbClass.__name__ )
+  db.gLogger = db.log
+  db.inserted = []
+  def insertFieldsMany( tableName, fields, rows, **kwargs ):
+    db.inserted.extend( rows )
+    return S_OK( len( rows ) )
+  db.insertFieldsMany = insertFieldsMany
+  db._update = lambda *args, **kwargs: S_OK( 1 )
+  db._query = lambda *args, **kwargs: S_OK( ( ( 1, ), ) )
+  db._escapeString = lambda value: S_OK( "'%s'" % value )
+  return db
+
+class UnicodeValuesTestCase( unittest.TestCase ):
+
+  def test_toStr( self ):
+    db = getDB( JobDB )
+    self.assertEqual( db._toStr( VALUE ), ENCODED )
+    self.assertEqual( db._toStr( ENCODED ), ENCODED )
+    self.assertEqual( db._toStr( 12 ), '12' )
+
+  def test_jobParameters( self ):
+    db = getDB( JobDB )
+    self.assert_( db.setJobParameters( 1, [ ( 'Name', VALUE ) ] )['OK'] )
+    self.assertEqual( db.inserted, [ ( 1, 'Name', ENCODED ) ] )
+
+  def test_heartBeatData( self ):
+    db = getDB( JobDB )
+    self.assert_( db.setHeartBeatData( 1, { 'Static' : VALUE }, { 'Dynamic' : VALUE } )['OK'] )
+    self.assertEqual( db.inserted, [ ( 1, 'Static', ENCODED ), ( 1, 'Dynamic', ENCODED ) ] )
+    db.inserted = []
+    db._JobDB__insertHeartBeatRows = lambda tableName, fields, rows: db.insertFieldsMany( tableName, fields, rows )
+    result = db.setHeartBeatDataBulk( { 1 : '2015-01-01 10:00:00' }, { 1 : { 'Static' : VALUE } },
+                                      [ ( 1, 'Dynamic', VALUE, '2015-01-01 10:00:00' ) ] )
+    self.assert_( result['OK'] )
+    self.assertEqual( db.inserted, [ ( 1, 'Static', ENCODED ), ( 1, 'Dynamic', ENCODED, '2015-01-01 10:00:00' ) ] )
+
+  def test_loggingRecords( self ):
+    db = getDB( JobLoggingDB )
+    self.assert_( db.addLoggingRecord( 1, status = 'Failed', minor = VALUE, date = '2015-01-01 10:00:00',
+                                       source = VALUE )['OK'] )
+    self.assert_( db.addLoggingRecords( [ ( 2, 'Failed', VALUE, 'idem', '2015-01-01 10:00:00', 'Test' ) ] )['OK'] )
+    self.assertEqual( [ row[2] for row in db.inserted ], [ ENCODED, ENCODED ] )
+    self.assertEqual( db.inserted[0][6], ENCODED )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( UnicodeValuesTestCase )
+  unittest.TextTestRunner( verbosity = 2 ).run( suite )
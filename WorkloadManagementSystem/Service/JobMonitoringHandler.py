@@ -6,9 +6,11 @@
 
 __RCSID__ = "$Id$"
 
-from types import IntType, LongType, ListType, DictType, StringTypes, StringType, NoneType, BooleanType
+from types import IntType, LongType, ListType, TupleType, DictType, StringTypes, StringType, NoneType, BooleanType
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
-from DIRAC import S_OK, S_ERROR
+from DIRAC import S_OK, S_ERROR, gConfig, gLogger
+from DIRAC.Core.Utilities.DictCache import DictCache
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 from DIRAC.WorkloadManagementSystem.DB.TaskQueueDB import TaskQueueDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
@@ -20,6 +22,14 @@ from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 gJobDB = False
 gJobLoggingDB = False
 gTaskQueueDB = False
+# Name of the TaskQueueDB if it can be joined with the JobDB
+gTQDBName = None
+# Status counters of the selections of the job monitor
+gCountersCache = DictCache()
+gCountersCacheTime = 30
+# Seek position of the items at the page boundaries of the job monitor selections
+gPageBoundaryCache = DictCache()
+PAGE_BOUNDARY_CACHE_TIME = 600
 
 SUMMARY = ['JobType', 'Site', 'JobName', 'Owner', 'SubmissionTime',
            'LastUpdateTime', 'Status', 'MinorStatus', 'ApplicationStatus']
@@ -29,12 +39,35 @@ FINAL_STATES = ['Done', 'Completed', 'Stalled', 'Failed', 'Killed']
 
 def initializeJobMonitoringHandler( serviceInfo ):
 
-  global gJobDB, gJobLoggingDB, gTaskQueueDB
+  global gJobDB, gJobLoggingDB, gTaskQueueDB, gTQDBName, gCountersCacheTime
   gJobDB = JobDB()
   gJobLoggingDB = JobLoggingDB()
   gTaskQueueDB = TaskQueueDB()
+  if ( gTaskQueueDB.dbHost, gTaskQueueDB.dbPort ) == ( gJobDB.dbHost, gJobDB.dbPort ):
+    # The JobDB user also needs to read the TaskQueueDB
+    result = gJobDB._query( "SELECT JobId FROM `%s`.`tq_Jobs` LIMIT 1" % gTaskQueueDB.dbName )
+    if result['OK']:
+      gTQDBName = gTaskQueueDB.dbName
+    else:
+      gLogger.info( "The TaskQueueDB can not be joined with the JobDB", result['Message'] )
+  gCountersCacheTime = gConfig.getValue( '%s/CountersCacheTime' % serviceInfo['serviceSectionPath'],
+                                         gCountersCacheTime )
+  gThreadScheduler.addPeriodicTask( 300, gCountersCache.purgeExpired )
+  gThreadScheduler.addPeriodicTask( 300, gPageBoundaryCache.purgeExpired )
   return S_OK()
 
+def _getSelectionKey( selectDict, startDate, endDate ):
+  """ Key of a job selection for the caches, independent of the order of the conditions
+  """
+  items = []
+  for key, value in selectDict.items():
+    if type( value ) in ( ListType, TupleType ):
+      value = tuple( sorted( [ str( v ) for v in value ] ) )
+    else:
+      value = str( value )
+    items.append( ( str( key ), value ) )
+  return ( tuple( sorted( items ) ), str( startDate ), str( endDate ) )
+
 class JobMonitoringHandler( RequestHandler ):
 
   def initialize( self ):
@@ -295,6 +328,20 @@ class JobMonitoringHandler( RequestHandler ):
     restring = str( result['Value'] )
     return S_OK( restring )
 
+##############################################################################
+  @staticmethod
+  def __getJobsSummaryPage( selectDict, **kwargs ):
+    """ Get a page of jobs with their TQ joined from the TaskQueueDB if possible. If the join
+        fails, it is not tried anymore and the TQs are taken from the TaskQueueDB apart
+    """
+    global gTQDBName
+    result = gJobDB.getJobsSummaryPage( selectDict, tqDBName = gTQDBName, **kwargs )
+    if not result['OK'] and gTQDBName:
+      gLogger.warn( "Failed to join the TaskQueueDB with the JobDB", result['Message'] )
+      gTQDBName = None
+      result = gJobDB.getJobsSummaryPage( selectDict, **kwargs )
+    return result
+
 ##############################################################################
   types_getJobPageSummaryWeb = [DictType, ListType, IntType, IntType]
   def export_getJobPageSummaryWeb( self, selectDict, sortList, startItem, maxItems, selectJobs = True ):
@@ -320,54 +367,74 @@ class JobMonitoringHandler( RequestHandler ):
     if result['Value'] != 'ALL':
       selectDict[ ( 'Owner', 'OwnerGroup' ) ] = result['Value']
 
-    # Sorting instructions. Only one for the moment.
+    # Sorting instructions. Only one for the moment, the jobs are then ordered by JobID
     if sortList:
       orderAttribute = sortList[0][0] + ":" + sortList[0][1]
     else:
-      orderAttribute = None
-
-    statusDict = {}
-    result = gJobDB.getCounters( 'Jobs', ['Status'], selectDict,
-                               newer = startDate,
-                               older = endDate,
-                               timeStamp = 'LastUpdateTime' )
-
-    nJobs = 0
-    if result['OK']:
-      for stDict, count in result['Value']:
-        nJobs += count
-        statusDict[stDict['Status']] = count
+      orderAttribute = "JobID:DESC"
+
+    # The counters are cached for a short time, as the job monitor asks them for each page
+    selectionKey = _getSelectionKey( selectDict, startDate, endDate )
+    statusDict = gCountersCache.get( selectionKey )
+    if statusDict is None:
+      statusDict = {}
+      result = gJobDB.getCounters( 'Jobs', ['Status'], selectDict,
+                                 newer = startDate,
+                                 older = endDate,
+                                 timeStamp = 'LastUpdateTime' )
+      if result['OK']:
+        for stDict, count in result['Value']:
+          statusDict[stDict['Status']] = count
+        gCountersCache.add( selectionKey, gCountersCacheTime, statusDict )
+    nJobs = sum( statusDict.values() )
 
     resultDict['TotalRecords'] = nJobs
     if nJobs == 0:
       return S_OK( resultDict )
 
-    resultDict['Extras'] = statusDict
+    resultDict['Extras'] = dict( statusDict )
 
     if selectJobs:
       iniJob = startItem
       if iniJob >= nJobs:
         return S_ERROR( 'Item number out of range' )
 
-      result = gJobDB.selectJobs( selectDict, orderAttribute = orderAttribute,
-                                newer = startDate, older = endDate, limit = ( maxItems, iniJob ) )
+      # Pages following an already served one are selected with a seek from its last job
+      # instead of an offset, that has to go through all the previous jobs
+      after = None
+      if iniJob:
+        after = gPageBoundaryCache.get( ( selectionKey, orderAttribute, iniJob ) )
+      result = self.__getJobsSummaryPage( selectDict, older = endDate, newer = startDate,
+                                          orderAttribute = orderAttribute, maxItems = maxItems,
+                                          offset = iniJob, after = after, attrList = SUMMARY )
       if not result['OK']:
         return S_ERROR( 'Failed to select jobs: ' + result['Message'] )
+      page = result['Value']
+      if not page:
+        return S_OK( resultDict )
+      gPageBoundaryCache.add( ( selectionKey, orderAttribute, iniJob + len( page ) ),
+                              PAGE_BOUNDARY_CACHE_TIME, page[-1][2] )
 
-      summaryJobList = result['Value']
+      summaryJobList = [ int( jobDict['JobID'] ) for jobDict, _tqID, _after in page ]
       if not self.globalJobsInfo:
         validJobs, _invalidJobs, _nonauthJobs, _ownJobs = self.jobPolicy.evaluateJobRights( summaryJobList,
                                                                                             RIGHT_GET_INFO )
-        summaryJobList = validJobs
+        validJobs = set( validJobs )
+        page = [ item for item in page if int( item[0]['JobID'] ) in validJobs ]
+        summaryJobList = [ jobID for jobID in summaryJobList if jobID in validJobs ]
 
-      result = gJobDB.getAttributesForJobList( summaryJobList, SUMMARY )
-      if not result['OK']:
-        return S_ERROR( 'Failed to get job summary: ' + result['Message'] )
+      # If no jobs can be selected after the properties check
+      if not page:
+        return S_OK( resultDict )
 
-      summaryDict = result['Value']
+      tqDict = {}
+      if not gTQDBName:
+        result = gTaskQueueDB.getTaskQueueForJobs( summaryJobList )
+        if result['OK']:
+          tqDict = result['Value']
 
       # Evaluate last sign of life time
-      for jobID, jobDict in summaryDict.items():
+      for jobDict, _tqID, _after in page:
         if jobDict['HeartBeatTime'] == 'None':
           jobDict['LastSignOfLife'] = jobDict['LastUpdateTime']
         else:
@@ -378,25 +445,17 @@ class JobMonitoringHandler( RequestHandler ):
           else:
             jobDict['LastSignOfLife'] = jobDict['LastUpdateTime']
 
-      tqDict = {}
-      result = gTaskQueueDB.getTaskQueueForJobs( summaryJobList )
-      if result['OK']:
-        tqDict = result['Value']
-
-      # If no jobs can be selected after the properties check
-      if not summaryDict.keys():
-        return S_OK( resultDict )
-
       # prepare the standard structure now
-      key = summaryDict.keys()[0]
-      paramNames = summaryDict[key].keys()
+      paramNames = page[0][0].keys()
 
       records = []
-      for jobID, jobDict in summaryDict.items():
+      for jobDict, tqID, _after in page:
         jParList = []
         for pname in paramNames:
           jParList.append( jobDict[pname] )
-        jParList.append( tqDict.get( jobID, 0 ) )
+        if tqID is None:
+          tqID = tqDict.get( int( jobDict['JobID'] ), 0 )
+        jParList.append( tqID )
         records.append( jParList )
 
       resultDict['ParameterNames'] = paramNames + ['TaskQueueID']
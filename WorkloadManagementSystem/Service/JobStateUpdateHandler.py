@@ -16,23 +16,46 @@ __RCSID__ = "$Id$"
 from types import StringType, IntType, LongType, ListType, DictType
 # from types import *
 import time
+import atexit
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
-from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC import gLogger, gConfig, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
+from DIRAC.WorkloadManagementSystem.private.JobStatusQueue import JobStatusQueue, JOB_FINAL_STATES
+from DIRAC.WorkloadManagementSystem.private.HeartBeatStore import HeartBeatStore
 
 # This is a global instance of the JobDB class
 jobDB = False
 logDB = False
-
-JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
+statusQueue = False
+heartBeatStore = False
 
 def initializeJobStateUpdateHandler( serviceInfo ):
 
   global jobDB
   global logDB
+  global statusQueue
+  global heartBeatStore
   jobDB = JobDB()
   logDB = JobLoggingDB()
+  # With a StatusFlushWindow the bulk status updates are queued and written in bulk
+  # every StatusFlushWindow seconds, or every MaxJobsPerFlush jobs
+  csPath = serviceInfo['serviceSectionPath']
+  statusQueue = JobStatusQueue( jobDB, logDB,
+                                flushWindow = gConfig.getValue( '%s/StatusFlushWindow' % csPath, 0. ),
+                                maxJobsPerFlush = gConfig.getValue( '%s/MaxJobsPerFlush' % csPath, 1000 ),
+                                maxQueuedJobs = gConfig.getValue( '%s/MaxQueuedJobs' % csPath, 50000 ) )
+  # The queued updates are already acknowledged to the clients, write them before exiting
+  if statusQueue.isQueueing():
+    atexit.register( statusQueue.stop )
+  # With a HeartBeatFlushPeriod the heart beats are kept in memory and written in bulk every
+  # HeartBeatFlushPeriod seconds. The dynamic data is logged at most every HeartBeatLoggingPeriod seconds
+  heartBeatStore = HeartBeatStore( jobDB,
+                                   flushPeriod = gConfig.getValue( '%s/HeartBeatFlushPeriod' % csPath, 0 ),
+                                   loggingPeriod = gConfig.getValue( '%s/HeartBeatLoggingPeriod' % csPath, 0 ),
+                                   maxJobsPerFlush = gConfig.getValue( '%s/MaxJobsPerFlush' % csPath, 1000 ) )
+  if heartBeatStore.isQueueing():
+    atexit.register( heartBeatStore.stop )
   return S_OK()
 
 class JobStateUpdateHandler( RequestHandler ):
@@ -128,101 +151,20 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Set various status fields for job specified by its JobId.
         Set only the last status in the JobDB, updating all the status
         logging information in the JobLoggingDB. The statusDict has datetime
-        as a key and status information dictionary as values
+        as a key and status information dictionary as values.
+        If the service has a StatusFlushWindow, the update is queued and
+        written later together with the updates of other jobs
     """
 
-    status = ""
-    minor = ""
-    application = ""
-    appCounter = ""
-    endDate = ''
-    startDate = ''
-    startFlag = ''
     jobID = int( jobID )
+    if statusQueue.isQueueing():
+      return statusQueue.addJobStatus( jobID, statusDict )
 
-    result = jobDB.getJobAttributes( jobID, ['Status'] )
+    result = statusQueue.processJobs( { jobID : statusDict } )
     if not result['OK']:
       return result
-
-    if not result['Value']:
-      # if there is no matching Job it returns an empty dictionary
-      return S_ERROR( 'No Matching Job' )
-
-    new_status = result['Value']['Status']
-    if new_status == "Stalled":
-      status = 'Running'
-
-    # Get the latest WN time stamps of status updates
-    result = logDB.getWMSTimeStamps( int( jobID ) )
-    if not result['OK']:
-      return result
-    lastTime = max( [float( t ) for s, t in result['Value'].items() if s != 'LastTime'] )
-    from DIRAC import Time
-    lastTime = Time.toString( Time.fromEpoch( lastTime ) )
-
-    # Get the last status values
-    dates = sorted( statusDict )
-    # We should only update the status if its time stamp is more recent than the last update
-    for date in [date for date in dates if date >= lastTime]:
-      sDict = statusDict[date]
-      if sDict['Status']:
-        status = sDict['Status']
-        if status in JOB_FINAL_STATES:
-          endDate = date
-        if status == "Running":
-          startFlag = 'Running'
-      if sDict['MinorStatus']:
-        minor = sDict['MinorStatus']
-        if minor == "Application" and startFlag == 'Running':
-          startDate = date
-      if sDict['ApplicationStatus']:
-        application = sDict['ApplicationStatus']
-      counter = sDict.get( 'ApplicationCounter' )
-      if counter:
-        appCounter = counter
-    attrNames = []
-    attrValues = []
-    if status:
-      attrNames.append( 'Status' )
-      attrValues.append( status )
-    if minor:
-      attrNames.append( 'MinorStatus' )
-      attrValues.append( minor )
-    if application:
-      attrNames.append( 'ApplicationStatus' )
-      attrValues.append( application )
-    if appCounter:
-      attrNames.append( 'ApplicationCounter' )
-      attrValues.append( appCounter )
-    result = jobDB.setJobAttributes( jobID, attrNames, attrValues, update = True )
-    if not result['OK']:
-      return result
-
-    if endDate:
-      result = jobDB.setEndExecTime( jobID, endDate )
-    if startDate:
-      result = jobDB.setStartExecTime( jobID, startDate )
-
-    # Update the JobLoggingDB records
-    for date in dates:
-      sDict = statusDict[date]
-      status = sDict['Status']
-      if not status:
-        status = 'idem'
-      minor = sDict['MinorStatus']
-      if not minor:
-        minor = 'idem'
-      application = sDict['ApplicationStatus']
-      if not application:
-        application = 'idem'
-      else:
-        status = "Running"
-        minor = "Application"
-      source = sDict['Source']
-      result = logDB.addLoggingRecord( jobID, status, minor, application, date, source )
-      if not result['OK']:
-        return result
-
+    if jobID in result['Value']:
+      return S_ERROR( result['Value'][jobID] )
     return S_OK()
 
   ###########################################################################
@@ -316,7 +258,7 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Send a heart beat sign of life for a job jobID
     """
 
-    result = jobDB.setHeartBeatData( int( jobID ), staticData, dynamicData )
+    result = heartBeatStore.addHeartBeat( int( jobID ), staticData, dynamicData )
     if not result['OK']:
       gLogger.warn( 'Failed to set the heart beat data for job %d ' % int( jobID ) )
 
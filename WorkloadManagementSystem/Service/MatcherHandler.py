@@ -6,7 +6,7 @@
 
 __RCSID__ = "$Id$"
 
-from types import StringType, DictType, StringTypes
+from types import StringType, DictType, StringTypes, IntType, LongType
 
 from DIRAC                                             import gLogger, S_OK, S_ERROR
 
@@ -90,6 +90,32 @@ class MatcherHandler( RequestHandler ):
     gMonitor.addMark( "matchesOK" )
     return S_OK( result )
 
+##############################################################################
+  types_requestJobs = [ [StringType, DictType], [IntType, LongType] ]
+  def export_requestJobs( self, resourceDescription, maxJobs ):
+    """ Serve up to maxJobs jobs to a pilot filling several slots at once.
+        The jobs are the highest priority ones matching the agent's site capacity
+    """
+
+    maxJobs = min( maxJobs, self.srv_getCSOption( "MaxJobsPerRequest", 50 ) )
+    if maxJobs < 1:
+      return S_ERROR( "Invalid number of jobs requested: %s" % maxJobs )
+
+    resourceDescription['Setup'] = self.serviceInfoDict['clientSetup']
+    credDict = self.getRemoteCredentials()
+
+    try:
+      result = self.matcher.selectJobs( resourceDescription, credDict, maxJobs )
+    except RuntimeError, rte:
+      self.log.error( "Error requesting jobs: ", rte )
+      return S_ERROR( "Error requesting jobs" )
+    if type( result ) == DictType:
+      # An S_ERROR coming from the DBs
+      return result
+    gMonitor.addMark( "matchesDone" )
+    gMonitor.addMark( "matchesOK", len( result ) )
+    return S_OK( result )
+
 ##############################################################################
   types_getActiveTaskQueues = []
   def export_getActiveTaskQueues( self ):
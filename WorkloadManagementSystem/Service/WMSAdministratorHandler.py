@@ -570,7 +570,7 @@ class WMSAdministratorHandler(RequestHandler):
     return result
 
   ##########################################################################################
-  types_setAccountingFlag = [StringTypes]
+  types_setAccountingFlag = [ list( StringTypes ) + [ ListType ] ]
   def export_setAccountingFlag(self,pilotRef,mark='True'):
     """ Set the pilot AccountingSent flag
     """
@@ -578,7 +578,7 @@ class WMSAdministratorHandler(RequestHandler):
     return result
 
   ##########################################################################################
-  types_setPilotStatus = [StringTypes, StringTypes]
+  types_setPilotStatus = [ list( StringTypes ) + [ ListType ], StringTypes ]
   def export_setPilotStatus(self,pilotRef,status,destination=None,reason=None,gridSite=None,queue=None):
     """ Set the pilot agent status
     """
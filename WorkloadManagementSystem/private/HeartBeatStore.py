@@ -0,0 +1,185 @@
+""" Store of the job heart beats received by the JobStateUpdate service
+
+    The heart beats are kept in memory and written periodically for all the jobs at once
+    with JobDB.setHeartBeatDataBulk:
+      - the last HeartBeatTime of each job, with one UPDATE on Jobs
+      - the last static data of each job, with multi-row REPLACEs into JobParameters
+      - the dynamic data, with multi-row INSERTs into HeartBeatLoggingInfo
+
+    The dynamic data of a job is down-sampled: it is only logged if the previous sample
+    logged for the job is older than the logging period. The data of a job is written
+    at most one flush period after it was received, which has to stay well below the
+    stalled time of the StalledJobAgent.
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import threading
+
+from DIRAC import gLogger, S_OK, Time
+
+class HeartBeatStore( object ):
+  """ Keep the heart beats of the jobs and write them in bulk
+
+      With a flush period of 0 the heart beats are written at once with JobDB.setHeartBeatData
+  """
+
+  def __init__( self, jobDB, flushPeriod = 0, loggingPeriod = 0, maxJobsPerFlush = 1000 ):
+    self.__jobDB = jobDB
+    self.__flushPeriod = flushPeriod
+    self.__loggingPeriod = loggingPeriod
+    self.__maxJobsPerFlush = maxJobsPerFlush
+    self.log = gLogger.getSubLogger( 'HeartBeatStore' )
+    self.__lock = threading.Lock()
+    self.__flushLock = threading.Lock()
+    # jobID -> time stamp of the last heart beat
+    self.__heartBeatTimes = {}
+    # jobID -> { name : value }
+    self.__staticData = {}
+    # [ ( jobID, name, value, time stamp ) ]
+    self.__dynamicRows = []
+    # jobID -> epoch of the last logged dynamic data
+    self.__lastLogged = {}
+    self.__stopEvent = threading.Event()
+    self.__flushThread = None
+
+  def isQueueing( self ):
+    """ True if the heart beats are kept in memory
+    """
+    return self.__flushPeriod > 0
+
+  def addHeartBeat( self, jobID, staticDataDict, dynamicDataDict ):
+    """ Account a heart beat of a job
+    """
+    now = time.time()
+    self.__lock.acquire()
+    try:
+      if dynamicDataDict and now - self.__lastLogged.get( jobID, 0 ) < self.__loggingPeriod:
+        dynamicDataDict = {}
+      elif dynamicDataDict:
+        self.__lastLogged[jobID] = now
+    finally:
+      self.__lock.release()
+
+    if not self.isQueueing():
+      return self.__jobDB.setHeartBeatData( jobID, staticDataDict, dynamicDataDict )
+
+    heartBeatTime = Time.toString( Time.dateTime() )
+    self.__lock.acquire()
+    try:
+      self.__heartBeatTimes[jobID] = heartBeatTime
+      if staticDataDict:
+        self.__staticData.setdefault( jobID, {} ).update( staticDataDict )
+      for name, value in dynamicDataDict.items():
+        self.__dynamicRows.append( ( jobID, name, value, heartBeatTime ) )
+      if not self.__flushThread:
+        self.__flushThread = threading.Thread( target = self.__flushLoop )
+        self.__flushThread.setDaemon( True )
+        self.__flushThread.start()
+    finally:
+      self.__lock.release()
+    return S_OK()
+
+  def getNumQueuedJobs( self ):
+    """ Number of jobs with heart beats not yet written
+    """
+    return len( self.__heartBeatTimes )
+
+  def stop( self, timeout = 10 ):
+    """ Stop the flushing thread and write the heart beats still kept in memory
+    """
+    self.__stopEvent.set()
+    flushThread = self.__flushThread
+    if flushThread:
+      flushThread.join( timeout )
+    result = self.flush()
+    if self.__heartBeatTimes:
+      self.log.error( "Heart beats lost at stop", "for %d jobs" % len( self.__heartBeatTimes ) )
+    return result
+
+  def __flushLoop( self ):
+    """ Body of the flushing thread
+    """
+    while not self.__stopEvent.isSet():
+      self.__stopEvent.wait( self.__flushPeriod )
+      if self.__stopEvent.isSet():
+        break
+      try:
+        result = self.flush()
+        if not result['OK']:
+          self.log.warn( "Failed to write the heart beats, will retry", result['Message'] )
+        self.__forgetOldJobs()
+      except Exception, excp:
+        self.log.exception( "Exception while writing the heart beats", lException = excp )
+
+  def __forgetOldJobs( self ):
+    """ Forget the logging time of the jobs that did not send a heart beat for long
+    """
+    limit = time.time() - max( 3 * self.__loggingPeriod, 3600 )
+    self.__lock.acquire()
+    try:
+      for jobID in [ jobID for jobID, lastLogged in self.__lastLogged.items() if lastLogged < limit ]:
+        del self.__lastLogged[jobID]
+    finally:
+      self.__lock.release()
+
+  def flush( self ):
+    """ Write the heart beats kept in memory. A batch that can not be written is put back
+        and the next batches are still written
+
+    :return: S_OK( number of jobs written ) or the error of the last failed batch
+    """
+    written = 0
+    failed = None
+    self.__flushLock.acquire()
+    try:
+      # Only the jobs pending now, the ones put back are retried in the next flush
+      self.__lock.acquire()
+      try:
+        pendingJobIDs = sorted( self.__heartBeatTimes )
+      finally:
+        self.__lock.release()
+
+      for iPos in range( 0, len( pendingJobIDs ), self.__maxJobsPerFlush ):
+        jobIDs = set( pendingJobIDs[iPos:iPos + self.__maxJobsPerFlush] )
+        self.__lock.acquire()
+        try:
+          heartBeatTimes = dict( [ ( jobID, self.__heartBeatTimes.pop( jobID ) ) for jobID in jobIDs ] )
+          staticData = dict( [ ( jobID, self.__staticData.pop( jobID ) ) for jobID in jobIDs
+                               if jobID in self.__staticData ] )
+          dynamicRows = [ row for row in self.__dynamicRows if row[0] in jobIDs ]
+          self.__dynamicRows = [ row for row in self.__dynamicRows if row[0] not in jobIDs ]
+        finally:
+          self.__lock.release()
+
+        result = self.__jobDB.setHeartBeatDataBulk( heartBeatTimes, staticData, dynamicRows )
+        if not result['OK']:
+          self.__requeue( heartBeatTimes, staticData, dynamicRows )
+          failed = result
+          continue
+        written += len( heartBeatTimes )
+    finally:
+      self.__flushLock.release()
+    if failed:
+      return failed
+    return S_OK( written )
+
+  def __requeue( self, heartBeatTimes, staticData, dynamicRows ):
+    """ Put back the heart beats that could not be written, the newer ones win
+    """
+    self.__lock.acquire()
+    try:
+      for jobID, heartBeatTime in heartBeatTimes.items():
+        self.__heartBeatTimes.setdefault( jobID, heartBeatTime )
+      for jobID, paramDict in staticData.items():
+        paramDict.update( self.__staticData.get( jobID, {} ) )
+        self.__staticData[jobID] = paramDict
+      self.__dynamicRows = dynamicRows + self.__dynamicRows
+      # Do not accumulate the heart beat log forever if the DB is down
+      maxRows = 100 * self.__maxJobsPerFlush
+      if len( self.__dynamicRows ) > maxRows:
+        self.log.warn( "Dropping %d heart beat log records" % ( len( self.__dynamicRows ) - maxRows ) )
+        self.__dynamicRows = self.__dynamicRows[-maxRows:]
+    finally:
+      self.__lock.release()
@@ -0,0 +1,361 @@
+""" Coalescing queue of the job status updates received by the JobStateUpdate service
+
+    The status dictionaries sent with setJobStatusBulk are accumulated per job for a
+    short window and then written for all the jobs at once:
+      - one SELECT for the current status and one for the last logging time of all the jobs
+      - one UPDATE on Jobs per distinct set of new attribute values
+      - one UPDATE per StartExecTime / EndExecTime for all the jobs
+      - multi-row INSERTs of all the logging records
+
+    As in the single job processing, only the status records more recent than the last
+    logging record of a job can change the job attributes, and all of them are logged.
+
+    A batch that can not be written is split to find the jobs making it fail. A job failing
+    on its own is retried in the next flushes and dropped after maxJobFailures attempts.
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import threading
+
+from DIRAC import gLogger, S_OK, S_ERROR, Time
+
+JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
+# Max number of logging records written at once, with a single INSERT
+MAX_LOGGING_RECORDS = 1000
+
+def getJobStatusChanges( currentStatus, lastTime, statusDict ):
+  """ Get the changes to apply to a job from the status records more recent than lastTime
+
+  :param str currentStatus: current Status of the job
+  :param str lastTime: time stamp of the last logging record of the job
+  :param dict statusDict: { date : { 'Status', 'MinorStatus', 'ApplicationStatus', ... } }
+  :return: ( attrNames, attrValues, startDate, endDate )
+  """
+  status = ""
+  minor = ""
+  application = ""
+  appCounter = ""
+  endDate = ''
+  startDate = ''
+  startFlag = ''
+
+  if currentStatus == "Stalled":
+    status = 'Running'
+
+  # We should only update the status if its time stamp is more recent than the last update
+  for date in [ date for date in sorted( statusDict ) if date >= lastTime ]:
+    sDict = statusDict[date]
+    if sDict['Status']:
+      status = sDict['Status']
+      if status in JOB_FINAL_STATES:
+        endDate = date
+      if status == "Running":
+        startFlag = 'Running'
+    if sDict['MinorStatus']:
+      minor = sDict['MinorStatus']
+      if minor == "Application" and startFlag == 'Running':
+        startDate = date
+    if sDict['ApplicationStatus']:
+      application = sDict['ApplicationStatus']
+    counter = sDict.get( 'ApplicationCounter' )
+    if counter:
+      appCounter = counter
+
+  attrNames = []
+  attrValues = []
+  if status:
+    attrNames.append( 'Status' )
+    attrValues.append( status )
+  if minor:
+    attrNames.append( 'MinorStatus' )
+    attrValues.append( minor )
+  if application:
+    attrNames.append( 'ApplicationStatus' )
+    attrValues.append( application )
+  if appCounter:
+    attrNames.append( 'ApplicationCounter' )
+    attrValues.append( appCounter )
+  return attrNames, attrValues, startDate, endDate
+
+def getLoggingRecords( jobID, statusDict ):
+  """ Get the ( jobID, status, minor, application, date, source ) logging records of
+      all the status records of a job
+  """
+  records = []
+  for date in sorted( statusDict ):
+    sDict = statusDict[date]
+    status = sDict['Status']
+    if not status:
+      status = 'idem'
+    minor = sDict['MinorStatus']
+    if not minor:
+      minor = 'idem'
+    application = sDict['ApplicationStatus']
+    if not application:
+      application = 'idem'
+    else:
+      status = "Running"
+      minor = "Application"
+    records.append( ( jobID, status, minor, application, date, sDict['Source'] ) )
+  return records
+
+class JobStatusQueue( object ):
+  """ Accumulate the status records of the jobs and write them in bulk
+
+      With a flush window of 0 nothing is queued and processJobs has to be called directly
+  """
+
+  def __init__( self, jobDB, logDB, flushWindow = 1., maxJobsPerFlush = 1000, maxQueuedJobs = 50000,
+                maxJobFailures = 5 ):
+    self.__jobDB = jobDB
+    self.__logDB = logDB
+    self.__flushWindow = flushWindow
+    self.__maxJobsPerFlush = maxJobsPerFlush
+    self.__maxQueuedJobs = maxQueuedJobs
+    self.__maxJobFailures = maxJobFailures
+    self.log = gLogger.getSubLogger( 'JobStatusQueue' )
+    self.__lock = threading.Lock()
+    # Only one flush at a time, to keep the order of the updates of a job
+    self.__flushLock = threading.Lock()
+    # jobID -> { date : sDict }
+    self.__pending = {}
+    self.__oldestQueueTime = 0
+    # jobID -> number of flushes that failed to write the job on its own
+    self.__jobFailures = {}
+    self.__flushEvent = threading.Event()
+    self.__stopEvent = threading.Event()
+    self.__flushThread = None
+
+  def isQueueing( self ):
+    """ True if the updates are queued
+    """
+    return self.__flushWindow > 0
+
+  def getNumQueuedJobs( self ):
+    """ Number of jobs with pending status records
+    """
+    return len( self.__pending )
+
+  def addJobStatus( self, jobID, statusDict ):
+    """ Queue the status records of a job. They are merged with the ones already queued
+    """
+    self.__lock.acquire()
+    try:
+      if jobID not in self.__pending and len( self.__pending ) >= self.__maxQueuedJobs:
+        return S_ERROR( 'Too many queued job status updates, try later' )
+      if not self.__pending:
+        self.__oldestQueueTime = time.time()
+      self.__pending.setdefault( jobID, {} ).update( statusDict )
+      numQueued = len( self.__pending )
+      if not self.__flushThread:
+        self.__flushThread = threading.Thread( target = self.__flushLoop )
+        self.__flushThread.setDaemon( True )
+        self.__flushThread.start()
+    finally:
+      self.__lock.release()
+    if numQueued >= self.__maxJobsPerFlush:
+      self.__flushEvent.set()
+    return S_OK()
+
+  def stop( self, timeout = 10 ):
+    """ Stop the flushing thread and write the updates still queued, they were
+        already acknowledged to the clients
+    """
+    self.__stopEvent.set()
+    self.__flushEvent.set()
+    flushThread = self.__flushThread
+    if flushThread:
+      flushThread.join( timeout )
+    result = self.flush( force = True )
+    if self.__pending:
+      self.log.error( "Job status updates lost at stop", "for %d jobs" % len( self.__pending ) )
+    return result
+
+  def __flushLoop( self ):
+    """ Body of the flushing thread
+    """
+    while not self.__stopEvent.isSet():
+      timeout = self.__flushWindow
+      if self.__pending:
+        timeout = max( 0.01, self.__oldestQueueTime + self.__flushWindow - time.time() )
+      self.__flushEvent.wait( timeout )
+      self.__flushEvent.clear()
+      if self.__stopEvent.isSet():
+        break
+      try:
+        self.flush( force = False )
+      except Exception, excp:
+        self.log.exception( "Exception while flushing job status updates", lException = excp )
+
+  def flush( self, force = True ):
+    """ Write the queued status records. Unless forced, only full batches are written
+        before the window of the oldest queued job is over
+
+    :return: S_OK( number of jobs processed )
+    """
+    processed = 0
+    self.__flushLock.acquire()
+    try:
+      while True:
+        self.__lock.acquire()
+        try:
+          if not self.__pending:
+            break
+          if not force and len( self.__pending ) < self.__maxJobsPerFlush and \
+             time.time() - self.__oldestQueueTime < self.__flushWindow:
+            break
+          jobIDs = sorted( self.__pending )[:self.__maxJobsPerFlush]
+          batch = dict( [ ( jobID, self.__pending.pop( jobID ) ) for jobID in jobIDs ] )
+          if self.__pending:
+            self.__oldestQueueTime = time.time()
+        finally:
+          self.__lock.release()
+
+        numProcessed, error = self.__writeBatch( batch )
+        processed += numProcessed
+        if error:
+          self.log.warn( "Failed to write job status updates, will retry", error['Message'] )
+          break
+    finally:
+      self.__flushLock.release()
+    return S_OK( processed )
+
+  def __writeBatch( self, batch ):
+    """ Process a batch and put back the jobs that could not be written. A failed batch is
+        split in halves until the jobs making it fail are found, unless both halves fail,
+        as when the DB is down
+
+    :return: ( number of jobs processed, S_ERROR of the failure or None )
+    """
+    processed, error = self.__tryBatch( batch )
+    if not error:
+      return processed, None
+    # From here the batch only has the jobs not written
+    while len( batch ) > 1:
+      jobIDs = sorted( batch )
+      halves = [ dict( [ ( jobID, batch[jobID] ) for jobID in jobIDs[:len( jobIDs ) / 2] ] ),
+                 dict( [ ( jobID, batch[jobID] ) for jobID in jobIDs[len( jobIDs ) / 2:] ] ) ]
+      errors = []
+      for half in halves:
+        numProcessed, halfError = self.__tryBatch( half )
+        processed += numProcessed
+        errors.append( halfError )
+      if errors[0] and errors[1]:
+        for half in halves:
+          self.__requeue( half )
+        return processed, errors[0]
+      if errors[0]:
+        batch, error = halves[0], errors[0]
+      else:
+        batch, error = halves[1], errors[1]
+    if batch:
+      self.__requeue( batch, failedAlone = True )
+    return processed, error
+
+  def __tryBatch( self, batch ):
+    """ Process a batch. On failure the jobs fully written are removed from it
+
+    :return: ( number of jobs processed, S_ERROR of the failure or None )
+    """
+    result = self.processJobs( batch )
+    if not result['OK']:
+      processedJobs = result.get( 'ProcessedJobs', [] )
+      for jobID in processedJobs:
+        del batch[jobID]
+        self.__jobFailures.pop( jobID, None )
+      return len( processedJobs ), result
+    for jobID, error in result['Value'].items():
+      self.log.warn( "Failed to update status of job %s" % jobID, error )
+    for jobID in batch:
+      self.__jobFailures.pop( jobID, None )
+    return len( batch ), None
+
+  def __requeue( self, batch, failedAlone = False ):
+    """ Put back a batch in front of the updates received since. A job failing on its
+        own is dropped after maxJobFailures attempts
+    """
+    self.__lock.acquire()
+    try:
+      for jobID, statusDict in batch.items():
+        if failedAlone:
+          self.__jobFailures[jobID] = self.__jobFailures.get( jobID, 0 ) + 1
+          if self.__jobFailures[jobID] >= self.__maxJobFailures:
+            self.log.error( "Dropping the status updates of job %s" % jobID,
+                            "after %d failed attempts" % self.__jobFailures.pop( jobID ) )
+            continue
+        statusDict.update( self.__pending.get( jobID, {} ) )
+        self.__pending[jobID] = statusDict
+      self.__oldestQueueTime = time.time()
+    finally:
+      self.__lock.release()
+
+  def processJobs( self, jobStatusDicts ):
+    """ Apply the status records of several jobs
+
+    :param dict jobStatusDicts: { jobID : statusDict }
+    :return: S_OK( { jobID : error message } ) with the jobs that could not be updated,
+             S_ERROR if the updates failed in the DB, with the jobs completely written in
+             its 'ProcessedJobs' list
+    """
+    failed = {}
+    jobIDs = jobStatusDicts.keys()
+    result = self.__jobDB.getAttributesForJobList( jobIDs, ['Status'] )
+    if not result['OK']:
+      return result
+    jobStatus = result['Value']
+    # Get the latest WN time stamps of status updates
+    result = self.__logDB.getLastStatusTimes( jobIDs )
+    if not result['OK']:
+      return result
+    lastTimes = result['Value']
+
+    attrGroups = {}
+    startDates = {}
+    endDates = {}
+    records = []
+    for jobID in sorted( jobIDs ):
+      if jobID not in jobStatus:
+        failed[jobID] = 'No Matching Job'
+        continue
+      if jobID not in lastTimes:
+        failed[jobID] = 'No Logging Info for job %d' % jobID
+        continue
+      lastTime = Time.toString( Time.fromEpoch( lastTimes[jobID] ) )
+      statusDict = jobStatusDicts[jobID]
+      attrNames, attrValues, startDate, endDate = getJobStatusChanges( jobStatus[jobID]['Status'],
+                                                                      lastTime, statusDict )
+      attrGroups.setdefault( ( tuple( attrNames ), tuple( attrValues ) ), [] ).append( jobID )
+      if startDate:
+        startDates[jobID] = startDate
+      if endDate:
+        endDates[jobID] = endDate
+      records.append( ( jobID, getLoggingRecords( jobID, statusDict ) ) )
+
+    for ( attrNames, attrValues ), groupJobIDs in attrGroups.items():
+      result = self.__jobDB.setJobAttributes( groupJobIDs, list( attrNames ), list( attrValues ), update = True )
+      if not result['OK']:
+        return result
+    result = self.__jobDB.setJobsExecTime( 'EndExecTime', endDates )
+    if not result['OK']:
+      return result
+    result = self.__jobDB.setJobsExecTime( 'StartExecTime', startDates )
+    if not result['OK']:
+      return result
+    # Update the JobLoggingDB records, with all the records of a job in the same INSERT so that
+    # the jobs already logged are known if one fails
+    loggedJobs = []
+    while records:
+      chunkJobs = []
+      chunkRecords = []
+      while records and ( not chunkRecords or len( chunkRecords ) + len( records[0][1] ) <= MAX_LOGGING_RECORDS ):
+        jobID, jobRecords = records.pop( 0 )
+        chunkJobs.append( jobID )
+        chunkRecords.extend( jobRecords )
+      result = self.__logDB.addLoggingRecords( chunkRecords )
+      if not result['OK']:
+        result['ProcessedJobs'] = loggedJobs
+        return result
+      loggedJobs.extend( chunkJobs )
+    return S_OK( failed )
@@ -0,0 +1,298 @@
+""" In-memory index of the task queues used by TaskQueueDB to select matching TQs
+    without going through the multi-join match SQL.
+
+    The index mirrors the content of the tq_TaskQueues, tq_TQTo* and tq_Jobs tables:
+      - the single value definition of each TQ ( OwnerDN, OwnerGroup, Setup, CPUTime ) and its priority
+      - the multi value definitions ( Sites, BannedSites, Platforms, Tags, ... ) as sets
+      - the number of jobs per TQ and job priority
+
+    Values are stored unescaped, exactly as they are stored in the DB.
+"""
+
+__RCSID__ = "$Id$"
+
+import types
+import random
+import threading
+
+# Same field definitions as in TaskQueueDB
+singleValueDefFields = ( 'OwnerDN', 'OwnerGroup', 'Setup', 'CPUTime' )
+multiValueDefFields = ( 'Sites', 'GridCEs', 'GridMiddlewares', 'BannedSites',
+                        'Platforms', 'PilotTypes', 'SubmitPools', 'JobTypes', 'Tags' )
+multiValueMatchFields = ( 'GridCE', 'Site', 'GridMiddleware', 'Platform',
+                          'PilotType', 'SubmitPool', 'JobType', 'Tag' )
+tagMatchFields = ( 'Tag', )
+bannedJobMatchFields = ( 'Site', )
+strictRequireMatchFields = ( 'SubmitPool', 'Platform', 'PilotType', 'Tag' )
+
+def _toList( value ):
+  """ Return the value as a list of stripped strings
+  """
+  if type( value ) not in ( types.ListType, types.TupleType ):
+    value = [ value ]
+  return [ str( v ).strip() for v in value ]
+
+class TaskQueueMatchIndex( object ):
+  """ Thread safe in-memory representation of the task queues
+  """
+
+  def __init__( self ):
+    self.__lock = threading.Lock()
+    self.__tqDefs = {}
+    # tqId -> { jobPriority : [ numJobs, realPriority ] }
+    self.__tqJobs = {}
+
+  def __len__( self ):
+    return len( self.__tqDefs )
+
+  def getTaskQueueIds( self ):
+    """ Get the ids of all the TQs in the index
+    """
+    return self.__tqDefs.keys()
+
+  def getNumJobs( self, tqId ):
+    """ Get the number of jobs known for a TQ
+    """
+    return sum( [ prioData[0] for prioData in self.__tqJobs.get( tqId, {} ).values() ] )
+
+  def setTaskQueue( self, tqId, tqDefDict, priority ):
+    """ Add or replace a TQ definition
+    """
+    tqDef = { 'Priority' : float( priority ) }
+    for field in singleValueDefFields:
+      tqDef[ field ] = tqDefDict[ field ]
+    for field in multiValueDefFields:
+      tqDef[ field ] = frozenset( [ value.strip() for value in tqDefDict.get( field, [] ) if value.strip() ] )
+    self.__lock.acquire()
+    try:
+      self.__tqDefs[ tqId ] = tqDef
+      self.__tqJobs.setdefault( tqId, {} )
+    finally:
+      self.__lock.release()
+
+  def removeTaskQueue( self, tqId ):
+    """ Remove a TQ and its jobs from the index
+    """
+    self.__lock.acquire()
+    try:
+      self.__tqDefs.pop( tqId, None )
+      self.__tqJobs.pop( tqId, None )
+    finally:
+      self.__lock.release()
+
+  def setTaskQueuePriority( self, tqId, priority ):
+    """ Update the priority of a TQ
+    """
+    self.__lock.acquire()
+    try:
+      if tqId in self.__tqDefs:
+        self.__tqDefs[ tqId ][ 'Priority' ] = float( priority )
+    finally:
+      self.__lock.release()
+
+  def setJobs( self, tqId, jobPriority, realPriority, numJobs ):
+    """ Set the number of jobs with a given priority in a TQ
+    """
+    self.__lock.acquire()
+    try:
+      prioDict = self.__tqJobs.setdefault( tqId, {} )
+      if numJobs > 0:
+        prioDict[ jobPriority ] = [ numJobs, realPriority ]
+      else:
+        prioDict.pop( jobPriority, None )
+    finally:
+      self.__lock.release()
+
+  def addJob( self, tqId, jobPriority, realPriority ):
+    """ Account for a new job in a TQ
+    """
+    self.__lock.acquire()
+    try:
+      prioDict = self.__tqJobs.setdefault( tqId, {} )
+      if jobPriority in prioDict:
+        prioDict[ jobPriority ][0] += 1
+      else:
+        prioDict[ jobPriority ] = [ 1, realPriority ]
+    finally:
+      self.__lock.release()
+
+  def removeJob( self, tqId, jobPriority ):
+    """ Account for a job that has left a TQ
+    """
+    self.__lock.acquire()
+    try:
+      prioDict = self.__tqJobs.get( tqId, {} )
+      if jobPriority in prioDict:
+        prioDict[ jobPriority ][0] -= 1
+        if prioDict[ jobPriority ][0] < 1:
+          prioDict.pop( jobPriority )
+    finally:
+      self.__lock.release()
+
+  def pickJobPriority( self, tqId ):
+    """ Select the priority of the job to extract from a TQ. This is the in-memory
+        equivalent of ORDER BY RAND() / RealPriority LIMIT 1 over the jobs of the TQ:
+        the minimum of n uniform values is sampled once per priority group
+        Returns the job priority or None if the TQ has no jobs
+    """
+    self.__lock.acquire()
+    try:
+      prioItems = self.__tqJobs.get( tqId, {} ).items()
+    finally:
+      self.__lock.release()
+    winner = None
+    winnerKey = None
+    for jobPriority, ( numJobs, realPriority ) in prioItems:
+      if numJobs < 1:
+        continue
+      key = 1 - random.random() ** ( 1.0 / numJobs )
+      if realPriority > 0:
+        key /= realPriority
+      if winnerKey is None or key < winnerKey:
+        winner = jobPriority
+        winnerKey = key
+    return winner
+
+  def matchTaskQueues( self, tqMatchDict, numQueuesToGet = 1, negativeCond = {}, jobSharingGroups = () ):
+    """ Get the TQs that match the requirements, ordered by RAND() / Priority as the match SQL does
+
+        :param tqMatchDict: unescaped match definition
+        :param numQueuesToGet: max number of TQs to return, 0 means all
+        :param negativeCond: negative conditions as accepted by TaskQueueDB
+        :param jobSharingGroups: groups having the JobSharing property
+        :return: list of ( tqId, ownerDN, ownerGroup )
+    """
+    checks = self.__generateMatchChecks( tqMatchDict, negativeCond, jobSharingGroups )
+    self.__lock.acquire()
+    try:
+      tqItems = self.__tqDefs.items()
+    finally:
+      self.__lock.release()
+    matched = []
+    for tqId, tqDef in tqItems:
+      for check in checks:
+        if not check( tqDef ):
+          break
+      else:
+        priority = tqDef[ 'Priority' ]
+        if priority > 0:
+          matched.append( ( random.random() / priority, tqId, tqDef ) )
+        else:
+          matched.append( ( 0, tqId, tqDef ) )
+    matched.sort()
+    if numQueuesToGet:
+      matched = matched[ :numQueuesToGet ]
+    return [ ( tqId, tqDef[ 'OwnerDN' ], tqDef[ 'OwnerGroup' ] ) for _, tqId, tqDef in matched ]
+
+  def __generateMatchChecks( self, tqMatchDict, negativeCond, jobSharingGroups ):
+    """ Translate the match dict into a list of functions that receive a TQ definition.
+        A TQ matches if all of them return True. Mirrors TaskQueueDB.__generateTQMatchSQL
+    """
+    checks = []
+    if 'OwnerDN' in tqMatchDict and 'OwnerGroup' in tqMatchDict:
+      sharingGroups = set()
+      ownerPairs = set()
+      for group in _toList( tqMatchDict[ 'OwnerGroup' ] ):
+        if group in jobSharingGroups:
+          sharingGroups.add( group )
+        else:
+          for dn in _toList( tqMatchDict[ 'OwnerDN' ] ):
+            ownerPairs.add( ( dn, group ) )
+      checks.append( lambda tqDef: tqDef[ 'OwnerGroup' ] in sharingGroups or \
+                                   ( tqDef[ 'OwnerDN' ], tqDef[ 'OwnerGroup' ] ) in ownerPairs )
+    else:
+      for field in ( 'OwnerGroup', 'OwnerDN' ):
+        if field in tqMatchDict:
+          checks.append( self.__inCheck( field, _toList( tqMatchDict[ field ] ) ) )
+    if 'CPUTime' in tqMatchDict:
+      cpuTime = tqMatchDict[ 'CPUTime' ]
+      if type( cpuTime ) in ( types.ListType, types.TupleType ):
+        cpuTime = max( cpuTime )
+      checks.append( lambda tqDef: tqDef[ 'CPUTime' ] <= cpuTime )
+    if 'Setup' in tqMatchDict:
+      checks.append( self.__inCheck( 'Setup', _toList( tqMatchDict[ 'Setup' ] ) ) )
+
+    for field in multiValueMatchFields:
+      tqField = "%ss" % field
+      if field in tqMatchDict and tqMatchDict[ field ]:
+        values = frozenset( _toList( tqMatchDict[ field ] ) )
+        if field in tagMatchFields:
+          if 'Any' not in values:
+            # All the tags required by the TQ have to be provided by the resource
+            checks.append( self.__subsetCheck( tqField, values ) )
+        else:
+          checks.append( self.__intersectCheck( tqField, values ) )
+        if field in bannedJobMatchFields:
+          checks.append( self.__notAllInCheck( 'Banned%s' % tqField, values ) )
+      bannedField = "Banned%s" % field
+      if bannedField in tqMatchDict and tqMatchDict[ bannedField ]:
+        checks.append( self.__notAllInCheck( tqField, frozenset( _toList( tqMatchDict[ bannedField ] ) ) ) )
+
+    for field in strictRequireMatchFields:
+      if field not in tqMatchDict:
+        checks.append( self.__emptyCheck( "%ss" % field ) )
+
+    if negativeCond:
+      checks.append( self.__negativeCheck( negativeCond ) )
+    return checks
+
+  @staticmethod
+  def __inCheck( field, values ):
+    values = frozenset( values )
+    return lambda tqDef: str( tqDef[ field ] ) in values
+
+  @staticmethod
+  def __emptyCheck( field ):
+    return lambda tqDef: not tqDef[ field ]
+
+  @staticmethod
+  def __intersectCheck( field, values ):
+    """ TQ does not define the field or at least one value is in the TQ definition
+    """
+    return lambda tqDef: not tqDef[ field ] or not values.isdisjoint( tqDef[ field ] )
+
+  @staticmethod
+  def __subsetCheck( field, values ):
+    """ TQ does not define the field or all the TQ values are provided
+    """
+    return lambda tqDef: tqDef[ field ] <= values
+
+  @staticmethod
+  def __notAllInCheck( field, values ):
+    """ At least one of the values is not in the TQ definition
+    """
+    return lambda tqDef: not values <= tqDef[ field ]
+
+  def __negativeCheck( self, negativeCond ):
+    """ Negative conditions: list of dicts are OR'ed, see TaskQueueDB.__generateNotSQL
+    """
+    if type( negativeCond ) in ( types.ListType, types.TupleType ):
+      condChecks = [ self.__negativeDictCheck( condDict ) for condDict in negativeCond ]
+      return lambda tqDef: any( [ check( tqDef ) for check in condChecks ] )
+    elif type( negativeCond ) == types.DictType:
+      return self.__negativeDictCheck( negativeCond )
+    raise RuntimeError( "negativeCond has to be either a list or a dict and it's %s" % type( negativeCond ) )
+
+  @staticmethod
+  def __negativeDictCheck( negativeCond ):
+    """ not ( cond1 and cond2 ) = ( not cond1 or not cond2 )
+    """
+    fieldChecks = []
+    for field in negativeCond:
+      if field in multiValueMatchFields:
+        fieldChecks.append( ( "%ss" % field, frozenset( _toList( negativeCond[ field ] ) ), True ) )
+      elif field in singleValueDefFields:
+        fieldChecks.append( ( field, frozenset( _toList( negativeCond[ field ] ) ), False ) )
+
+    def check( tqDef ):
+      if not fieldChecks:
+        return True
+      for field, values, isMulti in fieldChecks:
+        if isMulti:
+          if values.isdisjoint( tqDef[ field ] ):
+            return True
+        elif str( tqDef[ field ] ) not in values or len( values ) > 1:
+          return True
+      return False
+
+    return check
@@ -0,0 +1,113 @@
+""" Unit tests of the HeartBeatStore coalescing and down-sampling of the heart beats
+"""
+
+import unittest
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.WorkloadManagementSystem.private.HeartBeatStore import HeartBeatStore
+
+class FakeJobDB( object ):
+  """ Record the heart beat writes
+  """
+
+  def __init__( self ):
+    self.direct = []
+    self.bulk = []
+    self.fail = False
+    self.failingJobs = set()
+
+  def setHeartBeatData( self, jobID, staticDataDict, dynamicDataDict ):
+    self.direct.append( ( jobID, staticDataDict, dynamicDataDict ) )
+    return S_OK()
+
+  def setHeartBeatDataBulk( self, heartBeatTimes, staticDataDict, dynamicDataRows ):
+    if self.fail or self.failingJobs & set( heartBeatTimes ):
+      return S_ERROR( 'Failed to set the heart beat times' )
+    self.bulk.append( ( heartBeatTimes, staticDataDict, dynamicDataRows ) )
+    return S_OK()
+
+class HeartBeatStoreTestCase( unittest.TestCase ):
+  """ Test the direct and the bulk writing of the heart beats
+  """
+
+  def setUp( self ):
+    self.jobDB = FakeJobDB()
+    self.stores = []
+
+  def tearDown( self ):
+    # Do not leave the flushing threads running
+    for store in self.stores:
+      store.stop()
+
+  def getStore( self, **kwargs ):
+    store = HeartBeatStore( self.jobDB, **kwargs )
+    self.stores.append( store )
+    return store
+
+  def test_direct( self ):
+    """ Without flush period the heart beats are written at once, the log is down-sampled
+    """
+    store = self.getStore( loggingPeriod = 3600 )
+    self.assertFalse( store.isQueueing() )
+    store.addHeartBeat( 1, { 'Memory' : '2GB' }, { 'CPUConsumed' : 10 } )
+    store.addHeartBeat( 1, {}, { 'CPUConsumed' : 20 } )
+    store.addHeartBeat( 2, {}, { 'CPUConsumed' : 30 } )
+    self.assertEqual( self.jobDB.direct, [ ( 1, { 'Memory' : '2GB' }, { 'CPUConsumed' : 10 } ),
+                                           ( 1, {}, {} ),
+                                           ( 2, {}, { 'CPUConsumed' : 30 } ) ] )
+
+  def test_bulk( self ):
+    """ The heart beats are merged per job and written by flush
+    """
+    store = self.getStore( flushPeriod = 3600 )
+    self.assertTrue( store.isQueueing() )
+    store.addHeartBeat( 1, { 'Memory' : '2GB' }, { 'CPUConsumed' : 10 } )
+    store.addHeartBeat( 1, { 'Memory' : '4GB' }, { 'CPUConsumed' : 20 } )
+    store.addHeartBeat( 2, {}, { 'CPUConsumed' : 30, 'WallClockTime' : 40 } )
+    self.assertEqual( store.getNumQueuedJobs(), 2 )
+    self.assertEqual( self.jobDB.direct, [] )
+    # A failed flush is retried
+    self.jobDB.fail = True
+    self.assertFalse( store.flush()['OK'] )
+    self.assertEqual( store.getNumQueuedJobs(), 2 )
+    self.jobDB.fail = False
+    self.assertEqual( store.flush()['Value'], 2 )
+    self.assertEqual( store.getNumQueuedJobs(), 0 )
+    self.assertEqual( len( self.jobDB.bulk ), 1 )
+    heartBeatTimes, staticData, dynamicRows = self.jobDB.bulk[0]
+    self.assertEqual( sorted( heartBeatTimes ), [ 1, 2 ] )
+    self.assertEqual( staticData, { 1 : { 'Memory' : '4GB' } } )
+    self.assertEqual( sorted( [ row[:3] for row in dynamicRows ] ),
+                      [ ( 1, 'CPUConsumed', 10 ), ( 1, 'CPUConsumed', 20 ),
+                        ( 2, 'CPUConsumed', 30 ), ( 2, 'WallClockTime', 40 ) ] )
+    self.assertEqual( store.flush()['Value'], 0 )
+
+  def test_failedBatch( self ):
+    """ The batches after a failed one are written, the failed one is kept for the next flush
+    """
+    store = self.getStore( flushPeriod = 3600, maxJobsPerFlush = 2 )
+    for jobID in range( 1, 6 ):
+      store.addHeartBeat( jobID, {}, { 'CPUConsumed' : jobID } )
+    self.jobDB.failingJobs = set( [ 1 ] )
+    self.assertFalse( store.flush()['OK'] )
+    self.assertEqual( sorted( [ jobID for batch in self.jobDB.bulk for jobID in batch[0] ] ), [ 3, 4, 5 ] )
+    self.assertEqual( store.getNumQueuedJobs(), 2 )
+    self.jobDB.failingJobs = set()
+    self.assertEqual( store.flush()['Value'], 2 )
+    self.assertEqual( store.getNumQueuedJobs(), 0 )
+
+  def test_stop( self ):
+    """ The heart beats kept in memory are written at stop and the flushing thread ends
+    """
+    store = self.getStore( flushPeriod = 3600 )
+    for jobID in range( 1, 4 ):
+      store.addHeartBeat( jobID, {}, { 'CPUConsumed' : jobID } )
+    self.assertEqual( self.jobDB.bulk, [] )
+    self.assertEqual( store.stop()['Value'], 3 )
+    self.assertEqual( store.getNumQueuedJobs(), 0 )
+    self.assertEqual( sorted( self.jobDB.bulk[0][0] ), [ 1, 2, 3 ] )
+    self.assertFalse( store._HeartBeatStore__flushThread.isAlive() )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( HeartBeatStoreTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
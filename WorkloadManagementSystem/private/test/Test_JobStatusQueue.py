@@ -0,0 +1,202 @@
+""" Unit tests of the JobStatusQueue coalescing of the job status updates
+"""
+
+import time
+import unittest
+
+from DIRAC import S_OK, S_ERROR, Time
+from DIRAC.WorkloadManagementSystem.private.JobStatusQueue import JobStatusQueue
+
+class FakeJobDB( object ):
+  """ Jobs table in memory
+  """
+
+  def __init__( self ):
+    self.jobs = {}
+    self.updates = 0
+    self.fail = False
+    self.failingJobs = set()
+
+  def getAttributesForJobList( self, jobIDList, attrList = None ):
+    return S_OK( dict( [ ( jobID, dict( self.jobs[jobID] ) ) for jobID in jobIDList if jobID in self.jobs ] ) )
+
+  def setJobAttributes( self, jobID, attrNames, attrValues, update = False, myDate = None ):
+    if self.fail or self.failingJobs.intersection( jobID ):
+      return S_ERROR( 'JobDB.setAttributes: failed to set attribute' )
+    self.updates += 1
+    for jID in jobID:
+      self.jobs[jID].update( dict( zip( attrNames, attrValues ) ) )
+    return S_OK()
+
+  def setJobsExecTime( self, timeName, dateDict ):
+    if dateDict:
+      self.updates += 1
+    for jobID, date in dateDict.items():
+      self.jobs[jobID].setdefault( timeName, date )
+    return S_OK()
+
+class FakeLogDB( object ):
+  """ LoggingInfo table in memory
+  """
+
+  def __init__( self ):
+    self.records = []
+    self.inserts = 0
+    # Number of inserts done before they start failing
+    self.failAfter = None
+
+  def getLastStatusTimes( self, jobIDList ):
+    lastTimes = {}
+    for record in self.records:
+      if record[0] in jobIDList:
+        epoch = Time.toEpoch( Time.fromString( record[4] ) )
+        lastTimes[record[0]] = max( lastTimes.get( record[0], 0 ), epoch )
+    return S_OK( lastTimes )
+
+  def addLoggingRecords( self, records ):
+    if self.failAfter is not None and self.inserts >= self.failAfter:
+      return S_ERROR( 'Failed to insert logging records' )
+    self.inserts += 1
+    self.records.extend( records )
+    return S_OK( len( records ) )
+
+def statusRecord( status = '', minor = '', application = '' ):
+  return { 'Status' : status, 'MinorStatus' : minor, 'ApplicationStatus' : application, 'Source' : 'JobWrapper' }
+
+class JobStatusQueueTestCase( unittest.TestCase ):
+  """ Test the bulk processing and the queueing of the status updates
+  """
+
+  def setUp( self ):
+    self.jobDB = FakeJobDB()
+    self.logDB = FakeLogDB()
+    self.queues = []
+    for jobID in range( 1, 4 ):
+      self.jobDB.jobs[jobID] = { 'Status' : 'Matched', 'MinorStatus' : 'Assigned' }
+      self.logDB.records.append( ( jobID, 'Received', 'Job accepted', 'idem', '2015-01-01 10:00:00', 'JobManager' ) )
+
+  def tearDown( self ):
+    for queue in self.queues:
+      queue.stop()
+
+  def getQueue( self, **kwargs ):
+    queue = JobStatusQueue( self.jobDB, self.logDB, **kwargs )
+    self.queues.append( queue )
+    return queue
+
+  def test_processJobs( self ):
+    """ Only the newer records change the attributes, all are logged
+    """
+    queue = self.getQueue( flushWindow = 0 )
+    self.assertFalse( queue.isQueueing() )
+    statusDicts = { 1 : { '2015-01-01 11:00:00' : statusRecord( 'Running', 'Application' ),
+                          '2015-01-01 12:00:00' : statusRecord( 'Done', 'Execution Complete' ) },
+                    2 : { '2015-01-01 09:00:00' : statusRecord( 'Failed', 'Too late' ),
+                          '2015-01-01 11:00:00' : statusRecord( 'Running', 'Application' ) },
+                    3 : { '2015-01-01 11:00:00' : statusRecord( 'Running', 'Application' ) },
+                    4 : { '2015-01-01 11:00:00' : statusRecord( 'Running', 'Application' ) } }
+    result = queue.processJobs( statusDicts )
+    self.assertTrue( result['OK'] )
+    self.assertEqual( result['Value'].keys(), [ 4 ] )
+    self.assertEqual( self.jobDB.jobs[1]['Status'], 'Done' )
+    self.assertEqual( self.jobDB.jobs[1]['StartExecTime'], '2015-01-01 11:00:00' )
+    self.assertEqual( self.jobDB.jobs[1]['EndExecTime'], '2015-01-01 12:00:00' )
+    self.assertEqual( self.jobDB.jobs[2]['Status'], 'Running' )
+    self.assertFalse( 'EndExecTime' in self.jobDB.jobs[2] )
+    # Jobs 2 and 3 get the same attributes with one UPDATE
+    self.assertEqual( self.jobDB.updates, 4 )
+    self.assertEqual( self.logDB.inserts, 1 )
+    self.assertEqual( len( self.logDB.records ), 3 + 5 )
+
+  def test_queue( self ):
+    """ The updates of a job are merged and written by flush
+    """
+    queue = self.getQueue( flushWindow = 3600 )
+    self.assertTrue( queue.isQueueing() )
+    queue.addJobStatus( 1, { '2015-01-01 11:00:00' : statusRecord( 'Running', 'Application' ) } )
+    queue.addJobStatus( 1, { '2015-01-01 12:00:00' : statusRecord( 'Done', 'Execution Complete' ) } )
+    queue.addJobStatus( 2, { '2015-01-01 11:00:00' : statusRecord( 'Running', 'Application' ) } )
+    self.assertEqual( queue.getNumQueuedJobs(), 2 )
+    self.assertEqual( self.jobDB.jobs[1]['Status'], 'Matched' )
+    # Nothing is written before the window is over
+    self.assertEqual( queue.flush( force = False )['Value'], 0 )
+    # A failed flush is retried
+    self.jobDB.fail = True
+    self.assertEqual( queue.flush()['Value'], 0 )
+    self.assertEqual( queue.getNumQueuedJobs(), 2 )
+    self.jobDB.fail = False
+    self.assertEqual( queue.flush()['Value'], 2 )
+    self.assertEqual( queue.getNumQueuedJobs(), 0 )
+    self.assertEqual( self.jobDB.jobs[1]['Status'], 'Done' )
+    self.assertEqual( self.jobDB.jobs[2]['Status'], 'Running' )
+
+  def test_failingJob( self ):
+    """ A job failing on its own does not block the others and is dropped after a few attempts
+    """
+    queue = self.getQueue( flushWindow = 3600, maxJobFailures = 2 )
+    for jobID in range( 1, 4 ):
+      queue.addJobStatus( jobID, { '2015-01-01 11:00:00' : statusRecord( 'Running', 'Application' ) } )
+    self.jobDB.failingJobs.add( 2 )
+    self.assertEqual( queue.flush()['Value'], 2 )
+    self.assertEqual( queue.getNumQueuedJobs(), 1 )
+    self.assertEqual( self.jobDB.jobs[1]['Status'], 'Running' )
+    self.assertEqual( self.jobDB.jobs[3]['Status'], 'Running' )
+    self.assertEqual( queue.flush()['Value'], 0 )
+    self.assertEqual( queue.getNumQueuedJobs(), 0 )
+    self.assertEqual( self.jobDB.jobs[2]['Status'], 'Matched' )
+
+  def test_partialLogging( self ):
+    """ The logging records already written are not inserted again
+    """
+    queue = self.getQueue( flushWindow = 3600 )
+    bigRecord = dict( [ ( '2015-01-01 11:%02d:%02d' % ( i / 60, i % 60 ), statusRecord( 'Running', 'Step %d' % i ) )
+                        for i in range( 600 ) ] )
+    for jobID in range( 1, 4 ):
+      queue.addJobStatus( jobID, dict( bigRecord ) )
+    # One INSERT per job with 600 records each, the second one fails
+    self.logDB.failAfter = 1
+    self.assertEqual( queue.flush()['Value'], 1 )
+    self.assertEqual( queue.getNumQueuedJobs(), 2 )
+    self.logDB.failAfter = None
+    self.assertEqual( queue.flush()['Value'], 2 )
+    self.assertEqual( len( self.logDB.records ), 3 + 3 * 600 )
+
+  def test_stop( self ):
+    """ The flushing thread writes the updates and ends when stopped
+    """
+    queue = self.getQueue( flushWindow = 0.1 )
+    queue.addJobStatus( 1, { '2015-01-01 11:00:00' : statusRecord( 'Running', 'Application' ) } )
+    flushThread = queue._JobStatusQueue__flushThread
+    self.assert_( flushThread.isAlive() )
+    # The jobs leave the queue before being written, wait for the DB
+    for _i in range( 50 ):
+      if self.jobDB.jobs[1]['Status'] == 'Running':
+        break
+      time.sleep( 0.1 )
+    self.assertEqual( self.jobDB.jobs[1]['Status'], 'Running' )
+    queue.stop()
+    self.assertFalse( flushThread.isAlive() )
+
+  def test_stopWritesQueued( self ):
+    """ The updates still queued when stopping are written
+    """
+    queue = self.getQueue( flushWindow = 3600 )
+    for jobID in range( 1, 4 ):
+      queue.addJobStatus( jobID, { '2015-01-01 11:00:00' : statusRecord( 'Running', 'Application' ) } )
+    self.assertEqual( queue.stop()['Value'], 3 )
+    self.assertEqual( queue.getNumQueuedJobs(), 0 )
+    for jobID in range( 1, 4 ):
+      self.assertEqual( self.jobDB.jobs[jobID]['Status'], 'Running' )
+    self.assertEqual( len( self.logDB.records ), 6 )
+
+  def test_maxQueuedJobs( self ):
+    """ Updates are refused when too many jobs are queued
+    """
+    queue = self.getQueue( flushWindow = 3600, maxQueuedJobs = 1 )
+    self.assertTrue( queue.addJobStatus( 1, { '2015-01-01 11:00:00' : statusRecord( 'Running' ) } )['OK'] )
+    self.assertTrue( queue.addJobStatus( 1, { '2015-01-01 12:00:00' : statusRecord( 'Done' ) } )['OK'] )
+    self.assertFalse( queue.addJobStatus( 2, { '2015-01-01 11:00:00' : statusRecord( 'Running' ) } )['OK'] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( JobStatusQueueTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
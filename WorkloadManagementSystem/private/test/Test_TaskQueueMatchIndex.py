@@ -0,0 +1,72 @@
+""" Unit tests for the in-memory task queue match index
+"""
+
+import unittest
+
+from DIRAC.WorkloadManagementSystem.private.TaskQueueMatchIndex import TaskQueueMatchIndex
+
+class TaskQueueMatchIndexTestCase( unittest.TestCase ):
+  """ Base class for the TaskQueueMatchIndex test cases
+  """
+  def setUp( self ):
+    self.index = TaskQueueMatchIndex()
+    baseDef = { 'OwnerDN' : '/DC=user/CN=one', 'OwnerGroup' : 'user', 'Setup' : 'Test', 'CPUTime' : 3600 }
+    self.index.setTaskQueue( 1, dict( baseDef ), 1 )
+    self.index.setTaskQueue( 2, dict( baseDef, Sites = [ 'Site.A' ] ), 1 )
+    self.index.setTaskQueue( 3, dict( baseDef, BannedSites = [ 'Site.A' ] ), 1 )
+    self.index.setTaskQueue( 4, dict( baseDef, Platforms = [ 'x86_64' ] ), 1 )
+    self.index.setTaskQueue( 5, dict( baseDef, Tags = [ 'MultiProcessor', 'GPU' ] ), 1 )
+    self.index.setTaskQueue( 6, dict( baseDef, CPUTime = 86400 ), 1 )
+    self.index.setTaskQueue( 7, dict( baseDef, OwnerDN = '/DC=user/CN=two' ), 1 )
+
+  def _match( self, matchDict, **kwargs ):
+    return sorted( [ tqId for tqId, _, _ in self.index.matchTaskQueues( matchDict, numQueuesToGet = 0, **kwargs ) ] )
+
+class MatchSuccess( TaskQueueMatchIndexTestCase ):
+
+  def test_singleValues( self ):
+    self.assertEqual( self._match( { 'Setup' : 'Test', 'CPUTime' : 3600 } ), [ 1, 2, 3, 7 ] )
+    self.assertEqual( self._match( { 'Setup' : 'Test', 'CPUTime' : 100000 } ), [ 1, 2, 3, 6, 7 ] )
+    self.assertEqual( self._match( { 'Setup' : 'Other', 'CPUTime' : 100000 } ), [] )
+
+  def test_owner( self ):
+    matchDict = { 'Setup' : 'Test', 'CPUTime' : 3600, 'OwnerDN' : '/DC=user/CN=one', 'OwnerGroup' : 'user' }
+    self.assertEqual( self._match( matchDict ), [ 1, 2, 3 ] )
+    self.assertEqual( self._match( matchDict, jobSharingGroups = [ 'user' ] ), [ 1, 2, 3, 7 ] )
+
+  def test_sites( self ):
+    self.assertEqual( self._match( { 'Setup' : 'Test', 'CPUTime' : 3600, 'Site' : 'Site.A' } ), [ 1, 2, 7 ] )
+    self.assertEqual( self._match( { 'Setup' : 'Test', 'CPUTime' : 3600, 'Site' : 'Site.B' } ), [ 1, 3, 7 ] )
+
+  def test_strictFields( self ):
+    matchDict = { 'Setup' : 'Test', 'CPUTime' : 3600, 'Platform' : [ 'x86_64', 'i686' ] }
+    self.assertEqual( self._match( matchDict ), [ 1, 2, 3, 4, 7 ] )
+    matchDict[ 'Tag' ] = [ 'GPU', 'MultiProcessor', 'BigMem' ]
+    self.assertEqual( self._match( matchDict ), [ 1, 2, 3, 4, 5, 7 ] )
+    matchDict[ 'Tag' ] = [ 'GPU' ]
+    self.assertEqual( self._match( matchDict ), [ 1, 2, 3, 4, 7 ] )
+
+  def test_negativeCond( self ):
+    matchDict = { 'Setup' : 'Test', 'CPUTime' : 3600 }
+    self.assertEqual( self._match( matchDict, negativeCond = { 'Site' : 'Site.A' } ), [ 1, 3, 7 ] )
+    self.assertEqual( self._match( matchDict, negativeCond = { 'OwnerDN' : [ '/DC=user/CN=two' ] } ), [ 1, 2, 3 ] )
+
+  def test_limitAndRemoval( self ):
+    self.assertEqual( len( self.index.matchTaskQueues( { 'Setup' : 'Test', 'CPUTime' : 3600 } ) ), 1 )
+    self.index.removeTaskQueue( 1 )
+    self.assertEqual( self._match( { 'Setup' : 'Test', 'CPUTime' : 3600 } ), [ 2, 3, 7 ] )
+
+  def test_jobPriorities( self ):
+    self.assertEqual( self.index.pickJobPriority( 1 ), None )
+    self.index.addJob( 1, 5, 5.0 )
+    self.index.addJob( 1, 5, 5.0 )
+    self.assertEqual( self.index.getNumJobs( 1 ), 2 )
+    self.assertEqual( self.index.pickJobPriority( 1 ), 5 )
+    self.index.removeJob( 1, 5 )
+    self.index.removeJob( 1, 5 )
+    self.assertEqual( self.index.pickJobPriority( 1 ), None )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( TaskQueueMatchIndexTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( MatchSuccess ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )